@@ -0,0 +1,348 @@
+"""
+Asynchronous (asyncio) SMTP delivery backend.
+
+The default SMTP backend keeps a single message in flight per connection and
+blocks while waiting for each reply of the server. With a remote relay most
+of the delivery time is spent waiting on the network. The `AsyncEmailBackend`
+keeps up to `concurrency` SMTP conversations in flight from a single process,
+each one over its own connection, driven by an asyncio event loop.
+
+The SMTP client is implemented on top of the asyncio streams, and raises the
+same exceptions as `smtplib`, so the error handling of the delivery (e.g.
+temporary errors) does not depend on the backend in use. STARTTLS requires
+Python 3.7 or later (`loop.start_tls`).
+"""
+import asyncio
+import base64
+import re
+import smtplib
+import socket
+import ssl
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+
+LINE_ENDINGS_RE = re.compile(br'(?:\r\n|\n|\r(?!\n))')
+
+LEADING_PERIOD_RE = re.compile(br'(?m)^\.')
+
+_local_hostname: Optional[str] = None
+
+
+def get_local_hostname() -> str:
+    global _local_hostname
+    if _local_hostname is None:
+        _local_hostname = socket.getfqdn()
+    return _local_hostname
+
+
+def prepare_data(data: bytes) -> bytes:
+    """
+    Normalize the line endings to CRLF and escape the lines starting with a
+    period, as required by the DATA command (RFC 5321 section 4.5.2).
+    """
+    data = LINE_ENDINGS_RE.sub(b'\r\n', data)
+    data = LEADING_PERIOD_RE.sub(b'..', data)
+    if not data.endswith(b'\r\n'):
+        data += b'\r\n'
+    return data + b'.\r\n'
+
+
+class AsyncSMTP:
+    """
+    Minimal asyncio SMTP client, supporting SSL, STARTTLS and the PLAIN and
+    LOGIN authentication mechanisms.
+    """
+    def __init__(self, host: str, port: int, username: str = None, password: str = None,
+                 use_tls: bool = False, use_ssl: bool = False, timeout: float = None,
+                 ssl_keyfile: str = None, ssl_certfile: str = None):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.use_ssl = use_ssl
+        self.timeout = timeout
+        self.ssl_keyfile = ssl_keyfile
+        self.ssl_certfile = ssl_certfile
+        self.reader: Any = None
+        self.writer: Any = None
+        self.extensions: dict = dict()
+
+    @property
+    def is_connected(self) -> bool:
+        return self.writer is not None and not self.writer.transport.is_closing()
+
+    def get_ssl_context(self) -> ssl.SSLContext:
+        context = ssl.create_default_context()
+        if self.ssl_certfile:
+            context.load_cert_chain(self.ssl_certfile, self.ssl_keyfile)
+        return context
+
+    async def _wait(self, coroutine):
+        if self.timeout:
+            return await asyncio.wait_for(coroutine, self.timeout)
+        return await coroutine
+
+    async def read_reply(self) -> Tuple[int, bytes]:
+        lines = list()
+        while True:
+            line = await self._wait(self.reader.readline())
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+            lines.append(line[4:].strip())
+            if line[3:4] != b'-':
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b'\n'.join(lines)
+
+    async def command(self, line: str) -> Tuple[int, bytes]:
+        if not self.is_connected:
+            raise smtplib.SMTPServerDisconnected('Please run connect() first')
+        self.writer.write(line.encode('ascii') + b'\r\n')
+        await self._wait(self.writer.drain())
+        return await self.read_reply()
+
+    async def ehlo(self):
+        code, message = await self.command('EHLO %s' % get_local_hostname())
+        if code != 250:
+            raise smtplib.SMTPHeloError(code, message)
+        self.extensions = dict()
+        for line in message.decode('latin-1').split('\n')[1:]:
+            keyword, _, params = line.partition(' ')
+            self.extensions[keyword.lower()] = params
+
+    async def starttls(self):
+        if 'starttls' not in self.extensions:
+            raise smtplib.SMTPNotSupportedError('STARTTLS extension not supported by server.')
+        code, message = await self.command('STARTTLS')
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, message)
+        if hasattr(self.writer, 'start_tls'):
+            await self._wait(self.writer.start_tls(self.get_ssl_context(), server_hostname=self.host))
+        else:
+            # Before Python 3.11 the streams cannot upgrade the connection:
+            # upgrade the transport and open new streams over it
+            loop = asyncio.get_event_loop()
+            reader = asyncio.StreamReader()
+            protocol = asyncio.StreamReaderProtocol(reader)
+            transport = await self._wait(loop.start_tls(
+                self.writer.transport, protocol, self.get_ssl_context(), server_hostname=self.host
+            ))
+            protocol.connection_made(transport)
+            self.reader = reader
+            self.writer = asyncio.StreamWriter(transport, protocol, reader, loop)
+        await self.ehlo()
+
+    async def login(self):
+        mechanisms = self.extensions.get('auth', '').upper().split()
+        if 'PLAIN' in mechanisms or 'LOGIN' not in mechanisms:
+            credentials = '\0%s\0%s' % (self.username, self.password)
+            code, message = await self.command('AUTH PLAIN %s' % self._encode(credentials))
+        else:
+            code, message = await self.command('AUTH LOGIN %s' % self._encode(self.username))
+            if code == 334:
+                code, message = await self.command(self._encode(self.password))
+        if code != 235:
+            raise smtplib.SMTPAuthenticationError(code, message)
+
+    def _encode(self, value: str) -> str:
+        return base64.b64encode(value.encode('utf-8')).decode('ascii')
+
+    async def connect(self):
+        ssl_context = self.get_ssl_context() if self.use_ssl else None
+        self.reader, self.writer = await self._wait(asyncio.open_connection(
+            self.host, self.port, ssl=ssl_context, server_hostname=self.host if ssl_context else None
+        ))
+        code, message = await self.read_reply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, message)
+        await self.ehlo()
+        if self.use_tls:
+            await self.starttls()
+        if self.username and self.password:
+            await self.login()
+
+    async def sendmail(self, from_email: str, recipients: Sequence[str], data: bytes):
+        """
+        Send a message, raising the same exceptions as `smtplib.SMTP.sendmail`.
+        """
+        code, message = await self.command('MAIL FROM:%s' % smtplib.quoteaddr(from_email))
+        if code != 250:
+            await self.rset()
+            raise smtplib.SMTPSenderRefused(code, message, from_email)
+        refused = dict()
+        for recipient in recipients:
+            code, message = await self.command('RCPT TO:%s' % smtplib.quoteaddr(recipient))
+            if code not in (250, 251):
+                refused[recipient] = (code, message)
+        if len(refused) == len(recipients):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        code, message = await self.command('DATA')
+        if code != 354:
+            await self.rset()
+            raise smtplib.SMTPDataError(code, message)
+        self.writer.write(prepare_data(data))
+        await self._wait(self.writer.drain())
+        code, message = await self.read_reply()
+        if code != 250:
+            raise smtplib.SMTPDataError(code, message)
+        return refused
+
+    async def rset(self):
+        try:
+            await self.command('RSET')
+        except smtplib.SMTPServerDisconnected:
+            pass
+
+    async def quit(self):
+        try:
+            await self.command('QUIT')
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class AsyncEmailBackend(BaseEmailBackend):
+    """
+    Django email backend sending the messages concurrently, over up to
+    `concurrency` SMTP connections driven by an asyncio event loop owned by
+    the backend. The connections are kept open between the calls to
+    `send_messages` until the backend is closed.
+    """
+    def __init__(self, host: str = None, port: int = None, username: str = None, password: str = None,
+                 use_tls: bool = None, use_ssl: bool = None, timeout: float = None,
+                 ssl_keyfile: str = None, ssl_certfile: str = None, concurrency: int = None,
+                 max_messages: int = None, fail_silently: bool = False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.smtp_kwargs: Dict[str, Any] = {
+            'host': host or settings.EMAIL_HOST,
+            'port': port or settings.EMAIL_PORT,
+            'username': settings.EMAIL_HOST_USER if username is None else username,
+            'password': settings.EMAIL_HOST_PASSWORD if password is None else password,
+            'use_tls': settings.EMAIL_USE_TLS if use_tls is None else use_tls,
+            'use_ssl': settings.EMAIL_USE_SSL if use_ssl is None else use_ssl,
+            'timeout': settings.EMAIL_TIMEOUT if timeout is None else timeout,
+            'ssl_keyfile': ssl_keyfile or None,
+            'ssl_certfile': ssl_certfile or None,
+        }
+        self.concurrency = concurrency or settings.COLOSSUS_DELIVERY_CONCURRENCY
+        if max_messages is None:
+            max_messages = settings.COLOSSUS_SMTP_MAX_MESSAGES_PER_CONNECTION
+        self.max_messages = max_messages
+        self.loop: Any = None
+        self.connections: List[AsyncSMTP] = list()
+        self.messages_count: dict = dict()
+
+    @property
+    def batch_size(self) -> int:
+        """
+        Number of messages the delivery should hand over at once to keep all
+        the connections busy.
+        """
+        return self.concurrency * 4
+
+    def open(self):
+        if self.loop is not None:
+            return False
+        self.loop = asyncio.new_event_loop()
+        return True
+
+    def close(self):
+        if self.loop is None:
+            return
+        try:
+            self.loop.run_until_complete(self._quit_all())
+        finally:
+            self.connections = list()
+            self.messages_count = dict()
+            self.loop.close()
+            self.loop = None
+
+    async def _quit_all(self):
+        await asyncio.gather(*[smtp.quit() for smtp in self.connections if smtp.is_connected])
+
+    async def _get_connected(self, smtp: AsyncSMTP) -> AsyncSMTP:
+        if self.max_messages and self.messages_count.get(id(smtp), 0) >= self.max_messages:
+            await smtp.quit()
+        if not smtp.is_connected:
+            self.messages_count[id(smtp)] = 0
+            await smtp.connect()
+        return smtp
+
+    async def _send(self, smtp: AsyncSMTP, email_message) -> None:
+        recipients = email_message.recipients()
+        if not recipients:
+            return
+        encoding = email_message.encoding or settings.DEFAULT_CHARSET
+        from_email = sanitize_address(email_message.from_email, encoding)
+        recipients = [sanitize_address(address, encoding) for address in recipients]
+        data = email_message.message().as_bytes(linesep='\r\n')
+        try:
+            try:
+                await self._get_connected(smtp)
+                await smtp.sendmail(from_email, recipients, data)
+            except smtplib.SMTPServerDisconnected:
+                # The server closed an idle connection, try once again
+                smtp.close()
+                await self._get_connected(smtp)
+                await smtp.sendmail(from_email, recipients, data)
+        except (OSError, asyncio.TimeoutError) as err:
+            smtp.close()
+            raise smtplib.SMTPServerDisconnected(str(err))
+        self.messages_count[id(smtp)] += 1
+
+    async def _worker(self, smtp: AsyncSMTP, queue: asyncio.Queue, results: list):
+        while not queue.empty():
+            index, email_message = queue.get_nowait()
+            try:
+                await self._send(smtp, email_message)
+            except smtplib.SMTPException as err:
+                results[index] = err
+
+    async def _send_all(self, email_messages) -> list:
+        results: list = [None] * len(email_messages)
+        queue: asyncio.Queue = asyncio.Queue()
+        for index, email_message in enumerate(email_messages):
+            queue.put_nowait((index, email_message))
+        while len(self.connections) < min(self.concurrency, len(email_messages)):
+            self.connections.append(AsyncSMTP(**self.smtp_kwargs))
+        workers = [self._worker(smtp, queue, results) for smtp in self.connections[:len(email_messages)]]
+        await asyncio.gather(*workers)
+        return results
+
+    def send_messages_detailed(self, email_messages) -> List[Optional[smtplib.SMTPException]]:
+        """
+        Send the messages concurrently.
+
+        :return: A list with the outcome of each message: None if the message
+                 was sent, otherwise the SMTP exception raised
+        """
+        if not email_messages:
+            return list()
+        new_loop = self.open()
+        try:
+            return self.loop.run_until_complete(self._send_all(list(email_messages)))
+        finally:
+            if new_loop:
+                self.close()
+
+    def send_messages(self, email_messages) -> int:
+        results = self.send_messages_detailed(email_messages)
+        errors = [result for result in results if result is not None]
+        if errors and not self.fail_silently:
+            raise errors[0]
+        return len(results) - len(errors)
@@ -1,16 +1,31 @@
 import logging
-import re
-from smtplib import SMTPException
+import time
+from smtplib import SMTPException, SMTPServerDisconnected
+from typing import Dict, List, Optional, Set, Tuple
 
+from django.apps import apps
+from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
-from django.core.mail import EmailMultiAlternatives, get_connection
+from django.core.mail import EmailMultiAlternatives
+from django.db import transaction
 from django.utils import timezone
-from django.utils.translation import gettext as _
 
-import html2text
-
-from colossus.apps.campaigns.constants import CampaignStatus
+from colossus.apps.campaigns.constants import CampaignStatus, DeliveryStatus
+from colossus.apps.campaigns.exceptions import DeliveryShardLeaseLost
+from colossus.apps.campaigns.ledger import (
+    get_sent_subscribers_ids as get_ledger_sent_subscribers_ids,
+    iter_sent_subscribers_ids as iter_ledger_sent_subscribers_ids,
+    record_deliveries,
+)
+from colossus.apps.campaigns.ratelimit import (
+    RateLimiter, RetryQueue, is_temporary_smtp_error,
+)
+from colossus.apps.campaigns.rendering import CompiledEmail
+from colossus.apps.campaigns.smtp import (
+    get_mailing_list_connection, get_relay_name, reopen_connection,
+)
 from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.rollups import add_to_rollups, record_activities
 from colossus.utils import get_absolute_url
 
 logger = logging.getLogger(__name__)
@@ -28,51 +43,42 @@ def get_test_email_context(**kwargs):
     return kwargs
 
 
-def send_campaign_email(email, context, to, connection=None, is_test=False):
+def build_campaign_email_message(email, context, to, connection=None, is_test=False,
+                                 compiled_email=None) -> EmailMultiAlternatives:
+    """
+    Render a campaign email message, ready to be sent.
+
+    :param compiled_email: Optional CompiledEmail instance, reused across the
+                           messages of a campaign to avoid rendering the email
+                           template for each message
+    """
     if isinstance(to, str):
         to = [to, ]
 
-    subject = email.subject
-    if is_test:
-        subject = '[%s] %s' % (_('Test'), subject)
-
-    rich_text_message = email.render(context)
-    plain_text_message = html2text.html2text(rich_text_message, bodywidth=2000)
-
-    # Remove track open from plain text version
-    plain_text_message = re.sub(r'(!\[\]\(https?://.*/track/open/.*/\)\n\n)', '', plain_text_message, 1)
-
-    headers = dict()
-    if not is_test:
-        headers['List-ID'] = '%s <%s.list-id.%s>' % (
-            email.campaign.mailing_list.name,
-            email.campaign.mailing_list.uuid,
-            context['domain']
-        ),
-        headers['List-Post'] = 'NO',
-        headers['List-Unsubscribe-Post'] = 'List-Unsubscribe=One-Click'
-
-        list_subscribe_header = ['<%s>' % context['sub']]
-        list_unsubscribe_header = ['<%s>' % context['unsub']]
-        if email.campaign.mailing_list.list_manager:
-            list_subscribe_header.append('<mailto:%s?subject=subscribe>' % email.campaign.mailing_list.list_manager)
-            list_unsubscribe_header.append(
-                '<mailto:%s?subject=unsubscribe>' % email.campaign.mailing_list.list_manager
-            )
-
-        headers['List-Subscribe'] = ', '.join(list_subscribe_header)
-        headers['List-Unsubscribe'] = ', '.join(list_unsubscribe_header)
+    if compiled_email is None:
+        compiled_email = CompiledEmail(email, context.get('domain'), is_test)
+
+    rich_text_message, plain_text_message = compiled_email.render(context)
 
     message = EmailMultiAlternatives(
-        subject=subject,
+        subject=compiled_email.subject,
         body=plain_text_message,
-        from_email=email.get_from(),
+        from_email=compiled_email.from_email,
         to=to,
         connection=connection,
-        headers=headers
+        headers=compiled_email.get_headers(context)
     )
     message.attach_alternative(rich_text_message, 'text/html')
+    return message
+
 
+def send_campaign_email(email, context, to, connection=None, is_test=False, compiled_email=None):
+    """
+    Render and send a campaign email.
+
+    :return: True if the email was sent, False otherwise
+    """
+    message = build_campaign_email_message(email, context, to, connection, is_test, compiled_email)
     try:
         message.send(fail_silently=False)
         return True
@@ -81,23 +87,38 @@ def send_campaign_email(email, context, to, connection=None, is_test=False):
         return False
 
 
-def send_campaign_email_subscriber(email, subscriber, site, connection=None):
-    unsubscribe_absolute_url = get_absolute_url('subscribers:unsubscribe', kwargs={
-        'mailing_list_uuid': email.campaign.mailing_list.uuid,
-        'subscriber_uuid': subscriber.uuid,
-        'campaign_uuid': email.campaign.uuid
-    })
-    subscribe_absolute_url = get_absolute_url('subscribers:subscribe', kwargs={
-        'mailing_list_uuid': email.campaign.mailing_list.uuid
-    })
-    context = {
-        'domain': site.domain,
-        'uuid': subscriber.uuid,
-        'name': subscriber.name,
-        'sub': subscribe_absolute_url,
-        'unsub': unsubscribe_absolute_url
-    }
-    return send_campaign_email(email, context, subscriber.get_email(), connection)
+def send_campaign_email_subscriber(email, subscriber, site, connection=None, compiled_email=None):
+    if compiled_email is None:
+        compiled_email = CompiledEmail(email, site.domain)
+    context = compiled_email.get_subscriber_context(subscriber)
+    return send_campaign_email(email, context, subscriber.get_email(), connection, compiled_email=compiled_email)
+
+
+def send_messages(connection, messages) -> List[Optional[SMTPException]]:
+    """
+    Send a batch of messages through an email backend. Backends able to send
+    the messages concurrently (see `AsyncEmailBackend`) get the whole batch at
+    once, the others are fed one message at a time. When the server closed
+    the session (e.g. after a 421 reply to a previous message), a new session
+    is opened and the message is sent again.
+
+    :return: A list with the outcome of each message: None if the message
+             was sent, otherwise the SMTP exception raised
+    """
+    if hasattr(connection, 'send_messages_detailed'):
+        return connection.send_messages_detailed(messages)
+    results: List[Optional[SMTPException]] = list()
+    for message in messages:
+        try:
+            try:
+                sent = connection.send_messages([message])
+            except SMTPServerDisconnected:
+                reopen_connection(connection)
+                sent = connection.send_messages([message])
+            results.append(None if sent else SMTPException('Message was not sent.'))
+        except SMTPException as err:
+            results.append(err)
+    return results
 
 
 def send_campaign_email_test(email, recipient_list):
@@ -111,27 +132,363 @@ def send_campaign_email_test(email, recipient_list):
     return send_campaign_email(email, context, recipient_list, is_test=True)
 
 
-def send_campaign(campaign):
-    campaign.status = CampaignStatus.DELIVERING
-    campaign.save(update_fields=['status'])
-    site = get_current_site(request=None)  # get site based on SITE_ID
+class SentActivitiesBuffer:
+    """
+    Buffer the SENT activities produced during the delivery of an email and
+    write them in batches: one INSERT for the activities and one UPDATE for
+    the subscribers `last_sent` field per batch. Meant to be used as a context
+    manager, so the remaining activities are written when the delivery ends.
+
+    With COLOSSUS_DELIVERY_LEDGER enabled, the deliveries, including the
+    failed ones, are written to the delivery ledger instead of the activities.
+
+    When a delivery shard is informed, its checkpoint and counters are saved
+    in the same transaction as each batch of activities. If another task took
+    over the shard in the meantime, `DeliveryShardLeaseLost` is raised once the
+    batch is written.
+
+    Note that if the process dies before a flush, the buffered recipients will
+    be sent the email again when the delivery is retried.
+    """
+    def __init__(self, email, size: int = None, shard=None):
+        self.email = email
+        self.size = size or settings.COLOSSUS_DELIVERY_BATCH_SIZE
+        self.shard = shard
+        self.use_ledger = settings.COLOSSUS_DELIVERY_LEDGER
+        self.subscribers_ids: List[int] = list()
+        self.failed_subscribers_ids: List[int] = list()
+        self.failed_count = 0
+        self.checkpoint: Optional[int] = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.flush()
 
+    def add(self, subscriber_id: int):
+        self.subscribers_ids.append(subscriber_id)
+        if len(self.subscribers_ids) >= self.size:
+            self.flush()
+
+    def add_failed(self, subscriber_id: Optional[int] = None):
+        self.failed_count += 1
+        if subscriber_id is not None and self.use_ledger:
+            self.failed_subscribers_ids.append(subscriber_id)
+
+    def set_checkpoint(self, subscriber_id: int):
+        """
+        Set the id of the subscriber up to which (inclusive) all the
+        recipients were processed.
+        """
+        self.checkpoint = subscriber_id
+
+    def flush(self) -> int:
+        has_progress = self.shard is not None and (self.failed_count or self.checkpoint is not None)
+        if not self.subscribers_ids and not has_progress:
+            return 0
+        Subscriber = apps.get_model('subscribers', 'Subscriber')
+        lease_kept = True
+        with transaction.atomic():
+            if self.use_ledger:
+                self.write_ledger()
+            else:
+                self.write_activities()
+            if self.subscribers_ids:
+                Subscriber.objects.filter(pk__in=self.subscribers_ids).update(last_sent=timezone.now())
+            if self.shard is not None:
+                lease_kept = self.shard.save_checkpoint(len(self.subscribers_ids), self.failed_count,
+                                                        self.checkpoint)
+        flushed = len(self.subscribers_ids)
+        self.subscribers_ids = list()
+        self.failed_subscribers_ids = list()
+        self.failed_count = 0
+        self.checkpoint = None
+        if not lease_kept:
+            raise DeliveryShardLeaseLost('Delivery shard "%s" was taken over by another task.' % self.shard)
+        return flushed
+
+    def write_activities(self):
+        Activity = apps.get_model('subscribers', 'Activity')
+        activities = [
+            Activity(activity_type=ActivityTypes.SENT, subscriber_id=subscriber_id, email=self.email)
+            for subscriber_id in self.subscribers_ids
+        ]
+        if activities:
+            Activity.objects.bulk_create(activities)
+            record_activities(activities)
+
+    def write_ledger(self):
+        statuses = dict.fromkeys(self.failed_subscribers_ids, DeliveryStatus.FAILED)
+        statuses.update(dict.fromkeys(self.subscribers_ids, DeliveryStatus.SENT))
+        if not statuses:
+            return
+        record_deliveries(self.email.pk, statuses)
+        if self.subscribers_ids:
+            key = (self.email.campaign.mailing_list_id, self.email.campaign_id, timezone.localdate(),
+                   ActivityTypes.SENT, None)
+            add_to_rollups({key: len(self.subscribers_ids)})
+
+
+def get_recipient_shards(campaign, shard_size: int) -> List[Tuple[int, int]]:
+    """
+    Split the campaign recipients into contiguous primary key ranges, each one
+    holding up to `shard_size` subscribers. The ranges are inclusive and are
+    meant to be delivered independently by different Celery workers.
+
+    :param campaign: Campaign instance being delivered
+    :param shard_size: Maximum number of recipients per shard
+    :return: List of (min_pk, max_pk) tuples ordered by primary key
+    """
+    shards = list()
+    min_pk = max_pk = None
+    count = 0
+    recipients_ids = campaign.get_recipients_bitmap()
+    if recipients_ids is None:
+        recipients_ids = campaign.get_recipients().order_by('pk').values_list('pk', flat=True).iterator()
+    for pk in recipients_ids:
+        if min_pk is None:
+            min_pk = pk
+        max_pk = pk
+        count += 1
+        if count == shard_size:
+            shards.append((min_pk, max_pk))
+            min_pk = None
+            count = 0
+    if min_pk is not None:
+        shards.append((min_pk, max_pk))
+    return shards
+
+
+def enable_tracking(campaign):
     if campaign.track_clicks:
         campaign.email.enable_click_tracking()
 
     if campaign.track_opens:
         campaign.email.enable_open_tracking()
 
-    with get_connection() as connection:
-        for subscriber in campaign.get_recipients():
-            if not subscriber.activities.filter(activity_type=ActivityTypes.SENT, email=campaign.email).exists():
-                sent = send_campaign_email_subscriber(campaign.email, subscriber, site, connection)
-                if sent:
-                    subscriber.create_activity(ActivityTypes.SENT, email=campaign.email)
-                    subscriber.update_open_and_click_rate()
-                    subscriber.last_sent = timezone.now()
-                    subscriber.save(update_fields=['last_sent'])
 
-    campaign.mailing_list.update_open_and_click_rate()
-    campaign.status = CampaignStatus.SENT
+def create_delivery_shards(campaign):
+    """
+    Split the campaign recipients into delivery shards, unless the campaign
+    already has them (e.g. when resuming an interrupted delivery).
+
+    :return: A queryset with the campaign delivery shards
+    """
+    if not campaign.delivery_shards.exists():
+        DeliveryShard = apps.get_model('campaigns', 'DeliveryShard')
+        shards = get_recipient_shards(campaign, settings.COLOSSUS_CAMPAIGN_SHARD_SIZE)
+        DeliveryShard.objects.bulk_create([
+            DeliveryShard(campaign=campaign, min_subscriber_id=min_pk, max_subscriber_id=max_pk)
+            for min_pk, max_pk in shards
+        ])
+    return campaign.delivery_shards.all()
+
+
+def prepare_campaign_delivery(campaign):
+    """
+    Flag the campaign as delivering, create the delivery shards and enable the
+    tracking features on the campaign email. Enabling click tracking at this
+    point also makes sure all the Link instances exist before the shards
+    start, so the concurrent shards only have to read them.
+    """
+    campaign.status = CampaignStatus.DELIVERING
     campaign.save(update_fields=['status'])
+    create_delivery_shards(campaign)
+    enable_tracking(campaign)
+
+
+def get_sent_subscribers_ids(email, min_pk=None, max_pk=None) -> Set[int]:
+    """
+    Load at once the ids of the subscribers who were already sent the email,
+    optionally within a primary key range, from the activities and the
+    delivery ledger. Used to make the delivery retries idempotent without
+    querying the activities of each recipient.
+
+    :param email: Email instance being delivered
+    :param min_pk: Optional lower bound (inclusive) of the subscribers ids
+    :param max_pk: Optional upper bound (inclusive) of the subscribers ids
+    :return: Set of subscribers ids
+    """
+    activities = email.activities.filter(activity_type=ActivityTypes.SENT)
+    if min_pk is not None:
+        activities = activities.filter(subscriber_id__gte=min_pk)
+    if max_pk is not None:
+        activities = activities.filter(subscriber_id__lte=max_pk)
+    subscribers_ids = set(activities.values_list('subscriber_id', flat=True))
+    subscribers_ids.update(get_ledger_sent_subscribers_ids(email.pk, min_pk, max_pk))
+    return subscribers_ids
+
+
+def send_campaign_shard(shard) -> int:
+    """
+    Deliver the campaign email to the recipients of a delivery shard, starting
+    right after the shard checkpoint when resuming an interrupted delivery.
+
+    The campaign email must already have the tracking features enabled. The
+    messages are sent through the SMTP relay of the mailing list, reusing a
+    pooled session when the list defines its own SMTP settings, and throttled
+    per relay and per recipient domain. The messages are handed over to the
+    backend in batches of `batch_size` messages when the backend sends them
+    concurrently, one at a time otherwise. Recipients refused with a
+    temporary SMTP error are deferred and retried with an exponential delay;
+    the checkpoint never moves past a deferred recipient. The subscribers
+    rates are not updated here, see `complete_campaign_delivery`.
+
+    The shard is skipped if it is complete or held by another task, see
+    `DeliveryShard.claim`. The lease is renewed while sending and while
+    waiting on the rate limits and the retries, and the delivery stops if
+    another task took over the shard anyway.
+
+    :return: Number of emails sent
+    """
+    if not shard.claim():
+        logger.info('Delivery shard "%s" is complete or held by another task.' % shard)
+        return 0
+    # Another task may have moved the checkpoint before its lease expired
+    shard.refresh_from_db(fields=['last_subscriber_id', 'start_date'])
+    shard.start()
+    campaign = shard.campaign
+    min_pk = shard.min_subscriber_id if shard.last_subscriber_id is None else shard.last_subscriber_id + 1
+    max_pk = shard.max_subscriber_id
+
+    site = get_current_site(request=None)  # get site based on SITE_ID
+    recipients = campaign.get_recipients().filter(pk__gte=min_pk, pk__lte=max_pk)
+    # The subscribers of the segment, if any, among the active subscribers of the shard
+    segment = campaign.get_recipients_bitmap()
+    segment_ids = set(segment.range(min_pk, max_pk)) if segment is not None else None
+    sent_subscribers_ids = get_sent_subscribers_ids(campaign.email, min_pk, max_pk)
+    compiled_email = CompiledEmail(campaign.email, site.domain)
+    lease_renewal = settings.COLOSSUS_DELIVERY_SHARD_LEASE / 3
+
+    def keep_lease():
+        if (timezone.now() - shard.lease_date).total_seconds() >= lease_renewal and not shard.renew_lease():
+            raise DeliveryShardLeaseLost('Delivery shard "%s" was taken over by another task.' % shard)
+
+    def sleep(seconds: float):
+        wake_at = time.time() + seconds
+        while True:
+            keep_lease()
+            remaining = wake_at - time.time()
+            if remaining <= 0:
+                break
+            time.sleep(min(remaining, lease_renewal))
+
+    rate_limiter = RateLimiter(get_relay_name(campaign.mailing_list), sleep=sleep)
+    retry_queue = RetryQueue(sleep=sleep)
+    # Recipients deferred or waiting in the batch. Insertion ordered, so the
+    # first key is always the lowest pending id
+    pending_ids: Dict[int, None] = dict()
+    batch: list = list()
+
+    sent_count = 0
+    try:
+        with get_mailing_list_connection(campaign.mailing_list) as connection, \
+                SentActivitiesBuffer(campaign.email, shard=shard) as progress:
+            batch_size = getattr(connection, 'batch_size', 1)
+
+            def send_batch():
+                nonlocal sent_count
+                results = send_messages(connection, [message for subscriber, attempt, message in batch])
+                for (subscriber, attempt, message), error in zip(batch, results):
+                    if error is None:
+                        rate_limiter.success()
+                        progress.add(subscriber.pk)
+                        sent_count += 1
+                    elif is_temporary_smtp_error(error):
+                        rate_limiter.backoff()
+                        if retry_queue.defer(subscriber, attempt):
+                            continue
+                        logger.warning('Giving up sending email "%s" to subscriber %s after %s attempts: %s'
+                                       % (campaign.email.uuid, subscriber.pk, attempt, error))
+                        progress.add_failed(subscriber.pk)
+                    else:
+                        logger.error('Could not send email "%s" to subscriber %s due to SMTP error: %s'
+                                     % (campaign.email.uuid, subscriber.pk, error))
+                        progress.add_failed(subscriber.pk)
+                    pending_ids.pop(subscriber.pk, None)
+                batch.clear()
+
+            def deliver(subscriber, attempt=1):
+                keep_lease()
+                rate_limiter.acquire(subscriber.email.rsplit('@', 1)[-1])
+                context = compiled_email.get_subscriber_context(subscriber)
+                message = build_campaign_email_message(campaign.email, context, subscriber.get_email(), connection,
+                                                       compiled_email=compiled_email)
+                pending_ids.setdefault(subscriber.pk)
+                batch.append((subscriber, attempt, message))
+                if len(batch) >= batch_size:
+                    send_batch()
+
+            def set_checkpoint(subscriber_id):
+                if pending_ids:
+                    subscriber_id = next(iter(pending_ids)) - 1
+                progress.set_checkpoint(subscriber_id)
+
+            for subscriber in recipients.order_by('pk'):
+                if subscriber.pk not in sent_subscribers_ids \
+                        and (segment_ids is None or subscriber.pk in segment_ids):
+                    deliver(subscriber)
+                    for deferred_subscriber, attempt in retry_queue.pop_ready():
+                        deliver(deferred_subscriber, attempt)
+                set_checkpoint(subscriber.pk)
+            send_batch()
+
+            while retry_queue:
+                retry_queue.wait()
+                for deferred_subscriber, attempt in retry_queue.pop_ready():
+                    deliver(deferred_subscriber, attempt)
+                send_batch()
+            progress.set_checkpoint(max_pk)
+    except DeliveryShardLeaseLost:
+        logger.warning('Delivery shard "%s" was taken over by another task after %s emails sent.'
+                       % (shard, sent_count))
+        return sent_count
+
+    shard.complete()
+    return sent_count
+
+
+def complete_campaign_delivery(campaign) -> bool:
+    """
+    Recompute the recipients open and click rates in a single set-based pass,
+    now that all the SENT activities are written, and then the list rates.
+
+    The campaign is flagged as sent with a conditional update, so when a
+    resumed delivery and the chord callback complete it concurrently, only
+    one of them does.
+
+    :return: False if some shards are still being delivered by other tasks,
+             in which case the last of them completes the delivery, or if the
+             delivery was already completed
+    """
+    if campaign.delivery_shards.filter(end_date=None).exists():
+        return False
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    delivering = Campaign.objects.filter(pk=campaign.pk, status=CampaignStatus.DELIVERING)
+    if not delivering.update(status=CampaignStatus.SENT):
+        return False
+    campaign.status = CampaignStatus.SENT
+    recipients_ids = campaign.email.activities \
+        .filter(activity_type=ActivityTypes.SENT) \
+        .values_list('subscriber_id', flat=True) \
+        .order_by('subscriber_id')
+    Subscriber.objects.update_open_and_click_rate(recipients_ids.iterator())
+    Subscriber.objects.update_open_and_click_rate(iter_ledger_sent_subscribers_ids(campaign.email.pk))
+    campaign.mailing_list.update_open_and_click_rate()
+    return True
+
+
+def send_campaign(campaign) -> bool:
+    """
+    Deliver the campaign to all its recipients serially, within the current
+    process, or resume an interrupted delivery. For the parallel delivery, see
+    `send_campaign_task`.
+
+    :return: True if the delivery is complete
+    """
+    prepare_campaign_delivery(campaign)
+    for shard in campaign.delivery_shards.stale():
+        send_campaign_shard(shard)
+    return complete_campaign_delivery(campaign)
@@ -41,3 +41,15 @@ class CampaignStatus:
     }
 
     CHOICES = tuple(LABELS.items())
+
+
+class DeliveryStatus:
+    SENT = 1
+    FAILED = 2
+
+    LABELS = {
+        SENT: _('Sent'),
+        FAILED: _('Failed'),
+    }
+
+    CHOICES = tuple(LABELS.items())
@@ -0,0 +1,2 @@
+class DeliveryShardLeaseLost(Exception):
+    pass
@@ -3,7 +3,9 @@ from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.utils.translation import gettext, gettext_lazy as _
 
+from colossus.apps.subscribers.exceptions import InvalidSegment
 from colossus.apps.subscribers.models import Tag
+from colossus.apps.subscribers.segments import Segment
 
 from .api import send_campaign_email_test
 from .constants import CampaignStatus
@@ -61,7 +63,7 @@ class CreateCampaignForm(forms.ModelForm):
 class CampaignRecipientsForm(forms.ModelForm):
     class Meta:
         model = Campaign
-        fields = ('mailing_list', 'tag')
+        fields = ('mailing_list', 'tag', 'segment')
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -75,6 +77,20 @@ class CampaignRecipientsForm(forms.ModelForm):
         elif self.instance.pk and self.instance.mailing_list:
             self.fields['tag'].queryset = self.instance.mailing_list.tags.order_by('name')
 
+    def clean(self):
+        cleaned_data = super().clean()
+        segment = cleaned_data.get('segment')
+        mailing_list = cleaned_data.get('mailing_list')
+        if segment:
+            if mailing_list is None:
+                self.add_error('segment', gettext('Select a mailing list to use a segment.'))
+            else:
+                try:
+                    Segment(segment, mailing_list)
+                except InvalidSegment as error:
+                    self.add_error('segment', str(error))
+        return cleaned_data
+
 
 class ScheduleCampaignForm(forms.ModelForm):
     class Meta:
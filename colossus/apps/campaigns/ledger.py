@@ -0,0 +1,191 @@
+"""
+Compact delivery ledger of the campaigns emails.
+
+With COLOSSUS_DELIVERY_LEDGER enabled, the deliveries are recorded in
+`DeliveryLedger` rows instead of a SENT activity per recipient: one row per
+email and batch of deliveries, holding the ascending subscribers ids as
+delta-encoded varints and one status byte per recipient. A recipient takes
+about three bytes, so a campaign of 1M recipients takes a few MB instead of
+a few hundred MB of activities.
+
+The subscribers ids of a row all belong to the same bucket of BUCKET_SIZE
+consecutive ids, so the deliveries of an email within a range of subscribers
+(the delivery shards) and the deliveries of a set of subscribers (the open
+and click rates) are found with an index lookup on the bucket.
+
+An email is sent at most once to each subscriber, whether recorded as an
+activity or in the ledger, so the sent counts of both are simply added up.
+The daily rollups are incremented as for the SENT activities, and rebuilt
+from the ledger rows (see `rebuild_rollups`), but the subscriber timeline does
+not show the deliveries recorded in the ledger.
+"""
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.apps import apps
+from django.db import transaction
+
+from colossus.apps.campaigns.constants import DeliveryStatus
+
+BUCKET_SIZE = 4096
+
+
+def encode_ids(ids: Iterable[int]) -> bytes:
+    """
+    :param ids: Ascending integers
+    :return: The differences between consecutive integers as varints
+    """
+    data = bytearray()
+    previous = 0
+    for value in ids:
+        delta = value - previous
+        previous = value
+        while delta >= 0x80:
+            data.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        data.append(delta)
+    return bytes(data)
+
+
+def decode_ids(data: bytes) -> List[int]:
+    ids = list()
+    value = shift = previous = 0
+    for byte in bytes(data):
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+        else:
+            previous += value
+            ids.append(previous)
+            value = shift = 0
+    return ids
+
+
+def decode_entries(ledger) -> List[Tuple[int, int]]:
+    """
+    :return: List of (subscriber_id, status) of a ledger row
+    """
+    return list(zip(decode_ids(ledger.subscribers_ids), bytes(ledger.statuses)))
+
+
+def _get_buckets(subscribers_ids: Iterable[int]) -> Set[int]:
+    return {subscriber_id // BUCKET_SIZE for subscriber_id in subscribers_ids}
+
+
+def record_deliveries(email_id: int, statuses: Dict[int, int]) -> List:
+    """
+    Write the deliveries of an email, one row per bucket.
+
+    :param statuses: Dictionary of subscriber id: `DeliveryStatus`
+    :return: List of the `DeliveryLedger` rows created
+    """
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    buckets: Dict[int, List[int]] = defaultdict(list)
+    for subscriber_id in sorted(statuses.keys()):
+        buckets[subscriber_id // BUCKET_SIZE].append(subscriber_id)
+    ledgers = [
+        DeliveryLedger(email_id=email_id,
+                       bucket=bucket,
+                       recipients_count=len(subscribers_ids),
+                       subscribers_ids=encode_ids(subscribers_ids),
+                       statuses=bytes(statuses[subscriber_id] for subscriber_id in subscribers_ids))
+        for bucket, subscribers_ids in buckets.items()
+    ]
+    DeliveryLedger.objects.bulk_create(ledgers)
+    return ledgers
+
+
+def get_sent_subscribers_ids(email_id: int, min_pk: Optional[int] = None, max_pk: Optional[int] = None) -> Set[int]:
+    """
+    :param min_pk: Optional lower bound (inclusive) of the subscribers ids
+    :param max_pk: Optional upper bound (inclusive) of the subscribers ids
+    :return: Set of the ids of the subscribers who were sent the email
+    """
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    ledgers = DeliveryLedger.objects.filter(email_id=email_id)
+    if min_pk is not None:
+        ledgers = ledgers.filter(bucket__gte=min_pk // BUCKET_SIZE)
+    if max_pk is not None:
+        ledgers = ledgers.filter(bucket__lte=max_pk // BUCKET_SIZE)
+    subscribers_ids = set()
+    for ledger in ledgers.only('subscribers_ids', 'statuses'):
+        for subscriber_id, status in decode_entries(ledger):
+            if status == DeliveryStatus.SENT \
+                    and (min_pk is None or subscriber_id >= min_pk) \
+                    and (max_pk is None or subscriber_id <= max_pk):
+                subscribers_ids.add(subscriber_id)
+    return subscribers_ids
+
+
+def iter_sent_subscribers_ids(email_id: int) -> Iterator[int]:
+    """
+    :return: Iterator over the ids of the subscribers who were sent the email,
+             in ascending order
+    """
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    ledgers = DeliveryLedger.objects \
+        .filter(email_id=email_id) \
+        .order_by('bucket') \
+        .only('bucket', 'subscribers_ids', 'statuses')
+    bucket: Optional[int] = None
+    subscribers_ids: Set[int] = set()
+    for ledger in ledgers.iterator():
+        if ledger.bucket != bucket:
+            yield from sorted(subscribers_ids)
+            bucket = ledger.bucket
+            subscribers_ids = set()
+        subscribers_ids.update(subscriber_id for subscriber_id, status in decode_entries(ledger)
+                               if status == DeliveryStatus.SENT)
+    yield from sorted(subscribers_ids)
+
+
+def get_sent_emails_ids(subscribers_ids: Iterable[int]) -> Dict[int, Set[int]]:
+    """
+    :return: Dictionary of subscriber id: set of the ids of the emails sent
+             to the subscriber, for the subscribers sent any email
+    """
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    subscribers_ids = set(subscribers_ids)
+    emails_ids: Dict[int, Set[int]] = defaultdict(set)
+    if not subscribers_ids:
+        return emails_ids
+    ledgers = DeliveryLedger.objects \
+        .filter(bucket__in=_get_buckets(subscribers_ids)) \
+        .only('email_id', 'subscribers_ids', 'statuses')
+    for ledger in ledgers:
+        for subscriber_id, status in decode_entries(ledger):
+            if status == DeliveryStatus.SENT and subscriber_id in subscribers_ids:
+                emails_ids[subscriber_id].add(ledger.email_id)
+    return emails_ids
+
+
+def remove_subscriber(subscriber_id: int) -> Set[int]:
+    """
+    Remove a deleted subscriber from the ledger, so its id is never mistaken
+    for another subscriber's.
+
+    :return: Set of the ids of the emails sent to the subscriber
+    """
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    emails_ids = set()
+    with transaction.atomic():
+        ledgers = DeliveryLedger.objects \
+            .filter(bucket=subscriber_id // BUCKET_SIZE) \
+            .select_for_update() \
+            .only('email_id', 'subscribers_ids', 'statuses')
+        for ledger in ledgers:
+            entries = decode_entries(ledger)
+            remaining = [(pk, status) for pk, status in entries if pk != subscriber_id]
+            if len(remaining) == len(entries):
+                continue
+            if any(status == DeliveryStatus.SENT for pk, status in entries if pk == subscriber_id):
+                emails_ids.add(ledger.email_id)
+            if remaining:
+                DeliveryLedger.objects.filter(pk=ledger.pk).update(
+                    recipients_count=len(remaining),
+                    subscribers_ids=encode_ids(pk for pk, status in remaining),
+                    statuses=bytes(status for pk, status in remaining),
+                )
+            else:
+                DeliveryLedger.objects.filter(pk=ledger.pk).delete()
+    return emails_ids
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+
+from colossus.apps.campaigns.models import Campaign
+from colossus.apps.campaigns.rendering import CompiledEmail, html_to_text
+
+
+class Command(BaseCommand):
+    help = 'Measure how many messages per second are rendered for a campaign, ' \
+           'rendering the template for each message versus using the compiled email.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('campaign_id', type=int, help='Campaign ID.')
+        parser.add_argument(
+            '--messages', type=int, default=1000,
+            help='Number of messages to render. Default is 1000.',
+        )
+
+    def render_template(self, email, contexts):
+        for context in contexts:
+            html = email.render(dict(context))
+            html_to_text(html)
+
+    def render_compiled(self, compiled_email, contexts):
+        for context in contexts:
+            compiled_email.render(context)
+
+    def measure(self, label, func, *args):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        rate = self.messages / elapsed if elapsed else float('inf')
+        self.stdout.write('%s: %.2f seconds, %.1f messages/second' % (label, elapsed, rate))
+        return elapsed
+
+    def handle(self, *args, **options):
+        try:
+            campaign = Campaign.objects.select_related('mailing_list').get(pk=options['campaign_id'])
+        except Campaign.DoesNotExist:
+            raise CommandError('Campaign "%s" does not exist.' % options['campaign_id'])
+
+        email = campaign.email
+        if email is None:
+            raise CommandError('Campaign "%s" has no email.' % campaign.pk)
+
+        self.messages = options['messages']
+        subscribers = list(campaign.get_recipients()[:self.messages])
+        if not subscribers:
+            raise CommandError('Campaign "%s" has no recipients.' % campaign.pk)
+
+        compiled_email = CompiledEmail(email, 'example.com')
+        contexts = [compiled_email.get_subscriber_context(subscribers[index % len(subscribers)])
+                    for index in range(self.messages)]
+
+        template_elapsed = self.measure('Template', self.render_template, email, contexts)
+        compiled_elapsed = self.measure('Compiled', self.render_compiled, compiled_email, contexts)
+
+        if not compiled_email.is_substitutable:
+            self.stdout.write(self.style.WARNING(
+                'The email template uses the personalization variables in tags or filters, '
+                'so each message is rendered individually.'
+            ))
+        if compiled_elapsed:
+            self.stdout.write(self.style.SUCCESS('Speedup: %.1fx' % (template_elapsed / compiled_elapsed)))
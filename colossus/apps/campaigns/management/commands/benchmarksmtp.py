@@ -0,0 +1,59 @@
+import time
+
+from django.core.mail import EmailMessage
+from django.core.mail.backends.smtp import EmailBackend
+from django.core.management import BaseCommand
+
+from colossus.apps.campaigns.aiosmtp import AsyncEmailBackend
+from colossus.test.smtp import SMTPSink
+
+
+class Command(BaseCommand):
+    help = 'Measure how many messages per second are delivered to a local in-process SMTP sink, ' \
+           'using the synchronous SMTP backend versus the asyncio SMTP backend.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--messages', type=int, default=1000,
+            help='Number of messages to send. Default is 1000.',
+        )
+        parser.add_argument(
+            '--concurrency', type=int, default=20,
+            help='SMTP conversations in flight for the asyncio backend. Default is 20.',
+        )
+        parser.add_argument(
+            '--latency', type=float, default=0.002,
+            help='Seconds the SMTP sink waits before each reply, simulating a remote relay. Default is 0.002.',
+        )
+
+    def measure(self, label, backend, messages):
+        start = time.perf_counter()
+        start_cpu = time.process_time()
+        with backend:
+            if isinstance(backend, AsyncEmailBackend):
+                for index in range(0, len(messages), backend.batch_size):
+                    backend.send_messages(messages[index:index + backend.batch_size])
+            else:
+                for message in messages:
+                    backend.send_messages([message])
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - start_cpu
+        self.stdout.write('%s: %.2f seconds, %.1f messages/second, %.1f messages/CPU second' % (
+            label, elapsed, len(messages) / elapsed, len(messages) / cpu if cpu else float('inf')
+        ))
+        return elapsed
+
+    def handle(self, *args, **options):
+        messages = [
+            EmailMessage('Benchmark %s' % index, 'Hi there!', 'john@doe.com', ['jane@doe.com'])
+            for index in range(options['messages'])
+        ]
+        with SMTPSink(latency=options['latency']) as sink:
+            smtp_kwargs = dict(host=sink.host, port=sink.port, username='', password='', use_tls=False,
+                               use_ssl=False)
+            sync_elapsed = self.measure('Sync', EmailBackend(**smtp_kwargs), messages)
+            async_elapsed = self.measure(
+                'Asyncio', AsyncEmailBackend(concurrency=options['concurrency'], **smtp_kwargs), messages
+            )
+        # The sink runs in the same process, so the CPU time includes both sides of the conversation
+        self.stdout.write(self.style.SUCCESS('Speedup: %.1fx' % (sync_elapsed / async_elapsed)))
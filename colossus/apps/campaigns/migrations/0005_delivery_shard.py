@@ -0,0 +1,35 @@
+# Generated by Django 2.1.5 on 2026-10-18 02:57
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0004_campaign_tag'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryShard',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('min_subscriber_id', models.PositiveIntegerField(verbose_name='min subscriber id')),
+                ('max_subscriber_id', models.PositiveIntegerField(verbose_name='max subscriber id')),
+                ('last_subscriber_id', models.PositiveIntegerField(blank=True, null=True, verbose_name='last processed subscriber id')),
+                ('sent_count', models.PositiveIntegerField(default=0, verbose_name='sent')),
+                ('failed_count', models.PositiveIntegerField(default=0, verbose_name='failed')),
+                ('start_date', models.DateTimeField(blank=True, null=True, verbose_name='start date')),
+                ('update_date', models.DateTimeField(blank=True, null=True, verbose_name='update date')),
+                ('end_date', models.DateTimeField(blank=True, null=True, verbose_name='end date')),
+                ('campaign', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='delivery_shards', to='campaigns.Campaign', verbose_name='campaign')),
+            ],
+            options={
+                'verbose_name': 'delivery shard',
+                'verbose_name_plural': 'delivery shards',
+                'db_table': 'colossus_delivery_shards',
+                'ordering': ('min_subscriber_id',),
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0005_delivery_shard'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeliveryLedger',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.PositiveIntegerField(verbose_name='bucket')),
+                ('recipients_count', models.PositiveIntegerField(default=0, verbose_name='recipients count')),
+                ('subscribers_ids', models.BinaryField(verbose_name='subscribers ids')),
+                ('statuses', models.BinaryField(verbose_name='statuses')),
+                ('date', models.DateTimeField(default=django.utils.timezone.now, verbose_name='date')),
+                ('email', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='delivery_ledgers', to='campaigns.Email')),
+            ],
+            options={
+                'verbose_name': 'delivery ledger',
+                'verbose_name_plural': 'delivery ledgers',
+                'db_table': 'colossus_delivery_ledgers',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='deliveryledger',
+            index_together={('bucket', 'email'), ('email', 'bucket')},
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0006_deliveryledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='campaign',
+            name='segment',
+            field=models.CharField(blank=True, help_text='Optional expression of tags, statuses and engagements with AND, OR and NOT, e.g. "tag:customers AND NOT opened:12".', max_length=1000, verbose_name='segment'),
+        ),
+    ]
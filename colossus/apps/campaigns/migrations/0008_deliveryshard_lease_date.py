@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('campaigns', '0007_campaign_segment'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deliveryshard',
+            name='lease_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='lease date'),
+        ),
+    ]
@@ -1,12 +1,14 @@
 import json
 import re
 import uuid
+from datetime import timedelta
 from typing import Optional
 
 from django.apps import apps
+from django.conf import settings
 from django.contrib.sites.shortcuts import get_current_site
 from django.db import models, transaction
-from django.db.models import Count, QuerySet
+from django.db.models import Count, Max, Min, QuerySet, Sum
 from django.template import Context, Template
 from django.urls import reverse
 from django.utils import timezone
@@ -16,12 +18,18 @@ from django.utils.translation import gettext, gettext_lazy as _
 from bs4 import BeautifulSoup
 
 from colossus.apps.lists.models import MailingList
-from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.bitmaps import get_status_key, get_tag_key
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.exceptions import InvalidSegment
+from colossus.apps.subscribers.segments import Segment
 from colossus.apps.templates.models import EmailTemplate
 from colossus.apps.templates.utils import get_template_blocks
 
 from .constants import CampaignStatus, CampaignTypes
-from .tasks import send_campaign_task, update_rates_after_campaign_deletion
+from .tasks import (
+    resume_campaign_task, send_campaign_task,
+    update_rates_after_campaign_deletion,
+)
 
 
 class Campaign(models.Model):
@@ -48,6 +56,13 @@ class Campaign(models.Model):
         null=True,
         blank=True
     )
+    segment = models.CharField(
+        _('segment'),
+        max_length=1000,
+        blank=True,
+        help_text=_('Optional expression of tags, statuses and engagements with AND, OR and NOT, '
+                    'e.g. "tag:customers AND NOT opened:12".')
+    )
     status = models.PositiveSmallIntegerField(
         _('status'),
         choices=CampaignStatus.CHOICES,
@@ -96,6 +111,14 @@ class Campaign(models.Model):
     def can_edit(self) -> bool:
         return self.status == CampaignStatus.DRAFT
 
+    @property
+    def can_resume(self) -> bool:
+        """
+        A delivery can be resumed once none of its shards is held by a running
+        task, otherwise the live shards would be delivered twice.
+        """
+        return self.status == CampaignStatus.DELIVERING and not self.delivery_shards.live().exists()
+
     @property
     def can_send(self) -> bool:
         for email in self.emails.all():
@@ -114,14 +137,74 @@ class Campaign(models.Model):
         return self.__cached_email
 
     def get_recipients(self):
+        """
+        :return: The active subscribers of the tag, not filtered by the
+                 segment (see `get_recipients_bitmap`)
+        """
         queryset = self.mailing_list.get_active_subscribers()
         if self.tag is not None:
             queryset = queryset.filter(tags=self.tag)
         return queryset
 
+    def get_recipients_bitmap(self):
+        """
+        :return: Bitmap of the ids of the active subscribers of the tag and
+                 segment, or None if the campaign has no segment
+        """
+        if not self.segment:
+            return None
+        keys = [get_status_key(Status.SUBSCRIBED)]
+        if self.tag_id is not None:
+            keys.append(get_tag_key(self.tag_id))
+        return Segment(self.segment, self.mailing_list).evaluate(*keys)
+
+    def get_recipients_count(self) -> int:
+        bitmap = self.get_recipients_bitmap()
+        if bitmap is not None:
+            return len(bitmap)
+        return self.get_recipients().count()
+
+    def get_delivery_progress(self) -> Optional[dict]:
+        """
+        Summarize the delivery checkpoints of the campaign shards.
+
+        :return: A dictionary with the sent, failed and remaining recipients
+                 counts and the delivery throughput in messages per second,
+                 or None if the delivery has not started
+        """
+        stats = self.delivery_shards.aggregate(
+            shards=Count('id'),
+            completed_shards=Count('end_date'),
+            sent=Sum('sent_count'),
+            failed=Sum('failed_count'),
+            start_date=Min('start_date'),
+            update_date=Max('update_date')
+        )
+        if not stats['shards']:
+            return None
+        sent = stats['sent'] or 0
+        failed = stats['failed'] or 0
+        if stats['completed_shards'] == stats['shards']:
+            remaining = 0
+        else:
+            remaining = max(0, self.recipients_count - sent - failed)
+        messages_per_second = 0.0
+        if stats['start_date'] is not None and stats['update_date'] is not None:
+            elapsed = (stats['update_date'] - stats['start_date']).total_seconds()
+            if elapsed > 0:
+                messages_per_second = sent / elapsed
+        return {
+            'sent': sent,
+            'failed': failed,
+            'remaining': remaining,
+            'messages_per_second': messages_per_second,
+            'shards': stats['shards'],
+            'completed_shards': stats['completed_shards'],
+        }
+
     def send(self):
         with transaction.atomic():
-            self.recipients_count = self.get_recipients().count()
+            self.recipients_count = self.get_recipients_count()
             self.send_date = timezone.now()
             self.status = CampaignStatus.QUEUED
             for email in self.emails.select_related('template').all():
@@ -132,6 +215,12 @@ class Campaign(models.Model):
             self.save()
         send_campaign_task.delay(self.pk)
 
+    def resume(self):
+        """
+        Resume an interrupted delivery from the shards checkpoints.
+        """
+        resume_campaign_task.delay(self.pk)
+
     @transaction.atomic
     def replicate(self):
         copy = gettext(' (copy)')
@@ -316,7 +405,10 @@ class Email(models.Model):
         }
 
         if self.campaign.mailing_list is not None and self.campaign.mailing_list.get_active_subscribers().exists():
-            _checklist['recipients'] = True
+            try:
+                _checklist['recipients'] = not self.campaign.segment or bool(self.campaign.get_recipients_bitmap())
+            except InvalidSegment:
+                pass
 
         if self.from_email:
             _checklist['from'] = True
@@ -501,3 +593,161 @@ class Link(models.Model):
         self.total_clicks_count = qs['total_count']
         self.save(update_fields=['unique_clicks_count', 'total_clicks_count'])
         return (self.unique_clicks_count, self.total_clicks_count)
+
+
+def get_lease_expiry_date():
+    return timezone.now() - timedelta(seconds=settings.COLOSSUS_DELIVERY_SHARD_LEASE)
+
+
+class DeliveryShardManager(models.Manager):
+    def live(self):
+        """
+        Incomplete shards held by a task that reported progress recently.
+        """
+        return self.filter(end_date=None, lease_date__gte=get_lease_expiry_date())
+
+    def stale(self):
+        """
+        Incomplete shards not claimed yet, or whose task stopped reporting
+        progress (e.g. the worker was restarted).
+        """
+        return self.filter(end_date=None) \
+            .filter(models.Q(lease_date=None) | models.Q(lease_date__lt=get_lease_expiry_date()))
+
+
+class DeliveryShard(models.Model):
+    """
+    A contiguous range of recipients (by subscriber primary key) of a campaign,
+    delivered by a single task. The shard records a durable checkpoint of the
+    delivery, so an interrupted delivery can be resumed right after the last
+    processed subscriber instead of scanning all the recipients again.
+
+    The task delivering the shard holds a lease on it, renewed on each
+    checkpoint and while the task waits (see `send_campaign_shard`). The shard
+    can only be claimed by another task once the lease is older than
+    COLOSSUS_DELIVERY_SHARD_LEASE seconds. The lease is renewed with a
+    conditional update on the lease date last written by the task, so a task
+    whose lease expired finds out it lost the shard.
+    """
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        related_name='delivery_shards',
+        verbose_name=_('campaign')
+    )
+    min_subscriber_id = models.PositiveIntegerField(_('min subscriber id'))
+    max_subscriber_id = models.PositiveIntegerField(_('max subscriber id'))
+    last_subscriber_id = models.PositiveIntegerField(_('last processed subscriber id'), null=True, blank=True)
+    sent_count = models.PositiveIntegerField(_('sent'), default=0)
+    failed_count = models.PositiveIntegerField(_('failed'), default=0)
+    start_date = models.DateTimeField(_('start date'), null=True, blank=True)
+    update_date = models.DateTimeField(_('update date'), null=True, blank=True)
+    end_date = models.DateTimeField(_('end date'), null=True, blank=True)
+    lease_date = models.DateTimeField(_('lease date'), null=True, blank=True)
+
+    objects = DeliveryShardManager()
+
+    class Meta:
+        verbose_name = _('delivery shard')
+        verbose_name_plural = _('delivery shards')
+        db_table = 'colossus_delivery_shards'
+        ordering = ('min_subscriber_id',)
+
+    def __str__(self) -> str:
+        return '%s [%s-%s]' % (self.campaign_id, self.min_subscriber_id, self.max_subscriber_id)
+
+    @property
+    def is_complete(self) -> bool:
+        return self.end_date is not None
+
+    def _holding_lease(self):
+        return DeliveryShard.objects.filter(pk=self.pk, end_date=None, lease_date=self.lease_date)
+
+    def claim(self) -> bool:
+        """
+        Atomically take the lease of the shard, unless it is complete or held
+        by another task.
+
+        :return: True if the lease was taken
+        """
+        now = timezone.now()
+        claimed = DeliveryShard.objects.stale().filter(pk=self.pk).update(lease_date=now)
+        if claimed:
+            self.lease_date = now
+        return bool(claimed)
+
+    def renew_lease(self) -> bool:
+        """
+        Atomically renew the lease, unless it was taken by another task.
+
+        :return: False if the lease was lost
+        """
+        now = timezone.now()
+        renewed = self._holding_lease().update(lease_date=now)
+        if renewed:
+            self.lease_date = now
+        return bool(renewed)
+
+    def start(self):
+        if self.start_date is None:
+            self.start_date = timezone.now()
+            self.save(update_fields=['start_date'])
+
+    def save_checkpoint(self, sent_count: int = 0, failed_count: int = 0, last_subscriber_id: int = None) -> bool:
+        """
+        Atomically increment the shard counters, move the checkpoint forward
+        and renew the lease. Meant to be called in the same transaction that
+        writes the SENT activities, so the checkpoint never gets ahead of the
+        activities.
+
+        :return: False if the lease was lost, in which case only the counters
+                 are incremented
+        """
+        now = timezone.now()
+        counters = {
+            'sent_count': models.F('sent_count') + sent_count,
+            'failed_count': models.F('failed_count') + failed_count,
+            'update_date': now,
+        }
+        values = dict(counters, lease_date=now)
+        if last_subscriber_id is not None:
+            values['last_subscriber_id'] = last_subscriber_id
+        if self._holding_lease().update(**values):
+            self.lease_date = now
+            return True
+        DeliveryShard.objects.filter(pk=self.pk).update(**counters)
+        return False
+
+    def complete(self) -> bool:
+        """
+        :return: False if the lease was lost, in which case the shard is left
+                 to the task holding it
+        """
+        now = timezone.now()
+        completed = self._holding_lease().update(end_date=now)
+        if completed:
+            self.end_date = now
+        return bool(completed)
+
+
+class DeliveryLedger(models.Model):
+    """
+    Recipients of an email delivered in a batch and the status of each
+    delivery, written by `ledger.py` instead of a SENT activity per recipient.
+    The subscribers ids of a row all fall within the same bucket.
+    """
+    email = models.ForeignKey(Email, on_delete=models.CASCADE, related_name='delivery_ledgers', db_index=False)
+    bucket = models.PositiveIntegerField(_('bucket'))
+    recipients_count = models.PositiveIntegerField(_('recipients count'), default=0)
+    subscribers_ids = models.BinaryField(_('subscribers ids'))
+    statuses = models.BinaryField(_('statuses'))
+    date = models.DateTimeField(_('date'), default=timezone.now)
+
+    class Meta:
+        verbose_name = _('delivery ledger')
+        verbose_name_plural = _('delivery ledgers')
+        db_table = 'colossus_delivery_ledgers'
+        index_together = (('email', 'bucket'), ('bucket', 'email'))
+
+    def __str__(self) -> str:
+        return '%s [%s]' % (self.email_id, self.bucket)
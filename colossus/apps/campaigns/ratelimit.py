@@ -0,0 +1,240 @@
+"""
+Send-rate limiting used during the delivery of the campaigns.
+
+The messages are throttled by two token buckets: one per SMTP relay and one
+per recipient domain. The relay rate is adaptive: it is cut in half every
+time the relay answers with a temporary error (e.g. 421 or 451) and slowly
+increased back after each accepted message, up to the configured limit, so
+the sustained throughput converges to what the relay accepts.
+
+The state of the buckets lives in a pluggable store, defined by the
+`COLOSSUS_RATE_LIMIT_STORE` setting. The default store keeps the state in
+memory, per process. Use `CacheRateLimitStore` with a shared cache backend
+(e.g. Redis or Memcached) to share the limits between all the workers.
+"""
+import heapq
+import itertools
+import threading
+import time
+from smtplib import (
+    SMTPException, SMTPRecipientsRefused, SMTPResponseException,
+    SMTPServerDisconnected,
+)
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.module_loading import import_string
+
+
+def is_temporary_smtp_error(error: SMTPException) -> bool:
+    """
+    Check if an SMTP error is temporary (4xx reply codes), meaning the message
+    can be sent again later.
+    """
+    if isinstance(error, SMTPServerDisconnected):
+        return True
+    if isinstance(error, SMTPRecipientsRefused):
+        codes = [code for code, message in error.recipients.values()]
+        return bool(codes) and all(400 <= code < 500 for code in codes)
+    if isinstance(error, SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+class BaseRateLimitStore:
+    """
+    Base class of the token buckets state storage. Subclasses must implement
+    the `get` and `set` methods.
+    """
+    def __init__(self, clock: Callable[[], float] = time.time):
+        self.clock = clock
+        self.lock = threading.Lock()
+
+    def get(self, key: str) -> Any:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    def consume(self, key: str, rate: float, capacity: float) -> float:
+        """
+        Take a token from a bucket.
+
+        :param key: Bucket identifier
+        :param rate: Tokens added to the bucket per second
+        :param capacity: Maximum number of tokens in the bucket
+        :return: Zero if a token was taken, otherwise the number of seconds
+                 to wait until a token is available
+        """
+        with self.lock:
+            now = self.clock()
+            bucket = self.get('bucket:%s' % key)
+            if bucket is None:
+                tokens, last_update = capacity, now
+            else:
+                tokens, last_update = bucket
+            tokens = min(capacity, tokens + (now - last_update) * rate)
+            if tokens >= 1 - 1e-9:  # tolerate the floating point error of the refill
+                tokens = max(0.0, tokens - 1)
+                wait = 0.0
+            else:
+                wait = (1 - tokens) / rate
+            self.set('bucket:%s' % key, (tokens, now))
+            return wait
+
+    def get_rate(self, key: str, default: float) -> float:
+        rate = self.get('rate:%s' % key)
+        return default if rate is None else rate
+
+    def set_rate(self, key: str, rate: float):
+        self.set('rate:%s' % key, rate)
+
+
+class LocalMemoryRateLimitStore(BaseRateLimitStore):
+    """
+    In-process store. Each worker process has its own limits.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.data: Dict[str, Any] = dict()
+
+    def get(self, key: str) -> Any:
+        return self.data.get(key)
+
+    def set(self, key: str, value: Any):
+        self.data[key] = value
+
+
+class CacheRateLimitStore(BaseRateLimitStore):
+    """
+    Store backed by the default Django cache, shared by all the workers when
+    the cache backend is shared. The read-modify-write of the buckets is not
+    atomic across processes, so concurrent workers may slightly exceed the
+    limits.
+    """
+    key_prefix = 'colossus:ratelimit:'
+    timeout = 3600
+
+    def get(self, key: str) -> Any:
+        return cache.get(self.key_prefix + key)
+
+    def set(self, key: str, value: Any):
+        cache.set(self.key_prefix + key, value, self.timeout)
+
+
+_store: Optional[BaseRateLimitStore] = None
+
+
+def get_rate_limit_store() -> BaseRateLimitStore:
+    global _store
+    if _store is None:
+        _store = import_string(settings.COLOSSUS_RATE_LIMIT_STORE)()
+    return _store
+
+
+class RateLimiter:
+    """
+    Throttle the messages sent to a relay and to the recipient domains. A rate
+    of zero disables the corresponding limit.
+    """
+    backoff_factor = 0.5
+    increase_step = 0.1
+    min_relay_rate = 1.0
+
+    def __init__(self, relay: str, relay_rate: float = None, domain_rate: float = None,
+                 store: BaseRateLimitStore = None, sleep: Callable[[float], None] = time.sleep):
+        self.relay = relay
+        self.max_relay_rate = settings.COLOSSUS_SMTP_RATE_LIMIT if relay_rate is None else relay_rate
+        self.domain_rate = settings.COLOSSUS_DOMAIN_RATE_LIMIT if domain_rate is None else domain_rate
+        self.store = get_rate_limit_store() if store is None else store
+        self.sleep = sleep
+
+    @property
+    def relay_rate(self) -> float:
+        return min(self.max_relay_rate, self.store.get_rate('relay:%s' % self.relay, self.max_relay_rate))
+
+    def _wait(self, key: str, rate: float):
+        wait = self.store.consume(key, rate, max(1.0, rate))
+        while wait > 0:
+            self.sleep(wait)
+            wait = self.store.consume(key, rate, max(1.0, rate))
+
+    def acquire(self, domain: str):
+        """
+        Block until a message can be sent to the relay and to the domain.
+        """
+        if self.max_relay_rate:
+            self._wait('relay:%s' % self.relay, self.relay_rate)
+        if self.domain_rate:
+            self._wait('domain:%s' % domain.lower(), self.domain_rate)
+
+    def backoff(self):
+        """
+        Cut the relay rate after a temporary error.
+        """
+        if self.max_relay_rate:
+            rate = max(self.min_relay_rate, self.relay_rate * self.backoff_factor)
+            self.store.set_rate('relay:%s' % self.relay, rate)
+
+    def success(self):
+        """
+        Raise the relay rate back towards the limit after an accepted message.
+        """
+        if self.max_relay_rate:
+            rate = self.relay_rate
+            if rate < self.max_relay_rate:
+                rate = min(self.max_relay_rate, rate + self.increase_step)
+                self.store.set_rate('relay:%s' % self.relay, rate)
+
+
+class RetryQueue:
+    """
+    Recipients deferred after a temporary error, ordered by the time they can
+    be retried. The delay doubles on each attempt.
+    """
+    def __init__(self, delay: float = None, max_retries: int = None,
+                 clock: Callable[[], float] = time.time, sleep: Callable[[float], None] = time.sleep):
+        self.delay = settings.COLOSSUS_DELIVERY_RETRY_DELAY if delay is None else delay
+        self.max_retries = settings.COLOSSUS_DELIVERY_MAX_RETRIES if max_retries is None else max_retries
+        self.clock = clock
+        self.sleep = sleep
+        self._counter = itertools.count()
+        self._heap: List[Tuple[float, int, int, Any]] = list()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def defer(self, item: Any, attempt: int) -> bool:
+        """
+        Schedule an item to be retried.
+
+        :param item: Deferred item, usually a subscriber
+        :param attempt: Number of the attempt that failed, starting at 1
+        :return: False if the item exceeded the maximum number of retries
+        """
+        if attempt > self.max_retries:
+            return False
+        ready_at = self.clock() + self.delay * 2 ** (attempt - 1)
+        heapq.heappush(self._heap, (ready_at, next(self._counter), attempt, item))
+        return True
+
+    def pop_ready(self) -> List[Tuple[Any, int]]:
+        """
+        :return: List of (item, attempt) tuples ready to be retried
+        """
+        now = self.clock()
+        ready = list()
+        while self._heap and self._heap[0][0] <= now:
+            ready_at, counter, attempt, item = heapq.heappop(self._heap)
+            ready.append((item, attempt + 1))
+        return ready
+
+    def wait(self):
+        """
+        Block until the next item is ready.
+        """
+        if self._heap:
+            wait = self._heap[0][0] - self.clock()
+            if wait > 0:
+                self.sleep(wait)
@@ -0,0 +1,191 @@
+"""
+Render pipeline used during the delivery of the campaigns.
+
+Rendering an email with the Django template engine and converting the result
+to plain text is the most expensive part of sending a message. As the only
+difference between the messages of a campaign is the personalization
+variables (uuid, name, sub and unsub), the `CompiledEmail` renders the email
+only once, using unique tokens in place of the personalization variables, and
+then each message is produced by replacing the tokens with the values of the
+recipient.
+"""
+import re
+import uuid
+from typing import Dict, Optional, Tuple
+
+from django.template import Context, Template
+from django.template.base import Node, TextNode, VariableNode
+from django.template.defaulttags import AutoEscapeControlNode
+from django.utils.crypto import get_random_string
+from django.utils.html import escape
+from django.utils.translation import gettext as _
+
+import html2text
+
+from colossus.utils import get_absolute_url
+
+PERSONALIZATION_VARIABLES = ('uuid', 'name', 'sub', 'unsub')
+
+PERSONALIZATION_VARIABLES_RE = re.compile(r'\b(%s)\b' % '|'.join(PERSONALIZATION_VARIABLES))
+
+TRACK_OPEN_RE = re.compile(r'(!\[\]\(https?://.*/track/open/.*/\)\n\n)')
+
+PLACEHOLDER_UUID = uuid.UUID(int=0)
+
+
+def html_to_text(html: str) -> str:
+    """
+    Convert the HTML version of an email to plain text, removing the open
+    tracking pixel.
+    """
+    text = html2text.html2text(html, bodywidth=2000)
+    return TRACK_OPEN_RE.sub('', text, 1)
+
+
+def is_substitutable(*templates: Template) -> bool:
+    """
+    Check if the personalization variables are only used as plain variables
+    (e.g. `{{ name }}`) in the templates, so the rendered output can be reused
+    just by replacing their values. Filters, tags using the variables (e.g.
+    `{% if name %}`) or changes in the auto-escaping make the output depend
+    on the values, in which case each message must be rendered individually.
+    """
+    for template in templates:
+        for node in template.nodelist.get_nodes_by_type(Node):
+            if isinstance(node, TextNode):
+                continue
+            if isinstance(node, AutoEscapeControlNode):
+                return False
+            if isinstance(node, VariableNode):
+                expression = node.filter_expression
+                lookups = getattr(expression.var, 'lookups', None)
+                if lookups and lookups[0] in PERSONALIZATION_VARIABLES:
+                    if expression.filters or len(lookups) > 1:
+                        return False
+            elif node.token is None or PERSONALIZATION_VARIABLES_RE.search(node.token.contents):
+                return False
+    return True
+
+
+class CompiledEmail:
+    """
+    Holds everything that can be computed once per campaign email: the parsed
+    template, the rendered HTML and plain text skeletons and the headers.
+    """
+    def __init__(self, email, domain: Optional[str] = None, is_test: bool = False):
+        self.email = email
+        self.domain = domain
+        self.is_test = is_test
+        self.subject = email.subject
+        if is_test:
+            self.subject = '[%s] %s' % (_('Test'), email.subject)
+        self.from_email = email.get_from()
+        self.template = Template(email.child_template_string)
+        self.tokens = {key: get_random_string(32, 'abcdefghijklmnopqrstuvwxyz0123456789')
+                       for key in PERSONALIZATION_VARIABLES}
+        self.__skeletons: Optional[Tuple[str, str]] = None
+        self.__is_substitutable: Optional[bool] = None
+        self.__urls: Optional[Tuple[str, str]] = None
+        self.__headers: Optional[Dict[str, str]] = None
+        self.__list_unsubscribe_mailto = ''
+
+    def _render_template(self, context_dict: dict) -> str:
+        context_dict = dict(context_dict)
+        context_dict[self.email.BASE_TEMPLATE_VAR] = self.email.base_template
+        return self.template.render(Context(context_dict))
+
+    @property
+    def is_substitutable(self) -> bool:
+        if self.__is_substitutable is None:
+            self.__is_substitutable = is_substitutable(self.template, self.email.base_template)
+        return self.__is_substitutable
+
+    def get_skeletons(self, context: dict) -> Tuple[str, str]:
+        """
+        Render the HTML and the plain text versions of the email once, with
+        tokens in place of the personalization variables. The other context
+        variables (e.g. domain) are expected to be the same for all messages.
+        """
+        if self.__skeletons is None:
+            context_dict = dict(context)
+            context_dict.update(self.tokens)
+            html = self._render_template(context_dict)
+            self.__skeletons = (html, html_to_text(html))
+        return self.__skeletons
+
+    def _substitute(self, skeleton: str, values: Dict[str, str]) -> str:
+        for key, token in self.tokens.items():
+            skeleton = skeleton.replace(token, values[key])
+        return skeleton
+
+    def render(self, context: dict) -> Tuple[str, str]:
+        """
+        Render the email for a given context.
+
+        :param context: Template context, including the personalization variables
+        :return: A tuple with the HTML and the plain text versions of the email
+        """
+        if not self.is_substitutable:
+            html = self._render_template(context)
+            return html, html_to_text(html)
+        html_skeleton, text_skeleton = self.get_skeletons(context)
+        values = {key: str(context.get(key, '')) for key in PERSONALIZATION_VARIABLES}
+        html = self._substitute(html_skeleton, {key: escape(value) for key, value in values.items()})
+        text = self._substitute(text_skeleton, values)
+        return html, text
+
+    def get_urls(self) -> Tuple[str, str]:
+        """
+        Build the subscribe and the unsubscribe absolute URLs once. The
+        unsubscribe URL holds a placeholder UUID in place of the subscriber's.
+        """
+        if self.__urls is None:
+            mailing_list = self.email.campaign.mailing_list
+            subscribe_url = get_absolute_url('subscribers:subscribe', kwargs={
+                'mailing_list_uuid': mailing_list.uuid
+            })
+            unsubscribe_url = get_absolute_url('subscribers:unsubscribe', kwargs={
+                'mailing_list_uuid': mailing_list.uuid,
+                'subscriber_uuid': PLACEHOLDER_UUID,
+                'campaign_uuid': self.email.campaign.uuid
+            })
+            self.__urls = (subscribe_url, unsubscribe_url)
+        return self.__urls
+
+    def get_subscriber_context(self, subscriber) -> dict:
+        subscribe_url, unsubscribe_url = self.get_urls()
+        return {
+            'domain': self.domain,
+            'uuid': subscriber.uuid,
+            'name': subscriber.name,
+            'sub': subscribe_url,
+            'unsub': unsubscribe_url.replace(str(PLACEHOLDER_UUID), str(subscriber.uuid))
+        }
+
+    def get_headers(self, context: dict) -> Dict[str, str]:
+        """
+        Build the List-* headers of the message. Only the List-Unsubscribe
+        header depends on the recipient, the others are built once.
+        """
+        if self.is_test:
+            return dict()
+
+        mailing_list = self.email.campaign.mailing_list
+        if self.__headers is None:
+            list_subscribe_header = ['<%s>' % context['sub']]
+            if mailing_list.list_manager:
+                list_subscribe_header.append('<mailto:%s?subject=subscribe>' % mailing_list.list_manager)
+                self.__list_unsubscribe_mailto = '<mailto:%s?subject=unsubscribe>' % mailing_list.list_manager
+            self.__headers = {
+                'List-ID': '%s <%s.list-id.%s>' % (mailing_list.name, mailing_list.uuid, context['domain']),
+                'List-Post': 'NO',
+                'List-Unsubscribe-Post': 'List-Unsubscribe=One-Click',
+                'List-Subscribe': ', '.join(list_subscribe_header),
+            }
+
+        headers = dict(self.__headers)
+        list_unsubscribe_header = ['<%s>' % context['unsub']]
+        if self.__list_unsubscribe_mailto:
+            list_unsubscribe_header.append(self.__list_unsubscribe_mailto)
+        headers['List-Unsubscribe'] = ', '.join(list_unsubscribe_header)
+        return headers
@@ -0,0 +1,235 @@
+"""
+Pool of SMTP connections used during the delivery of the campaigns.
+
+Mailing lists can have their own SMTP relay settings. Opening an SMTP session
+(TCP connection, TLS handshake and authentication) for every campaign shard is
+expensive, so the authenticated sessions are kept alive in a per-process pool,
+keyed by the SMTP settings of the list, and reused across tasks.
+"""
+import logging
+import smtplib
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.smtp import EmailBackend
+
+from celery.signals import worker_process_shutdown
+
+from colossus.apps.campaigns.aiosmtp import AsyncEmailBackend
+
+logger = logging.getLogger(__name__)
+
+SMTPSettingsKey = Tuple
+
+SMTP_SETTINGS_FIELDS = ('host', 'port', 'username', 'password', 'use_tls', 'use_ssl', 'timeout', 'ssl_keyfile',
+                        'ssl_certfile')
+
+
+def get_smtp_settings_key(mailing_list) -> Optional[SMTPSettingsKey]:
+    """
+    Build the key identifying the SMTP relay settings of a mailing list.
+
+    :param mailing_list: MailingList instance
+    :return: A tuple with the SMTP settings or None if the list does not
+             define its own SMTP host
+    """
+    if mailing_list is None or not mailing_list.smtp_host:
+        return None
+    return tuple(getattr(mailing_list, 'smtp_%s' % field) for field in SMTP_SETTINGS_FIELDS)
+
+
+def get_relay_name(mailing_list) -> str:
+    """
+    Identify the SMTP relay used to deliver the campaigns of a mailing list,
+    e.g. to throttle the messages sent through it.
+    """
+    if get_smtp_settings_key(mailing_list) is None:
+        return '%s@%s:%s' % (settings.EMAIL_HOST_USER, settings.EMAIL_HOST, settings.EMAIL_PORT)
+    return '%s@%s:%s' % (mailing_list.smtp_username, mailing_list.smtp_host, mailing_list.smtp_port or '')
+
+
+class PooledEmailBackend(EmailBackend):
+    """
+    SMTP email backend managed by a `SMTPConnectionPool`. The session is
+    renewed after `max_messages` messages and when the server closes it.
+    Calling `close` releases the backend back to the pool instead of
+    closing the session.
+    """
+    def __init__(self, pool: 'SMTPConnectionPool', key: SMTPSettingsKey, max_messages: int = 0, **kwargs):
+        super().__init__(**kwargs)
+        self.pool = pool
+        self.key = key
+        self.max_messages = max_messages
+        self.messages_sent = 0
+
+    def is_alive(self) -> bool:
+        if self.connection is None:
+            return False
+        try:
+            return self.connection.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    def close_connection(self):
+        """
+        Close the SMTP session for real.
+        """
+        try:
+            super().close()
+        except (smtplib.SMTPException, OSError):
+            self.connection = None
+        self.messages_sent = 0
+
+    def reconnect(self):
+        self.close_connection()
+        self.open()
+
+    def close(self):
+        self.pool.release(self)
+
+    def send_messages(self, email_messages):
+        if self.max_messages and self.messages_sent >= self.max_messages:
+            self.reconnect()
+        elif self.connection is None:
+            self.open()
+        try:
+            num_sent = super().send_messages(email_messages)
+        except smtplib.SMTPServerDisconnected:
+            logger.warning('SMTP server %s closed the connection. Reconnecting.', self.host)
+            self.reconnect()
+            num_sent = super().send_messages(email_messages)
+        self.messages_sent += num_sent
+        return num_sent
+
+
+class SMTPConnectionPool:
+    """
+    Keep up to `max_connections` idle authenticated SMTP sessions per relay
+    settings. The idle sessions are checked with a NOOP command before being
+    reused, so the sessions closed by the server are transparently renewed.
+    """
+    def __init__(self, max_connections: Optional[int] = None, max_messages: Optional[int] = None):
+        self.max_connections = max_connections
+        self.max_messages = max_messages
+        self._lock = threading.Lock()
+        self._idle: Dict[SMTPSettingsKey, List[PooledEmailBackend]] = defaultdict(list)
+
+    def get_max_connections(self) -> int:
+        if self.max_connections is None:
+            return settings.COLOSSUS_SMTP_POOL_SIZE
+        return self.max_connections
+
+    def get_max_messages(self) -> int:
+        if self.max_messages is None:
+            return settings.COLOSSUS_SMTP_MAX_MESSAGES_PER_CONNECTION
+        return self.max_messages
+
+    def create_backend(self, key: SMTPSettingsKey) -> PooledEmailBackend:
+        kwargs = dict(zip(SMTP_SETTINGS_FIELDS, key))
+        kwargs['ssl_keyfile'] = kwargs['ssl_keyfile'] or None
+        kwargs['ssl_certfile'] = kwargs['ssl_certfile'] or None
+        return PooledEmailBackend(pool=self, key=key, max_messages=self.get_max_messages(), fail_silently=False,
+                                  **kwargs)
+
+    def acquire(self, key: SMTPSettingsKey) -> PooledEmailBackend:
+        """
+        Take an idle session from the pool, or open a new one.
+        """
+        with self._lock:
+            idle_backends = self._idle[key]
+            backend = idle_backends.pop() if idle_backends else None
+        if backend is None:
+            backend = self.create_backend(key)
+        elif not backend.is_alive():
+            backend.close_connection()
+        backend.open()
+        return backend
+
+    def release(self, backend: PooledEmailBackend):
+        """
+        Return a session to the pool. If the pool is full or the session was
+        closed, the backend is discarded.
+        """
+        if backend.connection is not None:
+            with self._lock:
+                idle_backends = self._idle[backend.key]
+                if len(idle_backends) < self.get_max_connections():
+                    idle_backends.append(backend)
+                    return
+        backend.close_connection()
+
+    @contextmanager
+    def connection(self, key: SMTPSettingsKey):
+        backend = self.acquire(key)
+        try:
+            yield backend
+        except (smtplib.SMTPException, OSError):
+            backend.close_connection()
+            raise
+        finally:
+            backend.close()
+
+    def idle_count(self, key: SMTPSettingsKey) -> int:
+        with self._lock:
+            return len(self._idle[key])
+
+    def close_all(self):
+        with self._lock:
+            backends = [backend for idle_backends in self._idle.values() for backend in idle_backends]
+            self._idle.clear()
+        for backend in backends:
+            backend.close_connection()
+
+
+connection_pool = SMTPConnectionPool()
+
+
+def reopen_connection(connection):
+    """
+    Open a new session on an email backend whose session was closed by the
+    server, e.g. after a 421 reply. `smtplib` drops the socket but the Django
+    SMTP backend keeps the closed session, so `open` alone would do nothing.
+    """
+    if isinstance(connection, PooledEmailBackend):
+        connection.reconnect()
+        return
+    try:
+        connection.close()
+    except (smtplib.SMTPException, OSError):
+        pass
+    if isinstance(connection, EmailBackend):
+        connection.connection = None
+    connection.open()
+
+
+@contextmanager
+def get_mailing_list_connection(mailing_list):
+    """
+    Context manager providing the email backend used to deliver the campaigns
+    of a mailing list. Lists with their own SMTP relay settings use a pooled
+    session, the others use the default email backend. When the delivery
+    concurrency is greater than one, the asynchronous SMTP backend is used
+    instead, connecting to the list relay or to the default SMTP settings.
+    """
+    key = get_smtp_settings_key(mailing_list)
+    if settings.COLOSSUS_DELIVERY_CONCURRENCY > 1:
+        kwargs = dict()
+        if key is not None:
+            kwargs = dict(zip(SMTP_SETTINGS_FIELDS, key))
+        with AsyncEmailBackend(**kwargs) as connection:
+            yield connection
+    elif key is None:
+        with get_connection() as connection:
+            yield connection
+    else:
+        with connection_pool.connection(key) as connection:
+            yield connection
+
+
+@worker_process_shutdown.connect
+def close_connection_pool(**kwargs):
+    connection_pool.close_all()
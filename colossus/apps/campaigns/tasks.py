@@ -6,21 +6,48 @@ from django.utils import timezone
 
 from celery import shared_task
 
-from .api import send_campaign
+from colossus.utils import run_chord
+
+from .api import (
+    complete_campaign_delivery, enable_tracking, prepare_campaign_delivery,
+    send_campaign, send_campaign_shard,
+)
 from .constants import CampaignStatus
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def send_campaign_task(campaign_id):
+def _can_fan_out(app) -> bool:
+    """
+    Chords depend on a result backend to know when all the shards are done.
+    Eager mode runs everything in-process, so it does not need one.
+    """
+    return bool(app.conf.task_always_eager or app.conf.result_backend)
+
+
+def _deliver_campaign(app, campaign):
+    """
+    Deliver the incomplete shards of a campaign, in parallel when possible.
+    """
+    if _can_fan_out(app):
+        shards_ids = campaign.delivery_shards.stale().values_list('pk', flat=True)
+        header = [send_campaign_shard_task.si(shard_id) for shard_id in shards_ids]
+        run_chord(header, complete_campaign_delivery_task.si(campaign.pk))
+    else:
+        logger.warning('No Celery result backend configured. Campaign "%s" will be delivered '
+                       'serially.' % campaign.pk)
+        if send_campaign(campaign):
+            _notify_campaign_sent(campaign)
+
+
+@shared_task(bind=True)
+def send_campaign_task(self, campaign_id):
     Campaign = apps.get_model('campaigns', 'Campaign')
     try:
         campaign = Campaign.objects.get(pk=campaign_id)
         if campaign.status == CampaignStatus.QUEUED:
-            send_campaign(campaign)
-            mail_managers('Mailing campaign has been sent',
-                          'Your campaign "%s" is on its way to your subscribers!' % campaign.email.subject)
+            prepare_campaign_delivery(campaign)
+            _deliver_campaign(self.app, campaign)
         else:
             logger.warning('Campaign "%s" was placed in a queue with status "%s".' % (campaign_id,
                                                                                       campaign.get_status_display()))
@@ -28,6 +55,47 @@ def send_campaign_task(campaign_id):
         logger.exception('Campaign "%s" was placed in a queue but it does not exist.' % campaign_id)
 
 
+@shared_task(bind=True)
+def resume_campaign_task(self, campaign_id):
+    """
+    Resume an interrupted delivery (e.g. the worker was restarted), starting
+    each stale shard right after its last checkpoint. The shards still held by
+    a running task are left to it.
+    """
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    try:
+        campaign = Campaign.objects.get(pk=campaign_id)
+        if campaign.status == CampaignStatus.DELIVERING:
+            prepare_campaign_delivery(campaign)
+            _deliver_campaign(self.app, campaign)
+        else:
+            logger.warning('Campaign "%s" cannot be resumed with status "%s".' % (campaign_id,
+                                                                                  campaign.get_status_display()))
+    except Campaign.DoesNotExist:
+        logger.exception('Campaign "%s" was placed in a queue but it does not exist.' % campaign_id)
+
+
+@shared_task
+def send_campaign_shard_task(shard_id):
+    DeliveryShard = apps.get_model('campaigns', 'DeliveryShard')
+    shard = DeliveryShard.objects.select_related('campaign__mailing_list').get(pk=shard_id)
+    enable_tracking(shard.campaign)
+    return send_campaign_shard(shard)
+
+
+@shared_task
+def complete_campaign_delivery_task(campaign_id):
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    campaign = Campaign.objects.select_related('mailing_list').get(pk=campaign_id)
+    if complete_campaign_delivery(campaign):
+        _notify_campaign_sent(campaign)
+
+
+def _notify_campaign_sent(campaign):
+    mail_managers('Mailing campaign has been sent',
+                  'Your campaign "%s" is on its way to your subscribers!' % campaign.email.subject)
+
+
 @shared_task
 def send_scheduled_campaigns_task():
     Campaign = apps.get_model('campaigns', 'Campaign')
@@ -39,8 +107,5 @@ def send_scheduled_campaigns_task():
 
 @shared_task
 def update_rates_after_campaign_deletion(mailing_list_id):
-    MailingList = apps.get_model('lists', 'MailingList')
-    mailing_list = MailingList.objects.only('pk').get(pk=mailing_list_id)
-    for subscriber in mailing_list.subscribers.only('pk'):
-        subscriber.update_open_and_click_rate()
-    mailing_list.update_open_and_click_rate()
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    Subscriber.objects.update_mailing_list_rates(mailing_list_id)
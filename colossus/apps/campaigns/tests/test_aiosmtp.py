@@ -0,0 +1,101 @@
+from io import StringIO
+
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.test import override_settings
+
+from colossus.apps.campaigns.aiosmtp import AsyncEmailBackend, prepare_data
+from colossus.apps.campaigns.api import send_campaign
+from colossus.apps.campaigns.ratelimit import is_temporary_smtp_error
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.smtp import SMTPSink
+from colossus.test.testcases import TestCase
+
+
+class PrepareDataTests(TestCase):
+    def test_line_endings_and_periods(self):
+        self.assertEqual(b'a\r\n..b\r\nc\r\n.\r\n', prepare_data(b'a\n.b\rc'))
+
+
+class AsyncEmailBackendTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink(recipient_replies={'busy@colossusmail.com': '451 Try again later'})
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+
+    def get_backend(self, **kwargs):
+        return AsyncEmailBackend(host=self.sink.host, port=self.sink.port, username='', password='',
+                                 use_tls=False, use_ssl=False, **kwargs)
+
+    def get_messages(self, count, to='jane@doe.com'):
+        return [EmailMessage('Subject %s' % index, '.Body', 'John <john@doe.com>', [to]) for index in range(count)]
+
+    def test_send_messages_concurrently(self):
+        with self.get_backend(concurrency=3) as backend:
+            self.assertEqual(10, backend.send_messages(self.get_messages(10)))
+        self.assertEqual(10, len(self.sink.messages))
+        self.assertEqual(3, self.sink.connections_count)
+        mail_from, recipients, data = self.sink.messages[0]
+        self.assertEqual('john@doe.com', mail_from)
+        self.assertEqual(['jane@doe.com'], recipients)
+        self.assertIn(b'\r\n.Body', data)
+
+    def test_connections_kept_open_between_batches(self):
+        with self.get_backend(concurrency=2) as backend:
+            backend.send_messages(self.get_messages(4))
+            backend.send_messages(self.get_messages(4))
+        self.assertEqual(8, len(self.sink.messages))
+        self.assertEqual(2, self.sink.connections_count)
+
+    def test_max_messages_per_connection(self):
+        with self.get_backend(concurrency=1, max_messages=2) as backend:
+            backend.send_messages(self.get_messages(5))
+        self.assertEqual(5, len(self.sink.messages))
+        self.assertEqual(3, self.sink.connections_count)
+
+    def test_detailed_results(self):
+        messages = self.get_messages(1) + self.get_messages(1, to='busy@colossusmail.com')
+        with self.get_backend(concurrency=2) as backend:
+            results = backend.send_messages_detailed(messages)
+        self.assertIsNone(results[0])
+        self.assertTrue(is_temporary_smtp_error(results[1]))
+        self.assertEqual(1, len(self.sink.messages))
+
+
+class SendCampaignAsyncTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink()
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+        self.mailing_list = MailingListFactory(smtp_host=self.sink.host, smtp_port=self.sink.port,
+                                               smtp_use_tls=False)
+        self.subscribers = SubscriberFactory.create_batch(10, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.save()
+
+    @override_settings(COLOSSUS_DELIVERY_CONCURRENCY=4)
+    def test_send_campaign(self):
+        send_campaign(self.campaign)
+        recipients = {recipients[0] for mail_from, recipients, data in self.sink.messages}
+        self.assertEqual({subscriber.email for subscriber in self.subscribers}, recipients)
+        self.assertEqual(4, self.sink.connections_count)
+        self.assertEqual(10, Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count())
+        self.assertEqual(10, self.campaign.get_delivery_progress()['sent'])
+
+
+class BenchmarkSMTPCommandTests(TestCase):
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('benchmarksmtp', messages=5, concurrency=2, latency=0, stdout=out)
+        self.assertIn('Sync:', out.getvalue())
+        self.assertIn('Asyncio:', out.getvalue())
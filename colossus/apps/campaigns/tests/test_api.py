@@ -1,9 +1,18 @@
+from datetime import timedelta
+from unittest import mock
+
 from django.core import mail
+from django.test import override_settings
+from django.utils import timezone
 
+from colossus.apps.campaigns import api
 from colossus.apps.campaigns.api import (
-    get_test_email_context, send_campaign, send_campaign_email_test,
+    SentActivitiesBuffer, complete_campaign_delivery, get_recipient_shards,
+    get_sent_subscribers_ids, get_test_email_context, send_campaign,
+    send_campaign_email_test,
 )
 from colossus.apps.campaigns.constants import CampaignStatus
+from colossus.apps.campaigns.models import DeliveryShard
 from colossus.apps.campaigns.tests.factories import (
     CampaignFactory, EmailFactory,
 )
@@ -11,7 +20,9 @@ from colossus.apps.lists.models import MailingList
 from colossus.apps.lists.tests.factories import MailingListFactory
 from colossus.apps.subscribers.constants import ActivityTypes
 from colossus.apps.subscribers.models import Activity, Subscriber
-from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.apps.subscribers.tests.factories import (
+    SubscriberFactory, TagFactory,
+)
 from colossus.test.testcases import TestCase
 from colossus.utils import get_absolute_url
 
@@ -128,6 +139,223 @@ class SendCampaignTests(TestCase):
                 self.assertIn('/track/open/', html_body, 'Email HTML body must contain track open pixel.')
 
 
+class SendCampaignResumeTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(5, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.set_blocks({'content': '<p>Hi there!</p>'})
+        self.email.save()
+        self.already_sent = self.subscribers[:3]
+        for subscriber in self.already_sent:
+            subscriber.create_activity(ActivityTypes.SENT, email=self.email)
+
+    def test_get_sent_subscribers_ids(self):
+        # activities and delivery ledger
+        with self.assertNumQueries(2):
+            sent_subscribers_ids = get_sent_subscribers_ids(self.email)
+        self.assertEqual(sent_subscribers_ids, {subscriber.pk for subscriber in self.already_sent})
+
+    def test_get_sent_subscribers_ids_range(self):
+        pk = self.already_sent[1].pk
+        self.assertEqual(get_sent_subscribers_ids(self.email, pk, pk), {pk})
+
+    def test_send_remaining_recipients_only(self):
+        send_campaign(self.campaign)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(
+            {message.to[0] for message in mail.outbox},
+            {subscriber.email for subscriber in self.subscribers[3:]}
+        )
+        activities_count = Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count()
+        self.assertEqual(activities_count, 5)
+
+
+class SentActivitiesBufferTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.email = EmailFactory()
+        self.subscribers = SubscriberFactory.create_batch(5, mailing_list=MailingListFactory(), last_sent=None)
+
+    def test_flush_when_full(self):
+        buffer = SentActivitiesBuffer(self.email, size=2)
+        with self.assertNumQueries(0):
+            buffer.add(self.subscribers[0].pk)
+        # savepoint, insert, mailing lists, rollup (savepoint, select, insert, release), update, release savepoint
+        with self.assertNumQueries(9):
+            buffer.add(self.subscribers[1].pk)
+        self.assertEqual(2, Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count())
+        self.assertEqual(2, Subscriber.objects.exclude(last_sent=None).count())
+
+    def test_flush_on_exit(self):
+        with SentActivitiesBuffer(self.email, size=100) as buffer:
+            for subscriber in self.subscribers:
+                buffer.add(subscriber.pk)
+            self.assertEqual(0, Activity.objects.count())
+        self.assertEqual(5, Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count())
+        self.assertEqual(5, Subscriber.objects.exclude(last_sent=None).count())
+
+    def test_flush_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(0, SentActivitiesBuffer(self.email).flush())
+
+
+class DeliveryCheckpointTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(6, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list, recipients_count=6)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.save()
+
+    def test_shards_completed(self):
+        with self.settings(COLOSSUS_CAMPAIGN_SHARD_SIZE=4):
+            send_campaign(self.campaign)
+        shards = list(self.campaign.delivery_shards.all())
+        self.assertEqual(2, len(shards))
+        self.assertTrue(all(shard.is_complete for shard in shards))
+        self.assertEqual([4, 2], [shard.sent_count for shard in shards])
+        self.assertEqual([shard.max_subscriber_id for shard in shards],
+                         [shard.last_subscriber_id for shard in shards])
+
+    def test_resume_from_checkpoint(self):
+        """
+        Subscribers up to the checkpoint must not be loaded nor sent again,
+        even without a SENT activity
+        """
+        self.campaign.status = CampaignStatus.DELIVERING
+        self.campaign.save()
+        pks = sorted(subscriber.pk for subscriber in self.subscribers)
+        DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=pks[0], max_subscriber_id=pks[-1],
+                                     last_subscriber_id=pks[3], sent_count=4)
+        send_campaign(self.campaign)
+        self.assertEqual({message.to[0] for message in mail.outbox},
+                         {subscriber.email for subscriber in self.subscribers if subscriber.pk > pks[3]})
+        progress = self.campaign.get_delivery_progress()
+        self.assertEqual(6, progress['sent'])
+        self.assertEqual(0, progress['remaining'])
+
+    def test_live_shard_not_resumed(self):
+        """
+        A shard held by a running task must not be delivered twice, and the
+        campaign is completed by that task
+        """
+        self.campaign.status = CampaignStatus.DELIVERING
+        self.campaign.save()
+        pks = sorted(subscriber.pk for subscriber in self.subscribers)
+        live = DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=pks[0],
+                                            max_subscriber_id=pks[2], lease_date=timezone.now())
+        DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=pks[3], max_subscriber_id=pks[-1],
+                                     lease_date=timezone.now() - timedelta(hours=1))
+        self.assertFalse(live.claim())
+        self.assertFalse(send_campaign(self.campaign))
+        self.assertEqual({message.to[0] for message in mail.outbox},
+                         {subscriber.email for subscriber in self.subscribers if subscriber.pk > pks[2]})
+        self.campaign.refresh_from_db()
+        self.assertEqual(CampaignStatus.DELIVERING, self.campaign.status)
+        self.assertFalse(self.campaign.can_resume)
+
+    @override_settings(COLOSSUS_DELIVERY_SHARD_LEASE=0)
+    def test_lease_lost_stops_delivery(self):
+        """
+        Once another task took over the shard, the delivery must stop without
+        moving the checkpoint nor completing the shard
+        """
+        send_messages = api.send_messages
+
+        def send_messages_and_lose_lease(connection, messages):
+            results = send_messages(connection, messages)
+            DeliveryShard.objects.update(lease_date=timezone.now() + timedelta(hours=1))
+            return results
+
+        with mock.patch('colossus.apps.campaigns.api.send_messages', side_effect=send_messages_and_lose_lease):
+            self.assertFalse(send_campaign(self.campaign))
+        self.assertEqual(1, len(mail.outbox))
+        self.assertEqual(1, Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count())
+        shard = self.campaign.delivery_shards.get()
+        self.assertFalse(shard.is_complete)
+        self.assertEqual((1, None), (shard.sent_count, shard.last_subscriber_id))
+        self.campaign.refresh_from_db()
+        self.assertEqual(CampaignStatus.DELIVERING, self.campaign.status)
+
+    def test_complete_delivery_once(self):
+        self.assertTrue(send_campaign(self.campaign))
+        self.assertFalse(complete_campaign_delivery(self.campaign))
+        self.campaign.refresh_from_db()
+        self.assertEqual(CampaignStatus.SENT, self.campaign.status)
+
+    def test_buffer_saves_checkpoint(self):
+        pks = sorted(subscriber.pk for subscriber in self.subscribers)
+        shard = DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=pks[0],
+                                             max_subscriber_id=pks[-1])
+        with SentActivitiesBuffer(self.email, size=2, shard=shard) as buffer:
+            buffer.add(pks[0])
+            buffer.add_failed()
+            buffer.set_checkpoint(pks[1])
+            buffer.add(pks[2])
+            buffer.set_checkpoint(pks[2])
+            shard.refresh_from_db()
+            self.assertEqual((2, 1, pks[1]), (shard.sent_count, shard.failed_count, shard.last_subscriber_id))
+        shard.refresh_from_db()
+        self.assertEqual((2, 1, pks[2]), (shard.sent_count, shard.failed_count, shard.last_subscriber_id))
+
+
+class GetRecipientShardsTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(7, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+
+    def test_shards_cover_all_recipients(self):
+        shards = get_recipient_shards(self.campaign, 3)
+        self.assertEqual(len(shards), 3)
+        pks = sorted(subscriber.pk for subscriber in self.subscribers)
+        self.assertEqual(shards[0], (pks[0], pks[2]))
+        self.assertEqual(shards[1], (pks[3], pks[5]))
+        self.assertEqual(shards[2], (pks[6], pks[6]))
+
+    def test_single_shard(self):
+        shards = get_recipient_shards(self.campaign, 100)
+        self.assertEqual(len(shards), 1)
+
+    def test_no_recipients(self):
+        self.mailing_list.subscribers.all().delete()
+        self.assertEqual(get_recipient_shards(self.campaign, 3), [])
+
+
+class SendCampaignSegmentTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.tag = TagFactory(name='customers', mailing_list=self.mailing_list)
+        self.subscribers = SubscriberFactory.create_batch(5, mailing_list=self.mailing_list)
+        self.tagged = self.subscribers[1::2]
+        for subscriber in self.tagged:
+            subscriber.tags.add(self.tag)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list, segment='NOT tag:customers')
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.save()
+
+    def test_shards_follow_segment(self):
+        self.assertEqual(get_recipient_shards(self.campaign, 2), [
+            (self.subscribers[0].pk, self.subscribers[2].pk),
+            (self.subscribers[4].pk, self.subscribers[4].pk),
+        ])
+
+    def test_send_segment_only(self):
+        send_campaign(self.campaign)
+        sent = Activity.objects.filter(activity_type=ActivityTypes.SENT).values_list('subscriber_id', flat=True)
+        self.assertEqual(sorted(sent), [self.subscribers[0].pk, self.subscribers[2].pk, self.subscribers[4].pk])
+        self.assertEqual(len(mail.outbox), 3)
+
+
 class SendCampaignEmailTestTests(TestCase):
     def setUp(self):
         super().setUp()
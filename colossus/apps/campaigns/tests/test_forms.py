@@ -1,5 +1,8 @@
-from colossus.apps.campaigns.forms import CreateCampaignForm
+from colossus.apps.campaigns.forms import (
+    CampaignRecipientsForm, CreateCampaignForm,
+)
 from colossus.apps.campaigns.models import Campaign
+from colossus.apps.campaigns.tests.factories import CampaignFactory
 from colossus.apps.lists.tests.factories import MailingListFactory
 from colossus.apps.subscribers.tests.factories import TagFactory
 from colossus.test.testcases import TestCase
@@ -64,3 +67,31 @@ class CreateCampaignFormTests(TestCase):
         self.assertEqual('Test campaign', campaign.name)
         self.assertIsNone(campaign.mailing_list)
         self.assertIsNone(campaign.tag)
+
+
+class CampaignRecipientsFormTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.tag = TagFactory(name='customers', mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory()
+
+    def test_valid_segment(self):
+        form = CampaignRecipientsForm({
+            'mailing_list': self.mailing_list.pk,
+            'segment': 'tag:customers AND NOT status:pending'
+        }, instance=self.campaign)
+        self.assertTrue(form.is_valid())
+        self.assertEqual('tag:customers AND NOT status:pending', form.save().segment)
+
+    def test_invalid_segment(self):
+        form = CampaignRecipientsForm({
+            'mailing_list': self.mailing_list.pk,
+            'segment': 'tag:unknown'
+        }, instance=self.campaign)
+        self.assertFalse(form.is_valid())
+        self.assertIn('segment', form.errors)
+
+    def test_segment_without_list(self):
+        form = CampaignRecipientsForm({'segment': 'tag:customers'}, instance=self.campaign)
+        self.assertFalse(form.is_valid())
+        self.assertIn('segment', form.errors)
@@ -0,0 +1,94 @@
+from unittest import mock
+
+from django.core import mail
+from django.test import override_settings
+
+from colossus.apps.campaigns.api import (
+    SentActivitiesBuffer, get_sent_subscribers_ids, send_campaign,
+)
+from colossus.apps.campaigns.constants import DeliveryStatus
+from colossus.apps.campaigns.ledger import (
+    BUCKET_SIZE, decode_entries, decode_ids, encode_ids, get_sent_emails_ids,
+    iter_sent_subscribers_ids, record_deliveries,
+)
+from colossus.apps.campaigns.models import DeliveryLedger
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity, Subscriber
+from colossus.apps.subscribers.rollups import get_activity_counts
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.testcases import TestCase
+
+
+class LedgerEncodingTests(TestCase):
+    def test_encode_ids(self):
+        ids = [1, 2, 130, 131, 2 ** 40]
+        self.assertEqual(ids, decode_ids(encode_ids(ids)))
+
+    def test_encoded_size(self):
+        # Consecutive ids take a byte each
+        self.assertEqual(1000, len(encode_ids(range(10000, 11000))) - 1)
+
+    def test_rows_per_bucket(self):
+        email = EmailFactory()
+        ids = [BUCKET_SIZE - 1, BUCKET_SIZE, BUCKET_SIZE + 1]
+        record_deliveries(email.pk, {pk: DeliveryStatus.SENT for pk in ids})
+        self.assertEqual([(0, 1), (1, 2)], list(DeliveryLedger.objects.order_by('bucket')
+                                                .values_list('bucket', 'recipients_count')))
+        self.assertEqual(ids, list(iter_sent_subscribers_ids(email.pk)))
+
+
+@override_settings(COLOSSUS_DELIVERY_LEDGER=True)
+class DeliveryLedgerTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(5, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.set_blocks({'content': '<p>Hi there!</p>'})
+        self.email.save()
+
+    def test_send_campaign(self):
+        send_campaign(self.campaign)
+        self.assertEqual(5, len(mail.outbox))
+        self.assertFalse(Activity.objects.filter(activity_type=ActivityTypes.SENT).exists())
+        self.assertEqual({subscriber.pk for subscriber in self.subscribers}, get_sent_subscribers_ids(self.email))
+        counts = get_activity_counts([ActivityTypes.SENT], campaign_id=self.campaign.pk)
+        self.assertEqual(5, counts[ActivityTypes.SENT])
+        self.assertEqual(5, Subscriber.objects.exclude(last_sent=None).count())
+
+    def test_send_remaining_recipients_only(self):
+        record_deliveries(self.email.pk, {subscriber.pk: DeliveryStatus.SENT for subscriber in self.subscribers[:3]})
+        send_campaign(self.campaign)
+        self.assertEqual({subscriber.email for subscriber in self.subscribers[3:]},
+                         {message.to[0] for message in mail.outbox})
+
+    def test_failed_deliveries(self):
+        with SentActivitiesBuffer(self.email) as buffer:
+            buffer.add(self.subscribers[0].pk)
+            buffer.add_failed(self.subscribers[1].pk)
+        expected = [(self.subscribers[0].pk, DeliveryStatus.SENT), (self.subscribers[1].pk, DeliveryStatus.FAILED)]
+        self.assertEqual(expected, decode_entries(DeliveryLedger.objects.get()))
+        self.assertEqual({self.subscribers[0].pk}, get_sent_subscribers_ids(self.email))
+
+    def test_rates(self):
+        send_campaign(self.campaign)
+        subscriber = self.subscribers[0]
+        subscriber.create_activity(ActivityTypes.OPENED, email=self.email)
+        self.assertEqual(1.0, subscriber.update_open_rate())
+        Subscriber.objects.update_open_and_click_rate([subscriber.pk for subscriber in self.subscribers])
+        self.assertEqual([1.0, 0.0, 0.0, 0.0, 0.0],
+                         list(Subscriber.objects.order_by('pk').values_list('open_rate', flat=True)))
+
+    @mock.patch('colossus.apps.subscribers.models.update_rates_after_subscriber_deletion')
+    def test_subscriber_deleted(self, update_rates):
+        send_campaign(self.campaign)
+        subscriber_id = self.subscribers[0].pk
+        self.subscribers[0].delete()
+        update_rates.delay.assert_called_once_with(self.mailing_list.pk, [])
+        self.assertEqual({}, get_sent_emails_ids([subscriber_id]))
+        self.assertEqual(4, DeliveryLedger.objects.get().recipients_count)
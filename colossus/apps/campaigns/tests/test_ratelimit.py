@@ -0,0 +1,180 @@
+from smtplib import (
+    SMTPDataError, SMTPRecipientsRefused, SMTPResponseException,
+    SMTPServerDisconnected,
+)
+from unittest import mock
+
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend
+from django.test import override_settings
+
+from colossus.apps.campaigns.api import send_campaign
+from colossus.apps.campaigns.models import DeliveryShard
+from colossus.apps.campaigns.ratelimit import (
+    LocalMemoryRateLimitStore, RateLimiter, RetryQueue,
+    is_temporary_smtp_error,
+)
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.testcases import TestCase
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps: list = list()
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class IsTemporarySMTPErrorTests(TestCase):
+    def test_temporary_errors(self):
+        self.assertTrue(is_temporary_smtp_error(SMTPResponseException(421, b'Try again later')))
+        self.assertTrue(is_temporary_smtp_error(SMTPDataError(451, b'Throttled')))
+        self.assertTrue(is_temporary_smtp_error(SMTPServerDisconnected()))
+        self.assertTrue(is_temporary_smtp_error(SMTPRecipientsRefused({'a@b.com': (450, b'Mailbox busy')})))
+
+    def test_permanent_errors(self):
+        self.assertFalse(is_temporary_smtp_error(SMTPDataError(550, b'Rejected')))
+        self.assertFalse(is_temporary_smtp_error(SMTPRecipientsRefused({
+            'a@b.com': (450, b'Mailbox busy'),
+            'c@d.com': (550, b'No such user'),
+        })))
+
+
+class RateLimiterTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.store = LocalMemoryRateLimitStore(clock=self.clock)
+
+    def get_rate_limiter(self, relay_rate=0, domain_rate=0):
+        return RateLimiter('relay', relay_rate=relay_rate, domain_rate=domain_rate, store=self.store,
+                           sleep=self.clock.sleep)
+
+    def test_relay_rate(self):
+        rate_limiter = self.get_rate_limiter(relay_rate=10)
+        for _ in range(30):
+            rate_limiter.acquire('colossusmail.com')
+        # The first 10 messages use the initial burst, the other 20 take 2 seconds
+        self.assertAlmostEqual(2.0, self.clock.now - 1000.0)
+
+    def test_domain_rate(self):
+        rate_limiter = self.get_rate_limiter(domain_rate=1)
+        rate_limiter.acquire('colossusmail.com')
+        rate_limiter.acquire('example.com')
+        self.assertEqual(self.clock.sleeps, [])
+        rate_limiter.acquire('COLOSSUSMAIL.COM')
+        self.assertAlmostEqual(1.0, sum(self.clock.sleeps))
+
+    def test_no_limit(self):
+        rate_limiter = self.get_rate_limiter()
+        for _ in range(100):
+            rate_limiter.acquire('colossusmail.com')
+        self.assertEqual(self.clock.sleeps, [])
+
+    def test_backoff_and_recover(self):
+        rate_limiter = self.get_rate_limiter(relay_rate=10)
+        rate_limiter.backoff()
+        self.assertEqual(5.0, rate_limiter.relay_rate)
+        rate_limiter.backoff()
+        self.assertEqual(2.5, rate_limiter.relay_rate)
+        for _ in range(200):
+            rate_limiter.success()
+        self.assertEqual(10.0, rate_limiter.relay_rate)
+
+    def test_backoff_min_rate(self):
+        rate_limiter = self.get_rate_limiter(relay_rate=2)
+        for _ in range(10):
+            rate_limiter.backoff()
+        self.assertEqual(1.0, rate_limiter.relay_rate)
+
+    def test_rate_shared_through_store(self):
+        self.get_rate_limiter(relay_rate=10).backoff()
+        self.assertEqual(5.0, self.get_rate_limiter(relay_rate=10).relay_rate)
+
+
+class RetryQueueTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.queue = RetryQueue(delay=10, max_retries=2, clock=self.clock, sleep=self.clock.sleep)
+
+    def test_exponential_delay(self):
+        self.assertTrue(self.queue.defer('a', 1))
+        self.assertTrue(self.queue.defer('b', 2))
+        self.assertEqual([], self.queue.pop_ready())
+        self.queue.wait()
+        self.assertEqual([('a', 2)], self.queue.pop_ready())
+        self.queue.wait()
+        self.assertEqual([('b', 3)], self.queue.pop_ready())
+        self.assertEqual([10, 10], self.clock.sleeps)
+        self.assertEqual(0, len(self.queue))
+
+    def test_max_retries(self):
+        self.assertFalse(self.queue.defer('a', 3))
+        self.assertEqual(0, len(self.queue))
+
+
+class ThrottledEmailBackend(EmailBackend):
+    """
+    Refuse the first messages of each recipient with a temporary error.
+    """
+    refusals = 1
+    attempts: dict = dict()
+
+    def send_messages(self, messages):
+        for message in messages:
+            recipient = message.to[0]
+            ThrottledEmailBackend.attempts[recipient] = ThrottledEmailBackend.attempts.get(recipient, 0) + 1
+            if ThrottledEmailBackend.attempts[recipient] <= self.refusals:
+                raise SMTPDataError(451, b'Throttled, try again later')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='colossus.apps.campaigns.tests.test_ratelimit.ThrottledEmailBackend',
+                   COLOSSUS_DELIVERY_RETRY_DELAY=0, COLOSSUS_DELIVERY_MAX_RETRIES=2)
+class SendCampaignRetryTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        ThrottledEmailBackend.attempts = dict()
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(3, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.save()
+
+    def test_deferred_recipients_retried(self):
+        send_campaign(self.campaign)
+        self.assertEqual(3, len(mail.outbox))
+        self.assertEqual(3, Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count())
+
+    def test_give_up_after_max_retries(self):
+        ThrottledEmailBackend.refusals = 3
+        self.addCleanup(setattr, ThrottledEmailBackend, 'refusals', 1)
+        send_campaign(self.campaign)
+        self.assertEqual(0, len(mail.outbox))
+        self.assertEqual({subscriber.email: 3 for subscriber in self.subscribers}, ThrottledEmailBackend.attempts)
+
+    @override_settings(COLOSSUS_DELIVERY_SHARD_LEASE=0.3, COLOSSUS_DELIVERY_RETRY_DELAY=0.25)
+    def test_lease_renewed_while_waiting(self):
+        """
+        The shard lease must be renewed while waiting for the deferred
+        recipients, otherwise the shard would be claimed by another task
+        """
+        renew_lease = DeliveryShard.renew_lease
+        with mock.patch.object(DeliveryShard, 'renew_lease', autospec=True, side_effect=renew_lease) as mock_renew:
+            send_campaign(self.campaign)
+        self.assertGreaterEqual(mock_renew.call_count, 2)
+        self.assertEqual(3, len(mail.outbox))
@@ -0,0 +1,128 @@
+import re
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.template import Template
+
+from colossus.apps.campaigns.rendering import (
+    CompiledEmail, html_to_text, is_substitutable,
+)
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.testcases import TestCase
+
+
+class IsSubstitutableTests(TestCase):
+    def test_substitutable(self):
+        cases = (
+            'Hi {{ name }}!',
+            '<a href="{{ unsub }}">unsubscribe</a> <img src="http://example.com/{{uuid}}/">',
+            '{% if domain %}{{ domain|upper }}{% endif %} {{ sub }}',
+            'No variables at all',
+        )
+        for template_string in cases:
+            with self.subTest(template_string=template_string):
+                self.assertTrue(is_substitutable(Template(template_string)))
+
+    def test_not_substitutable(self):
+        cases = (
+            'Hi {{ name|upper }}!',
+            'Hi {{ name|default:"there" }}!',
+            '{% if name %}Hi {{ name }}{% else %}Hi there{% endif %}',
+            '{% autoescape off %}{{ name }}{% endautoescape %}',
+            '{{ uuid.hex }}',
+        )
+        for template_string in cases:
+            with self.subTest(template_string=template_string):
+                self.assertFalse(is_substitutable(Template(template_string)))
+
+
+class CompiledEmailTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory(list_manager='manager@colossusmail.com')
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Subject')
+        self.email.set_template_content()
+        self.email.set_blocks({
+            'content': '<p>Hi {{ name }} & friends!</p><a href="{{ unsub }}">unsubscribe</a>'
+                       '<img src="http://example.com/track/open/{{ uuid }}/">'
+        })
+        self.email.save()
+        self.subscribers = [
+            SubscriberFactory(mailing_list=self.mailing_list, name='John <Doe>'),
+            SubscriberFactory(mailing_list=self.mailing_list, name=''),
+        ]
+
+    def _legacy_render(self, context):
+        html = self.email.render(dict(context))
+        return html, html_to_text(html)
+
+    def test_render_same_output_as_template(self):
+        """
+        The plain text version is converted from the skeleton, so html2text
+        may collapse the whitespace around the values differently
+        """
+        compiled_email = CompiledEmail(self.email, 'example.com')
+        self.assertTrue(compiled_email.is_substitutable)
+        for subscriber in self.subscribers:
+            context = compiled_email.get_subscriber_context(subscriber)
+            expected_html, expected_text = self._legacy_render(context)
+            html, text = compiled_email.render(context)
+            with self.subTest(subscriber=subscriber):
+                self.assertEqual(expected_html, html)
+                self.assertEqual(re.sub(r'\s+', ' ', expected_text), re.sub(r'\s+', ' ', text))
+
+    def test_render_fallback(self):
+        self.email.set_blocks({'content': '{% if name %}Hi {{ name }}{% else %}Hi there{% endif %}'})
+        self.email.save()
+        email = type(self.email).objects.get(pk=self.email.pk)
+        compiled_email = CompiledEmail(email, 'example.com')
+        self.assertFalse(compiled_email.is_substitutable)
+        html, text = compiled_email.render(compiled_email.get_subscriber_context(self.subscribers[1]))
+        self.assertIn('Hi there', html)
+        html, text = compiled_email.render(compiled_email.get_subscriber_context(self.subscribers[0]))
+        self.assertIn('Hi John &lt;Doe&gt;', html)
+
+    def test_subscriber_context_unsubscribe_url(self):
+        compiled_email = CompiledEmail(self.email, 'example.com')
+        subscriber = self.subscribers[0]
+        context = compiled_email.get_subscriber_context(subscriber)
+        self.assertIn(str(subscriber.uuid), context['unsub'])
+        self.assertIn(str(self.campaign.uuid), context['unsub'])
+
+    def test_headers(self):
+        compiled_email = CompiledEmail(self.email, 'example.com')
+        context = compiled_email.get_subscriber_context(self.subscribers[0])
+        headers = compiled_email.get_headers(context)
+        self.assertEqual(headers['List-Post'], 'NO')
+        list_id = '%s <%s.list-id.example.com>' % (self.mailing_list.name, self.mailing_list.uuid)
+        self.assertEqual(headers['List-ID'], list_id)
+        self.assertEqual(headers['List-Unsubscribe'], '<%s>, <mailto:manager@colossusmail.com?subject=unsubscribe>'
+                         % context['unsub'])
+
+    def test_test_email_headers(self):
+        compiled_email = CompiledEmail(self.email, is_test=True)
+        self.assertEqual(compiled_email.get_headers({}), {})
+        self.assertEqual(compiled_email.subject, '[Test] Subject')
+
+
+class BenchmarkRenderCommandTests(TestCase):
+    def test_benchmark(self):
+        mailing_list = MailingListFactory()
+        campaign = CampaignFactory(mailing_list=mailing_list)
+        email = EmailFactory(campaign=campaign)
+        email.set_template_content()
+        email.save()
+        SubscriberFactory.create_batch(3, mailing_list=mailing_list)
+        out = StringIO()
+        call_command('benchmarkrender', campaign.pk, messages=5, stdout=out)
+        self.assertIn('Template:', out.getvalue())
+        self.assertIn('Compiled:', out.getvalue())
+
+    def test_campaign_does_not_exist(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmarkrender', 0)
@@ -0,0 +1,159 @@
+import smtplib
+from unittest import mock
+
+from django.core import mail
+from django.core.mail import EmailMessage
+from django.test import override_settings
+
+from colossus.apps.campaigns.api import send_campaign
+from colossus.apps.campaigns.smtp import (
+    SMTPConnectionPool, get_mailing_list_connection, get_smtp_settings_key,
+)
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.smtp import SMTPSink
+from colossus.test.testcases import TestCase
+
+
+class FakeSMTP:
+    instances: list = list()
+
+    def __init__(self, host, port, **kwargs):
+        self.host = host
+        self.port = port
+        self.sent = 0
+        self.closed = False
+        self.disconnect_on_next_send = False
+        FakeSMTP.instances.append(self)
+
+    def starttls(self, **kwargs):
+        pass
+
+    def login(self, username, password):
+        pass
+
+    def noop(self):
+        if self.closed:
+            raise smtplib.SMTPServerDisconnected()
+        return 250, b'OK'
+
+    def sendmail(self, from_email, recipients, message):
+        if self.closed or self.disconnect_on_next_send:
+            self.closed = True
+            raise smtplib.SMTPServerDisconnected()
+        self.sent += 1
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+class SMTPConnectionPoolTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        FakeSMTP.instances = list()
+        patcher = mock.patch('django.core.mail.backends.smtp.smtplib.SMTP', FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.mailing_list = MailingListFactory(smtp_host='smtp.colossusmail.com', smtp_port=587,
+                                               smtp_username='user', smtp_password='secret')
+        self.key = get_smtp_settings_key(self.mailing_list)
+        self.pool = SMTPConnectionPool(max_connections=1, max_messages=2)
+
+    def send(self, connection, count=1):
+        messages = [EmailMessage('Subject', 'Body', 'john@doe.com', ['jane@doe.com']) for _ in range(count)]
+        for message in messages:
+            connection.send_messages([message])
+
+    def test_reuse_connection(self):
+        with self.pool.connection(self.key) as connection:
+            self.send(connection)
+        with self.pool.connection(self.key) as connection:
+            self.send(connection)
+        self.assertEqual(1, len(FakeSMTP.instances))
+        self.assertEqual(2, FakeSMTP.instances[0].sent)
+        self.assertEqual(1, self.pool.idle_count(self.key))
+
+    def test_pool_size(self):
+        with self.pool.connection(self.key) as connection_1, self.pool.connection(self.key) as connection_2:
+            self.assertIsNot(connection_1, connection_2)
+        self.assertEqual(2, len(FakeSMTP.instances))
+        self.assertEqual(1, self.pool.idle_count(self.key))
+        self.assertEqual(1, len([smtp for smtp in FakeSMTP.instances if smtp.closed]))
+
+    def test_max_messages_per_connection(self):
+        with self.pool.connection(self.key) as connection:
+            self.send(connection, 5)
+        self.assertEqual(3, len(FakeSMTP.instances))
+        self.assertEqual([2, 2, 1], [smtp.sent for smtp in FakeSMTP.instances])
+
+    def test_reconnect_idle_connection_closed_by_server(self):
+        with self.pool.connection(self.key) as connection:
+            self.send(connection)
+        FakeSMTP.instances[0].closed = True
+        with self.pool.connection(self.key) as connection:
+            self.send(connection)
+        self.assertEqual(2, len(FakeSMTP.instances))
+        self.assertEqual(1, FakeSMTP.instances[1].sent)
+
+    def test_reconnect_on_server_disconnected(self):
+        with self.pool.connection(self.key) as connection:
+            FakeSMTP.instances[0].disconnect_on_next_send = True
+            self.send(connection)
+        self.assertEqual(2, len(FakeSMTP.instances))
+        self.assertEqual(1, FakeSMTP.instances[1].sent)
+
+    def test_close_all(self):
+        with self.pool.connection(self.key):
+            pass
+        self.pool.close_all()
+        self.assertEqual(0, self.pool.idle_count(self.key))
+        self.assertTrue(FakeSMTP.instances[0].closed)
+
+
+class GetMailingListConnectionTests(TestCase):
+    def test_settings_key(self):
+        self.assertIsNone(get_smtp_settings_key(MailingListFactory()))
+        mailing_list_1 = MailingListFactory(smtp_host='smtp.colossusmail.com', smtp_username='user_1')
+        mailing_list_2 = MailingListFactory(smtp_host='smtp.colossusmail.com', smtp_username='user_2')
+        self.assertNotEqual(get_smtp_settings_key(mailing_list_1), get_smtp_settings_key(mailing_list_2))
+
+    def test_default_connection(self):
+        with get_mailing_list_connection(MailingListFactory()) as connection:
+            connection.send_messages([EmailMessage('Subject', 'Body', 'john@doe.com', ['jane@doe.com'])])
+        self.assertEqual(1, len(mail.outbox))
+
+
+class DefaultConnectionReconnectTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.sink = SMTPSink(recipient_replies={'busy@colossusmail.com': '421 Service not available'})
+        self.sink.start()
+        self.addCleanup(self.sink.stop)
+        self.mailing_list = MailingListFactory()
+        for email in ('a@colossusmail.com', 'busy@colossusmail.com', 'b@colossusmail.com',
+                      'c@colossusmail.com', 'd@colossusmail.com'):
+            SubscriberFactory(email=email, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.save()
+
+    def test_reconnect_after_service_not_available(self):
+        """
+        Test the default email backend opens a new session after the server
+        closed it with a 421 reply, so the following recipients are delivered
+        """
+        with override_settings(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+                               EMAIL_HOST=self.sink.host, EMAIL_PORT=self.sink.port, EMAIL_HOST_USER='',
+                               EMAIL_HOST_PASSWORD='', EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                               COLOSSUS_DELIVERY_RETRY_DELAY=0, COLOSSUS_DELIVERY_MAX_RETRIES=1):
+            send_campaign(self.campaign)
+        recipients = {recipients[0] for mail_from, recipients, data in self.sink.messages}
+        self.assertEqual({'a@colossusmail.com', 'b@colossusmail.com', 'c@colossusmail.com', 'd@colossusmail.com'},
+                         recipients)
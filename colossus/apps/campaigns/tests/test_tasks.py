@@ -0,0 +1,69 @@
+from django.core import mail
+from django.test import override_settings
+
+from colossus.apps.campaigns.constants import CampaignStatus
+from colossus.apps.campaigns.tasks import send_campaign_task
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.testcases import TestCase
+
+
+@override_settings(COLOSSUS_CAMPAIGN_SHARD_SIZE=3, MANAGERS=[('Admin', 'admin@colossusmail.com')])
+class SendCampaignTaskTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscribers = SubscriberFactory.create_batch(10, mailing_list=self.mailing_list)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list, status=CampaignStatus.QUEUED)
+        self.email = EmailFactory(campaign=self.campaign, from_email='john@doe.com', subject='Test email subject')
+        self.email.set_template_content()
+        self.email.set_blocks({'content': '<p>Hi there!</p><a href="https://google.com">google</a>'})
+        self.email.save()
+        send_campaign_task.delay(self.campaign.pk)
+
+    def test_campaign_status(self):
+        self.campaign.refresh_from_db()
+        self.assertEqual(self.campaign.status, CampaignStatus.SENT)
+
+    def test_all_shards_delivered(self):
+        recipients = {message.to[0] for message in mail.outbox if message.subject == 'Test email subject'}
+        self.assertEqual(recipients, {subscriber.email for subscriber in self.subscribers})
+
+    def test_activity_sent_created(self):
+        activities_count = Activity.objects.filter(activity_type=ActivityTypes.SENT, email=self.email).count()
+        self.assertEqual(activities_count, 10)
+
+    def test_links_not_duplicated(self):
+        self.assertEqual(self.email.links.count(), 1)
+
+    def test_managers_notified_once(self):
+        subjects = [message.subject for message in mail.outbox]
+        self.assertEqual(subjects.count('[Colossus] Mailing campaign has been sent'), 1)
+
+
+class UpdateRatesAfterCampaignDeletionTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+        kept_email = EmailFactory(campaign=CampaignFactory(mailing_list=self.mailing_list))
+        self.subscriber.create_activity(ActivityTypes.SENT, email=kept_email)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        deleted_email = EmailFactory(campaign=self.campaign)
+        self.subscriber.create_activity(ActivityTypes.SENT, email=deleted_email, campaign=self.campaign)
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=deleted_email, campaign=self.campaign)
+        self.subscriber.update_open_and_click_rate()
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_rates_updated(self):
+        self.assertEqual(0.5, self.subscriber.open_rate)
+        self.campaign.delete()
+        self.subscriber.refresh_from_db()
+        self.mailing_list.refresh_from_db()
+        self.assertEqual(0.0, self.subscriber.open_rate)
+        self.assertEqual(0.0, self.mailing_list.open_rate)
@@ -1,8 +1,12 @@
 from django.urls import reverse
+from django.utils import timezone
 
-from colossus.apps.campaigns.models import Campaign
+from colossus.apps.campaigns.constants import CampaignStatus
+from colossus.apps.campaigns.models import Campaign, DeliveryShard
 from colossus.apps.lists.tests.factories import MailingListFactory
-from colossus.apps.subscribers.tests.factories import TagFactory
+from colossus.apps.subscribers.tests.factories import (
+    SubscriberFactory, TagFactory,
+)
 from colossus.test.testcases import AuthenticatedTestCase, TestCase
 
 from .factories import CampaignFactory
@@ -19,6 +23,7 @@ class CampaignsLoginRequiredTests(TestCase):
             ('campaigns', None),
             ('campaign_add', None),
             ('campaign_detail', {'pk': 1}),
+            ('campaign_resume', {'pk': 1}),
             ('campaign_preview', {'pk': 1}),
             ('campaign_edit', {'pk': 1}),
             ('campaign_edit_recipients', {'pk': 1}),
@@ -103,3 +108,43 @@ class TestCampaignEditRecipientsViewNoneMailingList(AuthenticatedTestCase):
 
     def test_status_code(self):
         self.assertEqual(200, self.response.status_code)
+
+
+class CampaignDeliveryProgressViewTests(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        mailing_list = MailingListFactory()
+        subscriber = SubscriberFactory(mailing_list=mailing_list)
+        self.campaign = CampaignFactory(mailing_list=mailing_list, status=CampaignStatus.DELIVERING,
+                                        recipients_count=10)
+        DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=0, max_subscriber_id=0,
+                                     sent_count=4, failed_count=1, end_date=timezone.now())
+        DeliveryShard.objects.create(campaign=self.campaign, min_subscriber_id=subscriber.pk,
+                                     max_subscriber_id=subscriber.pk, sent_count=2)
+
+    def test_progress(self):
+        response = self.client.get(reverse('campaigns:campaign_detail', kwargs={'pk': self.campaign.pk}))
+        progress = response.context['delivery_progress']
+        self.assertEqual((6, 1, 3), (progress['sent'], progress['failed'], progress['remaining']))
+        self.assertContains(response, '6 sent, 1 failed, 3 remaining')
+        self.assertContains(response, reverse('campaigns:campaign_resume', kwargs={'pk': self.campaign.pk}))
+
+    def test_resume(self):
+        self.campaign.email.set_template_content()
+        self.campaign.email.save()
+        url = reverse('campaigns:campaign_resume', kwargs={'pk': self.campaign.pk})
+        response = self.client.post(url)
+        self.assertRedirects(response, reverse('campaigns:campaign_detail', kwargs={'pk': self.campaign.pk}))
+        self.campaign.refresh_from_db()
+        self.assertEqual(CampaignStatus.SENT, self.campaign.status)
+        self.assertEqual(7, self.campaign.get_delivery_progress()['sent'])
+
+    def test_resume_live_delivery(self):
+        self.campaign.delivery_shards.filter(end_date=None).update(lease_date=timezone.now())
+        response = self.client.get(reverse('campaigns:campaign_detail', kwargs={'pk': self.campaign.pk}))
+        self.assertNotContains(response, reverse('campaigns:campaign_resume', kwargs={'pk': self.campaign.pk}))
+        response = self.client.post(reverse('campaigns:campaign_resume', kwargs={'pk': self.campaign.pk}))
+        self.assertRedirects(response, reverse('campaigns:campaign_detail', kwargs={'pk': self.campaign.pk}))
+        self.campaign.refresh_from_db()
+        self.assertEqual(CampaignStatus.DELIVERING, self.campaign.status)
+        self.assertEqual(6, self.campaign.get_delivery_progress()['sent'])
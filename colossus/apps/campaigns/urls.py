@@ -9,6 +9,7 @@ urlpatterns = [
     path('add/', views.CampaignCreateView.as_view(), name='campaign_add'),
     path('<int:pk>/', views.CampaignDetailView.as_view(), name='campaign_detail'),
     path('<int:pk>/revert-draft/', views.CampaignRevertDraftView.as_view(), name='campaign_revert_draft'),
+    path('<int:pk>/resume/', views.CampaignResumeView.as_view(), name='campaign_resume'),
     path('<int:pk>/scheduled/', views.CampaignScheduledView.as_view(), name='campaign_scheduled'),
     path('<int:pk>/preview/', views.CampaignPreviewView.as_view(), name='campaign_preview'),
     path('<int:pk>/reports/', views.CampaignReportsView.as_view(), name='campaign_reports'),
@@ -19,7 +19,11 @@ from django.views.generic import (
 from colossus.apps.core.models import Country
 from colossus.apps.lists.models import MailingList
 from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.exceptions import InvalidSegment
 from colossus.apps.subscribers.models import Activity
+from colossus.apps.subscribers.rollups import (
+    get_activity_counts, get_countries_counts,
+)
 
 from .api import get_test_email_context
 from .constants import CampaignStatus, CampaignTypes
@@ -104,6 +108,11 @@ class CampaignEditView(CampaignMixin, DetailView):
     def get_context_data(self, **kwargs):
         kwargs['test_email_form'] = CampaignTestEmailForm()
         kwargs['checklist'] = self.object.email.checklist()
+        if self.object.mailing_list is not None:
+            try:
+                kwargs['recipients_count'] = self.object.get_recipients_count()
+            except InvalidSegment as error:
+                kwargs['segment_error'] = error
         return super().get_context_data(**kwargs)
 
 
@@ -113,6 +122,10 @@ class CampaignDetailView(CampaignMixin, DetailView):
     context_object_name = 'campaign'
     extra_context = {'submenu': 'details'}
 
+    def get_context_data(self, **kwargs):
+        kwargs['delivery_progress'] = self.object.get_delivery_progress()
+        return super().get_context_data(**kwargs)
+
 
 @method_decorator(login_required, name='dispatch')
 class CampaignScheduledView(CampaignMixin, DetailView):
@@ -136,6 +149,18 @@ class CampaignRevertDraftView(View):
         return redirect(campaign)
 
 
+@method_decorator(login_required, name='dispatch')
+class CampaignResumeView(View):
+    def post(self, request, pk):
+        campaign = get_object_or_404(Campaign, pk=pk, status=CampaignStatus.DELIVERING)
+        if campaign.can_resume:
+            campaign.resume()
+            messages.success(request, gettext('The campaign delivery was resumed from where it stopped.'))
+        else:
+            messages.warning(request, gettext('The campaign is still being delivered and cannot be resumed yet.'))
+        return redirect('campaigns:campaign_detail', pk=pk)
+
+
 @method_decorator(login_required, name='dispatch')
 class CampaignPreviewView(CampaignMixin, DetailView):
     model = Campaign
@@ -168,9 +193,7 @@ class CampaignReportsView(CampaignMixin, DetailView):
 
         links = campaign.get_links().only('url', 'total_clicks_count')[:10]
 
-        unsubscribed_count = Activity.objects \
-            .filter(campaign_id=self.kwargs.get('pk'), activity_type=ActivityTypes.UNSUBSCRIBED) \
-            .count()
+        unsubscribed_count = get_activity_counts([ActivityTypes.UNSUBSCRIBED], campaign_id=self.kwargs.get('pk'))
 
         subscriber_open_activities = Activity.objects \
             .filter(email__campaign_id=self.kwargs.get('pk'), activity_type=ActivityTypes.OPENED) \
@@ -178,15 +201,11 @@ class CampaignReportsView(CampaignMixin, DetailView):
             .annotate(total_opens=Count('id')) \
             .order_by('-total_opens')[:10]
 
-        location_open_activities = Activity.objects \
-            .filter(email__campaign_id=self.kwargs.get('pk'), activity_type=ActivityTypes.OPENED) \
-            .values('location__country__code', 'location__country__name') \
-            .annotate(total_opens=Count('id')) \
-            .order_by('-total_opens')[:10]
+        location_open_activities = get_countries_counts(ActivityTypes.OPENED, campaign_id=self.kwargs.get('pk'))[:10]
 
         kwargs.update({
             'links': links,
-            'unsubscribed_count': unsubscribed_count,
+            'unsubscribed_count': unsubscribed_count[ActivityTypes.UNSUBSCRIBED],
             'subscriber_open_activities': subscriber_open_activities,
             'location_open_activities': location_open_activities,
         })
@@ -201,11 +220,7 @@ class CampaignReportsLocationsView(CampaignMixin, DetailView):
     extra_context = {'submenu': 'reports'}
 
     def get_context_data(self, **kwargs):
-        location_open_activities = Activity.objects \
-            .filter(email__campaign_id=self.kwargs.get('pk'), activity_type=ActivityTypes.OPENED) \
-            .values('location__country__code', 'location__country__name') \
-            .annotate(total_opens=Count('id')) \
-            .order_by('-total_opens')
+        location_open_activities = get_countries_counts(ActivityTypes.OPENED, campaign_id=self.kwargs.get('pk'))
 
         kwargs.update({
             'location_open_activities': location_open_activities,
@@ -1,10 +1,11 @@
 import uuid
 
 from django.contrib.sites.models import Site
+from django.core.cache import cache
 from django.test import override_settings
 
 from colossus.test.testcases import TestCase
-from colossus.utils import get_absolute_url
+from colossus.utils import debounce_task, get_absolute_url
 
 
 class TestGetAbsoluteURL(TestCase):
@@ -31,3 +32,45 @@ class TestGetAbsoluteURL(TestCase):
         Site.objects.clear_cache()
         url = get_absolute_url('login')
         self.assertEqual(url, 'http://mysite.com/accounts/login/')
+
+
+class FakeTask:
+    name = 'fake_task'
+
+    def __init__(self):
+        self.calls = list()
+
+    def delay(self, *args):
+        self.calls.append((args, None))
+
+    def apply_async(self, args, countdown):
+        self.calls.append((tuple(args), countdown))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=False)
+class TestDebounceTask(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.task = FakeTask()
+
+    def test_task_scheduled_once_per_window(self):
+        self.assertTrue(debounce_task(self.task, 1, window=3600))
+        self.assertFalse(debounce_task(self.task, 1, window=3600))
+        self.assertTrue(debounce_task(self.task, 2, window=3600))
+        self.assertEqual([(1,), (2,)], [args for args, countdown in self.task.calls])
+
+    def test_task_scheduled_at_the_end_of_the_window(self):
+        debounce_task(self.task, 1, window=3600)
+        args, countdown = self.task.calls[0]
+        self.assertTrue(0 < countdown <= 3600)
+
+    @override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+    def test_eager_tasks_not_debounced(self):
+        debounce_task(self.task, 1, window=3600)
+        debounce_task(self.task, 1, window=3600)
+        self.assertEqual([((1,), None), ((1,), None)], self.task.calls)
+
+    def test_zero_window_disables_debounce(self):
+        debounce_task(self.task, 1, window=0)
+        debounce_task(self.task, 1, window=0)
+        self.assertEqual(2, len(self.task.calls))
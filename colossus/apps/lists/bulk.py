@@ -0,0 +1,95 @@
+"""
+Set-based operations over lists of pasted email addresses.
+
+The email addresses are resolved in chunks of `COLOSSUS_IMPORT_CHUNK_SIZE`,
+with one query per chunk instead of one query per email address, ignoring
+the case like the lookups they replace.
+"""
+from itertools import islice
+from typing import Iterable, Iterator, List, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from colossus.apps.lists.importer import (
+    create_subscribers, get_existing_subscribers,
+)
+from colossus.apps.lists.stats import invalidate_stats
+from colossus.apps.subscribers.bitmaps import add_ids, get_tag_key, set_status
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.domains import get_domain_name, resolve_domains
+from colossus.apps.subscribers.models import Activity, Subscriber
+from colossus.apps.subscribers.rollups import record_activities
+
+
+def iter_chunks(emails: Iterable[str]) -> Iterator[List[str]]:
+    emails = iter(emails)
+    chunk = list(islice(emails, settings.COLOSSUS_IMPORT_CHUNK_SIZE))
+    while chunk:
+        yield chunk
+        chunk = list(islice(emails, settings.COLOSSUS_IMPORT_CHUNK_SIZE))
+
+
+@transaction.atomic
+def import_emails(mailing_list, emails: Iterable[str], status: int) -> Tuple[int, int]:
+    """
+    Add the email addresses to a mailing list, creating the missing
+    subscribers and assigning the status to all of them.
+
+    :param mailing_list: MailingList instance
+    :param emails: Email addresses, without duplicates
+    :param status: Subscriber status
+    :return: A tuple with the number of subscribers created and updated
+    """
+    created = updated = 0
+    for chunk in iter_chunks(emails):
+        existing = get_existing_subscribers(mailing_list.pk, chunk)
+        domains = resolve_domains(get_domain_name(email) for email in chunk if email.lower() not in existing)
+        new_rows = [
+            {'email': email, 'domain_id': domains[get_domain_name(email)], 'status': status}
+            for email in chunk if email.lower() not in existing
+        ]
+        subscribers_ids = create_subscribers(mailing_list.pk, new_rows)
+        activities = [
+            Activity(activity_type=ActivityTypes.IMPORTED, subscriber_id=subscriber_id)
+            for subscriber_id in subscribers_ids
+        ]
+        Activity.objects.bulk_create(activities)
+        record_activities(activities)
+        Subscriber.objects.filter(pk__in=existing.values()).update(status=status, update_date=timezone.now())
+        set_status(mailing_list.pk, subscribers_ids + list(existing.values()), status)
+        created += len(subscribers_ids)
+        updated += len(existing)
+    mailing_list.update_subscribers_count()
+    invalidate_stats(mailing_list.pk)
+    return created, updated
+
+
+@transaction.atomic
+def tag_emails(mailing_list, tag, emails: Iterable[str]) -> int:
+    """
+    Add the subscribers of a mailing list to a tag, with one insert in the
+    tags through table per chunk. Email addresses not matching any subscriber
+    are ignored.
+
+    :param mailing_list: MailingList instance
+    :param tag: Tag instance
+    :param emails: Email addresses, without duplicates
+    :return: The number of subscribers tagged
+    """
+    SubscriberTag = Subscriber.tags.through
+    tagged = 0
+    for chunk in iter_chunks(emails):
+        subscribers_ids = set(get_existing_subscribers(mailing_list.pk, chunk).values())
+        already_tagged = SubscriberTag.objects \
+            .filter(tag_id=tag.pk, subscriber_id__in=subscribers_ids) \
+            .values_list('subscriber_id', flat=True)
+        new_subscribers_ids = subscribers_ids.difference(already_tagged)
+        SubscriberTag.objects.bulk_create([
+            SubscriberTag(tag_id=tag.pk, subscriber_id=subscriber_id)
+            for subscriber_id in new_subscribers_ids
+        ])
+        add_ids(mailing_list.pk, get_tag_key(tag.pk), new_subscribers_ids)
+        tagged += len(subscribers_ids)
+    return tagged
@@ -1,11 +1,11 @@
 from collections import OrderedDict
 
-from django.db.models import Count, Q
 from django.utils import timezone
 from django.utils.translation import gettext as _
 
-from colossus.apps.subscribers.constants import ActivityTypes
-from colossus.apps.subscribers.models import Activity
+from colossus.apps.lists.stats import get_stats
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.rollups import get_daily_counts
 
 
 class Chart:
@@ -43,24 +43,19 @@ class SubscriptionsSummaryChart(Chart):
         self.mailing_list = mailing_list
 
     def get_data(self):
-        thirty_days_ago = timezone.now() - timezone.timedelta(30)
-
-        # Group by query returning the counts for subscribe actions and
-        # unsubscribe actions. The Count queries are defined externally
-        # for readability.
-        # Output format:
-        # <QuerySet [
-        #     {'trunc_date': datetime.date(2018, 6, 10), 'subscribed': 1, 'unsubscribed': 0},
-        #     {'trunc_date': datetime.date(2018, 6, 11), 'subscribed': 3, 'unsubscribed': 2},
-        #     {'trunc_date': datetime.date(2018, 6, 12), 'subscribed': 1, 'unsubscribed': 0}
-        # ]>
-        subscribed_expression = Count('id', filter=Q(activity_type=ActivityTypes.SUBSCRIBED))
-        unsubscribed_expression = Count('id', filter=Q(activity_type=ActivityTypes.UNSUBSCRIBED))
-        activities = Activity.objects \
-            .filter(subscriber__mailing_list=self.mailing_list, date__date__gt=thirty_days_ago) \
-            .values('date__date') \
-            .annotate(subscribed=subscribed_expression, unsubscribed=unsubscribed_expression) \
-            .order_by('date__date')
+        today = timezone.localdate(timezone.now())
+
+        # Daily counts of subscribe and unsubscribe actions, read from the
+        # activities rollups. Output format:
+        # {
+        #     datetime.date(2018, 6, 10): {ActivityTypes.SUBSCRIBED: 1},
+        #     datetime.date(2018, 6, 11): {ActivityTypes.SUBSCRIBED: 3, ActivityTypes.UNSUBSCRIBED: 2},
+        # }
+        daily_counts = get_daily_counts(
+            self.mailing_list.pk,
+            [ActivityTypes.SUBSCRIBED, ActivityTypes.UNSUBSCRIBED],
+            since=today - timezone.timedelta(29)
+        )
 
         # First initialize the `series` dictionary with all last 30 days.
         # This is necessary because if the count of subscribers for a given
@@ -69,16 +64,16 @@ class SubscriptionsSummaryChart(Chart):
         # It's a way to keep the rendering of the bar chart consistent.
         series = OrderedDict()
         for i in range(30):
-            date = timezone.localdate(timezone.now()) - timezone.timedelta(i)
+            date = today - timezone.timedelta(i)
             key = date.strftime('%-d %b, %y')
             series[key] = {'sub': 0, 'unsub': 0, 'order': i}
 
         # Now we are replacing the existing entries with actual counts
         # comming from our queryset.
-        for entry in activities:
-            key = entry['date__date'].strftime('%-d %b, %y')
-            series[key]['sub'] = entry['subscribed']
-            series[key]['unsub'] = entry['unsubscribed']
+        for date, counts in daily_counts.items():
+            key = date.strftime('%-d %b, %y')
+            series[key]['sub'] = counts.get(ActivityTypes.SUBSCRIBED, 0)
+            series[key]['unsub'] = counts.get(ActivityTypes.UNSUBSCRIBED, 0)
 
         # Here is time to grab the info and place on lists for labels
         # and the data. Note that we are sorting the series data so to
@@ -146,16 +141,13 @@ class DoughnutChart(Chart):
 
 class ListLocationsChart(DoughnutChart):
     def get_data(self):
-        locations = self.mailing_list.get_active_subscribers() \
-            .select_related('location') \
-            .values('location__country__code', 'location__country__name') \
-            .annotate(total=Count('location__country__code')) \
-            .order_by('-total')[:5]
+        stats = get_stats(self.mailing_list)
+        locations = stats['locations'][:5]
 
         locations_data = [location['total'] for location in locations]
         labels_data = [location['location__country__name'] for location in locations]
 
-        total = self.mailing_list.get_active_subscribers().count()
+        total = stats['status_counts'][Status.SUBSCRIBED]
         top_5_total = sum(locations_data)
         others = total - top_5_total
         if others > 0:
@@ -174,16 +166,13 @@ class ListLocationsChart(DoughnutChart):
 
 class ListDomainsChart(DoughnutChart):
     def get_data(self):
-        domains = self.mailing_list.get_active_subscribers() \
-            .select_related('domain') \
-            .values('domain__name') \
-            .annotate(total=Count('domain__name')) \
-            .order_by('-total')[:5]
+        stats = get_stats(self.mailing_list)
+        domains = stats['domains'][:5]
 
         domains_data = [domain['total'] for domain in domains]
         domains_labels = [domain['domain__name'] for domain in domains]
 
-        total = self.mailing_list.get_active_subscribers().count()
+        total = stats['status_counts'][Status.SUBSCRIBED]
         top_5_total = sum(domains_data)
         others = total - top_5_total
         if others > 0:
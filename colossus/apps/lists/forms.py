@@ -1,19 +1,21 @@
 from smtplib import SMTPAuthenticationError
-from typing import Dict, List
+from typing import Dict, List, Tuple
 
 from django import forms
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.mail.backends.smtp import EmailBackend
-from django.db import transaction
 from django.forms import BoundField
-from django.utils import timezone
 from django.utils.translation import gettext, gettext_lazy as _
 
+from colossus.apps.lists.bulk import import_emails, tag_emails
 from colossus.apps.lists.constants import ImportFields, ImportStatus
-from colossus.apps.lists.tasks import import_subscribers
-from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.lists.tasks import (
+    import_emails_task, import_subscribers, tag_emails_task,
+)
+from colossus.apps.subscribers.constants import Status
 from colossus.apps.subscribers.fields import MultipleEmailField
-from colossus.apps.subscribers.models import Domain, Subscriber, Tag
+from colossus.apps.subscribers.models import Tag
 
 from .models import MailingList, SubscriberImport
 
@@ -160,37 +162,28 @@ class PasteImportSubscribersForm(forms.Form):
         widget=forms.Select(attrs={'class': 'w-50'})
     )
 
-    def import_subscribers(self, mailing_list):
-        cached_domains = dict()
+    def is_bulk(self) -> bool:
+        """
+        :return: True if the import should run as a background task
+        """
+        return len(self.cleaned_data.get('emails')) > settings.COLOSSUS_BULK_TASK_THRESHOLD
+
+    def import_subscribers(self, mailing_list) -> Tuple[int, int]:
+        """
+        :return: A tuple with the number of subscribers created and updated
+        """
         emails = self.cleaned_data.get('emails')
-        status = self.cleaned_data.get('status')
-
-        with transaction.atomic():
-            for email in emails:
-
-                email_name, domain_part = email.rsplit('@', 1)
-                domain_name = '@' + domain_part
-
-                try:
-                    domain = cached_domains[domain_name]
-                except KeyError:
-                    domain, created = Domain.objects.get_or_create(name=domain_name)
-                    cached_domains[domain_name] = domain
-
-                subscriber, created = Subscriber.objects.get_or_create(
-                    email__iexact=email,
-                    mailing_list=mailing_list,
-                    defaults={
-                        'email': email,
-                        'domain': domain
-                    }
-                )
-                if created:
-                    subscriber.create_activity(ActivityTypes.IMPORTED)
-                subscriber.status = status
-                subscriber.update_date = timezone.now()
-                subscriber.save()
-            mailing_list.update_subscribers_count()
+        status = int(self.cleaned_data.get('status'))
+        return import_emails(mailing_list, emails, status)
+
+    def queue(self, mailing_list, user):
+        """
+        Import the email addresses with a Celery task, notifying the user when
+        it is done.
+        """
+        emails = list(self.cleaned_data.get('emails'))
+        status = int(self.cleaned_data.get('status'))
+        import_emails_task.delay(mailing_list.pk, emails, status, user.pk)
 
 
 class MailingListSMTPForm(forms.ModelForm):
@@ -236,7 +229,12 @@ class BulkTagForm(forms.Form):
         super().__init__(*args, **kwargs)
         self.fields['tag'].queryset = self.mailing_list.tags.all()
 
-    @transaction.atomic()
+    def is_bulk(self) -> bool:
+        """
+        :return: True if the tagging should run as a background task
+        """
+        return len(self.cleaned_data.get('emails')) > settings.COLOSSUS_BULK_TASK_THRESHOLD
+
     def tag_subscribers(self) -> int:
         """
         Process the form adding the valid subscribers to the given tag.
@@ -244,12 +242,13 @@ class BulkTagForm(forms.Form):
         """
         tag = self.cleaned_data.get('tag')
         emails = self.cleaned_data.get('emails')
-        success_count = 0
-        for email in emails:
-            try:
-                subscriber = Subscriber.objects.get(mailing_list=self.mailing_list, email__iexact=email)
-                subscriber.tags.add(tag)
-                success_count += 1
-            except Subscriber.DoesNotExist:
-                pass
-        return success_count
+        return tag_emails(self.mailing_list, tag, emails)
+
+    def queue(self, user):
+        """
+        Tag the subscribers with a Celery task, notifying the user when it is
+        done.
+        """
+        tag = self.cleaned_data.get('tag')
+        emails = list(self.cleaned_data.get('emails'))
+        tag_emails_task.delay(self.mailing_list.pk, tag.pk, emails, user.pk)
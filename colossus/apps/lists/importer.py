@@ -0,0 +1,486 @@
+"""
+Streaming import of subscribers from CSV files.
+
+The rows are parsed lazily and processed in chunks of
+`COLOSSUS_IMPORT_CHUNK_SIZE` rows. For each chunk the existing subscribers
+are resolved with a single query, the new subscribers and the IMPORTED
+activities are bulk inserted, the existing subscribers are updated with a
+single UPDATE statement, and the chunk is committed. No lock is held between
+the chunks, so a large import does not block the rest of the application.
+
+The import progress (position in the file, rows processed and counters) is
+committed in the same transaction as each chunk, so an interrupted import can
+be resumed from the last committed chunk. Invalid rows are recorded in the
+`SubscriberImportError` log and the import keeps going.
+
+Large files are split into byte ranges aligned to line boundaries
+(`SubscriberImportSegment`), imported in parallel by `SegmentImporter`
+workers reading the file through a memory map.
+"""
+import csv
+import mmap
+import time
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import (
+    BigIntegerField, Case, F, IntegerField, Value, When,
+)
+from django.db.models.functions import Lower
+from django.utils import timezone
+from django.utils.translation import gettext
+
+from colossus.apps.lists.constants import ImportFields, ImportStrategies
+from colossus.apps.lists.models import (
+    SubscriberImport, SubscriberImportError, SubscriberImportKey,
+    SubscriberImportSegment,
+)
+from colossus.apps.subscribers.bitmaps import index_subscribers
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.domains import get_domain_name, resolve_domains
+from colossus.apps.subscribers.models import Activity, Subscriber
+from colossus.apps.subscribers.rollups import record_activities
+
+# (row_number, row, offset), where offset is the position in the file right
+# after the row
+CSVRow = Tuple[int, List[str], int]
+
+
+def count_lines(buffer, start: int, end: int, block_size: int = 2 ** 24) -> int:
+    """
+    Count the line breaks of a byte range of a memory mapped file, one block
+    at a time.
+    """
+    return sum(buffer[position:min(position + block_size, end)].count(b'\n')
+               for position in range(start, end, block_size))
+
+
+def split_file(path: str, segment_size: int) -> List[Tuple[int, int, int]]:
+    """
+    Split a CSV file into byte ranges of about `segment_size` bytes, aligned to
+    line boundaries. The first range starts with the header row.
+
+    Quoted values spanning multiple lines are not supported: a range may start
+    in the middle of such a row.
+
+    :return: List of (start, end, first_row_number) tuples, where the row
+             numbers count the header as the first row
+    """
+    segments: List[Tuple[int, int, int]] = list()
+    with open(path, 'rb') as csvfile:
+        if not csvfile.seek(0, 2):
+            return segments
+        with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            size = len(buffer)
+            start = 0
+            line_number = 1
+            while start < size:
+                end = start + segment_size
+                if end >= size:
+                    end = size
+                else:
+                    newline = buffer.find(b'\n', end - 1)
+                    end = size if newline == -1 else newline + 1
+                # The header row of the first range is not imported
+                first_row_number = 2 if start == 0 else line_number
+                segments.append((start, end, first_row_number))
+                line_number += count_lines(buffer, start, end)
+                start = end
+    return segments
+
+
+def get_existing_subscribers(mailing_list_id: int, emails: Iterable[str]) -> Dict[str, int]:
+    """
+    Resolve the subscribers of a list with a single query, matching the email
+    addresses ignoring the case, through the (mailing list, lower(email))
+    index.
+
+    :return: Dictionary mapping the lowercase email addresses to the ids of
+             the subscribers already on the list
+    """
+    subscribers = Subscriber.objects \
+        .filter(mailing_list_id=mailing_list_id) \
+        .annotate(email_lower=Lower('email')) \
+        .filter(email_lower__in={email.lower() for email in emails})
+    return {email.lower(): pk for email, pk in subscribers.values_list('email', 'pk')}
+
+
+def create_subscribers(mailing_list_id: int, rows: List[dict]) -> List[int]:
+    """
+    Bulk insert new subscribers.
+
+    :param rows: List of subscriber fields
+    :return: The ids of the new subscribers
+    """
+    if not rows:
+        return list()
+    subscribers = [Subscriber(mailing_list_id=mailing_list_id, **fields) for fields in rows]
+    Subscriber.objects.bulk_create(subscribers)
+    emails = [fields['email'] for fields in rows]
+    return list(Subscriber.objects
+                .filter(mailing_list_id=mailing_list_id, email__in=emails)
+                .values_list('pk', flat=True))
+
+
+class SubscriberImporter:
+    """
+    Import the rows of a `SubscriberImport` CSV file, following its columns
+    mapping and import strategy.
+
+    Rows that cannot be parsed (e.g. without a valid email address) are
+    recorded in the error log. When the same email address appears more than
+    once in a chunk, the last row wins.
+    """
+    def __init__(self, subscriber_import, chunk_size: int = None):
+        self.subscriber_import = subscriber_import
+        self.mailing_list_id = subscriber_import.mailing_list_id
+        self.strategy = subscriber_import.strategy
+        self.columns_mapping = subscriber_import.get_columns_mapping()
+        self.chunk_size = settings.COLOSSUS_IMPORT_CHUNK_SIZE if chunk_size is None else chunk_size
+        self.max_errors = settings.COLOSSUS_IMPORT_MAX_ERRORS
+        self.created = 0
+        self.updated = 0
+        self.skipped = 0
+        self.errors = 0
+        self.rows_count = 0
+        self.offset = 0
+        self.committed_offset = 0
+        self.started_at = time.time()
+
+    def parse_row(self, row: List[str]) -> dict:
+        """
+        :return: The subscriber fields of a CSV row
+        :raises ValueError: If the row cannot be imported
+        """
+        fields = {'status': self.subscriber_import.subscriber_status}
+        for column_index, subscriber_field_name in self.columns_mapping.items():
+            field_parser = ImportFields.PARSERS[subscriber_field_name]
+            try:
+                value = row[column_index]
+            except IndexError:
+                raise ValueError(gettext('The row has fewer columns than expected.'))
+            fields[subscriber_field_name] = field_parser(value)
+        email = fields.get('email', '')
+        if '@' not in email:
+            raise ValueError(gettext('Invalid email address.'))
+        if len(email) > Subscriber._meta.get_field('email').max_length:
+            raise ValueError(gettext('The email address is too long.'))
+        return fields
+
+    def iter_lines(self, csvfile) -> Iterator[str]:
+        """
+        Decode the lines of a file opened in binary mode, keeping track of the
+        position in the file.
+        """
+        for line in csvfile:
+            self.offset += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+    def iter_rows(self, csvfile) -> Iterator[CSVRow]:
+        """
+        Parse the CSV rows starting at the last committed position, skipping
+        the header at the beginning of the file.
+
+        :return: Iterator of (row_number, row, offset) tuples. The row numbers
+                 count the header as the first row
+        """
+        self.offset = self.committed_offset = self.subscriber_import.processed_bytes
+        csvfile.seek(self.offset)
+        reader = csv.reader(self.iter_lines(csvfile))
+        if self.offset == 0:
+            next(reader, None)
+        first_row_number = self.subscriber_import.processed_rows + 2
+        for row_number, row in enumerate(reader, start=first_row_number):
+            yield row_number, row, self.offset
+
+    def get_existing_subscribers(self, emails: Iterable[str]) -> Dict[str, int]:
+        return get_existing_subscribers(self.mailing_list_id, emails)
+
+    def create_subscribers(self, rows: List[dict]) -> List[int]:
+        return create_subscribers(self.mailing_list_id, rows)
+
+    def update_subscribers(self, rows: Dict[int, dict]):
+        """
+        Update the existing subscribers with a single UPDATE statement, one
+        CASE expression per field.
+
+        :param rows: Dictionary mapping the subscribers ids to their new fields
+        """
+        if not rows:
+            return
+        fields_names: Set[str] = set()
+        for fields in rows.values():
+            fields_names.update(fields.keys())
+        values = {'update_date': timezone.now()}
+        for field_name in fields_names:
+            model_field = Subscriber._meta.get_field(field_name)
+            output_field = IntegerField() if model_field.is_relation else model_field
+            whens = [When(pk=pk, then=Value(fields[field_name], output_field=output_field))
+                     for pk, fields in rows.items() if field_name in fields]
+            values[field_name] = Case(*whens, default=F(field_name), output_field=output_field)
+        Subscriber.objects.filter(pk__in=rows.keys()).update(**values)
+
+    def make_error(self, row_number: int, row: List[str], message: str) -> SubscriberImportError:
+        return SubscriberImportError(
+            subscriber_import_id=self.subscriber_import.pk,
+            row_number=row_number,
+            row=','.join(row),
+            message=message[:255]
+        )
+
+    def claim_rows(self, parsed_rows: Dict[str, dict], positions: Dict[str, int]) -> Set[str]:
+        """
+        Hook to discard the rows superseded by rows imported by another worker
+        (see `SegmentImporter`). Called within the chunk transaction.
+
+        :param parsed_rows: Dictionary mapping the lowercase email addresses to
+                            the subscriber fields, changed in place
+        :param positions: Dictionary mapping the lowercase email addresses to
+                          the position of their rows in the file
+        :return: The email addresses of the subscribers already imported by
+                 this import, updated regardless of the import strategy
+        """
+        return set()
+
+    def record_imported_rows(self, keys: Set[str], claimed: Set[str], positions: Dict[str, int]):
+        """
+        Hook called within the chunk transaction with the email addresses of
+        the subscribers created or updated (see `claim_rows`).
+        """
+        pass
+
+    def import_chunk(self, rows: List[CSVRow]) -> Tuple[int, int, int, int]:
+        """
+        Import a chunk of CSV rows and save the import progress within a
+        single transaction.
+
+        :return: A tuple with the number of subscribers created, updated and
+                 skipped, and the number of invalid rows
+        """
+        created = updated = skipped = 0
+        parsed_rows: Dict[str, dict] = dict()
+        positions: Dict[str, int] = dict()
+        errors = list()
+        for row_number, row, offset in rows:
+            try:
+                fields = self.parse_row(row)
+            except ValueError as exc:
+                errors.append(self.make_error(row_number, row, str(exc)))
+                continue
+            key = fields['email'].lower()
+            if key in parsed_rows:
+                skipped += 1
+            parsed_rows[key] = fields
+            positions[key] = offset
+
+        with transaction.atomic():
+            parsed_rows_count = len(parsed_rows)
+            claimed = self.claim_rows(parsed_rows, positions)
+            skipped += parsed_rows_count - len(parsed_rows)
+            domains = resolve_domains(get_domain_name(fields['email']) for fields in parsed_rows.values())
+            for fields in parsed_rows.values():
+                fields['domain_id'] = domains[get_domain_name(fields['email'])]
+            existing = self.get_existing_subscribers(fields['email'] for fields in parsed_rows.values())
+
+            new_rows = list()
+            updated_rows = dict()
+            imported_keys = set()
+            for key, fields in parsed_rows.items():
+                if key in existing:
+                    if key in claimed or self.strategy in (ImportStrategies.UPDATE,
+                                                           ImportStrategies.UPDATE_OR_CREATE):
+                        updated_rows[existing[key]] = fields
+                        imported_keys.add(key)
+                    else:
+                        skipped += 1
+                else:
+                    if self.strategy in (ImportStrategies.CREATE, ImportStrategies.UPDATE_OR_CREATE):
+                        new_rows.append(fields)
+                        imported_keys.add(key)
+                    else:
+                        skipped += 1
+
+            subscribers_ids = self.create_subscribers(new_rows)
+            self.update_subscribers(updated_rows)
+            subscribers_ids.extend(updated_rows.keys())
+            index_subscribers(self.mailing_list_id, subscribers_ids)
+            activities = [
+                Activity(activity_type=ActivityTypes.IMPORTED, subscriber_id=subscriber_id)
+                for subscriber_id in subscribers_ids
+            ]
+            Activity.objects.bulk_create(activities)
+            record_activities(activities)
+            self.record_imported_rows(imported_keys, claimed, positions)
+            created = len(new_rows)
+            updated = len(updated_rows)
+            self.save_progress(rows, created, updated, skipped, errors)
+        self.committed_offset = rows[-1][2]
+        return created, updated, skipped, len(errors)
+
+    def import_rows(self, rows: List[CSVRow]):
+        """
+        Import a chunk of CSV rows. If the chunk is rejected by the database,
+        import its rows one by one so only the offending rows are recorded in
+        the error log.
+        """
+        try:
+            results = [self.import_chunk(rows)]
+        except DatabaseError:
+            results = list()
+            for row_number, row, offset in rows:
+                try:
+                    results.append(self.import_chunk([(row_number, row, offset)]))
+                except DatabaseError as exc:
+                    error = self.make_error(row_number, row, str(exc))
+                    with transaction.atomic():
+                        self.save_progress([(row_number, row, offset)], 0, 0, 0, [error])
+                    self.committed_offset = offset
+                    results.append((0, 0, 0, 1))
+        for created, updated, skipped, errors in results:
+            self.created += created
+            self.updated += updated
+            self.skipped += skipped
+            self.errors += errors
+        self.rows_count += len(rows)
+
+    def get_progress_values(self, rows: List[CSVRow], created: int, updated: int, skipped: int,
+                            errors: List[SubscriberImportError]) -> dict:
+        row_number, row, offset = rows[-1]
+        elapsed = time.time() - self.started_at
+        rows_count = self.rows_count + len(rows)
+        return {
+            'processed_bytes': F('processed_bytes') + (offset - self.committed_offset),
+            'processed_rows': F('processed_rows') + len(rows),
+            'created_count': F('created_count') + created,
+            'updated_count': F('updated_count') + updated,
+            'skipped_count': F('skipped_count') + skipped,
+            'errors_count': F('errors_count') + len(errors),
+            'rows_per_second': round(rows_count / elapsed, 2) if elapsed else 0.0,
+            'lease_date': timezone.now(),
+        }
+
+    def save_progress(self, rows: List[CSVRow], created: int, updated: int, skipped: int,
+                      errors: List[SubscriberImportError]):
+        """
+        Record the position in the file after the last row of a chunk, the
+        counters and the error log of the chunk, and renew the lease of the
+        import. Only the first `COLOSSUS_IMPORT_MAX_ERRORS` errors are kept in
+        the log.
+        """
+        if errors:
+            stored_errors = self.subscriber_import.errors.count()
+            SubscriberImportError.objects.bulk_create(errors[:max(self.max_errors - stored_errors, 0)])
+        values = self.get_progress_values(rows, created, updated, skipped, errors)
+        SubscriberImport.objects.filter(pk=self.subscriber_import.pk).update(**values)
+
+    def run(self) -> Tuple[int, int, int]:
+        """
+        Import the file from the last committed position, committing each
+        chunk along with the import progress.
+
+        :return: A tuple with the number of subscribers created, updated and
+                 skipped by this run
+        """
+        self.started_at = time.time()
+        with open(self.subscriber_import.file.path, 'rb') as csvfile:
+            rows = self.iter_rows(csvfile)
+            chunk = list(islice(rows, self.chunk_size))
+            while chunk:
+                self.import_rows(chunk)
+                chunk = list(islice(rows, self.chunk_size))
+        self.subscriber_import.refresh_from_db()
+        return self.created, self.updated, self.skipped
+
+
+class SegmentImporter(SubscriberImporter):
+    """
+    Import the rows of a `SubscriberImportSegment`, reading its byte range
+    through a memory map. The progress of the segment is committed along with
+    each chunk, so it can be resumed as well.
+
+    Segments are imported concurrently, so an email address found in more than
+    one segment is resolved with the `SubscriberImportKey` records: the row
+    closest to the end of the file wins, whatever the order the segments are
+    processed.
+    """
+    max_attempts = 3
+
+    def __init__(self, segment, chunk_size: int = None):
+        super().__init__(segment.subscriber_import, chunk_size)
+        self.segment = segment
+
+    def iter_segment_lines(self, buffer) -> Iterator[str]:
+        end = self.segment.end
+        while self.offset < end:
+            newline = buffer.find(b'\n', self.offset, end)
+            stop = end if newline == -1 else newline + 1
+            line = buffer[self.offset:stop]
+            self.offset = stop
+            yield line.decode('utf-8', errors='replace')
+
+    def iter_rows(self, csvfile) -> Iterator[CSVRow]:
+        self.offset = self.committed_offset = self.segment.offset
+        if self.segment.is_finished:
+            return
+        with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            reader = csv.reader(self.iter_segment_lines(buffer))
+            if self.offset == 0:
+                next(reader, None)
+            first_row_number = self.segment.first_row_number + self.segment.processed_rows
+            for row_number, row in enumerate(reader, start=first_row_number):
+                yield row_number, row, self.offset
+
+    def claim_rows(self, parsed_rows: Dict[str, dict], positions: Dict[str, int]) -> Set[str]:
+        keys = SubscriberImportKey.objects \
+            .select_for_update() \
+            .filter(subscriber_import_id=self.subscriber_import.pk, email__in=parsed_rows.keys()) \
+            .values_list('email', 'position')
+        claimed = set()
+        for key, position in keys:
+            if position > positions[key]:
+                del parsed_rows[key]
+            else:
+                claimed.add(key)
+        return claimed
+
+    def record_imported_rows(self, keys: Set[str], claimed: Set[str], positions: Dict[str, int]):
+        SubscriberImportKey.objects.bulk_create([
+            SubscriberImportKey(subscriber_import_id=self.subscriber_import.pk, email=key, position=positions[key])
+            for key in keys - claimed
+        ])
+        claimed_keys = keys & claimed
+        if claimed_keys:
+            SubscriberImportKey.objects \
+                .filter(subscriber_import_id=self.subscriber_import.pk, email__in=claimed_keys) \
+                .update(position=Case(*[When(email=key, then=Value(positions[key])) for key in claimed_keys],
+                                      default=F('position'), output_field=BigIntegerField()))
+
+    def import_chunk(self, rows: List[CSVRow]) -> Tuple[int, int, int, int]:
+        """
+        Import a chunk of CSV rows, trying again if a concurrent segment
+        created some of the same subscribers in the meantime.
+        """
+        for attempt in range(self.max_attempts - 1):
+            try:
+                return super().import_chunk(rows)
+            except IntegrityError:
+                pass
+        return super().import_chunk(rows)
+
+    def get_progress_values(self, rows: List[CSVRow], created: int, updated: int, skipped: int,
+                            errors: List[SubscriberImportError]) -> dict:
+        values = super().get_progress_values(rows, created, updated, skipped, errors)
+        # The overall throughput is computed once all the segments are done
+        del values['rows_per_second']
+        return values
+
+    def save_progress(self, rows: List[CSVRow], created: int, updated: int, skipped: int,
+                      errors: List[SubscriberImportError]):
+        super().save_progress(rows, created, updated, skipped, errors)
+        row_number, row, offset = rows[-1]
+        SubscriberImportSegment.objects.filter(pk=self.segment.pk).update(
+            offset=offset,
+            processed_rows=F('processed_rows') + len(rows)
+        )
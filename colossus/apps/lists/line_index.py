@@ -0,0 +1,88 @@
+"""
+Line offsets index of the subscribers import CSV files.
+
+The index is built once, right after the upload, with a single newline scan
+of the memory mapped file, and stored next to it as an array of 64 bit
+offsets, one per line. Counting the lines, or reading any line of the file,
+then takes constant time, without reading the lines before it.
+
+Quoted values spanning multiple lines are indexed as separate lines.
+"""
+import csv
+import io
+import mmap
+import os
+import re
+from array import array
+from typing import List
+
+INDEX_SUFFIX = '.idx'
+
+NEWLINE = re.compile(b'\n')
+
+OFFSET_SIZE = array('Q').itemsize
+
+
+class LineIndex:
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + INDEX_SUFFIX
+
+    def __len__(self) -> int:
+        return os.path.getsize(self.index_path) // OFFSET_SIZE
+
+    def exists(self) -> bool:
+        return os.path.exists(self.index_path)
+
+    def build(self, buffer_size: int = 2 ** 20):
+        """
+        Scan the file for line breaks and write the offsets of the beginning
+        of each line, `buffer_size` offsets at a time.
+        """
+        with open(self.path, 'rb') as csvfile, open(self.index_path, 'wb') as index_file:
+            size = csvfile.seek(0, 2)
+            if not size:
+                return
+            offsets = array('Q', [0])
+            with mmap.mmap(csvfile.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                for match in NEWLINE.finditer(buffer):  # type: ignore
+                    if match.end() < size:
+                        offsets.append(match.end())
+                    if len(offsets) >= buffer_size:
+                        offsets.tofile(index_file)
+                        offsets = array('Q')
+            offsets.tofile(index_file)
+
+    def delete(self):
+        if self.exists():
+            os.remove(self.index_path)
+
+    def get_offsets(self, start: int, stop: int) -> List[int]:
+        offsets = array('Q')
+        with open(self.index_path, 'rb') as index_file:
+            index_file.seek(start * OFFSET_SIZE)
+            offsets.frombytes(index_file.read(max(stop - start, 0) * OFFSET_SIZE))
+        return offsets.tolist()
+
+    def get_lines(self, start: int, stop: int) -> str:
+        """
+        :return: The lines from `start` (inclusive) to `stop` (exclusive) of
+                 the file, zero-based
+        """
+        offsets = self.get_offsets(start, stop + 1)
+        if not offsets:
+            return ''
+        with open(self.path, 'rb') as csvfile:
+            csvfile.seek(offsets[0])
+            if len(offsets) > stop - start:
+                content = csvfile.read(offsets[-1] - offsets[0])
+            else:
+                content = csvfile.read()
+        return content.decode('utf-8', errors='replace')
+
+    def get_rows(self, start: int, stop: int) -> List[List[str]]:
+        """
+        :return: The CSV rows from the line `start` (inclusive) to the line
+                 `stop` (exclusive), zero-based
+        """
+        return list(csv.reader(io.StringIO(self.get_lines(start, stop))))
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0002_auto_20181112_2315'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='rows_per_second',
+            field=models.FloatField(default=0.0, editable=False, verbose_name='rows per second'),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:37
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0003_subscriberimport_rows_per_second'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriberImportError',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('row_number', models.PositiveIntegerField(verbose_name='row number')),
+                ('row', models.TextField(blank=True, verbose_name='row')),
+                ('message', models.CharField(max_length=255, verbose_name='message')),
+            ],
+            options={
+                'verbose_name': 'subscribers import error',
+                'verbose_name_plural': 'subscribers import errors',
+                'db_table': 'colossus_subscribers_imports_errors',
+                'ordering': ('row_number',),
+            },
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='created_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='created'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='errors_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='errors'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='processed_bytes',
+            field=models.BigIntegerField(default=0, editable=False, verbose_name='processed bytes'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='processed_rows',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='processed rows'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='skipped_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='skipped'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='updated_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='updated'),
+        ),
+        migrations.AddField(
+            model_name='subscriberimporterror',
+            name='subscriber_import',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='errors', to='lists.SubscriberImport', verbose_name='subscribers import'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0004_subscriberimport_progress'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriberImportKey',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('email', models.CharField(max_length=255, verbose_name='email address')),
+                ('position', models.BigIntegerField(verbose_name='position')),
+                ('subscriber_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='keys', to='lists.SubscriberImport', verbose_name='subscribers import')),
+            ],
+            options={
+                'verbose_name': 'subscribers import key',
+                'verbose_name_plural': 'subscribers import keys',
+                'db_table': 'colossus_subscribers_imports_keys',
+            },
+        ),
+        migrations.CreateModel(
+            name='SubscriberImportSegment',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('index', models.PositiveIntegerField(verbose_name='index')),
+                ('start', models.BigIntegerField(verbose_name='start')),
+                ('end', models.BigIntegerField(verbose_name='end')),
+                ('offset', models.BigIntegerField(help_text='Position of the next row to import.', verbose_name='offset')),
+                ('first_row_number', models.PositiveIntegerField(verbose_name='first row number')),
+                ('processed_rows', models.PositiveIntegerField(default=0, verbose_name='processed rows')),
+                ('subscriber_import', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='segments', to='lists.SubscriberImport', verbose_name='subscribers import')),
+            ],
+            options={
+                'verbose_name': 'subscribers import segment',
+                'verbose_name_plural': 'subscribers import segments',
+                'db_table': 'colossus_subscribers_imports_segments',
+                'ordering': ('index',),
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscriberimportsegment',
+            unique_together={('subscriber_import', 'index')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscriberimportkey',
+            unique_together={('subscriber_import', 'email')},
+        ),
+    ]
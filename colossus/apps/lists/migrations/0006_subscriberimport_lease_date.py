@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0005_subscriberimport_segments'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='subscriberimport',
+            name='lease_date',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='lease date'),
+        ),
+    ]
@@ -1,14 +1,17 @@
-import csv
 import json
 import uuid
+from datetime import timedelta
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.db import models
-from django.db.models import Avg
+from django.db.models import Avg, Q
 from django.urls import reverse
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 from colossus.apps.lists.constants import ImportStatus, ImportStrategies
+from colossus.apps.lists.line_index import LineIndex
 from colossus.apps.subscribers.constants import Status, TemplateKeys
 from colossus.storage import PrivateMediaStorage
 
@@ -102,8 +105,8 @@ class MailingList(models.Model):
             open=Avg('open_rate'),
             click=Avg('click_rate')
         )
-        self.open_rate = round(qs.get('open', 0.0), 4)
-        self.click_rate = round(qs.get('click', 0.0), 4)
+        self.open_rate = round(qs['open'] or 0.0, 4)
+        self.click_rate = round(qs['click'] or 0.0, 4)
         self.save(update_fields=['open_rate', 'click_rate'])
 
     def _get_form_template(self, form_template_key: str):
@@ -137,6 +140,10 @@ class MailingList(models.Model):
         return self._get_form_template(TemplateKeys.GOODBYE_EMAIL)
 
 
+def get_import_lease_expiry_date():
+    return timezone.now() - timedelta(seconds=settings.COLOSSUS_IMPORT_LEASE)
+
+
 class SubscriberImport(models.Model):
     mailing_list = models.ForeignKey(
         MailingList,
@@ -178,6 +185,14 @@ class SubscriberImport(models.Model):
         help_text=_('The email address will be used as the main subscriber identifier to determine if they are '
                     'already on the list.')
     )
+    rows_per_second = models.FloatField(_('rows per second'), default=0.0, editable=False)
+    processed_bytes = models.BigIntegerField(_('processed bytes'), default=0, editable=False)
+    processed_rows = models.PositiveIntegerField(_('processed rows'), default=0, editable=False)
+    created_count = models.PositiveIntegerField(_('created'), default=0, editable=False)
+    updated_count = models.PositiveIntegerField(_('updated'), default=0, editable=False)
+    skipped_count = models.PositiveIntegerField(_('skipped'), default=0, editable=False)
+    errors_count = models.PositiveIntegerField(_('errors'), default=0, editable=False)
+    lease_date = models.DateTimeField(_('lease date'), null=True, blank=True, editable=False)
 
     __cached_headings = None
 
@@ -188,6 +203,8 @@ class SubscriberImport(models.Model):
 
     def delete(self, using=None, keep_parents=False):
         super().delete(using, keep_parents)
+        if self.file:
+            LineIndex(self.file.path).delete()
         self.file.delete(save=False)
 
     def set_columns_mapping(self, columns_mapping):
@@ -200,37 +217,206 @@ class SubscriberImport(models.Model):
             columns_mapping = dict()
         return {int(key): value for key, value in columns_mapping.items()}
 
+    def get_line_index(self) -> LineIndex:
+        """
+        :return: The line offsets index of the file, built if missing (e.g.
+                 files uploaded before the index was introduced)
+        """
+        line_index = LineIndex(self.file.path)
+        if not line_index.exists():
+            line_index.build()
+        return line_index
+
     def get_headings(self):
         if self.__cached_headings is None:
-            with open(self.file.path, 'r') as csvfile:
-                reader = csv.reader(csvfile)
-                csv_headings = next(reader)
-                self.__cached_headings = csv_headings
+            rows = self.get_line_index().get_rows(0, 1)
+            self.__cached_headings = rows[0] if rows else list()
         return self.__cached_headings
 
     def get_str_headings(self):
         return ', '.join(self.get_headings())
 
-    def get_rows(self, limit=None):
-        rows = list()
-        with open(self.file.path, 'r') as csvfile:
-            reader = csv.reader(csvfile)
-            # skip header
-            next(reader)
-            for index, row in enumerate(reader):
-                if index == limit:
-                    break
-                rows.append(row)
-        return rows
+    def get_rows(self, limit=None, offset=0):
+        """
+        Read the rows straight from their position in the file, using the line
+        offsets index.
+
+        :param limit: Maximum number of rows, or None to read all the rows
+        :param offset: Number of rows to skip, not counting the header
+        :return: List of CSV rows
+        """
+        line_index = self.get_line_index()
+        start = offset + 1  # skip header
+        stop = len(line_index) if limit is None else start + limit
+        return line_index.get_rows(start, stop)
+
+    def get_row(self, row_number):
+        """
+        :param row_number: Row number, counting the header as the first row
+        :return: The CSV row, or None if the file has fewer rows
+        """
+        rows = self.get_line_index().get_rows(row_number - 1, row_number)
+        return rows[0] if rows else None
 
     def get_preview(self):
         return self.get_rows(limit=10)
 
+    @property
+    def can_resume(self) -> bool:
+        """
+        The errored imports can be resumed, and so can the imports whose task
+        stopped committing chunks for longer than COLOSSUS_IMPORT_LEASE seconds
+        (e.g. the worker was restarted).
+        """
+        if self.status == ImportStatus.IMPORTING:
+            return self.lease_date is None or self.lease_date < get_import_lease_expiry_date()
+        return self.status == ImportStatus.ERRORED
+
+    def resume(self) -> bool:
+        """
+        Queue an interrupted import again. The import continues from the last
+        committed chunk (see `processed_bytes`). The status is changed with a
+        conditional update, so an import is never resumed twice.
+
+        :return: True if the import was queued again
+        """
+        from colossus.apps.lists.tasks import import_subscribers
+        resumable = Q(status=ImportStatus.ERRORED) \
+            | Q(status=ImportStatus.IMPORTING, lease_date=None) \
+            | Q(status=ImportStatus.IMPORTING, lease_date__lt=get_import_lease_expiry_date())
+        resumed = SubscriberImport.objects.filter(resumable, pk=self.pk).update(status=ImportStatus.QUEUED)
+        if not resumed:
+            return False
+        self.status = ImportStatus.QUEUED
+        import_subscribers.delay(self.pk)
+        return True
+
+    def claim(self) -> bool:
+        """
+        Atomically start a queued import and take its lease, renewed with each
+        committed chunk (see `SubscriberImporter.save_progress`).
+
+        :return: True if the import was started
+        """
+        now = timezone.now()
+        claimed = SubscriberImport.objects \
+            .filter(pk=self.pk, status=ImportStatus.QUEUED) \
+            .update(status=ImportStatus.IMPORTING, lease_date=now)
+        if claimed:
+            self.status = ImportStatus.IMPORTING
+            self.lease_date = now
+        return bool(claimed)
+
+    def get_progress(self) -> dict:
+        """
+        Summary of the import progress, computed from the instance fields only.
+
+        :return: Dictionary with the import status and counters
+        """
+        try:
+            file_size = self.file.size
+        except (OSError, ValueError):
+            file_size = 0
+        percent = round(min(self.processed_bytes / file_size, 1.0) * 100, 1) if file_size else 0.0
+        return {
+            'status': self.status,
+            'status_display': str(self.get_status_display()),
+            'is_finished': self.status in (ImportStatus.COMPLETED, ImportStatus.ERRORED, ImportStatus.CANCELED),
+            'can_resume': self.can_resume,
+            'percent': percent,
+            'size': max(self.size - 1, 0),
+            'processed_rows': self.processed_rows,
+            'created': self.created_count,
+            'updated': self.updated_count,
+            'skipped': self.skipped_count,
+            'errors': self.errors_count,
+            'rows_per_second': self.rows_per_second,
+        }
+
     def set_size(self, save=True):
-        with open(self.file.path, 'r') as csvfile:
-            dialect = csv.Sniffer().sniff(csvfile.read(1024))
-            csvfile.seek(0)
-            reader = csv.reader(csvfile, dialect)
-            self.size = sum(1 for row in reader)
+        """
+        Build the line offsets index of the uploaded file, which holds the
+        number of lines of the file.
+        """
+        line_index = LineIndex(self.file.path)
+        line_index.build()
+        self.size = len(line_index)
         if save:
             self.save(update_fields=['size'])
+
+
+class SubscriberImportError(models.Model):
+    subscriber_import = models.ForeignKey(
+        SubscriberImport,
+        on_delete=models.CASCADE,
+        related_name='errors',
+        verbose_name=_('subscribers import')
+    )
+    row_number = models.PositiveIntegerField(_('row number'))
+    row = models.TextField(_('row'), blank=True)
+    message = models.CharField(_('message'), max_length=255)
+
+    class Meta:
+        verbose_name = _('subscribers import error')
+        verbose_name_plural = _('subscribers import errors')
+        db_table = 'colossus_subscribers_imports_errors'
+        ordering = ('row_number',)
+
+    def __str__(self):
+        return '%s: %s' % (self.row_number, self.message)
+
+
+class SubscriberImportSegment(models.Model):
+    """
+    Byte range of a subscribers import CSV file, imported by its own worker.
+    The segments are aligned to line boundaries.
+    """
+    subscriber_import = models.ForeignKey(
+        SubscriberImport,
+        on_delete=models.CASCADE,
+        related_name='segments',
+        verbose_name=_('subscribers import')
+    )
+    index = models.PositiveIntegerField(_('index'))
+    start = models.BigIntegerField(_('start'))
+    end = models.BigIntegerField(_('end'))
+    offset = models.BigIntegerField(_('offset'), help_text=_('Position of the next row to import.'))
+    first_row_number = models.PositiveIntegerField(_('first row number'))
+    processed_rows = models.PositiveIntegerField(_('processed rows'), default=0)
+
+    class Meta:
+        verbose_name = _('subscribers import segment')
+        verbose_name_plural = _('subscribers import segments')
+        db_table = 'colossus_subscribers_imports_segments'
+        unique_together = (('subscriber_import', 'index'),)
+        ordering = ('index',)
+
+    def __str__(self):
+        return '%s-%s' % (self.start, self.end)
+
+    @property
+    def is_finished(self) -> bool:
+        return self.offset >= self.end
+
+
+class SubscriberImportKey(models.Model):
+    """
+    Position in the file of the last row imported for each email address of a
+    segmented import. Used to resolve the email addresses found in more than
+    one segment: the row closest to the end of the file wins, regardless of
+    the order the segments are processed.
+    """
+    subscriber_import = models.ForeignKey(
+        SubscriberImport,
+        on_delete=models.CASCADE,
+        related_name='keys',
+        verbose_name=_('subscribers import')
+    )
+    email = models.CharField(_('email address'), max_length=255)
+    position = models.BigIntegerField(_('position'))
+
+    class Meta:
+        verbose_name = _('subscribers import key')
+        verbose_name_plural = _('subscribers import keys')
+        db_table = 'colossus_subscribers_imports_keys'
+        unique_together = (('subscriber_import', 'email'),)
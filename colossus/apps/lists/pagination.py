@@ -0,0 +1,106 @@
+"""
+Keyset pagination of the subscribers.
+
+Instead of an OFFSET, which reads and discards all the rows of the previous
+pages, each page starts right after (or right before) the last row of the
+page the user comes from. The page is read with an index seek on the
+ordering columns, so the deep pages are as fast as the first one.
+
+The cursor is the position of that row, as `<direction><date>_<pk>`, where
+the direction is `n` for the next page and `p` for the previous page, and
+the date is the ordering field in microseconds since the epoch. The primary
+key breaks the ties between rows of the same date.
+"""
+import datetime
+from typing import List, Optional, Tuple
+
+from django.db.models import Q
+from django.utils import timezone
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+NEXT = 'n'
+PREVIOUS = 'p'
+
+
+def encode_cursor(direction: str, date: datetime.datetime, pk: int) -> str:
+    return '%s%d_%d' % (direction, (date - EPOCH) // datetime.timedelta(microseconds=1), pk)
+
+
+def decode_cursor(cursor: str) -> Optional[Tuple[str, datetime.datetime, int]]:
+    """
+    :return: Tuple of (direction, date, pk), or None if the cursor is invalid
+    """
+    try:
+        direction, position = cursor[0], cursor[1:]
+        microseconds, pk = position.split('_')
+        if direction not in (NEXT, PREVIOUS):
+            return None
+        return direction, EPOCH + datetime.timedelta(microseconds=int(microseconds)), int(pk)
+    except (IndexError, ValueError, OverflowError):
+        return None
+
+
+class KeysetPage:
+    def __init__(self, object_list: List, has_next: bool, has_previous: bool, field: str):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.field = field
+
+    def __len__(self) -> int:
+        return len(self.object_list)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_next:
+            return None
+        last = self.object_list[-1]
+        return encode_cursor(NEXT, getattr(last, self.field), last.pk)
+
+    @property
+    def previous_cursor(self) -> Optional[str]:
+        if not self.has_previous:
+            return None
+        first = self.object_list[0]
+        return encode_cursor(PREVIOUS, getattr(first, self.field), first.pk)
+
+
+class KeysetPaginator:
+    """
+    Paginate a queryset in ascending order of a date field and primary key.
+    The queryset must be backed by an index on (<filters>, field, pk).
+    """
+    def __init__(self, queryset, per_page: int, field: str):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+
+    def get_page(self, cursor: Optional[str]) -> KeysetPage:
+        """
+        :param cursor: Position of the page, the first page if None or invalid
+        """
+        position = decode_cursor(cursor) if cursor else None
+        if position is None:
+            rows = list(self.queryset.order_by(self.field, 'pk')[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], len(rows) > self.per_page, False, self.field)
+
+        direction, date, pk = position
+        if direction == NEXT:
+            queryset = self.queryset \
+                .filter(Q(**{'%s__gt' % self.field: date}) | Q(**{self.field: date, 'pk__gt': pk})) \
+                .order_by(self.field, 'pk')
+            rows = list(queryset[:self.per_page + 1])
+            return KeysetPage(rows[:self.per_page], len(rows) > self.per_page, True, self.field)
+
+        queryset = self.queryset \
+            .filter(Q(**{'%s__lt' % self.field: date}) | Q(**{self.field: date, 'pk__lt': pk})) \
+            .order_by('-%s' % self.field, '-pk')
+        rows = list(queryset[:self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        rows.reverse()
+        return KeysetPage(rows, True, has_previous, self.field)
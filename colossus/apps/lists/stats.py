@@ -0,0 +1,129 @@
+"""
+Cached statistics of the mailing lists detail page.
+
+The status counts, the top countries and domains of the active subscribers
+and the summary of the last 30 days are computed together and stored in the
+default cache, one entry per mailing list, for at most
+COLOSSUS_LIST_STATS_MAX_AGE seconds.
+
+The status counts and the summary are updated in place when a subscriber is
+created, deleted or changes status, or when a subscription activity is
+recorded, once the transaction is committed. The top countries and domains
+change slowly and are only recomputed when the entry expires or is refreshed
+manually. The imports refresh the whole entry.
+
+The in place updates are not atomic, so concurrent updates may be lost until
+the entry expires.
+"""
+from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.rollups import get_activity_counts
+
+TOP_SIZE = 10
+
+SUMMARY_ACTIVITY_TYPES = {
+    ActivityTypes.SUBSCRIBED: 'subscribed',
+    ActivityTypes.UNSUBSCRIBED: 'unsubscribed',
+    ActivityTypes.CLEANED: 'cleaned',
+}
+
+
+def get_stats_key(mailing_list_id: int) -> str:
+    return 'colossus:lists:stats:%s' % mailing_list_id
+
+
+def compute_stats(mailing_list) -> Dict[str, Any]:
+    status_counts = dict.fromkeys((status for status, label in Status.CHOICES), 0)
+    status_counts.update(mailing_list.subscribers.values_list('status').annotate(total=Count('id')).order_by())
+
+    locations = mailing_list.get_active_subscribers() \
+        .values('location__country__code', 'location__country__name') \
+        .annotate(total=Count('location__country__code')) \
+        .order_by('-total')[:TOP_SIZE]
+
+    domains = mailing_list.get_active_subscribers() \
+        .values('domain__name') \
+        .annotate(total=Count('domain__name')) \
+        .order_by('-total')[:TOP_SIZE]
+
+    thirty_days_ago = timezone.localdate() - timedelta(30)
+    summary = get_activity_counts(SUMMARY_ACTIVITY_TYPES.keys(), mailing_list_id=mailing_list.pk,
+                                  date__gte=thirty_days_ago)
+
+    return {
+        'status_counts': status_counts,
+        'locations': list(locations),
+        'domains': list(domains),
+        'summary_last_30_days': {key: summary[activity_type] for activity_type, key in SUMMARY_ACTIVITY_TYPES.items()},
+        'computed_at': timezone.now(),
+    }
+
+
+def refresh_stats(mailing_list) -> Dict[str, Any]:
+    stats = compute_stats(mailing_list)
+    cache.set(get_stats_key(mailing_list.pk), stats, timeout=settings.COLOSSUS_LIST_STATS_MAX_AGE)
+    return stats
+
+
+def get_stats(mailing_list) -> Dict[str, Any]:
+    """
+    :return: The cached statistics of the mailing list, computed if missing
+    """
+    stats = cache.get(get_stats_key(mailing_list.pk))
+    if stats is None:
+        stats = refresh_stats(mailing_list)
+    return stats
+
+
+def invalidate_stats(mailing_list_id: int):
+    transaction.on_commit(lambda: cache.delete(get_stats_key(mailing_list_id)))
+
+
+def _update_stats(mailing_list_id: int, update: Callable[[Dict[str, Any]], None]):
+    def apply():
+        key = get_stats_key(mailing_list_id)
+        stats = cache.get(key)
+        if stats is None:
+            return
+        update(stats)
+        # Keep the original expiration, so the entry is never older than the maximum age
+        age = (timezone.now() - stats['computed_at']).total_seconds()
+        timeout = settings.COLOSSUS_LIST_STATS_MAX_AGE - age
+        if timeout > 0:
+            cache.set(key, stats, timeout=timeout)
+        else:
+            cache.delete(key)
+
+    transaction.on_commit(apply)
+
+
+def count_status_change(mailing_list_id: int, previous_status: Optional[int], status: Optional[int]):
+    """
+    :param previous_status: Status before the change, None for new subscribers
+    :param status: Status after the change, None for deleted subscribers
+    """
+    def update(stats):
+        if previous_status is not None:
+            stats['status_counts'][previous_status] -= 1
+        if status is not None:
+            stats['status_counts'][status] += 1
+
+    _update_stats(mailing_list_id, update)
+
+
+def count_activity(mailing_list_id: int, activity_type: int):
+    if activity_type not in SUMMARY_ACTIVITY_TYPES:
+        return
+
+    def update(stats):
+        stats['summary_last_30_days'][SUMMARY_ACTIVITY_TYPES[activity_type]] += 1
+
+    _update_stats(mailing_list_id, update)
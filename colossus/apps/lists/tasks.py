@@ -1,10 +1,10 @@
 """
 Collection of Celery tasks for the lists app.
 """
-import csv
 import json
 import logging
-from typing import Dict, Union
+import time
+from typing import Dict, List, Union
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
@@ -13,15 +13,19 @@ from django.utils import timezone
 
 from celery import shared_task
 
-from colossus.apps.lists.constants import (
-    ImportFields, ImportStatus, ImportStrategies,
+from colossus.apps.lists.bulk import import_emails, tag_emails
+from colossus.apps.lists.constants import ImportStatus
+from colossus.apps.lists.importer import (
+    SegmentImporter, SubscriberImporter, split_file,
 )
+from colossus.apps.lists.stats import refresh_stats
 from colossus.apps.notifications.constants import Actions
 from colossus.apps.notifications.models import Notification
 from colossus.apps.subscribers.constants import ActivityTypes, Status
-from colossus.apps.subscribers.models import Domain, Subscriber
+from colossus.apps.subscribers.models import Tag
+from colossus.utils import run_chord
 
-from .models import MailingList, SubscriberImport
+from .models import MailingList, SubscriberImport, SubscriberImportSegment
 
 logger = logging.getLogger(__name__)
 User = get_user_model()
@@ -72,119 +76,173 @@ def clean_lists_hard_bounces_task():
         clean_list_task.delay(id)
 
 
+def complete_subscribers_import(subscriber_import: SubscriberImport, succeeded: bool) -> str:
+    """
+    Set the final status of an import and notify its user.
+
+    :param subscriber_import: SubscriberImport instance
+    :param succeeded: If all the rows were processed
+    :return: Message with the status of the import process
+    """
+    subscriber_import.refresh_from_db()
+    if succeeded:
+        subscriber_import.mailing_list.update_subscribers_count()
+        subscriber_import.status = ImportStatus.COMPLETED
+        notification_action = Actions.IMPORT_COMPLETED
+        output_message = 'The subscriber import "%s" completed with success. %s created, %s updated, %s skipped, ' \
+                         '%s errors.' % (subscriber_import.pk, subscriber_import.created_count,
+                                         subscriber_import.updated_count, subscriber_import.skipped_count,
+                                         subscriber_import.errors_count)
+    else:
+        subscriber_import.status = ImportStatus.ERRORED
+        notification_action = Actions.IMPORT_ERRORED
+        output_message = 'An error occurred while importing the file "%s" after %s rows. The import can be ' \
+                         'resumed from there.' % (subscriber_import.pk, subscriber_import.processed_rows)
+    subscriber_import.save(update_fields=['status'])
+    refresh_stats(subscriber_import.mailing_list)
+    Notification.objects.create(user=subscriber_import.user, action=notification_action, text=output_message)
+    return output_message
+
+
+def can_split_import(subscriber_import: SubscriberImport) -> bool:
+    """
+    Large files are imported in segments, in parallel. Collecting the results of
+    the segments requires a result backend (or the tasks to run eagerly).
+    """
+    if subscriber_import.segments.exists():
+        return True
+    segment_size = settings.COLOSSUS_IMPORT_SEGMENT_SIZE
+    if not segment_size or not (settings.CELERY_TASK_ALWAYS_EAGER or settings.CELERY_RESULT_BACKEND):
+        return False
+    return subscriber_import.file.size > segment_size
+
+
+def import_segments(subscriber_import: SubscriberImport) -> int:
+    """
+    Split the import file in segments (unless resuming) and import the
+    unfinished ones with a group of tasks. The chord callback completes the
+    import once all the segments are done.
+
+    :return: Number of segments queued
+    """
+    if not subscriber_import.segments.exists():
+        segments = split_file(subscriber_import.file.path, settings.COLOSSUS_IMPORT_SEGMENT_SIZE)
+        SubscriberImportSegment.objects.bulk_create([
+            SubscriberImportSegment(subscriber_import=subscriber_import, index=index, start=start, end=end,
+                                    offset=start, first_row_number=first_row_number)
+            for index, (start, end, first_row_number) in enumerate(segments)
+        ])
+    segments_ids = [segment.pk for segment in subscriber_import.segments.all() if not segment.is_finished]
+    started_at = time.time()
+    if segments_ids:
+        header = [import_segment.s(segment_id) for segment_id in segments_ids]
+        run_chord(header, complete_segmented_import.s(subscriber_import.pk, started_at))
+    else:
+        complete_segmented_import.delay([], subscriber_import.pk, started_at)
+    return len(segments_ids)
+
+
 @shared_task
-def import_subscribers(subscriber_import_id: Union[str, int]) -> str:
+def import_segment(segment_id: int) -> bool:
+    """
+    Import the rows of a SubscriberImportSegment.
+
+    :return: True if the segment was imported, False if it failed
     """
-    Parse the data from a SubscriberImport CSV file and import to the database.
+    try:
+        segment = SubscriberImportSegment.objects.select_related('subscriber_import').get(pk=segment_id)
+        SegmentImporter(segment).run()
+        return True
+    except Exception:
+        logger.exception('An error occurred while importing the segment "%s".' % segment_id)
+        return False
+
 
+@shared_task
+def complete_segmented_import(results: List[bool], subscriber_import_id: int, started_at: float) -> str:
+    """
+    Chord callback of the segments of an import.
+
+    :param results: Results of the `import_segment` tasks
     :param subscriber_import_id: SubscriberImport instance ID
+    :param started_at: Timestamp of the segments dispatch
     :return: Message with the status of the import process
     """
-    try:
-        subscriber_import = SubscriberImport.objects.get(pk=subscriber_import_id)
-        if subscriber_import.status == ImportStatus.QUEUED:
+    subscriber_import = SubscriberImport.objects.get(pk=subscriber_import_id)
+    succeeded = all(results)
+    if succeeded:
+        subscriber_import.keys.all().delete()
+    elapsed = time.time() - started_at
+    rows_per_second = round(subscriber_import.processed_rows / elapsed, 2) if elapsed else 0.0
+    SubscriberImport.objects.filter(pk=subscriber_import_id).update(rows_per_second=rows_per_second)
+    return complete_subscribers_import(subscriber_import, succeeded)
 
-            # Start import process
-            subscriber_import.status = ImportStatus.IMPORTING
-            subscriber_import.save(update_fields=['status'])
 
-            import_status: int
-            notification_action: int
-            output_message = ''
-            cached_domains: Dict[str, Domain] = dict()
+@shared_task
+def import_subscribers(subscriber_import_id: Union[str, int]) -> str:
+    """
+    Parse the data from a SubscriberImport CSV file and import to the database,
+    in chunks (see `colossus.apps.lists.importer`). A resumed import continues
+    from the last committed chunk. Large files are split in segments imported
+    in parallel.
 
+    :param subscriber_import_id: SubscriberImport instance ID
+    :return: Message with the status of the import process
+    """
+    try:
+        subscriber_import = SubscriberImport.objects.get(pk=subscriber_import_id)
+        if subscriber_import.claim():
             try:
-                columns_mapping = subscriber_import.get_columns_mapping()
-                subscriber_created = 0
-                subscriber_updated = 0
-                subscriber_skipped = 0
-
-                with open(subscriber_import.file.path, 'r') as csvfile:
-                    reader = csv.reader(csvfile)
-
-                    # FIXME: determine if needs to skip the first line or not
-                    if True:
-                        next(reader)
-
-                    with transaction.atomic():
-                        for row in reader:
-                            subscriber = None
-
-                            defaults = {'status': subscriber_import.subscriber_status}
-
-                            for column_index, subscriber_field_name in columns_mapping.items():
-                                field_parser = ImportFields.PARSERS[subscriber_field_name]
-                                cleaned_field_data = field_parser(row[column_index])
-                                defaults[subscriber_field_name] = cleaned_field_data
-
-                            email_name, domain_part = defaults['email'].rsplit('@', 1)
-                            domain_name = '@' + domain_part
-
-                            try:
-                                email_domain = cached_domains[domain_name]
-                            except KeyError:
-                                email_domain, created = Domain.objects.get_or_create(name=domain_name)
-                                cached_domains[domain_name] = email_domain
-
-                            defaults['domain'] = email_domain
-
-                            subscriber_queryset = Subscriber.objects.filter(
-                                email__iexact=defaults['email'],
-                                mailing_list_id=subscriber_import.mailing_list_id,
-                            )
-                            subscriber_exists = subscriber_queryset.exists()
-
-                            if subscriber_import.strategy == ImportStrategies.CREATE:
-                                if not subscriber_exists:
-                                    subscriber = Subscriber.objects.create(
-                                        mailing_list_id=subscriber_import.mailing_list_id,
-                                        **defaults
-                                    )
-                                    subscriber_created += 1
-                                else:
-                                    subscriber_skipped += 1
-
-                            elif subscriber_import.strategy == ImportStrategies.UPDATE:
-                                if subscriber_exists:
-                                    subscriber_queryset.update(update_date=timezone.now(), **defaults)
-                                    subscriber = subscriber_queryset.get()
-                                else:
-                                    subscriber_skipped += 1
-
-                            elif subscriber_import.strategy == ImportStrategies.UPDATE_OR_CREATE:
-                                subscriber, created = Subscriber.objects.update_or_create(
-                                    email__iexact=defaults['email'],
-                                    mailing_list_id=subscriber_import.mailing_list_id,
-                                    defaults=defaults
-                                )
-                                if created:
-                                    subscriber_created += 1
-                                else:
-                                    subscriber.update_date = timezone.now()
-                                    subscriber.save(update_fields=['update_date'])
-                                    subscriber_updated += 1
-
-                            if subscriber is not None:
-                                subscriber.create_activity(ActivityTypes.IMPORTED)
-
-                subscriber_import.mailing_list.update_subscribers_count()
-                import_status = ImportStatus.COMPLETED
-                notification_action = Actions.IMPORT_COMPLETED
-                output_message = 'The subscriber import "%s" completed with success. %s created, %s updated, ' \
-                                 '%s skipped.' % (subscriber_import_id, subscriber_created, subscriber_updated,
-                                                  subscriber_skipped)
+                if can_split_import(subscriber_import):
+                    count = import_segments(subscriber_import)
+                    return 'The subscriber import "%s" was split in %s segments.' % (subscriber_import_id, count)
+                SubscriberImporter(subscriber_import).run()
+                succeeded = True
             except Exception:
-                import_status = ImportStatus.ERRORED
-                notification_action = Actions.IMPORT_ERRORED
-                output_message = 'An error occurred while importing the file "%s".' % subscriber_import_id
-                logger.exception(output_message)
-            finally:
-                subscriber_import.status = import_status
-                subscriber_import.save(update_fields=['status'])
-                Notification.objects.create(user=subscriber_import.user, action=notification_action,
-                                            text=output_message)
-                return output_message
+                succeeded = False
+                logger.exception('An error occurred while importing the file "%s".' % subscriber_import_id)
+            return complete_subscribers_import(subscriber_import, succeeded)
         else:
             return 'The subscriber import file "%s" was not queued to be imported.' % subscriber_import_id
     except SubscriberImport.DoesNotExist:
         return 'Subscriber import file "%s" does not exist.' % subscriber_import_id
+
+
+@shared_task
+def import_emails_task(mailing_list_id: int, emails: List[str], status: int, user_id: int) -> str:
+    """
+    Background version of the pasted email addresses import, used for the
+    large lists of email addresses (see `COLOSSUS_BULK_TASK_THRESHOLD`).
+
+    :return: Message with the status of the import process
+    """
+    mailing_list = MailingList.objects.get(pk=mailing_list_id)
+    data: Dict[str, int] = {'mailing_list_id': mailing_list_id}
+    try:
+        created, updated = import_emails(mailing_list, emails, status)
+        data.update(created=created, updated=updated, ignored=0)
+        notification_action = Actions.IMPORT_COMPLETED
+        output_message = 'The email addresses were imported to the list "%s" with success. %s created, ' \
+                         '%s updated.' % (mailing_list.name, created, updated)
+    except Exception:
+        notification_action = Actions.IMPORT_ERRORED
+        output_message = 'An error occurred while importing the email addresses to the list "%s".' % mailing_list.name
+        logger.exception(output_message)
+    Notification.objects.create(user_id=user_id, action=notification_action, text=json.dumps(data))
+    return output_message
+
+
+@shared_task
+def tag_emails_task(mailing_list_id: int, tag_id: int, emails: List[str], user_id: int) -> str:
+    """
+    Background version of the bulk tagging, used for the large lists of email
+    addresses (see `COLOSSUS_BULK_TASK_THRESHOLD`).
+
+    :return: Message with the number of subscribers tagged
+    """
+    mailing_list = MailingList.objects.get(pk=mailing_list_id)
+    tag = Tag.objects.get(pk=tag_id, mailing_list=mailing_list)
+    tagged = tag_emails(mailing_list, tag, emails)
+    text = json.dumps({'mailing_list_id': mailing_list_id, 'tag_name': tag.name, 'tagged': tagged})
+    Notification.objects.create(user_id=user_id, action=Actions.SUBSCRIBERS_TAGGED, text=text)
+    return '%s subscribers were tagged with "%s".' % (tagged, tag.name)
@@ -0,0 +1,53 @@
+from django.test import override_settings
+
+from colossus.apps.lists.bulk import import_emails, tag_emails
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.models import Activity, Subscriber
+from colossus.apps.subscribers.tests.factories import (
+    SubscriberFactory, TagFactory,
+)
+from colossus.test.testcases import TestCase
+
+from .factories import MailingListFactory
+
+
+@override_settings(COLOSSUS_IMPORT_CHUNK_SIZE=2)
+class ImportEmailsTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+
+    def test_import_emails(self):
+        subscriber = SubscriberFactory(mailing_list=self.mailing_list, email='John@example.com',
+                                       status=Status.UNSUBSCRIBED)
+        emails = ['john@example.com', 'mary@example.com', 'peter@example.org']
+        self.assertEqual((2, 1), import_emails(self.mailing_list, emails, Status.SUBSCRIBED))
+        subscriber.refresh_from_db()
+        self.assertEqual(Status.SUBSCRIBED, subscriber.status)
+        subscribers = Subscriber.objects.filter(mailing_list=self.mailing_list)
+        self.assertEqual(3, subscribers.count())
+        self.assertEqual('@example.org', subscribers.get(email='peter@example.org').domain.name)
+        self.assertEqual(2, Activity.objects.filter(activity_type=ActivityTypes.IMPORTED).count())
+        self.mailing_list.refresh_from_db()
+        self.assertEqual(3, self.mailing_list.subscribers_count)
+
+    def test_queries_do_not_depend_on_emails_count(self):
+        import_emails(self.mailing_list, ['a@example.com', 'b@example.com'], Status.SUBSCRIBED)
+        emails = ['c@example.com', 'd@example.com']
+        with self.assertNumQueries(19):
+            import_emails(self.mailing_list, emails, Status.SUBSCRIBED)
+
+
+@override_settings(COLOSSUS_IMPORT_CHUNK_SIZE=2)
+class TagEmailsTests(TestCase):
+    def test_tag_emails(self):
+        mailing_list = MailingListFactory()
+        tag = TagFactory(mailing_list=mailing_list)
+        tagged = SubscriberFactory(mailing_list=mailing_list, email='john@example.com')
+        tagged.tags.add(tag)
+        subscriber = SubscriberFactory(mailing_list=mailing_list, email='Mary@example.com')
+        other_list_subscriber = SubscriberFactory(email='peter@example.com')
+        emails = ['john@example.com', 'mary@example.com', 'peter@example.com', 'unknown@example.com']
+        self.assertEqual(2, tag_emails(mailing_list, tag, emails))
+        self.assertTrue(subscriber.tags.filter(pk=tag.pk).exists())
+        self.assertFalse(other_list_subscriber.tags.exists())
+        self.assertEqual(2, tag.subscribers.count())
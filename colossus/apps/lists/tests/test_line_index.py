@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+
+from django.core.files.base import ContentFile
+
+from colossus.apps.lists.line_index import LineIndex
+from colossus.apps.lists.models import SubscriberImport
+from colossus.test.testcases import TestCase
+
+from .factories import MailingListFactory
+
+
+class LineIndexTests(TestCase):
+    def setUp(self):
+        self.location = tempfile.mkdtemp()
+        self.path = os.path.join(self.location, 'subscribers.csv')
+
+    def tearDown(self):
+        shutil.rmtree(self.location)
+
+    def build(self, content: bytes, **kwargs) -> LineIndex:
+        with open(self.path, 'wb') as csvfile:
+            csvfile.write(content)
+        line_index = LineIndex(self.path)
+        line_index.build(**kwargs)
+        return line_index
+
+    def test_offsets(self):
+        line_index = self.build(b'email,name\na@example.com,A\nb@example.com,B\n')
+        self.assertEqual(3, len(line_index))
+        self.assertEqual([0, 11, 27], line_index.get_offsets(0, 3))
+
+    def test_last_line_without_line_break(self):
+        line_index = self.build(b'email\na@example.com\nb@example.com')
+        self.assertEqual(3, len(line_index))
+        self.assertEqual([['b@example.com']], line_index.get_rows(2, 3))
+        self.assertEqual([], line_index.get_rows(3, 4))
+
+    def test_empty_file(self):
+        line_index = self.build(b'')
+        self.assertEqual(0, len(line_index))
+        self.assertEqual([], line_index.get_rows(0, 1))
+
+    def test_offsets_written_in_buffers(self):
+        content = b''.join(b'%d@example.com\n' % index for index in range(10))
+        line_index = self.build(content, buffer_size=3)
+        self.assertEqual(10, len(line_index))
+        self.assertEqual([['4@example.com'], ['5@example.com']], line_index.get_rows(4, 6))
+
+    def test_delete(self):
+        line_index = self.build(b'email\n')
+        line_index.delete()
+        self.assertFalse(line_index.exists())
+
+
+class SubscriberImportLineIndexTests(TestCase):
+    def setUp(self):
+        self.storage = SubscriberImport._meta.get_field('file').storage
+        self.location = tempfile.mkdtemp()
+        self.storage.__dict__['base_location'] = self.location
+        self.storage.__dict__['location'] = self.location
+        content = 'email,name\n' + ''.join('%s@example.com,Subscriber %s\n' % (index, index) for index in range(20))
+        self.subscriber_import = SubscriberImport(mailing_list=MailingListFactory())
+        self.subscriber_import.file.save('subscribers.csv', ContentFile(content))
+
+    def tearDown(self):
+        self.storage.__dict__.pop('base_location')
+        self.storage.__dict__.pop('location')
+        shutil.rmtree(self.location)
+
+    def test_set_size_builds_index(self):
+        self.subscriber_import.set_size()
+        self.assertEqual(21, self.subscriber_import.size)
+        self.assertTrue(os.path.exists(self.subscriber_import.file.path + '.idx'))
+
+    def test_headings_and_rows(self):
+        self.assertEqual(['email', 'name'], self.subscriber_import.get_headings())
+        self.assertEqual(10, len(self.subscriber_import.get_preview()))
+        self.assertEqual([['5@example.com', 'Subscriber 5']], self.subscriber_import.get_rows(limit=1, offset=5))
+        self.assertEqual(20, len(self.subscriber_import.get_rows()))
+        self.assertEqual(['19@example.com', 'Subscriber 19'], self.subscriber_import.get_row(21))
+        self.assertIsNone(self.subscriber_import.get_row(22))
+
+    def test_delete_removes_index(self):
+        self.subscriber_import.set_size()
+        index_path = self.subscriber_import.file.path + '.idx'
+        self.subscriber_import.delete()
+        self.assertFalse(os.path.exists(index_path))
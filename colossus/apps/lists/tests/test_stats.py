@@ -0,0 +1,83 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from colossus.apps.lists.stats import (
+    count_status_change, get_stats, get_stats_key,
+)
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.tests.factories import SubscriberFactory
+from colossus.test.testcases import AuthenticatedTestCase, TestCase
+
+from .factories import MailingListFactory
+
+
+def run_on_commit(func):
+    func()
+
+
+@mock.patch('colossus.apps.lists.stats.transaction.on_commit', run_on_commit)
+class MailingListStatsTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        SubscriberFactory.create_batch(3, mailing_list=self.mailing_list, status=Status.SUBSCRIBED)
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list, status=Status.PENDING)
+
+    def test_compute_stats(self):
+        stats = get_stats(self.mailing_list)
+        self.assertEqual(3, stats['status_counts'][Status.SUBSCRIBED])
+        self.assertEqual(1, stats['status_counts'][Status.PENDING])
+        self.assertEqual(0, stats['status_counts'][Status.CLEANED])
+        self.assertEqual([{'domain__name': '@colossusmail.com', 'total': 3}], stats['domains'])
+
+    def test_stats_cached(self):
+        get_stats(self.mailing_list)
+        with self.assertNumQueries(0):
+            get_stats(self.mailing_list)
+
+    def test_status_change_counted(self):
+        get_stats(self.mailing_list)
+        self.subscriber.status = Status.SUBSCRIBED
+        self.subscriber.save()
+        self.subscriber.create_activity(ActivityTypes.SUBSCRIBED)
+        SubscriberFactory(mailing_list=self.mailing_list, status=Status.UNSUBSCRIBED)
+        stats = get_stats(self.mailing_list)
+        self.assertEqual(4, stats['status_counts'][Status.SUBSCRIBED])
+        self.assertEqual(0, stats['status_counts'][Status.PENDING])
+        self.assertEqual(1, stats['status_counts'][Status.UNSUBSCRIBED])
+        self.assertEqual(1, stats['summary_last_30_days']['subscribed'])
+
+    @override_settings(COLOSSUS_LIST_STATS_MAX_AGE=60)
+    def test_expired_stats_not_updated(self):
+        stats = get_stats(self.mailing_list)
+        stats['computed_at'] = timezone.now() - timedelta(seconds=61)
+        cache.set(get_stats_key(self.mailing_list.pk), stats)
+        count_status_change(self.mailing_list.pk, Status.PENDING, Status.SUBSCRIBED)
+        self.assertIsNone(cache.get(get_stats_key(self.mailing_list.pk)))
+
+
+class MailingListStatsViewsTests(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        SubscriberFactory(mailing_list=self.mailing_list, status=Status.SUBSCRIBED)
+
+    def test_detail_served_from_cache(self):
+        url = reverse('lists:list', kwargs={'pk': self.mailing_list.pk})
+        response = self.client.get(url)
+        self.assertEqual(1, response.context['subscribed_count'])
+        # Subscribers changed without invalidating the statistics
+        SubscriberFactory(mailing_list=self.mailing_list, status=Status.SUBSCRIBED)
+        response = self.client.get(url)
+        self.assertEqual(1, response.context['subscribed_count'])
+
+    def test_refresh(self):
+        get_stats(self.mailing_list)
+        SubscriberFactory(mailing_list=self.mailing_list, status=Status.SUBSCRIBED)
+        response = self.client.post(reverse('lists:refresh_stats', kwargs={'pk': self.mailing_list.pk}))
+        self.assertRedirects(response, reverse('lists:list', kwargs={'pk': self.mailing_list.pk}))
+        self.assertEqual(2, get_stats(self.mailing_list)['status_counts'][Status.SUBSCRIBED])
@@ -0,0 +1,349 @@
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
+
+from django.core.files.base import ContentFile
+from django.db import DatabaseError
+from django.test import override_settings
+from django.utils import timezone
+
+from colossus.apps.accounts.tests.factories import UserFactory
+from colossus.apps.lists.constants import ImportStatus, ImportStrategies
+from colossus.apps.lists.importer import (
+    SegmentImporter, SubscriberImporter, split_file,
+)
+from colossus.apps.lists.models import (
+    SubscriberImport, SubscriberImportError, SubscriberImportKey,
+    SubscriberImportSegment,
+)
+from colossus.apps.lists.tasks import (
+    import_emails_task, import_segments, import_subscribers, tag_emails_task,
+)
+from colossus.apps.notifications.constants import Actions
+from colossus.apps.notifications.models import Notification
+from colossus.apps.subscribers.constants import ActivityTypes, Status
+from colossus.apps.subscribers.models import Activity, Domain, Subscriber
+from colossus.apps.subscribers.tests.factories import (
+    SubscriberFactory, TagFactory,
+)
+from colossus.test.testcases import TestCase
+
+from .factories import MailingListFactory
+
+
+class SubscriberImportTestCase(TestCase):
+    """
+    Store the uploaded CSV files in a temporary directory.
+    """
+    def setUp(self):
+        super().setUp()
+        self.storage = SubscriberImport._meta.get_field('file').storage
+        self.location = tempfile.mkdtemp()
+        self.storage.__dict__['base_location'] = self.location
+        self.storage.__dict__['location'] = self.location
+        self.mailing_list = MailingListFactory()
+
+    def tearDown(self):
+        self.storage.__dict__.pop('base_location')
+        self.storage.__dict__.pop('location')
+        shutil.rmtree(self.location)
+        super().tearDown()
+
+    def create_import(self, rows, strategy=ImportStrategies.UPDATE_OR_CREATE, columns_mapping=None):
+        content = 'email,name\n' + ''.join('%s\n' % row for row in rows)
+        subscriber_import = SubscriberImport(
+            mailing_list=self.mailing_list,
+            user=UserFactory(),
+            strategy=strategy,
+            status=ImportStatus.QUEUED
+        )
+        subscriber_import.set_columns_mapping(columns_mapping or {0: 'email', 1: 'name'})
+        subscriber_import.file.save('subscribers.csv', ContentFile(content))
+        return subscriber_import
+
+
+class SubscriberImporterTests(SubscriberImportTestCase):
+    def test_create_subscribers_in_chunks(self):
+        rows = ['subscriber_%s@example.com,Subscriber %s' % (index, index) for index in range(25)]
+        subscriber_import = self.create_import(rows)
+        importer = SubscriberImporter(subscriber_import, chunk_size=10)
+        self.assertEqual((25, 0, 0), importer.run())
+        subscribers = Subscriber.objects.filter(mailing_list=self.mailing_list)
+        self.assertEqual(25, subscribers.count())
+        self.assertEqual({'@example.com'}, set(subscribers.values_list('domain__name', flat=True)))
+        self.assertEqual(1, Domain.objects.filter(name='@example.com').count())
+        self.assertEqual(25, Activity.objects.filter(activity_type=ActivityTypes.IMPORTED).count())
+        subscriber_import.refresh_from_db()
+        self.assertGreater(subscriber_import.rows_per_second, 0)
+
+    def test_update_or_create(self):
+        subscriber = SubscriberFactory(mailing_list=self.mailing_list, email='john@example.com', name='John',
+                                       status=Status.UNSUBSCRIBED)
+        subscriber_import = self.create_import(['John@Example.com,John Doe', 'mary@example.com,Mary'])
+        self.assertEqual((1, 1, 0), SubscriberImporter(subscriber_import).run())
+        subscriber.refresh_from_db()
+        self.assertEqual('John Doe', subscriber.name)
+        self.assertEqual(Status.SUBSCRIBED, subscriber.status)
+        self.assertTrue(subscriber.activities.filter(activity_type=ActivityTypes.IMPORTED).exists())
+        self.assertTrue(Subscriber.objects.filter(mailing_list=self.mailing_list, email='mary@example.com').exists())
+
+    def test_update_mixed_case_email(self):
+        subscriber = SubscriberFactory(mailing_list=self.mailing_list, email='Jane.Doe@example.com', name='Jane')
+        subscriber_import = self.create_import(['jane.doe@example.com,Jane Doe'])
+        self.assertEqual((0, 1, 0), SubscriberImporter(subscriber_import).run())
+        self.assertEqual(1, Subscriber.objects.filter(mailing_list=self.mailing_list).count())
+        subscriber.refresh_from_db()
+        self.assertEqual('Jane Doe', subscriber.name)
+
+    def test_create_only(self):
+        subscriber = SubscriberFactory(mailing_list=self.mailing_list, email='john@example.com', name='John')
+        subscriber_import = self.create_import(['john@example.com,John Doe', 'mary@example.com,Mary'],
+                                               strategy=ImportStrategies.CREATE)
+        self.assertEqual((1, 0, 1), SubscriberImporter(subscriber_import).run())
+        subscriber.refresh_from_db()
+        self.assertEqual('John', subscriber.name)
+
+    def test_update_only(self):
+        subscriber_import = self.create_import(['john@example.com,John Doe'], strategy=ImportStrategies.UPDATE)
+        self.assertEqual((0, 0, 1), SubscriberImporter(subscriber_import).run())
+        self.assertFalse(Subscriber.objects.filter(mailing_list=self.mailing_list).exists())
+
+    def test_duplicated_rows_skipped(self):
+        subscriber_import = self.create_import(['john@example.com,John', 'john@example.com,John Doe'])
+        self.assertEqual((1, 0, 1), SubscriberImporter(subscriber_import).run())
+        self.assertEqual('John Doe', Subscriber.objects.get(mailing_list=self.mailing_list).name)
+
+    def test_invalid_rows_logged(self):
+        subscriber_import = self.create_import(['not an email,Nobody', 'john@example.com,John', 'mary@example.com'])
+        self.assertEqual((1, 0, 0), SubscriberImporter(subscriber_import).run())
+        self.assertEqual(2, subscriber_import.errors_count)
+        errors = list(subscriber_import.errors.values_list('row_number', 'row'))
+        self.assertEqual([(2, 'not an email,Nobody'), (4, 'mary@example.com')], errors)
+
+    @override_settings(COLOSSUS_IMPORT_MAX_ERRORS=2)
+    def test_error_log_capped(self):
+        subscriber_import = self.create_import(['invalid %s,Nobody' % index for index in range(5)])
+        SubscriberImporter(subscriber_import, chunk_size=2).run()
+        self.assertEqual(5, subscriber_import.errors_count)
+        self.assertEqual(2, SubscriberImportError.objects.filter(subscriber_import=subscriber_import).count())
+
+    def test_progress_saved_per_chunk(self):
+        rows = ['subscriber_%s@example.com,Subscriber %s' % (index, index) for index in range(5)]
+        subscriber_import = self.create_import(rows)
+        SubscriberImporter(subscriber_import, chunk_size=2).run()
+        self.assertEqual(5, subscriber_import.processed_rows)
+        self.assertEqual(5, subscriber_import.created_count)
+        self.assertEqual(subscriber_import.file.size, subscriber_import.processed_bytes)
+        self.assertEqual(100.0, subscriber_import.get_progress()['percent'])
+
+    def test_resume_from_last_committed_chunk(self):
+        rows = ['subscriber_%s@example.com,Subscriber %s' % (index, index) for index in range(5)]
+        subscriber_import = self.create_import(rows)
+        importer = SubscriberImporter(subscriber_import, chunk_size=2)
+        import_chunk = importer.import_chunk
+        calls = list()
+
+        def failing_import_chunk(chunk):
+            calls.append(chunk)
+            if len(calls) == 2:
+                raise RuntimeError
+            return import_chunk(chunk)
+
+        with mock.patch.object(importer, 'import_chunk', side_effect=failing_import_chunk):
+            with self.assertRaises(RuntimeError):
+                importer.run()
+        subscriber_import.refresh_from_db()
+        self.assertEqual(2, subscriber_import.processed_rows)
+
+        self.assertEqual((3, 0, 0), SubscriberImporter(subscriber_import, chunk_size=2).run())
+        self.assertEqual(5, subscriber_import.processed_rows)
+        self.assertEqual(5, subscriber_import.created_count)
+        self.assertEqual(5, Subscriber.objects.filter(mailing_list=self.mailing_list).count())
+        self.assertEqual(5, Activity.objects.filter(activity_type=ActivityTypes.IMPORTED).count())
+
+    def test_rejected_chunk_imported_row_by_row(self):
+        subscriber_import = self.create_import(['a@example.com,A', 'b@example.com,B', 'c@example.com,C'])
+        importer = SubscriberImporter(subscriber_import)
+        create_subscribers = importer.create_subscribers
+
+        def failing_create_subscribers(rows):
+            if any(fields['email'] == 'b@example.com' for fields in rows):
+                raise DatabaseError('value too long')
+            return create_subscribers(rows)
+
+        with mock.patch.object(importer, 'create_subscribers', side_effect=failing_create_subscribers):
+            self.assertEqual((2, 0, 0), importer.run())
+        self.assertEqual(3, subscriber_import.processed_rows)
+        self.assertEqual(1, subscriber_import.errors_count)
+        self.assertEqual(3, subscriber_import.errors.get().row_number)
+        emails = set(Subscriber.objects.filter(mailing_list=self.mailing_list).values_list('email', flat=True))
+        self.assertEqual({'a@example.com', 'c@example.com'}, emails)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, COLOSSUS_IMPORT_CHUNK_SIZE=2)
+class ImportSubscribersTaskTests(SubscriberImportTestCase):
+    def test_import_completed(self):
+        subscriber_import = self.create_import(['a@example.com,A', 'b@example.com,B', 'c@example.com,C'])
+        import_subscribers.delay(subscriber_import.pk)
+        subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.COMPLETED, subscriber_import.status)
+        self.mailing_list.refresh_from_db()
+        self.assertEqual(3, self.mailing_list.subscribers_count)
+
+    def test_import_errored_and_resumed(self):
+        subscriber_import = self.create_import(['a@example.com,A', 'b@example.com,B', 'c@example.com,C'])
+        with mock.patch.object(SubscriberImporter, 'import_chunk', side_effect=RuntimeError):
+            import_subscribers.delay(subscriber_import.pk)
+        subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.ERRORED, subscriber_import.status)
+        self.assertTrue(subscriber_import.can_resume)
+
+        subscriber_import.resume()
+        subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.COMPLETED, subscriber_import.status)
+        self.assertEqual(3, subscriber_import.created_count)
+
+    def test_stale_import_resumed(self):
+        subscriber_import = self.create_import(['a@example.com,A', 'b@example.com,B', 'c@example.com,C'])
+        SubscriberImport.objects.filter(pk=subscriber_import.pk).update(
+            status=ImportStatus.IMPORTING,
+            lease_date=timezone.now() - timedelta(hours=1)
+        )
+        subscriber_import.refresh_from_db()
+        self.assertTrue(subscriber_import.can_resume)
+        self.assertTrue(subscriber_import.resume())
+        subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.COMPLETED, subscriber_import.status)
+        self.assertEqual(3, subscriber_import.created_count)
+
+    def test_live_import_not_resumed(self):
+        subscriber_import = self.create_import(['a@example.com,A'])
+        SubscriberImport.objects.filter(pk=subscriber_import.pk).update(
+            status=ImportStatus.IMPORTING,
+            lease_date=timezone.now()
+        )
+        subscriber_import.refresh_from_db()
+        self.assertFalse(subscriber_import.can_resume)
+        with mock.patch('colossus.apps.lists.tasks.import_subscribers.delay') as delay:
+            self.assertFalse(subscriber_import.resume())
+        delay.assert_not_called()
+
+    def test_import_started_once(self):
+        subscriber_import = self.create_import(['a@example.com,A'])
+        self.assertTrue(subscriber_import.claim())
+        self.assertIsNotNone(subscriber_import.lease_date)
+        self.assertIn('was not queued', import_subscribers.delay(subscriber_import.pk).get())
+
+
+class SplitFileTests(SubscriberImportTestCase):
+    def test_segments_aligned_to_lines(self):
+        rows = ['subscriber_%s@example.com,Subscriber %s' % (index, index) for index in range(10)]
+        subscriber_import = self.create_import(rows)
+        with open(subscriber_import.file.path, 'rb') as csvfile:
+            content = csvfile.read()
+        segments = split_file(subscriber_import.file.path, 100)
+        self.assertGreater(len(segments), 1)
+        self.assertEqual(0, segments[0][0])
+        self.assertEqual(len(content), segments[-1][1])
+        row_number = 2
+        for index, (start, end, first_row_number) in enumerate(segments):
+            if index:
+                self.assertEqual(segments[index - 1][1], start)
+            self.assertEqual(b'\n', content[end - 1:end])
+            self.assertEqual(row_number, first_row_number)
+            row_number = content[:end].count(b'\n') + 1
+
+    def test_empty_file(self):
+        subscriber_import = self.create_import([])
+        subscriber_import.file.save('empty.csv', ContentFile(''))
+        self.assertEqual([], split_file(subscriber_import.file.path, 100))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, COLOSSUS_IMPORT_CHUNK_SIZE=2, COLOSSUS_IMPORT_SEGMENT_SIZE=64)
+class ImportSegmentsTests(SubscriberImportTestCase):
+    def setUp(self):
+        super().setUp()
+        rows = ['subscriber_%s@example.com,Subscriber %s' % (index, index) for index in range(10)]
+        rows.insert(1, 'subscriber_8@example.com,First')
+        rows.append('not an email,Nobody')
+        rows.append('subscriber_1@example.com,Last')
+        self.subscriber_import = self.create_import(rows)
+
+    def create_segments(self):
+        segments = split_file(self.subscriber_import.file.path, 64)
+        SubscriberImportSegment.objects.bulk_create([
+            SubscriberImportSegment(subscriber_import=self.subscriber_import, index=index, start=start, end=end,
+                                    offset=start, first_row_number=first_row_number)
+            for index, (start, end, first_row_number) in enumerate(segments)
+        ])
+        return list(self.subscriber_import.segments.all())
+
+    def assertImported(self):
+        subscribers = Subscriber.objects.filter(mailing_list=self.mailing_list)
+        self.assertEqual(10, subscribers.count())
+        self.assertEqual('Last', subscribers.get(email='subscriber_1@example.com').name)
+        self.assertEqual('Subscriber 8', subscribers.get(email='subscriber_8@example.com').name)
+
+    def test_import_subscribers_in_segments(self):
+        self.assertIn('segments', import_subscribers.delay(self.subscriber_import.pk).get())
+        self.subscriber_import.refresh_from_db()
+        self.assertGreater(self.subscriber_import.segments.count(), 1)
+        self.assertEqual(ImportStatus.COMPLETED, self.subscriber_import.status)
+        self.assertEqual(13, self.subscriber_import.processed_rows)
+        self.assertEqual(self.subscriber_import.file.size, self.subscriber_import.processed_bytes)
+        self.assertEqual(1, self.subscriber_import.errors_count)
+        self.assertEqual(13, self.subscriber_import.errors.get().row_number)
+        self.assertFalse(SubscriberImportKey.objects.exists())
+        self.assertImported()
+        self.mailing_list.refresh_from_db()
+        self.assertEqual(10, self.mailing_list.subscribers_count)
+        self.assertEqual(1, Notification.objects.filter(user=self.subscriber_import.user).count())
+
+    def test_segments_order_does_not_matter(self):
+        for strategy in (ImportStrategies.CREATE, ImportStrategies.UPDATE_OR_CREATE):
+            with self.subTest(strategy=strategy):
+                Subscriber.objects.all().delete()
+                SubscriberImport.objects.filter(pk=self.subscriber_import.pk).update(strategy=strategy)
+                self.subscriber_import.refresh_from_db()
+                self.subscriber_import.segments.all().delete()
+                self.subscriber_import.keys.all().delete()
+                for segment in reversed(self.create_segments()):
+                    SegmentImporter(segment).run()
+                self.assertImported()
+
+    def test_resume_unfinished_segments(self):
+        segments = self.create_segments()
+        SegmentImporter(segments[0]).run()
+        with self.settings(CELERY_TASK_ALWAYS_EAGER=False), mock.patch('colossus.utils.chord') as chord:
+            self.assertEqual(len(segments) - 1, import_segments(self.subscriber_import))
+        header = chord.call_args[0][0]
+        self.assertEqual([segment.pk for segment in segments[1:]], [signature.args[0] for signature in header])
+
+    def test_failed_segment_errors_import(self):
+        self.subscriber_import.status = ImportStatus.QUEUED
+        with mock.patch.object(SegmentImporter, 'run', side_effect=RuntimeError):
+            import_subscribers.delay(self.subscriber_import.pk)
+        self.subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.ERRORED, self.subscriber_import.status)
+        self.assertEqual(1, Notification.objects.filter(user=self.subscriber_import.user).count())
+
+
+class BulkEmailsTasksTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.user = UserFactory()
+
+    def test_import_emails_task(self):
+        import_emails_task(self.mailing_list.pk, ['john@example.com'], Status.SUBSCRIBED, self.user.pk)
+        self.assertTrue(self.mailing_list.subscribers.filter(email='john@example.com').exists())
+        notification = Notification.objects.get(user=self.user)
+        self.assertEqual(Actions.IMPORT_COMPLETED, notification.action)
+
+    def test_tag_emails_task(self):
+        tag = TagFactory(mailing_list=self.mailing_list)
+        subscriber = SubscriberFactory(mailing_list=self.mailing_list, email='john@example.com')
+        tag_emails_task(self.mailing_list.pk, tag.pk, ['john@example.com'], self.user.pk)
+        self.assertTrue(subscriber.tags.filter(pk=tag.pk).exists())
+        notification = Notification.objects.get(user=self.user)
+        self.assertEqual(Actions.SUBSCRIBERS_TAGGED, notification.action)
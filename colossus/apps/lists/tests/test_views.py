@@ -1,6 +1,14 @@
+import datetime
+from unittest import mock
+
+from django.test import override_settings
 from django.urls import reverse
+from django.utils import timezone
 
+from colossus.apps.lists.constants import ImportStatus
+from colossus.apps.lists.models import SubscriberImport
 from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import Status
 from colossus.apps.subscribers.tests.factories import (
     SubscriberFactory, TagFactory,
 )
@@ -77,3 +85,169 @@ class BulkTagSubscribersViewSuccessTests(TagTestCase):
 
     def test_subscriber_tag(self):
         self.assertTrue(self.subscriber.tags.filter(pk=self.tag.pk).exists())
+
+
+@override_settings(COLOSSUS_BULK_TASK_THRESHOLD=1)
+class BulkTagSubscribersViewBackgroundTests(TagTestCase):
+    @mock.patch('colossus.apps.lists.tasks.tag_emails_task.delay')
+    def test_large_lists_tagged_in_background(self, delay):
+        tag = self.tags[0]
+        url = reverse('lists:bulk_tag', kwargs={'pk': self.mailing_list.pk})
+        response = self.client.post(url, {'tag': tag.pk, 'emails': 'john@example.com\nmary@example.com'})
+        self.assertRedirects(response, reverse('lists:tags', kwargs={'pk': self.mailing_list.pk}))
+        delay.assert_called_once_with(self.mailing_list.pk, tag.pk, ['john@example.com', 'mary@example.com'],
+                                      self.user.pk)
+
+
+@mock.patch('colossus.apps.lists.views.SubscriberListView.page_size', 2)
+class SubscriberListViewTests(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.tag = TagFactory(mailing_list=self.mailing_list)
+        optin_date = timezone.now() - datetime.timedelta(days=1)
+        # Two subscribers share the same opt-in date
+        self.subscribers = [
+            SubscriberFactory(mailing_list=self.mailing_list, email='%s@example.com' % name, name=name.title(),
+                              optin_date=optin_date + datetime.timedelta(hours=hours))
+            for name, hours in (('alice', 0), ('bob', 1), ('carol', 1), ('dave', 2), ('erin', 3))
+        ]
+        self.subscribers[1].tags.add(self.tag)
+        SubscriberFactory(email='alice@example.org')
+        self.url = reverse('lists:subscribers', kwargs={'pk': self.mailing_list.pk})
+
+    def get_emails(self, response):
+        return [subscriber.email.split('@')[0] for subscriber in response.context['subscribers']]
+
+    def test_keyset_pages(self):
+        response = self.client.get(self.url)
+        self.assertEqual(['alice', 'bob'], self.get_emails(response))
+        self.assertEqual(5, response.context['total_count'])
+        self.assertContains(response, '<strong>5</strong> subscribers')
+        page = response.context['page']
+        self.assertFalse(page.has_previous)
+
+        response = self.client.get(self.url, {'cursor': page.next_cursor})
+        self.assertEqual(['carol', 'dave'], self.get_emails(response))
+        page = response.context['page']
+        self.assertTrue(page.has_previous)
+        self.assertTrue(page.has_next)
+
+        response = self.client.get(self.url, {'cursor': page.next_cursor})
+        self.assertEqual(['erin'], self.get_emails(response))
+        page = response.context['page']
+        self.assertFalse(page.has_next)
+
+        response = self.client.get(self.url, {'cursor': page.previous_cursor})
+        self.assertEqual(['carol', 'dave'], self.get_emails(response))
+        response = self.client.get(self.url, {'cursor': response.context['page'].previous_cursor})
+        self.assertEqual(['alice', 'bob'], self.get_emails(response))
+        self.assertFalse(response.context['page'].has_previous)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'cursor': 'x1_a'})
+        self.assertEqual(['alice', 'bob'], self.get_emails(response))
+
+    def test_search(self):
+        response = self.client.get(self.url, {'q': 'ALI'})
+        self.assertEqual(['alice'], self.get_emails(response))
+        self.assertIsNone(response.context['total_count'])
+        response = self.client.get(self.url, {'q': 'car'})
+        self.assertEqual(['carol'], self.get_emails(response))
+        response = self.client.get(self.url, {'q': str(self.subscribers[3].uuid)})
+        self.assertEqual(['dave'], self.get_emails(response))
+
+    def test_tags_filter(self):
+        response = self.client.get(self.url, {'tags__in': self.tag.pk})
+        self.assertEqual(['bob'], self.get_emails(response))
+        self.assertEqual(1, response.context['total_count'])
+
+
+class PasteEmailsImportSubscribersViewTests(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.url = reverse('lists:paste_import_subscribers', kwargs={'pk': self.mailing_list.pk})
+        self.data = {'emails': 'john@example.com, mary@example.com', 'status': Status.SUBSCRIBED}
+
+    def test_import(self):
+        response = self.client.post(self.url, self.data)
+        self.assertRedirects(response, reverse('lists:subscribers', kwargs={'pk': self.mailing_list.pk}))
+        self.assertEqual(2, self.mailing_list.subscribers.count())
+
+    @override_settings(COLOSSUS_BULK_TASK_THRESHOLD=1)
+    @mock.patch('colossus.apps.lists.tasks.import_emails_task.delay')
+    def test_large_lists_imported_in_background(self, delay):
+        self.client.post(self.url, self.data)
+        delay.assert_called_once_with(self.mailing_list.pk, ['john@example.com', 'mary@example.com'],
+                                      Status.SUBSCRIBED, self.user.pk)
+        self.assertFalse(self.mailing_list.subscribers.exists())
+
+
+class SubscriberImportProgressTestCase(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.subscriber_import = SubscriberImport.objects.create(
+            mailing_list=self.mailing_list,
+            status=ImportStatus.ERRORED,
+            size=11,
+            processed_rows=4,
+            created_count=3,
+            errors_count=1
+        )
+        self.kwargs = {'pk': self.mailing_list.pk, 'import_pk': self.subscriber_import.pk}
+
+
+class SubscriberImportProgressViewTests(SubscriberImportProgressTestCase):
+    def test_progress(self):
+        response = self.client.get(reverse('lists:import_progress', kwargs=self.kwargs))
+        self.assertEqual(200, response.status_code)
+        data = response.json()
+        self.assertEqual(10, data['size'])
+        self.assertEqual(4, data['processed_rows'])
+        self.assertEqual(3, data['created'])
+        self.assertEqual(1, data['errors'])
+        self.assertTrue(data['is_finished'])
+        self.assertTrue(data['can_resume'])
+
+    def test_other_mailing_list_not_found(self):
+        kwargs = {'pk': MailingListFactory().pk, 'import_pk': self.subscriber_import.pk}
+        response = self.client.get(reverse('lists:import_progress', kwargs=kwargs))
+        self.assertEqual(404, response.status_code)
+
+    def test_queued_page(self):
+        response = self.client.get(reverse('lists:import_queued', kwargs=self.kwargs))
+        self.assertContains(response, reverse('lists:import_progress', kwargs=self.kwargs))
+        self.assertContains(response, reverse('lists:import_resume', kwargs=self.kwargs))
+
+
+class SubscriberImportResumeViewTests(SubscriberImportProgressTestCase):
+    @mock.patch('colossus.apps.lists.tasks.import_subscribers.delay')
+    def test_resume(self, delay):
+        response = self.client.post(reverse('lists:import_resume', kwargs=self.kwargs))
+        self.assertRedirects(response, reverse('lists:import_queued', kwargs=self.kwargs))
+        delay.assert_called_once_with(self.subscriber_import.pk)
+        self.subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.QUEUED, self.subscriber_import.status)
+
+    @mock.patch('colossus.apps.lists.tasks.import_subscribers.delay')
+    def test_live_import_not_resumed(self, delay):
+        SubscriberImport.objects.filter(pk=self.subscriber_import.pk).update(
+            status=ImportStatus.IMPORTING,
+            lease_date=timezone.now()
+        )
+        response = self.client.get(reverse('lists:import_queued', kwargs=self.kwargs))
+        self.assertNotContains(response, reverse('lists:import_resume', kwargs=self.kwargs))
+        response = self.client.post(reverse('lists:import_resume', kwargs=self.kwargs))
+        self.assertRedirects(response, reverse('lists:import_queued', kwargs=self.kwargs))
+        delay.assert_not_called()
+        self.subscriber_import.refresh_from_db()
+        self.assertEqual(ImportStatus.IMPORTING, self.subscriber_import.status)
+
+    @mock.patch('colossus.apps.lists.tasks.import_subscribers.delay')
+    def test_completed_import_not_resumed(self, delay):
+        SubscriberImport.objects.filter(pk=self.subscriber_import.pk).update(status=ImportStatus.COMPLETED)
+        response = self.client.post(reverse('lists:import_resume', kwargs=self.kwargs))
+        self.assertEqual(404, response.status_code)
+        delay.assert_not_called()
@@ -11,6 +11,7 @@ urlpatterns = [
     path('', views.MailingListListView.as_view(), name='lists'),
     path('add/', views.MailingListCreateView.as_view(), name='new_list'),
     path('<int:pk>/', views.MailingListDetailView.as_view(), name='list'),
+    path('<int:pk>/stats/refresh/', views.MailingListStatsRefreshView.as_view(), name='refresh_stats'),
     path('<int:pk>/locations/<str:country_code>/', views.MailingListCountryReportView.as_view(), name='country_report'),
     path('<int:pk>/subscribers/', views.SubscriberListView.as_view(), name='subscribers'),
     path('<int:pk>/subscribers/add/', views.SubscriberCreateView.as_view(), name='new_subscriber'),
@@ -18,10 +19,13 @@ urlpatterns = [
     path('<int:pk>/subscribers/import/csv/', views.SubscriberImportView.as_view(), name='csv_import_subscribers'),
     path('<int:pk>/subscribers/import/csv/<int:import_pk>/', views.SubscriberImportPreviewView.as_view(), name='import_preview'),
     path('<int:pk>/subscribers/import/csv/<int:import_pk>/queued/', views.SubscriberImportQueuedView.as_view(), name='import_queued'),
+    path('<int:pk>/subscribers/import/csv/<int:import_pk>/progress/', views.SubscriberImportProgressView.as_view(), name='import_progress'),
+    path('<int:pk>/subscribers/import/csv/<int:import_pk>/resume/', views.SubscriberImportResumeView.as_view(), name='import_resume'),
     path('<int:pk>/subscribers/import/csv/<int:import_pk>/download/', views.download_subscriber_import, name='download_subscriber_import'),
     path('<int:pk>/subscribers/import/csv/<int:import_pk>/delete/', views.SubscriberImportDeleteView.as_view(), name='delete_subscriber_import'),
     path('<int:pk>/subscribers/import/paste/', views.PasteEmailsImportSubscribersView.as_view(), name='paste_import_subscribers'),
     path('<int:pk>/subscribers/<int:subscriber_pk>/', views.SubscriberDetailView.as_view(), name='subscriber'),
+    path('<int:pk>/subscribers/<int:subscriber_pk>/archive/', views.SubscriberArchivedActivitiesView.as_view(), name='subscriber_archive'),
     path('<int:pk>/subscribers/<int:subscriber_pk>/edit/', views.SubscriberUpdateView.as_view(), name='edit_subscriber'),
     path('<int:pk>/subscribers/<int:subscriber_pk>/delete/', views.SubscriberDeleteView.as_view(), name='delete_subscriber'),
 
@@ -1,5 +1,7 @@
 import datetime
-from typing import Any, Dict
+import operator
+from functools import reduce
+from typing import Any, Dict, List, Optional
 
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
@@ -10,7 +12,6 @@ from django.forms import modelform_factory
 from django.http import Http404, HttpRequest, HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.utils.translation import gettext, gettext_lazy as _
 from django.views.generic import (
@@ -19,11 +20,12 @@ from django.views.generic import (
 )
 
 from colossus.apps.core.models import Country
-from colossus.apps.subscribers.constants import (
-    ActivityTypes, Status, TemplateKeys, Workflows,
+from colossus.apps.subscribers.bitmaps import (
+    ALL_KEY, get_tag_key, load_bitmap, load_bitmaps,
 )
+from colossus.apps.subscribers.constants import Status, TemplateKeys, Workflows
 from colossus.apps.subscribers.models import (
-    Activity, Subscriber, SubscriptionFormTemplate, Tag,
+    Subscriber, SubscriptionFormTemplate, Tag,
 )
 from colossus.apps.subscribers.subscription_settings import (
     SUBSCRIPTION_FORM_TEMPLATE_SETTINGS,
@@ -33,12 +35,15 @@ from colossus.utils import get_absolute_url, is_uuid
 from .charts import (
     ListDomainsChart, ListLocationsChart, SubscriptionsSummaryChart,
 )
+from .constants import ImportStatus
 from .forms import (
     BulkTagForm, ConfirmSubscriberImportForm, MailingListSMTPForm,
     PasteImportSubscribersForm,
 )
 from .mixins import FormTemplateMixin, MailingListMixin
 from .models import MailingList, SubscriberImport
+from .pagination import KeysetPaginator
+from .stats import get_stats, refresh_stats
 
 
 @method_decorator(login_required, name='dispatch')
@@ -70,42 +75,31 @@ class MailingListDetailView(DetailView):
     context_object_name = 'mailing_list'
 
     def get_context_data(self, **kwargs) -> Dict:
-        locations = self.object.get_active_subscribers() \
-            .select_related('location') \
-            .values('location__country__code', 'location__country__name') \
-            .annotate(total=Count('location__country__code')) \
-            .order_by('-total')[:10]
-
-        last_campaign = self.object.campaigns.order_by('-send_date').first()
-
-        domains = self.object.get_active_subscribers() \
-            .select_related('domain') \
-            .values('domain__name') \
-            .annotate(total=Count('domain__name')) \
-            .order_by('-total')[:10]
-
-        thirty_days_ago = timezone.now() - datetime.timedelta(30)
-        subscribed_expression = Count('id', filter=Q(activity_type=ActivityTypes.SUBSCRIBED))
-        unsubscribed_expression = Count('id', filter=Q(activity_type=ActivityTypes.UNSUBSCRIBED))
-        cleaned_expression = Count('id', filter=Q(activity_type=ActivityTypes.CLEANED))
-        summary_last_30_days = Activity.objects \
-            .filter(subscriber__mailing_list=self.object, date__gte=thirty_days_ago) \
-            .aggregate(subscribed=subscribed_expression,
-                       unsubscribed=unsubscribed_expression,
-                       cleaned=cleaned_expression)
+        stats = get_stats(self.object)
+        status_counts = stats['status_counts']
 
         kwargs['menu'] = 'lists'
         kwargs['submenu'] = 'details'
-        kwargs['subscribed_count'] = self.object.subscribers.filter(status=Status.SUBSCRIBED).count()
-        kwargs['unsubscribed_count'] = self.object.subscribers.filter(status=Status.UNSUBSCRIBED).count()
-        kwargs['cleaned_count'] = self.object.subscribers.filter(status=Status.CLEANED).count()
-        kwargs['locations'] = locations
-        kwargs['last_campaign'] = last_campaign
-        kwargs['summary_last_30_days'] = summary_last_30_days
-        kwargs['domains'] = domains
+        kwargs['subscribed_count'] = status_counts[Status.SUBSCRIBED]
+        kwargs['unsubscribed_count'] = status_counts[Status.UNSUBSCRIBED]
+        kwargs['cleaned_count'] = status_counts[Status.CLEANED]
+        kwargs['locations'] = stats['locations']
+        kwargs['last_campaign'] = self.object.campaigns.order_by('-send_date').first()
+        kwargs['summary_last_30_days'] = stats['summary_last_30_days']
+        kwargs['domains'] = stats['domains']
+        kwargs['stats_computed_at'] = stats['computed_at']
         return super().get_context_data(**kwargs)
 
 
+@method_decorator(login_required, name='dispatch')
+class MailingListStatsRefreshView(View):
+    def post(self, request, pk):
+        mailing_list = get_object_or_404(MailingList, pk=pk)
+        refresh_stats(mailing_list)
+        messages.success(request, gettext('The list statistics were refreshed.'))
+        return redirect('lists:list', pk=pk)
+
+
 @method_decorator(login_required, name='dispatch')
 class MailingListCountryReportView(MailingListMixin, DetailView):
     model = MailingList
@@ -134,22 +128,46 @@ class MailingListCountryReportView(MailingListMixin, DetailView):
 
 @method_decorator(login_required, name='dispatch')
 class SubscriberListView(MailingListMixin, ListView):
+    """
+    Browse the subscribers of a list with keyset pagination (see
+    `pagination.py`), in order of opt-in date.
+    """
     model = Subscriber
     context_object_name = 'subscribers'
-    paginate_by = 100
+    page_size = 100
     template_name = 'lists/subscriber_list.html'
 
+    def get_tags_ids(self) -> List[int]:
+        return [int(tag_id) for tag_id in self.request.GET.getlist('tags__in') if tag_id.isdigit()]
+
+    def get_total_count(self) -> Optional[int]:
+        """
+        :return: Number of subscribers of the list or of the filtered tags,
+                 read from the bitmaps, or None for the searches
+        """
+        if self.request.GET.get('q', '').strip():
+            return None
+        tags_ids = self.get_tags_ids()
+        if not tags_ids:
+            return len(load_bitmap(self.kwargs.get('pk'), ALL_KEY))
+        bitmaps = load_bitmaps(self.kwargs.get('pk'), [get_tag_key(tag_id) for tag_id in tags_ids])
+        return len(reduce(operator.or_, bitmaps.values()))
+
     def get_context_data(self, **kwargs):
+        paginator = KeysetPaginator(self.object_list, self.page_size, 'optin_date')
+        page = paginator.get_page(self.request.GET.get('cursor'))
         kwargs['submenu'] = 'subscribers'
-        kwargs['total_count'] = self.model.objects.count()
+        kwargs['page'] = page
+        kwargs['total_count'] = self.get_total_count()
+        kwargs['object_list'] = page.object_list
         return super().get_context_data(**kwargs)
 
     def get_queryset(self):
         queryset = self.model.objects.filter(mailing_list_id=self.kwargs.get('pk'))
 
-        tags_filter = self.request.GET.getlist('tags__in')
-        if tags_filter:
-            queryset = queryset.filter(tags__in=tags_filter)
+        tags_ids = self.get_tags_ids()
+        if tags_ids:
+            queryset = queryset.filter(tags__in=tags_ids)
 
         if self.request.GET.get('q', ''):
             query = self.request.GET.get('q').strip()
@@ -157,14 +175,14 @@ class SubscriberListView(MailingListMixin, ListView):
             if is_uuid(query):
                 queryset = queryset.filter(uuid=query)
             else:
-                queryset = queryset.filter(Q(email__icontains=query) | Q(name__icontains=query))
+                queryset = queryset & self.model.objects.search(query)
 
             self.extra_context = {
                 'is_filtered': True,
                 'query': query
             }
 
-        return queryset.order_by('optin_date')
+        return queryset
 
 
 @method_decorator(login_required, name='dispatch')
@@ -188,6 +206,39 @@ class SubscriberDetailView(MailingListMixin, DetailView):
     template_name = 'lists/subscriber_detail.html'
     context_object_name = 'subscriber'
 
+    def get_context_data(self, **kwargs):
+        kwargs['last_archived_month'] = self.object.activity_archives \
+            .order_by('-month') \
+            .values_list('month', flat=True) \
+            .first()
+        return super().get_context_data(**kwargs)
+
+
+@method_decorator(login_required, name='dispatch')
+class SubscriberArchivedActivitiesView(MailingListMixin, DetailView):
+    """
+    Fragment of the subscriber timeline with the archived activities of a
+    month, loaded on demand.
+    """
+    model = Subscriber
+    pk_url_kwarg = 'subscriber_pk'
+    template_name = 'lists/subscriber_archived_activities.html'
+    context_object_name = 'subscriber'
+
+    def get_context_data(self, **kwargs):
+        try:
+            month = datetime.datetime.strptime(self.request.GET.get('month', ''), '%Y-%m').date()
+        except ValueError:
+            raise Http404
+        archive = get_object_or_404(self.object.activity_archives, month=month)
+        kwargs['activities'] = archive.get_activities()
+        kwargs['older_month'] = self.object.activity_archives \
+            .filter(month__lt=month) \
+            .order_by('-month') \
+            .values_list('month', flat=True) \
+            .first()
+        return super().get_context_data(**kwargs)
+
 
 @method_decorator(login_required, name='dispatch')
 class SubscriberUpdateView(MailingListMixin, UpdateView):
@@ -230,7 +281,12 @@ class PasteEmailsImportSubscribersView(MailingListMixin, FormView):
         try:
             mailing_list_id = self.kwargs.get('pk')
             mailing_list = MailingList.objects.only('pk').get(pk=mailing_list_id)
-            form.import_subscribers(mailing_list)
+            if form.is_bulk():
+                form.queue(mailing_list, self.request.user)
+                messages.info(self.request, gettext('The email addresses are being imported. You will be notified '
+                                                    'when it is done.'))
+            else:
+                form.import_subscribers(mailing_list)
             return redirect('lists:subscribers', pk=mailing_list_id)
         except MailingList.DoesNotExist:
             raise Http404
@@ -292,7 +348,12 @@ class BulkTagSubscribersView(LoginRequiredMixin, TagMixin, MailingListMixin, For
         return kwargs
 
     def form_valid(self, form):
-        form.tag_subscribers()
+        if form.is_bulk():
+            form.queue(self.request.user)
+            messages.info(self.request, gettext('The subscribers are being tagged. You will be notified when it is '
+                                                'done.'))
+        else:
+            form.tag_subscribers()
         return redirect('lists:tags', pk=self.mailing_list.pk)
 
 
@@ -488,6 +549,38 @@ class SubscriberImportQueuedView(MailingListMixin, DetailView):
     pk_url_kwarg = 'import_pk'
     context_object_name = 'subscriber_import'
 
+    def get_context_data(self, **kwargs):
+        kwargs['progress'] = self.object.get_progress()
+        kwargs['errors'] = self.object.errors.all()[:100]
+        return super().get_context_data(**kwargs)
+
+
+@method_decorator(login_required, name='dispatch')
+class SubscriberImportProgressView(View):
+    """
+    Polled by the import page. Only the progress fields are loaded, with a
+    single query.
+    """
+    def get(self, request, pk, import_pk):
+        queryset = SubscriberImport.objects.only(
+            'file', 'status', 'size', 'rows_per_second', 'processed_bytes', 'processed_rows', 'created_count',
+            'updated_count', 'skipped_count', 'errors_count'
+        )
+        subscriber_import = get_object_or_404(queryset, pk=import_pk, mailing_list_id=pk)
+        return JsonResponse(subscriber_import.get_progress())
+
+
+@method_decorator(login_required, name='dispatch')
+class SubscriberImportResumeView(View):
+    def post(self, request, pk, import_pk):
+        subscriber_import = get_object_or_404(SubscriberImport, pk=import_pk, mailing_list_id=pk,
+                                              status__in=(ImportStatus.ERRORED, ImportStatus.IMPORTING))
+        if subscriber_import.resume():
+            messages.success(request, gettext('The import was resumed from where it stopped.'))
+        else:
+            messages.warning(request, gettext('The import is still running and cannot be resumed yet.'))
+        return redirect('lists:import_queued', pk=pk, import_pk=import_pk)
+
 
 @method_decorator(login_required, name='dispatch')
 class SubscriberImportDeleteView(MailingListMixin, DeleteView):
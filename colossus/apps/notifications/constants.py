@@ -6,6 +6,7 @@ class Actions:
     IMPORT_ERRORED = 2
     CAMPAIGN_SENT = 3
     LIST_CLEANED = 4
+    SUBSCRIBERS_TAGGED = 5
 
     ITEMS = {
         IMPORT_COMPLETED: {
@@ -23,6 +24,10 @@ class Actions:
         LIST_CLEANED: {
             'label': _('List cleaned'),
             'icon': 'fas fa-broom'
+        },
+        SUBSCRIBERS_TAGGED: {
+            'label': _('Subscribers tagged'),
+            'icon': 'fas fa-tags'
         }
     }
 
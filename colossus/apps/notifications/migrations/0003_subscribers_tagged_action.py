@@ -0,0 +1,18 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_auto_20180825_0042'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='action',
+            field=models.PositiveSmallIntegerField(choices=[(1, 'Subscribers import completed'), (2, 'Subscribers import failed'), (3, 'Campaign sent'), (4, 'List cleaned'), (5, 'Subscribers tagged')], verbose_name='action'),
+        ),
+    ]
@@ -10,7 +10,7 @@ from django.utils.translation import gettext_lazy as _
 from colossus.apps.notifications.constants import Actions
 from colossus.apps.notifications.renderers import (
     render_campaign_sent, render_import_completed, render_import_errored,
-    render_list_cleaned,
+    render_list_cleaned, render_subscribers_tagged,
 )
 
 User = get_user_model()
@@ -57,7 +57,8 @@ class Notification(models.Model):
             Actions.IMPORT_COMPLETED: render_import_completed,
             Actions.IMPORT_ERRORED: render_import_errored,
             Actions.CAMPAIGN_SENT: render_campaign_sent,
-            Actions.LIST_CLEANED: render_list_cleaned
+            Actions.LIST_CLEANED: render_list_cleaned,
+            Actions.SUBSCRIBERS_TAGGED: render_subscribers_tagged
         }
         renderer_function = renderers[self.action]
         return renderer_function(self)
@@ -41,3 +41,13 @@ def render_list_cleaned(notification):
     data['mailing_list_name'] = escape(mailing_list['name'])
     message = _('<strong>Cleaned</strong> %(cleaned)s emails from list %(mailing_list_name)s.') % data
     return mark_safe(message)
+
+
+def render_subscribers_tagged(notification):
+    data = notification.data
+    mailing_list = MailingList.objects.values('id', 'name').get(pk=data['mailing_list_id'])
+    data['mailing_list_name'] = escape(mailing_list['name'])
+    data['tag_name'] = escape(data['tag_name'])
+    message = _('<strong>Tagged</strong> %(tagged)s subscribers with "%(tag_name)s" in list '
+                '%(mailing_list_name)s.') % data
+    return mark_safe(message)
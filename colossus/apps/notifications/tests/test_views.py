@@ -4,8 +4,14 @@ from django.http import JsonResponse
 from django.urls import reverse
 
 from colossus.apps.accounts.models import User
+from colossus.apps.lists.tasks import import_emails_task, tag_emails_task
+from colossus.apps.lists.tests.factories import MailingListFactory
 from colossus.apps.notifications.models import Notification
 from colossus.apps.notifications.tests.factories import NotificationFactory
+from colossus.apps.subscribers.constants import Status
+from colossus.apps.subscribers.tests.factories import (
+    SubscriberFactory, TagFactory,
+)
 from colossus.test.testcases import AuthenticatedTestCase, TestCase
 
 
@@ -54,6 +60,28 @@ class NotificationListViewTests(AuthenticatedTestCase):
         self.assertEqual(5, count)
 
 
+class NotificationListViewBulkTasksTests(AuthenticatedTestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory(name='Newsletter')
+        SubscriberFactory(mailing_list=self.mailing_list, email='john@example.com')
+
+    def test_subscribers_tagged(self):
+        tag = TagFactory(mailing_list=self.mailing_list, name='VIP <customers>')
+        tag_emails_task(self.mailing_list.pk, tag.pk, ['john@example.com'], self.user.pk)
+        response = self.client.get(reverse('notifications:notifications'))
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, 'with "VIP &lt;customers&gt;" in list Newsletter')
+        response = self.client.get(reverse('notifications:unread'))
+        self.assertEqual(200, response.status_code)
+
+    def test_emails_imported(self):
+        import_emails_task(self.mailing_list.pk, ['jane@example.com'], Status.SUBSCRIBED, self.user.pk)
+        response = self.client.get(reverse('notifications:notifications'))
+        self.assertEqual(200, response.status_code)
+        self.assertContains(response, '1 created, 0 updated')
+
+
 class NotificationDetailViewTests(AuthenticatedTestCase):
     def setUp(self):
         super().setUp()
@@ -0,0 +1,219 @@
+"""
+Monthly archives of the old activities.
+
+The activities older than COLOSSUS_ACTIVITY_ARCHIVE_MONTHS are moved out of
+the activities table, one month at a time, into `ActivityArchive` rows: one
+per subscriber and month, holding the activities column by column as a zlib
+compressed JSON document. The subscriber timeline loads them on demand.
+
+Before the first batch of a month is archived, its rollups are recomputed
+from the activities, so the reports keep counting the archived activities.
+`rebuild_rollups` never recomputes the archived months afterwards.
+
+The open and click rates of the subscribers count the distinct emails sent,
+opened and clicked. Each archived email is added to the `archived_*_count`
+fields of the subscriber in the month of its last activity of the type, so
+the emails are counted once, whether their other activities are archived or
+not. The counts of the archived activities of deleted campaigns are kept, and
+the campaigns counters must not be reconciled once their activities are
+archived: the archives never cover the campaigns sent within the last
+COLOSSUS_COUNTERS_RECONCILIATION_DAYS.
+"""
+import datetime
+import json
+import zlib
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, IntegerField, Min, Value, When
+from django.utils import timezone
+
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.rollups import rebuild_rollups
+
+ARCHIVED_FIELDS = ('activity_type', 'date', 'description', 'ip_address', 'location_id', 'campaign_id',
+                   'email_id', 'link_id')
+
+# Activity types counted by the open and click rates, and the subscriber field of their archived count
+ARCHIVED_COUNTS_FIELDS = {
+    ActivityTypes.SENT: 'archived_sent_count',
+    ActivityTypes.OPENED: 'archived_opened_count',
+    ActivityTypes.CLICKED: 'archived_clicked_count',
+}
+
+
+def get_next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+
+def get_archive_horizon(months: Optional[int] = None) -> datetime.date:
+    """
+    :param months: Number of months kept, by default COLOSSUS_ACTIVITY_ARCHIVE_MONTHS
+    :return: First day of the oldest month not archived
+    """
+    if months is None:
+        months = settings.COLOSSUS_ACTIVITY_ARCHIVE_MONTHS
+    today = timezone.localdate()
+    year, month = divmod(today.year * 12 + today.month - 1 - months, 12)
+    horizon = datetime.date(year, month + 1, 1)
+    reconciled = today - datetime.timedelta(days=settings.COLOSSUS_COUNTERS_RECONCILIATION_DAYS)
+    return min(horizon, reconciled.replace(day=1))
+
+
+def _get_start_datetime(date: datetime.date) -> datetime.datetime:
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+
+def encode_activities(activities: List[Dict[str, Any]]) -> bytes:
+    """
+    :param activities: Dictionaries with the `ARCHIVED_FIELDS` of the activities
+    """
+    columns = {field: [activity[field] for activity in activities] for field in ARCHIVED_FIELDS}
+    columns['date'] = [date.timestamp() for date in columns['date']]
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode())
+
+
+def decode_activities(data: bytes) -> List[Dict[str, Any]]:
+    columns = json.loads(zlib.decompress(bytes(data)).decode())
+    columns['date'] = [datetime.datetime.fromtimestamp(date, timezone.utc) for date in columns['date']]
+    return [dict(zip(ARCHIVED_FIELDS, values)) for values in zip(*(columns[field] for field in ARCHIVED_FIELDS))]
+
+
+def load_archived_activities(archive) -> List:
+    """
+    :return: List of unsaved `Activity` instances of an archive, most recent
+             first, with the related objects used to render them
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    Email = apps.get_model('campaigns', 'Email')
+    Link = apps.get_model('campaigns', 'Link')
+    activities = [Activity(subscriber=archive.subscriber, **values) for values in decode_activities(archive.data)]
+    campaigns = Campaign.objects.in_bulk({a.campaign_id for a in activities if a.campaign_id is not None})
+    emails = Email.objects.select_related('campaign') \
+        .in_bulk({a.email_id for a in activities if a.email_id is not None})
+    links = Link.objects.in_bulk({a.link_id for a in activities if a.link_id is not None})
+    for activity in activities:
+        # The related objects deleted since then are left unresolved
+        if activity.campaign_id in campaigns:
+            activity.campaign = campaigns[activity.campaign_id]
+        if activity.email_id in emails:
+            activity.email = emails[activity.email_id]
+        if activity.link_id in links:
+            activity.link = links[activity.link_id]
+    # The archives are sorted by date and creation order
+    activities.reverse()
+    activities.sort(key=lambda a: a.date, reverse=True)
+    return activities
+
+
+def _archive_subscribers(subscribers_ids: List[int], month: datetime.date) -> int:
+    Activity = apps.get_model('subscribers', 'Activity')
+    ActivityArchive = apps.get_model('subscribers', 'ActivityArchive')
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    start, end = _get_start_datetime(month), _get_start_datetime(get_next_month(month))
+    activities = Activity.objects.filter(subscriber_id__in=subscribers_ids, date__gte=start, date__lt=end)
+    with transaction.atomic():
+        rows = list(activities.order_by('subscriber_id', 'date', 'pk').values('pk', 'subscriber_id', *ARCHIVED_FIELDS))
+        if not rows:
+            return 0
+        activities_per_subscriber: Dict[int, List[Dict[str, Any]]] = defaultdict(list)
+        for row in rows:
+            activities_per_subscriber[row['subscriber_id']].append(row)
+
+        # The emails with a later activity of the same type are counted when it is archived
+        later = set(Activity.objects
+                    .filter(subscriber_id__in=activities_per_subscriber.keys(),
+                            activity_type__in=ARCHIVED_COUNTS_FIELDS.keys(),
+                            email_id__in={row['email_id'] for row in rows if row['email_id'] is not None},
+                            date__gte=end)
+                    .values_list('subscriber_id', 'activity_type', 'email_id')
+                    .distinct())
+
+        archives_per_subscriber = {
+            archive.subscriber_id: archive
+            for archive in ActivityArchive.objects.filter(subscriber_id__in=activities_per_subscriber.keys(),
+                                                          month=month)
+        }
+        new_archives = list()
+        counts: Dict[str, List[When]] = {field: list() for field in ARCHIVED_COUNTS_FIELDS.values()}
+        for subscriber_id, subscriber_rows in activities_per_subscriber.items():
+            for activity_type, field in ARCHIVED_COUNTS_FIELDS.items():
+                emails_ids = {row['email_id'] for row in subscriber_rows
+                              if row['activity_type'] == activity_type and row['email_id'] is not None
+                              and (subscriber_id, activity_type, row['email_id']) not in later}
+                if emails_ids:
+                    counts[field].append(When(pk=subscriber_id, then=F(field) + Value(len(emails_ids))))
+            archive = archives_per_subscriber.get(subscriber_id)
+            if archive is not None:
+                # Activities created after the month was archived, e.g. with an explicit date
+                subscriber_rows = sorted(decode_activities(archive.data) + subscriber_rows, key=lambda r: r['date'])
+                archive.data = encode_activities(subscriber_rows)
+                archive.activities_count = len(subscriber_rows)
+                archive.save(update_fields=['data', 'activities_count'])
+            else:
+                new_archives.append(ActivityArchive(subscriber_id=subscriber_id,
+                                                    month=month,
+                                                    activities_count=len(subscriber_rows),
+                                                    data=encode_activities(subscriber_rows)))
+        ActivityArchive.objects.bulk_create(new_archives)
+
+        updates = {field: Case(*whens, default=F(field), output_field=IntegerField())
+                   for field, whens in counts.items() if whens}
+        if updates:
+            Subscriber.objects.filter(pk__in=activities_per_subscriber.keys()).update(**updates)
+
+        # Ignore the activities created since they were read
+        activities.filter(pk__lte=max(row['pk'] for row in rows)).delete()
+    return len(rows)
+
+
+def archive_month(month: datetime.date, batch_size: int = 500) -> int:
+    """
+    Move the activities of a month to the archives, folding them into the
+    rollups first.
+
+    :param month: First day of the month
+    :param batch_size: Number of subscribers archived per transaction
+    :return: Number of activities archived
+    """
+    ActivityArchive = apps.get_model('subscribers', 'ActivityArchive')
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    if not ActivityArchive.objects.filter(month=month).exists():
+        rebuild_rollups(start=month, end=get_next_month(month))
+    archived = 0
+    last_id = 0
+    while True:
+        subscribers_ids = list(Subscriber.objects
+                               .filter(pk__gt=last_id)
+                               .order_by('pk')
+                               .values_list('pk', flat=True)[:batch_size])
+        if not subscribers_ids:
+            break
+        archived += _archive_subscribers(subscribers_ids, month)
+        last_id = subscribers_ids[-1]
+    return archived
+
+
+def archive_activities(horizon: Optional[datetime.date] = None, batch_size: int = 500) -> int:
+    """
+    Archive all the months before the horizon, oldest first.
+
+    :param horizon: First day of the oldest month kept, by default `get_archive_horizon`
+    :return: Number of activities archived
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    if horizon is None:
+        horizon = get_archive_horizon()
+    oldest = Activity.objects.filter(date__lt=_get_start_datetime(horizon)).aggregate(date=Min('date'))['date']
+    if oldest is None:
+        return 0
+    archived = 0
+    month = timezone.localtime(oldest).date().replace(day=1)
+    while month < horizon:
+        archived += archive_month(month, batch_size)
+        month = get_next_month(month)
+    return archived
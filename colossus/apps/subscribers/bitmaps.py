@@ -0,0 +1,282 @@
+"""
+Bitmap index of the subscribers of the mailing lists.
+
+The ids of the subscribers of a list, of each status and of each tag are
+kept as bitmaps, so the segments of a list (see `segments.py`) are counted
+and resolved with bitwise operations instead of joins over the subscribers
+and their tags.
+
+Like a roaring bitmap, each bitmap is split into chunks of CHUNK_SIZE
+consecutive ids, stored zlib compressed in `SubscriberBitmap` rows, one per
+(mailing list, key, chunk). Adding or removing a subscriber rewrites a
+single chunk, locked within the transaction of the change, so the index is
+consistent with the committed subscribers. The keys are:
+
+- `all`: all the subscribers of the list
+- `status:<status>`: the subscribers with the status
+- `tag:<tag id>`: the subscribers with the tag
+
+The subscribers and tags changed with bulk queries must be reported with
+`add_ids`, `remove_ids` or `set_status`, or the bitmaps of the list rebuilt
+with `rebuild_bitmaps` (see the `rebuildbitmaps` command).
+"""
+import zlib
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.apps import apps
+from django.db import transaction
+
+from colossus.apps.subscribers.constants import Status
+
+CHUNK_SIZE = 65536
+
+CHUNK_BYTES = CHUNK_SIZE // 8
+
+ALL_KEY = 'all'
+
+
+def get_status_key(status: int) -> str:
+    return 'status:%s' % status
+
+
+def get_tag_key(tag_id: int) -> str:
+    return 'tag:%s' % tag_id
+
+
+class Bitmap:
+    """
+    Immutable set of subscribers ids, stored as the bits of an integer.
+    """
+    __slots__ = ('bits',)
+
+    def __init__(self, bits: int = 0):
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, ids: Iterable[int]) -> 'Bitmap':
+        data = bytearray()
+        for pk in ids:
+            index = pk >> 3
+            if index >= len(data):
+                data.extend(bytes(index - len(data) + 1))
+            data[index] |= 1 << (pk & 7)
+        return cls(int.from_bytes(data, 'little'))
+
+    def __and__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap(self.bits & other.bits)
+
+    def __or__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap(self.bits | other.bits)
+
+    def __sub__(self, other: 'Bitmap') -> 'Bitmap':
+        return Bitmap(self.bits & ~other.bits)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Bitmap) and self.bits == other.bits
+
+    def __bool__(self) -> bool:
+        return self.bits != 0
+
+    def __len__(self) -> int:
+        return bin(self.bits).count('1')
+
+    def __iter__(self) -> Iterator[int]:
+        """
+        :return: Iterator over the ids, in ascending order
+        """
+        data = self.bits.to_bytes((self.bits.bit_length() + 7) // 8, 'little')
+        for index, byte in enumerate(data):
+            if byte:
+                offset = index << 3
+                for bit in range(8):
+                    if byte & (1 << bit):
+                        yield offset + bit
+
+    def __repr__(self) -> str:
+        return '<Bitmap: %s ids>' % len(self)
+
+    def range(self, min_pk: int, max_pk: int) -> 'Bitmap':
+        """
+        :return: The ids between `min_pk` and `max_pk`, inclusive
+        """
+        mask = ((1 << (max_pk - min_pk + 1)) - 1) << min_pk
+        return Bitmap(self.bits & mask)
+
+
+def encode_chunks(subscribers_ids: Iterable[int]) -> Dict[int, bytes]:
+    """
+    :return: Dictionary of chunk: compressed data of the non-empty chunks
+    """
+    bitmap = Bitmap.from_ids(subscribers_ids)
+    chunks_count = (bitmap.bits.bit_length() + CHUNK_SIZE - 1) // CHUNK_SIZE
+    data = bitmap.bits.to_bytes(chunks_count * CHUNK_BYTES, 'little')
+    chunks = dict()
+    for chunk in range(chunks_count):
+        chunk_data = data[chunk * CHUNK_BYTES:(chunk + 1) * CHUNK_BYTES]
+        if any(chunk_data):
+            chunks[chunk] = zlib.compress(chunk_data)
+    return chunks
+
+
+def load_bitmaps(mailing_list_id: int, keys: Iterable[str]) -> Dict[str, Bitmap]:
+    """
+    Load bitmaps of a mailing list with a single query.
+
+    :return: Dictionary of key: Bitmap, empty for the keys without any id
+    """
+    SubscriberBitmap = apps.get_model('subscribers', 'SubscriberBitmap')
+    keys = set(keys)
+    chunks: Dict[str, Dict[int, bytes]] = defaultdict(dict)
+    rows = SubscriberBitmap.objects \
+        .filter(mailing_list_id=mailing_list_id, key__in=keys) \
+        .values_list('key', 'chunk', 'data')
+    for key, chunk, data in rows:
+        chunks[key][chunk] = zlib.decompress(bytes(data))
+    bitmaps = dict()
+    for key in keys:
+        key_chunks = chunks.get(key, dict())
+        data = bytearray(CHUNK_BYTES * (max(key_chunks.keys()) + 1) if key_chunks else 0)
+        for chunk, chunk_data in key_chunks.items():
+            data[chunk * CHUNK_BYTES:chunk * CHUNK_BYTES + len(chunk_data)] = chunk_data
+        bitmaps[key] = Bitmap(int.from_bytes(data, 'little'))
+    return bitmaps
+
+
+def load_bitmap(mailing_list_id: int, key: str) -> Bitmap:
+    return load_bitmaps(mailing_list_id, [key])[key]
+
+
+def _update_bitmaps(mailing_list_id: int, changes: Dict[str, Tuple[Iterable[int], Iterable[int]]]):
+    """
+    Update the chunks of several bitmaps, locked with a single query. Must be
+    called within a transaction.
+
+    :param changes: Dictionary of key: (ids added, ids removed)
+    """
+    SubscriberBitmap = apps.get_model('subscribers', 'SubscriberBitmap')
+    offsets: Dict[Tuple[str, int], Tuple[List[int], List[int]]] = defaultdict(lambda: (list(), list()))
+    for key, (added, removed) in changes.items():
+        for pk in added:
+            offsets[(key, pk // CHUNK_SIZE)][0].append(pk % CHUNK_SIZE)
+        for pk in removed:
+            offsets[(key, pk // CHUNK_SIZE)][1].append(pk % CHUNK_SIZE)
+    if not offsets:
+        return
+    rows = SubscriberBitmap.objects \
+        .select_for_update() \
+        .filter(mailing_list_id=mailing_list_id,
+                key__in={key for key, chunk in offsets.keys()},
+                chunk__in={chunk for key, chunk in offsets.keys()}) \
+        .order_by('pk')
+    rows_per_chunk = {(row.key, row.chunk): row for row in rows}
+    for (key, chunk), (added, removed) in offsets.items():
+        row = rows_per_chunk.get((key, chunk))
+        if row is None:
+            if not added:
+                continue
+            row, created = SubscriberBitmap.objects.select_for_update().get_or_create(
+                mailing_list_id=mailing_list_id,
+                key=key,
+                chunk=chunk,
+                defaults={'data': b''}
+            )
+        data = bytearray(CHUNK_BYTES)
+        if row.data:
+            chunk_data = zlib.decompress(bytes(row.data))
+            data[:len(chunk_data)] = chunk_data
+        for offset in added:
+            data[offset >> 3] |= 1 << (offset & 7)
+        for offset in removed:
+            data[offset >> 3] &= ~(1 << (offset & 7))
+        if any(data):
+            SubscriberBitmap.objects.filter(pk=row.pk).update(data=zlib.compress(bytes(data)))
+        else:
+            SubscriberBitmap.objects.filter(pk=row.pk).delete()
+
+
+def add_ids(mailing_list_id: int, key: str, subscribers_ids: Iterable[int]):
+    with transaction.atomic():
+        _update_bitmaps(mailing_list_id, {key: (subscribers_ids, ())})
+
+
+def remove_ids(mailing_list_id: int, key: str, subscribers_ids: Iterable[int]):
+    with transaction.atomic():
+        _update_bitmaps(mailing_list_id, {key: ((), subscribers_ids)})
+
+
+def set_status(mailing_list_id: int, subscribers_ids: Iterable[int], status: int,
+               previous_status: Optional[int] = None):
+    """
+    Move subscribers to the bitmap of a status, adding them to the list.
+
+    :param previous_status: Status of all the subscribers before the change,
+                            None if unknown: they are removed from all the
+                            other statuses
+    """
+    subscribers_ids = list(subscribers_ids)
+    if not subscribers_ids:
+        return
+    changes: Dict[str, Tuple[Iterable[int], Iterable[int]]] = {
+        ALL_KEY: (subscribers_ids, ()),
+        get_status_key(status): (subscribers_ids, ()),
+    }
+    previous_statuses = [previous_status] if previous_status is not None else Status.LABELS.keys()
+    for other_status in previous_statuses:
+        if other_status != status:
+            changes[get_status_key(other_status)] = ((), subscribers_ids)
+    with transaction.atomic():
+        _update_bitmaps(mailing_list_id, changes)
+
+
+def remove_subscriber(mailing_list_id: int, subscriber_id: int, status: int, tags_ids: Iterable[int]):
+    keys = [ALL_KEY, get_status_key(status)] + [get_tag_key(tag_id) for tag_id in tags_ids]
+    with transaction.atomic():
+        _update_bitmaps(mailing_list_id, {key: ((), [subscriber_id]) for key in keys})
+
+
+def index_subscribers(mailing_list_id: int, subscribers_ids: Iterable[int]):
+    """
+    Move subscribers created or updated with bulk queries to the bitmaps of
+    their current status.
+    """
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    subscribers_ids = list(subscribers_ids)
+    if not subscribers_ids:
+        return
+    statuses: Dict[int, List[int]] = defaultdict(list)
+    for pk, status in Subscriber.objects.filter(pk__in=subscribers_ids).values_list('pk', 'status'):
+        statuses[status].append(pk)
+    for status, status_subscribers_ids in statuses.items():
+        set_status(mailing_list_id, status_subscribers_ids, status)
+
+
+def rebuild_bitmaps(mailing_list_id: int) -> int:
+    """
+    Recompute the bitmaps of a mailing list from its subscribers and tags.
+
+    :return: Number of chunks created
+    """
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    SubscriberBitmap = apps.get_model('subscribers', 'SubscriberBitmap')
+    SubscriberTag = Subscriber.tags.through
+    ids: Dict[str, List[int]] = defaultdict(list)
+    with transaction.atomic():
+        subscribers = Subscriber.objects.filter(mailing_list_id=mailing_list_id).values_list('pk', 'status')
+        for pk, status in subscribers.iterator():
+            ids[ALL_KEY].append(pk)
+            ids[get_status_key(status)].append(pk)
+        tags = SubscriberTag.objects \
+            .filter(subscriber__mailing_list_id=mailing_list_id) \
+            .values_list('tag_id', 'subscriber_id')
+        for tag_id, subscriber_id in tags.iterator():
+            ids[get_tag_key(tag_id)].append(subscriber_id)
+
+        rows = [
+            SubscriberBitmap(mailing_list_id=mailing_list_id, key=key, chunk=chunk, data=data)
+            for key, subscribers_ids in ids.items()
+            for chunk, data in encode_chunks(subscribers_ids).items()
+        ]
+        SubscriberBitmap.objects.filter(mailing_list_id=mailing_list_id).delete()
+        SubscriberBitmap.objects.bulk_create(rows, batch_size=100)
+    return len(rows)
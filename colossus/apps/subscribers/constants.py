@@ -53,6 +53,24 @@ class ActivityTypes:
     CHOICES = tuple(LABELS.items())
 
 
+class EngagementTypes:
+    CAMPAIGN_OPEN = 1
+    CAMPAIGN_CLICK = 2
+    EMAIL_OPEN = 3
+    EMAIL_CLICK = 4
+    LINK_CLICK = 5
+
+    LABELS = {
+        CAMPAIGN_OPEN: _('Opened campaign'),
+        CAMPAIGN_CLICK: _('Clicked campaign'),
+        EMAIL_OPEN: _('Opened email'),
+        EMAIL_CLICK: _('Clicked email'),
+        LINK_CLICK: _('Clicked link'),
+    }
+
+    CHOICES = tuple(LABELS.items())
+
+
 # ==============================================================================
 # FORM TEMPLATE CONSTANTS
 # ==============================================================================
@@ -0,0 +1,320 @@
+"""
+Incremental opens and clicks counters of the campaigns, emails and links.
+
+Instead of counting the activities again on every open or click, the total
+counters are incremented with F-expressions, and the unique counters are
+incremented only on the first open or click of a subscriber on a campaign,
+email or link, tracked by the `Engagement` records. The cost of recording an
+event does not depend on the size of the campaign.
+
+When a subscriber is deleted, its opens and clicks, archived or not, and its
+engagement records are subtracted from the counters, which are never
+aggregated again from the activities (see `get_subscriber_counts`).
+
+The counters may drift (e.g. events recorded while a subscriber is deleted),
+so `reconcile_campaign_counters` rebuilds the engagement records and the
+counters of a campaign from its activities. It is executed periodically for
+the recent campaigns by `reconcile_engagement_counters_task`.
+"""
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from django.apps import apps
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast, Greatest
+
+from colossus.apps.subscribers.archive import decode_activities
+from colossus.apps.subscribers.constants import ActivityTypes, EngagementTypes
+
+# (engagement_type, target_id, subscriber_id)
+EngagementKey = Tuple[int, int, int]
+
+# (subscriber_id, email_id, campaign_id)
+OpenEvent = Tuple[int, int, int]
+
+# (subscriber_id, link_id, email_id, campaign_id)
+ClickEvent = Tuple[int, int, int, int]
+
+# engagement_type: (app_label, model_name, total_field, unique_field, rate_field)
+COUNTERS_FIELDS = {
+    EngagementTypes.CAMPAIGN_OPEN: ('campaigns', 'Campaign', 'total_opens_count', 'unique_opens_count', 'open_rate'),
+    EngagementTypes.CAMPAIGN_CLICK: ('campaigns', 'Campaign', 'total_clicks_count', 'unique_clicks_count',
+                                     'click_rate'),
+    EngagementTypes.EMAIL_OPEN: ('campaigns', 'Email', 'total_opens_count', 'unique_opens_count', None),
+    EngagementTypes.EMAIL_CLICK: ('campaigns', 'Email', 'total_clicks_count', 'unique_clicks_count', None),
+    EngagementTypes.LINK_CLICK: ('campaigns', 'Link', 'total_clicks_count', 'unique_clicks_count', None),
+}
+
+
+def record_first_engagements(keys: Set[EngagementKey]) -> Set[EngagementKey]:
+    """
+    Create the missing engagement records.
+
+    :param keys: Set of (engagement_type, target_id, subscriber_id) tuples
+    :return: The keys that did not exist yet, i.e. the first engagements
+    """
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    if not keys:
+        return set()
+    existing = Engagement.objects.filter(
+        engagement_type__in={key[0] for key in keys},
+        target_id__in={key[1] for key in keys},
+        subscriber_id__in={key[2] for key in keys}
+    ).values_list('engagement_type', 'target_id', 'subscriber_id')
+    new_keys = keys - set(existing)
+    engagements = [
+        Engagement(engagement_type=engagement_type, target_id=target_id, subscriber_id=subscriber_id)
+        for engagement_type, target_id, subscriber_id in new_keys
+    ]
+    try:
+        with transaction.atomic():
+            Engagement.objects.bulk_create(engagements)
+    except IntegrityError:
+        # A concurrent process recorded some of them in the meantime
+        created = set()
+        for engagement in engagements:
+            try:
+                with transaction.atomic():
+                    engagement.save()
+                created.add((engagement.engagement_type, engagement.target_id, engagement.subscriber_id))
+            except IntegrityError:
+                pass
+        new_keys = created
+    return new_keys
+
+
+def _rate_expression(unique_field: str, increment: int):
+    return Case(
+        When(recipients_count=0, then=Value(0.0)),
+        default=Cast(F(unique_field) + increment, FloatField()) / F('recipients_count'),
+        output_field=FloatField()
+    )
+
+
+def _increment(model, total_field: str, unique_field: str, totals: Dict[int, int], uniques: Dict[int, int],
+               rate_field: str = None):
+    for pk, total in totals.items():
+        values = {total_field: F(total_field) + total}
+        unique = uniques.get(pk, 0)
+        if unique:
+            values[unique_field] = F(unique_field) + unique
+            if rate_field is not None:
+                values[rate_field] = _rate_expression(unique_field, unique)
+        model.objects.filter(pk=pk).update(**values)
+
+
+def count_opens(opens: Iterable[OpenEvent]):
+    """
+    Increment the opens counters of the emails and campaigns.
+
+    :param opens: One (subscriber_id, email_id, campaign_id) tuple per open
+    """
+    Email = apps.get_model('campaigns', 'Email')
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    opens = list(opens)
+    if not opens:
+        return
+    keys = set()
+    for subscriber_id, email_id, campaign_id in opens:
+        keys.add((EngagementTypes.EMAIL_OPEN, email_id, subscriber_id))
+        keys.add((EngagementTypes.CAMPAIGN_OPEN, campaign_id, subscriber_id))
+    with transaction.atomic():
+        first_engagements = record_first_engagements(keys)
+        uniques = Counter((engagement_type, target_id) for engagement_type, target_id, _ in first_engagements)
+        _increment(
+            Email, 'total_opens_count', 'unique_opens_count',
+            totals=Counter(email_id for _, email_id, _ in opens),
+            uniques={pk: uniques[(EngagementTypes.EMAIL_OPEN, pk)] for _, pk, _ in opens}
+        )
+        _increment(
+            Campaign, 'total_opens_count', 'unique_opens_count',
+            totals=Counter(campaign_id for _, _, campaign_id in opens),
+            uniques={pk: uniques[(EngagementTypes.CAMPAIGN_OPEN, pk)] for _, _, pk in opens},
+            rate_field='open_rate'
+        )
+
+
+def count_clicks(clicks: Iterable[ClickEvent]):
+    """
+    Increment the clicks counters of the links, emails and campaigns.
+
+    :param clicks: One (subscriber_id, link_id, email_id, campaign_id) tuple
+                   per click
+    """
+    Link = apps.get_model('campaigns', 'Link')
+    Email = apps.get_model('campaigns', 'Email')
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    clicks = list(clicks)
+    if not clicks:
+        return
+    keys = set()
+    for subscriber_id, link_id, email_id, campaign_id in clicks:
+        keys.add((EngagementTypes.LINK_CLICK, link_id, subscriber_id))
+        keys.add((EngagementTypes.EMAIL_CLICK, email_id, subscriber_id))
+        keys.add((EngagementTypes.CAMPAIGN_CLICK, campaign_id, subscriber_id))
+    with transaction.atomic():
+        first_engagements = record_first_engagements(keys)
+        uniques = Counter((engagement_type, target_id) for engagement_type, target_id, _ in first_engagements)
+        _increment(
+            Link, 'total_clicks_count', 'unique_clicks_count',
+            totals=Counter(click[1] for click in clicks),
+            uniques={click[1]: uniques[(EngagementTypes.LINK_CLICK, click[1])] for click in clicks}
+        )
+        _increment(
+            Email, 'total_clicks_count', 'unique_clicks_count',
+            totals=Counter(click[2] for click in clicks),
+            uniques={click[2]: uniques[(EngagementTypes.EMAIL_CLICK, click[2])] for click in clicks}
+        )
+        _increment(
+            Campaign, 'total_clicks_count', 'unique_clicks_count',
+            totals=Counter(click[3] for click in clicks),
+            uniques={click[3]: uniques[(EngagementTypes.CAMPAIGN_CLICK, click[3])] for click in clicks},
+            rate_field='click_rate'
+        )
+
+
+def get_subscriber_counts(subscriber_id: int) -> List[Tuple[int, int, int, int]]:
+    """
+    Count the opens and clicks of a subscriber, from its activities and its
+    archived activities, and its first opens and clicks from its engagement
+    records. Meant to be called before the subscriber is deleted, see
+    `subtract_counts`.
+
+    :return: JSON serializable list of (engagement_type, target_id, total,
+             unique) tuples
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    ActivityArchive = apps.get_model('subscribers', 'ActivityArchive')
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    Email = apps.get_model('campaigns', 'Email')
+    activity_types = (ActivityTypes.OPENED, ActivityTypes.CLICKED)
+    rows = list(Activity.objects
+                .filter(subscriber_id=subscriber_id, activity_type__in=activity_types)
+                .exclude(email=None)
+                .values_list('activity_type', 'email_id', 'link_id'))
+    for archive in ActivityArchive.objects.filter(subscriber_id=subscriber_id).only('data'):
+        rows.extend((row['activity_type'], row['email_id'], row['link_id'])
+                    for row in decode_activities(archive.data)
+                    if row['activity_type'] in activity_types and row['email_id'] is not None)
+    campaigns_ids = dict(Email.objects
+                         .filter(pk__in={email_id for _, email_id, _ in rows})
+                         .values_list('pk', 'campaign_id'))
+
+    totals: Dict[Tuple[int, int], int] = Counter()
+    for activity_type, email_id, link_id in rows:
+        campaign_id = campaigns_ids.get(email_id)
+        if activity_type == ActivityTypes.OPENED:
+            totals[(EngagementTypes.EMAIL_OPEN, email_id)] += 1
+            if campaign_id is not None:
+                totals[(EngagementTypes.CAMPAIGN_OPEN, campaign_id)] += 1
+        else:
+            totals[(EngagementTypes.EMAIL_CLICK, email_id)] += 1
+            if campaign_id is not None:
+                totals[(EngagementTypes.CAMPAIGN_CLICK, campaign_id)] += 1
+            if link_id is not None:
+                totals[(EngagementTypes.LINK_CLICK, link_id)] += 1
+    uniques = set(Engagement.objects.filter(subscriber_id=subscriber_id).values_list('engagement_type', 'target_id'))
+    return [
+        (key[0], key[1], totals[key], int(key in uniques))
+        for key in sorted(set(totals.keys()) | uniques)
+    ]
+
+
+def subtract_counts(counts: Iterable[Tuple[int, int, int, int]]):
+    """
+    Decrement the opens and clicks counters of the campaigns, emails and
+    links, e.g. by the counts of a deleted subscriber.
+
+    :param counts: (engagement_type, target_id, total, unique) tuples, see
+                   `get_subscriber_counts`
+    """
+    with transaction.atomic():
+        for engagement_type, target_id, total, unique in counts:
+            app_label, model_name, total_field, unique_field, rate_field = COUNTERS_FIELDS[engagement_type]
+            values = {
+                total_field: Greatest(F(total_field) - total, 0),
+                unique_field: Greatest(F(unique_field) - unique, 0),
+            }
+            if rate_field is not None and unique:
+                values[rate_field] = _rate_expression(unique_field, -unique)
+            apps.get_model(app_label, model_name).objects.filter(pk=target_id).update(**values)
+
+
+def _iter_campaign_engagements(campaign) -> Iterator:
+    Activity = apps.get_model('subscribers', 'Activity')
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    activities = Activity.objects.filter(email__campaign=campaign).order_by()
+    opens = activities.filter(activity_type=ActivityTypes.OPENED)
+    clicks = activities.filter(activity_type=ActivityTypes.CLICKED)
+    for subscriber_id in opens.values_list('subscriber_id', flat=True).distinct().iterator():
+        yield Engagement(engagement_type=EngagementTypes.CAMPAIGN_OPEN, target_id=campaign.pk,
+                         subscriber_id=subscriber_id)
+    for subscriber_id in clicks.values_list('subscriber_id', flat=True).distinct().iterator():
+        yield Engagement(engagement_type=EngagementTypes.CAMPAIGN_CLICK, target_id=campaign.pk,
+                         subscriber_id=subscriber_id)
+    for subscriber_id, email_id in opens.values_list('subscriber_id', 'email_id').distinct().iterator():
+        yield Engagement(engagement_type=EngagementTypes.EMAIL_OPEN, target_id=email_id, subscriber_id=subscriber_id)
+    for subscriber_id, email_id in clicks.values_list('subscriber_id', 'email_id').distinct().iterator():
+        yield Engagement(engagement_type=EngagementTypes.EMAIL_CLICK, target_id=email_id, subscriber_id=subscriber_id)
+    for subscriber_id, link_id in clicks.exclude(link=None).values_list('subscriber_id', 'link_id').distinct() \
+            .iterator():
+        yield Engagement(engagement_type=EngagementTypes.LINK_CLICK, target_id=link_id, subscriber_id=subscriber_id)
+
+
+def reconcile_campaign_counters(campaign, batch_size: int = 1000):
+    """
+    Rebuild the engagement records of a campaign from its activities, and
+    recompute the counters of the campaign, its emails and its links with the
+    full aggregations, repairing any drift of the incremental counters.
+    """
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    Link = apps.get_model('campaigns', 'Link')
+    emails = list(campaign.emails.only('pk'))
+    links = list(Link.objects.filter(email__campaign=campaign).only('pk'))
+    with transaction.atomic():
+        Engagement.objects.filter(
+            Q(engagement_type__in=(EngagementTypes.CAMPAIGN_OPEN, EngagementTypes.CAMPAIGN_CLICK),
+              target_id=campaign.pk)
+            | Q(engagement_type__in=(EngagementTypes.EMAIL_OPEN, EngagementTypes.EMAIL_CLICK),
+                target_id__in=[email.pk for email in emails])
+            | Q(engagement_type=EngagementTypes.LINK_CLICK, target_id__in=[link.pk for link in links])
+        ).delete()
+        engagements = _iter_campaign_engagements(campaign)
+        batch = list(islice(engagements, batch_size))
+        while batch:
+            Engagement.objects.bulk_create(batch)
+            batch = list(islice(engagements, batch_size))
+        for email in emails:
+            email.update_opens_count()
+            email.update_clicks_count()
+        for link in links:
+            link.update_clicks_count()
+        campaign.update_opens_count_and_rate()
+        campaign.update_clicks_count_and_rate()
+
+
+def delete_orphan_engagements() -> int:
+    """
+    Delete the engagement records of the deleted campaigns, emails and links.
+
+    :return: Number of records deleted
+    """
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    Email = apps.get_model('campaigns', 'Email')
+    Link = apps.get_model('campaigns', 'Link')
+    targets = (
+        ((EngagementTypes.CAMPAIGN_OPEN, EngagementTypes.CAMPAIGN_CLICK), Campaign),
+        ((EngagementTypes.EMAIL_OPEN, EngagementTypes.EMAIL_CLICK), Email),
+        ((EngagementTypes.LINK_CLICK,), Link),
+    )
+    deleted = 0
+    for engagement_types, model in targets:
+        count, _ = Engagement.objects \
+            .filter(engagement_type__in=engagement_types) \
+            .exclude(target_id__in=model.objects.values('pk')) \
+            .delete()
+        deleted += count
+    return deleted
@@ -0,0 +1,129 @@
+"""
+Process-wide cache of the email domains ids.
+
+Nearly every subscriber write needs the id of the `Domain` of the email
+address. The ids are kept in a bounded LRU cache, and the missing domains are
+resolved in bulk by `resolve_domains`, creating the new ones with a single
+statement. The cache of the Celery worker processes, which run the bulk
+imports, is warmed when they start with the most frequent domains among the
+latest subscribers (see `signals.py`).
+
+The ids are only cached once the transaction that read or created them is
+committed, so a rolled back transaction never leaves unknown ids behind. The
+deleted domains are discarded from the cache (see `signals.py`).
+"""
+import threading
+from collections import Counter, OrderedDict
+from typing import Dict, Iterable, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+
+
+def get_domain_name(email: str) -> str:
+    email_name, domain_part = email.rsplit('@', 1)
+    return '@' + domain_part
+
+
+class DomainCache:
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.ids: Dict[str, int] = OrderedDict()
+        self.warmed = False
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def get(self, name: str) -> Optional[int]:
+        with self.lock:
+            domain_id = self.ids.get(name)
+            if domain_id is not None:
+                self.ids.move_to_end(name)  # type: ignore
+            return domain_id
+
+    def update(self, ids: Dict[str, int]):
+        with self.lock:
+            for name, domain_id in ids.items():
+                self.ids[name] = domain_id
+                self.ids.move_to_end(name)  # type: ignore
+            while len(self.ids) > self.max_size:
+                self.ids.popitem(last=False)  # type: ignore
+
+    def discard(self, name: str):
+        with self.lock:
+            self.ids.pop(name, None)
+
+    def clear(self):
+        with self.lock:
+            self.ids.clear()
+            self.warmed = False
+
+    def load(self, ids: Dict[str, int]):
+        self.update(ids)
+        self.warmed = True
+
+    def warm(self, size: int = None, sample_size: int = None):
+        """
+        Load the most frequent domains among the latest subscribers, reading a
+        bounded number of rows instead of counting all the subscribers.
+
+        :param size: Number of domains to load, defaults to
+                     `COLOSSUS_DOMAIN_CACHE_WARM_SIZE`
+        :param sample_size: Number of subscribers to read, defaults to
+                            `COLOSSUS_DOMAIN_CACHE_WARM_SAMPLE`
+        """
+        Subscriber = apps.get_model('subscribers', 'Subscriber')
+        size = settings.COLOSSUS_DOMAIN_CACHE_WARM_SIZE if size is None else size
+        sample_size = settings.COLOSSUS_DOMAIN_CACHE_WARM_SAMPLE if sample_size is None else sample_size
+        ids: Dict[str, int] = dict()
+        if size:
+            domains = Subscriber.objects \
+                .order_by('-pk') \
+                .values_list('domain__name', 'domain_id')[:sample_size]
+            ids.update(domain for domain, count in Counter(domains).most_common(size))
+        transaction.on_commit(lambda: self.load(ids))
+
+
+domain_cache = DomainCache(max_size=settings.COLOSSUS_DOMAIN_CACHE_SIZE)
+
+
+def resolve_domains(names: Iterable[str]) -> Dict[str, int]:
+    """
+    Resolve the ids of the domains, creating the missing ones.
+
+    :param names: Domains names, starting with "@"
+    :return: Dictionary mapping the domains names to their ids
+    """
+    Domain = apps.get_model('subscribers', 'Domain')
+    ids = dict()
+    missing = set()
+    for name in set(names):
+        domain_id = domain_cache.get(name)
+        if domain_id is None:
+            missing.add(name)
+        else:
+            ids[name] = domain_id
+    if missing:
+        found = dict(Domain.objects.filter(name__in=missing).values_list('name', 'pk'))
+        new_names = missing - set(found.keys())
+        if new_names:
+            try:
+                with transaction.atomic():
+                    Domain.objects.bulk_create([Domain(name=name) for name in new_names])
+            except IntegrityError:
+                # Created by a concurrent process in the meantime
+                pass
+            found.update(Domain.objects.filter(name__in=new_names).values_list('name', 'pk'))
+        transaction.on_commit(lambda: domain_cache.update(found))
+        ids.update(found)
+    return ids
+
+
+def resolve_domain(name: str) -> int:
+    """
+    :param name: Domain name, starting with "@"
+    :return: The domain id
+    """
+    return resolve_domains([name])[name]
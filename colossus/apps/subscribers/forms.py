@@ -9,7 +9,8 @@ from django.utils.translation import gettext
 from colossus.utils import get_client_ip
 
 from .constants import Status
-from .models import Domain, Subscriber
+from .domains import get_domain_name, resolve_domain
+from .models import Subscriber
 
 
 class SubscribeForm(forms.ModelForm):
@@ -44,12 +45,8 @@ class SubscribeForm(forms.ModelForm):
     def subscribe(self, request):
         email = self.cleaned_data.get('email')
 
-        email_name, domain_part = email.rsplit('@', 1)
-        domain_name = '@' + domain_part
-        email_domain, created = Domain.objects.get_or_create(name=domain_name)
-
         subscriber, created = Subscriber.objects.get_or_create(email=email, mailing_list=self.mailing_list, defaults={
-            'domain': email_domain
+            'domain_id': resolve_domain(get_domain_name(email))
         })
         subscriber.status = Status.PENDING
         subscriber.optin_ip_address = get_client_ip(request)
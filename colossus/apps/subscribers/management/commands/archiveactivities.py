@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand
+
+from colossus.apps.subscribers.archive import (
+    archive_activities, get_archive_horizon,
+)
+
+
+class Command(BaseCommand):
+    help = 'Move the old activities to the compressed monthly archives, after adding them to the reports rollups.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--months', type=int, dest='months',
+            help='Archive the activities older than this many months. By default it uses the '
+                 'COLOSSUS_ACTIVITY_ARCHIVE_MONTHS setting.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, dest='batch_size', default=500,
+            help='Number of subscribers archived per transaction.',
+        )
+
+    def handle(self, *args, **options):
+        horizon = get_archive_horizon(options['months'])
+        archived = archive_activities(horizon, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS('Successfully archived %s activities older than %s.' % (
+            archived, horizon.strftime('%Y-%m')
+        )))
@@ -0,0 +1,12 @@
+from django.core.management import BaseCommand
+
+from colossus.apps.subscribers.tracking import process_tracking_buffer
+
+
+class Command(BaseCommand):
+    help = 'Process the buffered open and click tracking events. Meant for the setups without a Celery beat ' \
+           'scheduler running the process_tracking_events_task periodic task.'
+
+    def handle(self, *args, **options):
+        created = process_tracking_buffer()
+        self.stdout.write(self.style.SUCCESS('Successfully created %s activities.' % created))
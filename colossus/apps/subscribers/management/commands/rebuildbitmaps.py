@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from colossus.apps.lists.models import MailingList
+from colossus.apps.subscribers.bitmaps import rebuild_bitmaps
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the bitmaps of the subscribers ids used to evaluate the segments ' \
+           'from the subscribers and their tags.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--list', type=int, action='append', dest='mailing_lists_ids', metavar='MAILING_LIST_ID',
+            help='Only rebuild the given mailing list. Can be used multiple times. By default it rebuilds all lists.',
+        )
+
+    def handle(self, *args, **options):
+        mailing_lists = MailingList.objects.order_by('pk')
+        if options['mailing_lists_ids']:
+            mailing_lists = mailing_lists.filter(pk__in=options['mailing_lists_ids'])
+
+        created = 0
+
+        for mailing_list_id, name in mailing_lists.values_list('pk', 'name'):
+            count = rebuild_bitmaps(mailing_list_id)
+            self.stdout.write('%s: created %s bitmap chunks.' % (name, count))
+            created += count
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt %s bitmap chunks.' % created))
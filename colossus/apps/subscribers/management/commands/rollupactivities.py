@@ -0,0 +1,29 @@
+from django.core.management import BaseCommand
+
+from colossus.apps.lists.models import MailingList
+from colossus.apps.subscribers.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the daily activities rollups used by the lists and campaigns reports ' \
+           'from the activities history.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--list', type=int, action='append', dest='mailing_lists_ids', metavar='MAILING_LIST_ID',
+            help='Only rebuild the given mailing list. Can be used multiple times. By default it rebuilds all lists.',
+        )
+
+    def handle(self, *args, **options):
+        mailing_lists = MailingList.objects.order_by('pk')
+        if options['mailing_lists_ids']:
+            mailing_lists = mailing_lists.filter(pk__in=options['mailing_lists_ids'])
+
+        created = 0
+
+        for mailing_list_id, name in mailing_lists.values_list('pk', 'name'):
+            count = rebuild_rollups(mailing_list_id)
+            self.stdout.write('%s: created %s rollup rows.' % (name, count))
+            created += count
+
+        self.stdout.write(self.style.SUCCESS('Successfully rebuilt %s rollup rows.' % created))
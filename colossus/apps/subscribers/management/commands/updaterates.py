@@ -0,0 +1,33 @@
+from django.core.management import BaseCommand
+
+from colossus.apps.lists.models import MailingList
+from colossus.apps.subscribers.models import Subscriber
+
+
+class Command(BaseCommand):
+    help = 'Recompute the open and click rates of the subscribers and mailing lists ' \
+           'based on their activities.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--list', type=int, action='append', dest='mailing_lists_ids', metavar='MAILING_LIST_ID',
+            help='Only update the given mailing list. Can be used multiple times. By default it updates all lists.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Number of subscribers updated per query.',
+        )
+
+    def handle(self, *args, **options):
+        mailing_lists = MailingList.objects.order_by('pk')
+        if options['mailing_lists_ids']:
+            mailing_lists = mailing_lists.filter(pk__in=options['mailing_lists_ids'])
+
+        updated = 0
+
+        for mailing_list_id, name in mailing_lists.values_list('pk', 'name'):
+            count = Subscriber.objects.update_mailing_list_rates(mailing_list_id, batch_size=options['batch_size'])
+            self.stdout.write('%s: updated rates for %s subscribers.' % (name, count))
+            updated += count
+
+        self.stdout.write(self.style.SUCCESS('Successfully updated rates for %s subscribers.' % updated))
@@ -0,0 +1,19 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:06
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0010_auto_20180825_0042'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='activity',
+            name='date',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='date'),
+        ),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:30
+
+from itertools import islice
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+OPENED = 4
+CLICKED = 5
+
+CAMPAIGN_OPEN = 1
+CAMPAIGN_CLICK = 2
+EMAIL_OPEN = 3
+EMAIL_CLICK = 4
+LINK_CLICK = 5
+
+
+def create_engagements(apps, schema_editor):
+    Activity = apps.get_model('subscribers', 'Activity')
+    Engagement = apps.get_model('subscribers', 'Engagement')
+    sources = (
+        (CAMPAIGN_OPEN, OPENED, 'email__campaign_id'),
+        (CAMPAIGN_CLICK, CLICKED, 'email__campaign_id'),
+        (EMAIL_OPEN, OPENED, 'email_id'),
+        (EMAIL_CLICK, CLICKED, 'email_id'),
+        (LINK_CLICK, CLICKED, 'link_id'),
+    )
+    for engagement_type, activity_type, target_field in sources:
+        rows = Activity.objects \
+            .filter(activity_type=activity_type) \
+            .exclude(**{target_field: None}) \
+            .values_list(target_field, 'subscriber_id') \
+            .order_by() \
+            .distinct() \
+            .iterator()
+        engagements = (
+            Engagement(engagement_type=engagement_type, target_id=target_id, subscriber_id=subscriber_id)
+            for target_id, subscriber_id in rows
+        )
+        batch = list(islice(engagements, 1000))
+        while batch:
+            Engagement.objects.bulk_create(batch)
+            batch = list(islice(engagements, 1000))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0011_activity_date_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Engagement',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('engagement_type', models.PositiveSmallIntegerField(choices=[(1, 'Opened campaign'), (2, 'Clicked campaign'), (3, 'Opened email'), (4, 'Clicked email'), (5, 'Clicked link')], verbose_name='type')),
+                ('target_id', models.PositiveIntegerField(verbose_name='target id')),
+                ('subscriber', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='engagements', to='subscribers.Subscriber')),
+            ],
+            options={
+                'verbose_name': 'engagement',
+                'verbose_name_plural': 'engagements',
+                'db_table': 'colossus_engagements',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='engagement',
+            unique_together={('engagement_type', 'target_id', 'subscriber')},
+        ),
+        migrations.RunPython(create_engagements, migrations.RunPython.noop),
+    ]
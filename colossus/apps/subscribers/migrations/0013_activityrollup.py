@@ -0,0 +1,38 @@
+# Generated by Django 2.1.5 on 2026-10-18 03:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0005_subscriberimport_segments'),
+        ('core', '0001_initial'),
+        ('campaigns', '0005_delivery_shard'),
+        ('subscribers', '0012_engagement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='date')),
+                ('activity_type', models.PositiveSmallIntegerField(choices=[(1, 'Subscribed'), (2, 'Unsubscribed'), (3, 'Was sent'), (4, 'Opened'), (5, 'Clicked'), (6, 'Imported'), (7, 'Cleaned')], verbose_name='type')),
+                ('count', models.IntegerField(default=0, verbose_name='count')),
+                ('campaign', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to='campaigns.Campaign')),
+                ('country', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='activity_rollups', to='core.Country')),
+                ('mailing_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_rollups', to='lists.MailingList')),
+            ],
+            options={
+                'verbose_name': 'activity rollup',
+                'verbose_name_plural': 'activity rollups',
+                'db_table': 'colossus_activity_rollups',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='activityrollup',
+            index_together={('mailing_list', 'date'), ('campaign', 'activity_type')},
+        ),
+    ]
@@ -0,0 +1,82 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+PARTIAL_INDEXES_VENDORS = ('postgresql', 'sqlite')
+
+# (name, columns, condition)
+PARTIAL_INDEXES = [
+    ('colossus_act_campaign_idx', ('campaign_id',), 'campaign_id IS NOT NULL'),
+    ('colossus_act_link_idx', ('link_id', 'subscriber_id'), 'link_id IS NOT NULL'),
+]
+
+
+def create_partial_indexes(apps, schema_editor):
+    """
+    Django 2.1 indexes cannot have a condition. The campaign and the link of
+    the activities are only set on a small fraction of the rows, so their
+    indexes skip the rows without one. The backends without partial indexes
+    get a regular index instead.
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    table = schema_editor.quote_name(Activity._meta.db_table)
+    partial = schema_editor.connection.vendor in PARTIAL_INDEXES_VENDORS
+    for name, columns, condition in PARTIAL_INDEXES:
+        sql = 'CREATE INDEX %s %s ON %s (%s)' % (
+            'IF NOT EXISTS' if partial else '',
+            schema_editor.quote_name(name),
+            table,
+            ', '.join(schema_editor.quote_name(column) for column in columns),
+        )
+        if partial:
+            sql += ' WHERE %s' % condition
+        schema_editor.execute(sql)
+
+
+def drop_partial_indexes(apps, schema_editor):
+    Activity = apps.get_model('subscribers', 'Activity')
+    for name, columns, condition in PARTIAL_INDEXES:
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'table': schema_editor.quote_name(Activity._meta.db_table),
+            'name': schema_editor.quote_name(name),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0013_activityrollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['subscriber', 'activity_type', 'email'], name='colossus_act_subscriber_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activity',
+            index=models.Index(fields=['email', 'activity_type', 'subscriber'], name='colossus_act_email_idx'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='campaign',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='campaigns.Campaign'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='email',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='campaigns.Email'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='link',
+            field=models.ForeignKey(blank=True, db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='campaigns.Link'),
+        ),
+        migrations.AlterField(
+            model_name='activity',
+            name='subscriber',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='activities', to='subscribers.Subscriber'),
+        ),
+        migrations.RunPython(create_partial_indexes, drop_partial_indexes),
+    ]
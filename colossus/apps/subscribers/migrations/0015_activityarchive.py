@@ -0,0 +1,52 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0014_activity_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityArchive',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(help_text='First day of the month.', verbose_name='month')),
+                ('activities_count', models.PositiveIntegerField(default=0, verbose_name='activities count')),
+                ('data', models.BinaryField(verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'activity archive',
+                'verbose_name_plural': 'activity archives',
+                'db_table': 'colossus_activity_archives',
+            },
+        ),
+        migrations.AddField(
+            model_name='subscriber',
+            name='archived_clicked_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='archived clicked count'),
+        ),
+        migrations.AddField(
+            model_name='subscriber',
+            name='archived_opened_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='archived opened count'),
+        ),
+        migrations.AddField(
+            model_name='subscriber',
+            name='archived_sent_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='archived sent count'),
+        ),
+        migrations.AddField(
+            model_name='activityarchive',
+            name='subscriber',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_archives', to='subscribers.Subscriber'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='activityarchive',
+            unique_together={('subscriber', 'month')},
+        ),
+    ]
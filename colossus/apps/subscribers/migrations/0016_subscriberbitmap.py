@@ -0,0 +1,72 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:17
+
+import zlib
+from collections import defaultdict
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Format of the chunks at the time of this migration (see `bitmaps.py`)
+CHUNK_SIZE = 65536
+
+CHUNK_BYTES = CHUNK_SIZE // 8
+
+
+def encode_chunks(subscribers_ids):
+    """
+    :return: Dictionary of chunk: zlib compressed little-endian bitset of the
+             ids of the chunk, for the non-empty chunks
+    """
+    chunks = defaultdict(lambda: bytearray(CHUNK_BYTES))
+    for pk in subscribers_ids:
+        offset = pk % CHUNK_SIZE
+        chunks[pk // CHUNK_SIZE][offset >> 3] |= 1 << (offset & 7)
+    return {chunk: zlib.compress(bytes(data)) for chunk, data in chunks.items()}
+
+
+def create_bitmaps(apps, schema_editor):
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    SubscriberBitmap = apps.get_model('subscribers', 'SubscriberBitmap')
+    ids = defaultdict(list)
+    for mailing_list_id, pk, status in Subscriber.objects.values_list('mailing_list_id', 'pk', 'status').iterator():
+        ids[(mailing_list_id, 'all')].append(pk)
+        ids[(mailing_list_id, 'status:%s' % status)].append(pk)
+    tags = Subscriber.tags.through.objects.values_list('subscriber__mailing_list_id', 'tag_id', 'subscriber_id')
+    for mailing_list_id, tag_id, subscriber_id in tags.iterator():
+        ids[(mailing_list_id, 'tag:%s' % tag_id)].append(subscriber_id)
+    for (mailing_list_id, key), subscribers_ids in ids.items():
+        SubscriberBitmap.objects.bulk_create([
+            SubscriberBitmap(mailing_list_id=mailing_list_id, key=key, chunk=chunk, data=data)
+            for chunk, data in encode_chunks(subscribers_ids).items()
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('lists', '0005_subscriberimport_segments'),
+        ('subscribers', '0015_activityarchive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubscriberBitmap',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=50, verbose_name='key')),
+                ('chunk', models.PositiveIntegerField(verbose_name='chunk')),
+                ('data', models.BinaryField(verbose_name='data')),
+                ('mailing_list', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='subscriber_bitmaps', to='lists.MailingList')),
+            ],
+            options={
+                'verbose_name': 'subscriber bitmap',
+                'verbose_name_plural': 'subscriber bitmaps',
+                'db_table': 'colossus_subscriber_bitmaps',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='subscriberbitmap',
+            unique_together={('mailing_list', 'key', 'chunk')},
+        ),
+        migrations.RunPython(create_bitmaps, migrations.RunPython.noop),
+    ]
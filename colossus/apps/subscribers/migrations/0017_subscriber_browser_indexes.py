@@ -0,0 +1,62 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:22
+
+from django.db import migrations, models
+
+SEARCH_COLUMNS = ('email', 'name')
+
+
+def get_search_index_name(column):
+    return 'colossus_sub_%s_search_idx' % column
+
+
+def create_search_indexes(apps, schema_editor):
+    """
+    Trigram indexes of the uppercase columns compared by the `icontains`
+    lookup on PostgreSQL. The other backends get a case insensitive index on
+    the mailing list and column, used by the prefix search.
+    """
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    table = schema_editor.quote_name(Subscriber._meta.db_table)
+    vendor = schema_editor.connection.vendor
+    if vendor == 'postgresql':
+        schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for column in SEARCH_COLUMNS:
+        name = schema_editor.quote_name(get_search_index_name(column))
+        quoted_column = schema_editor.quote_name(column)
+        if vendor == 'postgresql':
+            sql = 'CREATE INDEX IF NOT EXISTS %s ON %s USING gin (UPPER(%s::text) gin_trgm_ops)' % (
+                name, table, quoted_column
+            )
+        elif vendor == 'sqlite':
+            sql = 'CREATE INDEX IF NOT EXISTS %s ON %s (%s, %s COLLATE NOCASE)' % (
+                name, table, schema_editor.quote_name('mailing_list_id'), quoted_column
+            )
+        else:
+            sql = 'CREATE INDEX %s ON %s (%s, %s)' % (
+                name, table, schema_editor.quote_name('mailing_list_id'), quoted_column
+            )
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    for column in SEARCH_COLUMNS:
+        schema_editor.execute(schema_editor.sql_delete_index % {
+            'table': schema_editor.quote_name(Subscriber._meta.db_table),
+            'name': schema_editor.quote_name(get_search_index_name(column)),
+        })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0016_subscriberbitmap'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='subscriber',
+            index=models.Index(fields=['mailing_list', 'optin_date', 'id'], name='colossus_sub_optin_date_idx'),
+        ),
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,33 @@
+from django.db import migrations
+
+INDEX_NAME = 'colossus_sub_email_lower_idx'
+
+
+def create_email_lower_index(apps, schema_editor):
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        # Expression indexes are not portable, the other backends keep the (email, mailing list) index
+        return
+    schema_editor.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s, LOWER(%s))' % (
+        schema_editor.quote_name(INDEX_NAME),
+        schema_editor.quote_name(Subscriber._meta.db_table),
+        schema_editor.quote_name('mailing_list_id'),
+        schema_editor.quote_name('email'),
+    ))
+
+
+def drop_email_lower_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in ('postgresql', 'sqlite'):
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS %s' % schema_editor.quote_name(INDEX_NAME))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0017_subscriber_browser_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_email_lower_index, drop_email_lower_index),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 2.1.5 on 2026-10-18 04:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('subscribers', '0018_subscriber_email_lower_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrackingEvent',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.TextField(verbose_name='data')),
+            ],
+            options={
+                'verbose_name': 'tracking event',
+                'verbose_name_plural': 'tracking events',
+                'db_table': 'colossus_tracking_events',
+            },
+        ),
+    ]
@@ -1,11 +1,13 @@
 import hashlib
 import uuid
+from itertools import islice
+from typing import Iterable, Iterator, Optional
 from urllib.parse import urlencode
 
 from django.contrib.contenttypes.fields import GenericRelation
 from django.core.mail import EmailMultiAlternatives
-from django.db import models, transaction
-from django.db.models import Count, Q
+from django.db import connections, models, transaction
+from django.db.models import Case, Count, FloatField, Q, Value, When
 from django.template.loader import render_to_string
 from django.urls import reverse
 from django.utils import timezone
@@ -15,12 +17,27 @@ from django.utils.translation import gettext_lazy as _
 
 import html2text
 
+from colossus.apps.campaigns.ledger import (
+    get_sent_emails_ids, remove_subscriber as remove_subscriber_deliveries,
+)
 from colossus.apps.campaigns.models import Campaign, Email, Link
-from colossus.apps.core.models import City, Token
+from colossus.apps.core.models import City, Country, Token
 from colossus.apps.lists.models import MailingList
+from colossus.apps.lists.stats import count_activity, count_status_change
+from colossus.apps.subscribers.archive import load_archived_activities
+from colossus.apps.subscribers.bitmaps import (
+    remove_subscriber as remove_subscriber_bitmaps, set_status,
+)
+from colossus.apps.subscribers.counters import (
+    count_clicks, count_opens, get_subscriber_counts,
+)
+from colossus.apps.subscribers.domains import get_domain_name, resolve_domain
 from colossus.apps.subscribers.exceptions import (
     FormTemplateIsNotEmail, FormTemplateIsNotForm,
 )
+from colossus.apps.subscribers.rollups import (
+    add_to_rollups, count_subscriber_activities, record_activities,
+)
 from colossus.apps.subscribers.tasks import (
     update_click_rate, update_open_rate,
     update_rates_after_subscriber_deletion, update_subscriber_location,
@@ -28,7 +45,7 @@ from colossus.apps.subscribers.tasks import (
 from colossus.utils import get_absolute_url, get_client_ip
 
 from .activities import render_activity
-from .constants import ActivityTypes, Status, TemplateKeys
+from .constants import ActivityTypes, EngagementTypes, Status, TemplateKeys
 from .subscription_settings import SUBSCRIPTION_FORM_TEMPLATE_SETTINGS
 
 
@@ -93,6 +110,104 @@ class SubscriberManager(models.Manager):
         subscriber.save(using=self._db)
         return subscriber
 
+    def search(self, query: str):
+        """
+        Search the subscribers by email address or name, ignoring the case.
+        Any part matches on PostgreSQL, only the beginning on the other
+        backends (see the indexes of the 0017 migration). SQLite drops these
+        indexes when it rebuilds the table: a migration altering the model
+        must create them again.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            return self.filter(Q(email__icontains=query) | Q(name__icontains=query))
+        return self.filter(Q(email__istartswith=query) | Q(name__istartswith=query))
+
+    def update_open_and_click_rate(self, subscribers_ids: Iterable[int], batch_size: int = 500) -> int:
+        """
+        Set-based version of `Subscriber.update_open_and_click_rate`. For each
+        batch of subscribers, the open and click rates are computed with a
+        single grouped aggregate over the activities, plus the archived counts
+        and the emails of the delivery ledger, and saved with a single UPDATE
+        statement.
+
+        :param subscribers_ids: Ids of the subscribers to update. Can be a lazy iterator
+        :param batch_size: Number of subscribers processed per query
+        :return: Number of subscribers updated
+        """
+        updated = 0
+        subscribers_ids = iter(subscribers_ids)
+        batch = list(islice(subscribers_ids, batch_size))
+        while batch:
+            counts = self.filter(pk__in=batch) \
+                .values('pk', 'archived_sent_count', 'archived_opened_count', 'archived_clicked_count') \
+                .order_by('pk') \
+                .annotate(
+                    sent=Count('activities__email_id', distinct=True,
+                               filter=Q(activities__activity_type=ActivityTypes.SENT)),
+                    opened=Count('activities__email_id', distinct=True,
+                                 filter=Q(activities__activity_type=ActivityTypes.OPENED)),
+                    clicked=Count('activities__email_id', distinct=True,
+                                  filter=Q(activities__activity_type=ActivityTypes.CLICKED)),
+                )
+            ledger_emails_ids = get_sent_emails_ids(batch)
+            open_rates = list()
+            click_rates = list()
+            for count in counts:
+                sent = count['sent'] + count['archived_sent_count'] + len(ledger_emails_ids.get(count['pk'], ()))
+                if sent:
+                    open_rate = round((count['opened'] + count['archived_opened_count']) / sent, 4)
+                    click_rate = round((count['clicked'] + count['archived_clicked_count']) / sent, 4)
+                else:
+                    open_rate = click_rate = 0.0
+                open_rates.append(When(pk=count['pk'], then=Value(open_rate)))
+                click_rates.append(When(pk=count['pk'], then=Value(click_rate)))
+            # Subscribers deleted in the meantime fall back to the default value
+            updated += self.filter(pk__in=batch).update(
+                open_rate=Case(*open_rates, default=Value(0.0), output_field=FloatField()),
+                click_rate=Case(*click_rates, default=Value(0.0), output_field=FloatField()),
+            )
+            batch = list(islice(subscribers_ids, batch_size))
+        return updated
+
+    def iter_mailing_list_ids(self, mailing_list_id: int, batch_size: int = 500) -> Iterator[int]:
+        """
+        Iterate over the ids of the subscribers of a mailing list, fetching
+        `batch_size` ids per query by primary key ranges. Unlike a database
+        cursor, it is safe to update the subscribers while iterating.
+        """
+        last_pk = 0
+        while True:
+            ids = list(self.filter(mailing_list_id=mailing_list_id, pk__gt=last_pk)
+                       .order_by('pk')
+                       .values_list('pk', flat=True)[:batch_size])
+            yield from ids
+            if len(ids) < batch_size:
+                break
+            last_pk = ids[-1]
+
+    def update_mailing_list_rates(self, mailing_list_id: int, subscribers_ids: Optional[Iterable[int]] = None,
+                                  batch_size: int = 500) -> int:
+        """
+        Recompute the open and click rates of the subscribers of a mailing
+        list with `update_open_and_click_rate`, and then the rates of the
+        mailing list itself.
+
+        :param mailing_list_id: Id of the mailing list
+        :param subscribers_ids: Ids of the subscribers whose rates may have changed.
+                                Defaults to all the subscribers of the mailing list
+        :param batch_size: Number of subscribers processed per query
+        :return: Number of subscribers updated
+        """
+        if subscribers_ids is None:
+            subscribers_ids = self.iter_mailing_list_ids(mailing_list_id, batch_size)
+        updated = self.update_open_and_click_rate(subscribers_ids, batch_size)
+        try:
+            mailing_list = MailingList.objects.only('pk').get(pk=mailing_list_id)
+        except MailingList.DoesNotExist:
+            return updated
+        mailing_list.update_open_and_click_rate()
+        return updated
+
 
 class Subscriber(models.Model):
     uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
@@ -129,6 +244,10 @@ class Subscriber(models.Model):
         related_name='subscribers',
     )
     last_sent = models.DateTimeField(_('last campaign sent date'), null=True, blank=True)
+    # Distinct emails sent, opened and clicked within the archived activities (see `archive.py`)
+    archived_sent_count = models.PositiveIntegerField(_('archived sent count'), default=0, editable=False)
+    archived_opened_count = models.PositiveIntegerField(_('archived opened count'), default=0, editable=False)
+    archived_clicked_count = models.PositiveIntegerField(_('archived clicked count'), default=0, editable=False)
     tags = models.ManyToManyField(Tag, related_name='subscribers', verbose_name=_('tags'), blank=True)
     tokens = GenericRelation(Token)
 
@@ -141,6 +260,9 @@ class Subscriber(models.Model):
         verbose_name_plural = _('subscribers')
         unique_together = (('email', 'mailing_list',),)
         db_table = 'colossus_subscribers'
+        indexes = [
+            models.Index(fields=['mailing_list', 'optin_date', 'id'], name='colossus_sub_optin_date_idx'),
+        ]
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -159,28 +281,39 @@ class Subscriber(models.Model):
 
     def save(self, force_insert=False, force_update=False, using=None, update_fields=None):
         if self.__email != self.email:
-            email_name, domain_part = self.email.rsplit('@', 1)
-            domain_name = '@' + domain_part
-            email_domain, created = Domain.objects.get_or_create(name=domain_name)
-            self.domain = email_domain
+            self.domain_id = resolve_domain(get_domain_name(self.email))
             if update_fields is not None and 'domain' not in update_fields:
                 update_fields.append('domain')
             self.__email = self.email
 
-        super().save(force_insert, force_update, using, update_fields)
+        adding = self._state.adding
+        with transaction.atomic(using=using):
+            super().save(force_insert, force_update, using, update_fields)
+            if adding:
+                set_status(self.mailing_list_id, [self.pk], self.status, previous_status=self.status)
+            elif self.__status != self.status:
+                set_status(self.mailing_list_id, [self.pk], self.status, previous_status=self.__status)
+
+        if adding:
+            count_status_change(self.mailing_list_id, None, self.status)
+        elif self.__status != self.status:
+            count_status_change(self.mailing_list_id, self.__status, self.status)
 
         if self.__status != self.status:
             self.mailing_list.update_subscribers_count()
             self.__status = self.status
 
     def delete(self, using=None, keep_parents=False):
-        email_ids = list(self.activities.filter(activity_type=ActivityTypes.SENT).values_list('email_id', flat=True))
-        link_ids = list(self.activities.filter(activity_type=ActivityTypes.CLICKED)
-                        .values_list('link_id', flat=True)
-                        .order_by('link_id')
-                        .distinct())
-        super().delete(using, keep_parents)
-        update_rates_after_subscriber_deletion.delay(self.mailing_list_id, email_ids, link_ids)
+        rollups_counts = count_subscriber_activities(self.pk)
+        remove_subscriber_deliveries(self.pk)
+        counts = get_subscriber_counts(self.pk)
+        tags_ids = list(self.tags.values_list('pk', flat=True))
+        with transaction.atomic(using=using):
+            add_to_rollups({key: -count for key, count in rollups_counts.items()})
+            remove_subscriber_bitmaps(self.mailing_list_id, self.pk, self.status, tags_ids)
+            super().delete(using, keep_parents)
+        count_status_change(self.mailing_list_id, self.status, None)
+        update_rates_after_subscriber_deletion.delay(self.mailing_list_id, counts)
 
     def get_gravatar_url(self):
         email = self.email.lower().encode('utf-8')
@@ -236,6 +369,8 @@ class Subscriber(models.Model):
             'activity_type': activity_type
         })
         activity = Activity.objects.create(**activity_kwargs)
+        record_activities([activity])
+        count_activity(self.mailing_list_id, activity_type)
         return activity
 
     def get_activities(self, **filter_kwargs):
@@ -269,10 +404,12 @@ class Subscriber(models.Model):
             update_subscriber_location.delay(ip_address, self.pk)
         else:
             self.create_activity(ActivityTypes.OPENED, email=email, location=self.location)
+        count_opens([(self.pk, email.pk, email.campaign_id)])
         update_open_rate.delay(self.pk, email.pk)
 
     def click(self, link, ip_address=None):
         self.create_activity(ActivityTypes.CLICKED, link=link, email=link.email, ip_address=ip_address)
+        count_clicks([(self.pk, link.pk, link.email_id, link.email.campaign_id)])
         if ip_address is not None:
             self.last_seen_date = timezone.now()
             self.last_seen_ip_address = ip_address
@@ -285,13 +422,22 @@ class Subscriber(models.Model):
             update_subscriber_location.delay(ip_address, self.pk)
         update_click_rate.delay(self.pk, link.pk)
 
+    def count_sent(self, sent_activities_count: int) -> int:
+        """
+        :param sent_activities_count: Number of distinct emails of the SENT activities
+        :return: Number of emails sent, including the archived ones and the delivery ledger
+        """
+        ledger_emails_ids = get_sent_emails_ids([self.pk]).get(self.pk, ())
+        return sent_activities_count + self.archived_sent_count + len(ledger_emails_ids)
+
     def update_open_rate(self) -> float:
         count = self.activities.values('email_id', 'activity_type').aggregate(
             sent=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.SENT)),
             opened=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.OPENED)),
         )
+        sent = self.count_sent(count['sent'])
         try:
-            self.open_rate = round(count['opened'] / count['sent'], 4)
+            self.open_rate = round((count['opened'] + self.archived_opened_count) / sent, 4)
         except ZeroDivisionError:
             self.open_rate = 0.0
         finally:
@@ -303,8 +449,9 @@ class Subscriber(models.Model):
             sent=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.SENT)),
             clicked=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.CLICKED)),
         )
+        sent = self.count_sent(count['sent'])
         try:
-            self.click_rate = round(count['clicked'] / count['sent'], 4)
+            self.click_rate = round((count['clicked'] + self.archived_clicked_count) / sent, 4)
         except ZeroDivisionError:
             self.click_rate = 0.0
         finally:
@@ -317,9 +464,10 @@ class Subscriber(models.Model):
             opened=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.OPENED)),
             clicked=Count('email_id', distinct=True, filter=Q(activity_type=ActivityTypes.CLICKED)),
         )
+        sent = self.count_sent(count['sent'])
         try:
-            self.open_rate = round(count['opened'] / count['sent'], 4)
-            self.click_rate = round(count['clicked'] / count['sent'], 4)
+            self.open_rate = round((count['opened'] + self.archived_opened_count) / sent, 4)
+            self.click_rate = round((count['clicked'] + self.archived_clicked_count) / sent, 4)
         except ZeroDivisionError:
             self.open_rate = 0.0
             self.click_rate = 0.0
@@ -328,7 +476,7 @@ class Subscriber(models.Model):
 
 class Activity(models.Model):
     activity_type = models.PositiveSmallIntegerField(_('type'), choices=ActivityTypes.CHOICES)
-    date = models.DateTimeField(_('date'), auto_now_add=True)
+    date = models.DateTimeField(_('date'), default=timezone.now)
     description = models.TextField(_('description'), blank=True)
     ip_address = models.GenericIPAddressField(_('confirm IP address'), unpack_ipv4=True, blank=True, null=True)
     location = models.ForeignKey(
@@ -338,10 +486,29 @@ class Activity(models.Model):
         verbose_name=_('location'),
         related_name='activities',
     )
-    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='activities')
-    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, null=True, blank=True, related_name='activities')
-    email = models.ForeignKey(Email, on_delete=models.CASCADE, null=True, blank=True, related_name='activities')
-    link = models.ForeignKey(Link, on_delete=models.CASCADE, null=True, blank=True, related_name='activities')
+    # The foreign keys are indexed by the composite indexes below, and the
+    # campaign and link by partial indexes created by the 0014 migration.
+    # SQLite drops these when it rebuilds the table: a migration altering the
+    # model must create them again
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='activities', db_index=False)
+    campaign = models.ForeignKey(
+        Campaign,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='activities',
+        db_index=False
+    )
+    email = models.ForeignKey(
+        Email,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='activities',
+        db_index=False
+    )
+    link = models.ForeignKey(Link, on_delete=models.CASCADE, null=True, blank=True, related_name='activities',
+                             db_index=False)
 
     __cached_html = ''
 
@@ -349,6 +516,13 @@ class Activity(models.Model):
         verbose_name = _('activity')
         verbose_name_plural = _('activities')
         db_table = 'colossus_activities'
+        indexes = [
+            # Activities of the subscribers, per type and email: rates, forced opens, locations
+            models.Index(fields=['subscriber', 'activity_type', 'email'], name='colossus_act_subscriber_idx'),
+            # Activities of the emails, per type, counting the subscribers: opens and clicks counters, SENT
+            # activities of the deliveries
+            models.Index(fields=['email', 'activity_type', 'subscriber'], name='colossus_act_email_idx'),
+        ]
 
     @property
     def is_subscribed(self):
@@ -375,6 +549,108 @@ class Activity(models.Model):
         return self.date.strftime('%b %d, %Y %H:%M')
 
 
+class Engagement(models.Model):
+    """
+    First open or click of a subscriber on a campaign, an email or a link.
+    Used to increment the unique opens and clicks counters only once per
+    subscriber, without counting the distinct subscribers of the activities.
+    The target is the campaign, email or link id, depending on the type.
+    """
+    engagement_type = models.PositiveSmallIntegerField(_('type'), choices=EngagementTypes.CHOICES)
+    target_id = models.PositiveIntegerField(_('target id'))
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='engagements')
+
+    class Meta:
+        verbose_name = _('engagement')
+        verbose_name_plural = _('engagements')
+        db_table = 'colossus_engagements'
+        unique_together = (('engagement_type', 'target_id', 'subscriber'),)
+
+
+class ActivityRollup(models.Model):
+    """
+    Number of activities of a type per mailing list, campaign, day and
+    country, maintained by `rollups.py`. A key may be spread over several
+    rows, so the counts must always be summed.
+    """
+    mailing_list = models.ForeignKey(MailingList, on_delete=models.CASCADE, related_name='activity_rollups')
+    campaign = models.ForeignKey(Campaign, on_delete=models.CASCADE, null=True, related_name='activity_rollups')
+    date = models.DateField(_('date'))
+    activity_type = models.PositiveSmallIntegerField(_('type'), choices=ActivityTypes.CHOICES)
+    country = models.ForeignKey(Country, on_delete=models.SET_NULL, null=True, related_name='activity_rollups')
+    count = models.IntegerField(_('count'), default=0)
+
+    class Meta:
+        verbose_name = _('activity rollup')
+        verbose_name_plural = _('activity rollups')
+        db_table = 'colossus_activity_rollups'
+        index_together = (('mailing_list', 'date'), ('campaign', 'activity_type'))
+
+
+class ActivityArchive(models.Model):
+    """
+    Activities of a subscriber within a month, moved out of the activities
+    table by `archive.py`. The activities are stored column by column, as a
+    zlib compressed JSON document.
+    """
+    subscriber = models.ForeignKey(Subscriber, on_delete=models.CASCADE, related_name='activity_archives')
+    month = models.DateField(_('month'), help_text=_('First day of the month.'))
+    activities_count = models.PositiveIntegerField(_('activities count'), default=0)
+    data = models.BinaryField(_('data'))
+
+    class Meta:
+        verbose_name = _('activity archive')
+        verbose_name_plural = _('activity archives')
+        db_table = 'colossus_activity_archives'
+        unique_together = (('subscriber', 'month'),)
+
+    def __str__(self):
+        return '%s %s' % (self.subscriber_id, self.month.strftime('%Y-%m'))
+
+    def get_activities(self):
+        """
+        :return: List of unsaved `Activity` instances, most recent first
+        """
+        return load_archived_activities(self)
+
+
+class SubscriberBitmap(models.Model):
+    """
+    Chunk of a bitmap of the subscribers ids of a mailing list, maintained by
+    `bitmaps.py`. The chunk holds the ids from `chunk * CHUNK_SIZE`, as zlib
+    compressed bytes.
+    """
+    mailing_list = models.ForeignKey(MailingList, on_delete=models.CASCADE, related_name='subscriber_bitmaps')
+    key = models.CharField(_('key'), max_length=50)
+    chunk = models.PositiveIntegerField(_('chunk'))
+    data = models.BinaryField(_('data'))
+
+    class Meta:
+        verbose_name = _('subscriber bitmap')
+        verbose_name_plural = _('subscriber bitmaps')
+        db_table = 'colossus_subscriber_bitmaps'
+        unique_together = (('mailing_list', 'key', 'chunk'),)
+
+    def __str__(self):
+        return '%s %s %s' % (self.mailing_list_id, self.key, self.chunk)
+
+
+class TrackingEvent(models.Model):
+    """
+    Open or click tracking event waiting to be processed, appended by the
+    `DatabaseTrackingBuffer` of `tracking.py`.
+    """
+    data = models.TextField(_('data'))
+
+    class Meta:
+        verbose_name = _('tracking event')
+        verbose_name_plural = _('tracking events')
+        db_table = 'colossus_tracking_events'
+
+    def __str__(self):
+        return str(self.pk)
+
+
 class SubscriptionFormTemplate(models.Model):
     key = models.CharField(_('key'), choices=TemplateKeys.CHOICES, max_length=30, db_index=True)
     mailing_list = models.ForeignKey(
@@ -0,0 +1,323 @@
+"""
+Daily engagement rollups of the activities.
+
+The list and campaign reports count the activities of a type per day or per
+country. Instead of scanning the activities on every page view, the counts
+are kept in `ActivityRollup` rows, one per (mailing list, campaign, day,
+activity type, country), incremented with F-expressions whenever activities
+are written. The cost of the reports does not depend on the size of the
+history.
+
+The campaign and the country are nullable, so there is no unique constraint
+on the key and concurrent writers may create several rows for the same key.
+The counts are always read with `Sum`. `rebuild_rollups` recomputes the rows
+from the activities and the delivery ledger (see the `rollupactivities`
+command), except for the archived months, whose rollups are the only remaining
+counts (see `archive.py`). The counts of a deleted subscriber, archived months
+included, are subtracted from the rows.
+"""
+import datetime
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from colossus.apps.campaigns.constants import DeliveryStatus
+from colossus.apps.campaigns.ledger import BUCKET_SIZE, decode_entries
+from colossus.apps.subscribers.constants import ActivityTypes
+
+# (mailing_list_id, campaign_id, date, activity_type, country_id)
+RollupKey = Tuple[int, Optional[int], datetime.date, int, Optional[int]]
+
+
+def _get_cached(activity, field_name: str):
+    field = activity._meta.get_field(field_name)
+    if field.is_cached(activity):
+        return field.get_cached_value(activity)
+    return None
+
+
+def count_activities(activities: Iterable) -> Dict[RollupKey, int]:
+    """
+    Count unsaved or saved activities per rollup key, with at most one query
+    per related model to resolve the mailing lists, campaigns and countries
+    not already loaded in the activities.
+    """
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    Email = apps.get_model('campaigns', 'Email')
+    City = apps.get_model('core', 'City')
+
+    activities = list(activities)
+    mailing_lists_ids: Dict[int, int] = dict()
+    campaigns_ids: Dict[int, int] = dict()
+    countries_ids: Dict[int, Optional[int]] = dict()
+    for activity in activities:
+        subscriber = _get_cached(activity, 'subscriber')
+        if subscriber is not None:
+            mailing_lists_ids[activity.subscriber_id] = subscriber.mailing_list_id
+        email = _get_cached(activity, 'email')
+        if email is not None:
+            campaigns_ids[activity.email_id] = email.campaign_id
+        location = _get_cached(activity, 'location')
+        if location is not None:
+            countries_ids[activity.location_id] = location.country_id
+
+    missing_subscribers = {a.subscriber_id for a in activities} - set(mailing_lists_ids.keys())
+    if missing_subscribers:
+        mailing_lists_ids.update(
+            Subscriber.objects.filter(pk__in=missing_subscribers).values_list('pk', 'mailing_list_id')
+        )
+    missing_emails = {a.email_id for a in activities if a.email_id is not None} - set(campaigns_ids.keys())
+    if missing_emails:
+        campaigns_ids.update(Email.objects.filter(pk__in=missing_emails).values_list('pk', 'campaign_id'))
+    missing_locations = {a.location_id for a in activities if a.location_id is not None} - set(countries_ids.keys())
+    if missing_locations:
+        countries_ids.update(City.objects.filter(pk__in=missing_locations).values_list('pk', 'country_id'))
+
+    counts: Dict[RollupKey, int] = Counter()
+    for activity in activities:
+        mailing_list_id = mailing_lists_ids.get(activity.subscriber_id)
+        if mailing_list_id is None:
+            # Subscriber deleted in the meantime
+            continue
+        campaign_id = activity.campaign_id
+        if campaign_id is None and activity.email_id is not None:
+            campaign_id = campaigns_ids.get(activity.email_id)
+        date = timezone.localdate(activity.date)
+        country_id = countries_ids.get(activity.location_id) if activity.location_id is not None else None
+        counts[(mailing_list_id, campaign_id, date, activity.activity_type, country_id)] += 1
+    return counts
+
+
+def count_activities_queryset(queryset) -> Dict[RollupKey, int]:
+    """
+    Count the activities of a queryset per rollup key with a single grouped
+    query.
+    """
+    rows = queryset \
+        .annotate(
+            rollup_mailing_list=F('subscriber__mailing_list_id'),
+            rollup_campaign=Coalesce('campaign_id', 'email__campaign_id'),
+            rollup_date=TruncDate('date'),
+            rollup_country=F('location__country_id'),
+        ) \
+        .values('rollup_mailing_list', 'rollup_campaign', 'rollup_date', 'activity_type', 'rollup_country') \
+        .order_by() \
+        .annotate(total=Count('id'))
+    return {
+        (row['rollup_mailing_list'], row['rollup_campaign'], row['rollup_date'], row['activity_type'],
+         row['rollup_country']): row['total']
+        for row in rows
+    }
+
+
+def count_deliveries_queryset(queryset) -> Dict[RollupKey, int]:
+    """
+    Count the emails sent recorded in the `DeliveryLedger` rows of a queryset
+    per rollup key, as SENT activities without a country, the same way they
+    are added to the rollups during the delivery.
+    """
+    rows = queryset.values_list('email__campaign__mailing_list_id', 'email__campaign_id', 'date', 'statuses')
+    counts: Dict[RollupKey, int] = Counter()
+    for mailing_list_id, campaign_id, date, statuses in rows.iterator():
+        sent_count = bytes(statuses).count(DeliveryStatus.SENT)
+        if mailing_list_id is not None and sent_count:
+            counts[(mailing_list_id, campaign_id, timezone.localdate(date), ActivityTypes.SENT, None)] += sent_count
+    return counts
+
+
+def count_subscriber_activities(subscriber_id: int) -> Dict[RollupKey, int]:
+    """
+    Count the activities of a subscriber per rollup key, including its
+    archived activities and its deliveries recorded in the ledger. Meant to
+    be called before the subscriber is deleted, to subtract its counts from
+    the rollups.
+    """
+    from colossus.apps.subscribers.archive import decode_activities
+    Activity = apps.get_model('subscribers', 'Activity')
+    ActivityArchive = apps.get_model('subscribers', 'ActivityArchive')
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    counts = Counter(count_activities_queryset(Activity.objects.filter(subscriber_id=subscriber_id)))
+    archived_activities = [
+        Activity(subscriber_id=subscriber_id, **values)
+        for archive in ActivityArchive.objects.filter(subscriber_id=subscriber_id).only('data')
+        for values in decode_activities(archive.data)
+    ]
+    counts.update(count_activities(archived_activities))
+    ledgers = DeliveryLedger.objects \
+        .filter(bucket=subscriber_id // BUCKET_SIZE) \
+        .select_related('email__campaign') \
+        .only('date', 'subscribers_ids', 'statuses', 'email__campaign__mailing_list_id')
+    for ledger in ledgers:
+        campaign = ledger.email.campaign
+        if campaign.mailing_list_id is not None and (subscriber_id, DeliveryStatus.SENT) in decode_entries(ledger):
+            date = timezone.localdate(ledger.date)
+            counts[(campaign.mailing_list_id, campaign.pk, date, ActivityTypes.SENT, None)] += 1
+    return counts
+
+
+def add_to_rollups(counts: Dict[RollupKey, int]):
+    """
+    Increment (or decrement, with negative counts) the rollup rows, creating
+    the missing ones.
+    """
+    ActivityRollup = apps.get_model('subscribers', 'ActivityRollup')
+    with transaction.atomic():
+        for (mailing_list_id, campaign_id, date, activity_type, country_id), count in counts.items():
+            if not count:
+                continue
+            updated = ActivityRollup.objects \
+                .filter(mailing_list_id=mailing_list_id,
+                        campaign_id=campaign_id,
+                        date=date,
+                        activity_type=activity_type,
+                        country_id=country_id) \
+                .order_by('pk')[:1] \
+                .values_list('pk', flat=True)
+            rollup_id = next(iter(updated), None)
+            if rollup_id is not None:
+                ActivityRollup.objects.filter(pk=rollup_id).update(count=F('count') + count)
+            else:
+                ActivityRollup.objects.create(mailing_list_id=mailing_list_id,
+                                              campaign_id=campaign_id,
+                                              date=date,
+                                              activity_type=activity_type,
+                                              country_id=country_id,
+                                              count=count)
+
+
+def record_activities(activities: Iterable):
+    """
+    Add newly created activities to the rollups.
+    """
+    add_to_rollups(count_activities(activities))
+
+
+def move_activities(queryset, update_kwargs: dict) -> int:
+    """
+    Update the activities of a queryset, moving their counts to the new
+    rollup keys (e.g. when their location is resolved).
+
+    :return: Number of activities updated
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    with transaction.atomic():
+        activities_ids = list(queryset.values_list('pk', flat=True))
+        if not activities_ids:
+            return 0
+        activities = Activity.objects.filter(pk__in=activities_ids)
+        previous_counts = count_activities_queryset(activities)
+        updated = activities.update(**update_kwargs)
+        counts = Counter(count_activities_queryset(activities))
+        counts.subtract(previous_counts)
+        add_to_rollups(counts)
+    return updated
+
+
+def _get_start_datetime(date: datetime.date) -> datetime.datetime:
+    return timezone.make_aware(datetime.datetime.combine(date, datetime.time()))
+
+
+def rebuild_rollups(mailing_list_id: Optional[int] = None, start: Optional[datetime.date] = None,
+                    end: Optional[datetime.date] = None) -> int:
+    """
+    Recompute the rollup rows from the activities and the delivery ledger, for
+    all the mailing lists or a single one. The days of the archived months are
+    always kept.
+
+    :param start: First day to recompute, by default the first day not archived
+    :param end: Day after the last day to recompute, by default no limit
+    :return: Number of rollup rows created
+    """
+    Activity = apps.get_model('subscribers', 'Activity')
+    ActivityArchive = apps.get_model('subscribers', 'ActivityArchive')
+    ActivityRollup = apps.get_model('subscribers', 'ActivityRollup')
+    DeliveryLedger = apps.get_model('campaigns', 'DeliveryLedger')
+    activities = Activity.objects.all()
+    ledgers = DeliveryLedger.objects.all()
+    rollups = ActivityRollup.objects.all()
+    last_archived_month = ActivityArchive.objects.aggregate(month=Max('month'))['month']
+    if last_archived_month is not None:
+        archived_until = (last_archived_month + datetime.timedelta(days=32)).replace(day=1)
+        start = max(start, archived_until) if start is not None else archived_until
+    if start is not None:
+        activities = activities.filter(date__gte=_get_start_datetime(start))
+        ledgers = ledgers.filter(date__gte=_get_start_datetime(start))
+        rollups = rollups.filter(date__gte=start)
+    if end is not None:
+        activities = activities.filter(date__lt=_get_start_datetime(end))
+        ledgers = ledgers.filter(date__lt=_get_start_datetime(end))
+        rollups = rollups.filter(date__lt=end)
+    if mailing_list_id is not None:
+        activities = activities.filter(subscriber__mailing_list_id=mailing_list_id)
+        ledgers = ledgers.filter(email__campaign__mailing_list_id=mailing_list_id)
+        rollups = rollups.filter(mailing_list_id=mailing_list_id)
+    counts = Counter(count_activities_queryset(activities))
+    counts.update(count_deliveries_queryset(ledgers))
+    new_rollups: List = [
+        ActivityRollup(mailing_list_id=key[0],
+                       campaign_id=key[1],
+                       date=key[2],
+                       activity_type=key[3],
+                       country_id=key[4],
+                       count=count)
+        for key, count in counts.items()
+    ]
+    with transaction.atomic():
+        rollups.delete()
+        ActivityRollup.objects.bulk_create(new_rollups, batch_size=1000)
+    return len(new_rollups)
+
+
+def get_daily_counts(mailing_list_id: int, activity_types: Iterable[int],
+                     since: datetime.date) -> Dict[datetime.date, Dict[int, int]]:
+    """
+    :return: The number of activities of each type per day since the given
+             date (inclusive), for the days with any activity
+    """
+    ActivityRollup = apps.get_model('subscribers', 'ActivityRollup')
+    rows = ActivityRollup.objects \
+        .filter(mailing_list_id=mailing_list_id, activity_type__in=activity_types, date__gte=since) \
+        .values('date', 'activity_type') \
+        .order_by() \
+        .annotate(total=Sum('count'))
+    counts: Dict[datetime.date, Dict[int, int]] = dict()
+    for row in rows:
+        counts.setdefault(row['date'], dict())[row['activity_type']] = row['total']
+    return counts
+
+
+def get_activity_counts(activity_types: Iterable[int], **filters) -> Dict[int, int]:
+    """
+    :param filters: Lookups on the rollup rows, e.g. `campaign_id` or `date__gte`
+    :return: The number of activities of each type, zero when there is none
+    """
+    ActivityRollup = apps.get_model('subscribers', 'ActivityRollup')
+    activity_types = list(activity_types)
+    rows = ActivityRollup.objects \
+        .filter(activity_type__in=activity_types, **filters) \
+        .values('activity_type') \
+        .order_by() \
+        .annotate(total=Sum('count'))
+    counts = dict.fromkeys(activity_types, 0)
+    counts.update((row['activity_type'], row['total']) for row in rows)
+    return counts
+
+
+def get_countries_counts(activity_type: int, **filters):
+    """
+    :param filters: Lookups on the rollup rows, e.g. `campaign_id`
+    :return: Queryset of dictionaries with the `country__code`, `country__name`
+             and `total` number of activities, ordered by the total
+    """
+    ActivityRollup = apps.get_model('subscribers', 'ActivityRollup')
+    return ActivityRollup.objects \
+        .filter(activity_type=activity_type, **filters) \
+        .values('country__code', 'country__name') \
+        .annotate(total=Sum('count')) \
+        .filter(total__gt=0) \
+        .order_by('-total')
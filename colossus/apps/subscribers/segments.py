@@ -0,0 +1,191 @@
+"""
+Segments of the subscribers of a mailing list.
+
+A segment is an expression combining conditions with AND, OR, NOT and
+parentheses, for example:
+
+    tag:customers AND NOT (status:unsubscribed OR opened:12)
+
+The conditions are:
+
+- `tag:<tag name>`: the subscribers with the tag. Tag names with spaces or
+  punctuation are written between double quotes, e.g. `tag:"VIP customers"`,
+  escaping the double quotes and backslashes of the name with a backslash
+- `status:<pending|subscribed|unsubscribed|cleaned>`: the subscribers with the status
+- `opened:<campaign id>`: the subscribers who opened the campaign
+- `clicked:<campaign id>`: the subscribers who clicked a link of the campaign
+
+The tags and statuses are read from the bitmaps of the list (see `bitmaps.py`)
+and the campaigns engagements from the engagements table, and the expression
+is evaluated with bitwise operations. NOT is relative to all the subscribers
+of the list.
+"""
+import re
+from typing import Dict, List, Optional, Tuple
+
+from django.apps import apps
+from django.utils.translation import gettext
+
+from colossus.apps.subscribers.bitmaps import (
+    ALL_KEY, Bitmap, get_status_key, get_tag_key, load_bitmaps,
+)
+from colossus.apps.subscribers.constants import EngagementTypes, Status
+from colossus.apps.subscribers.exceptions import InvalidSegment
+
+TOKEN_REGEX = re.compile(
+    r'\s*(?:(?P<paren>[()])|(?P<name>[a-z]+):(?:"(?P<quoted>(?:[^"\\]|\\.)*)"|(?P<value>[\w-]+))|(?P<operator>\w+))',
+    re.IGNORECASE
+)
+
+ESCAPE_REGEX = re.compile(r'\\(.)')
+
+STATUSES = {
+    'pending': Status.PENDING,
+    'subscribed': Status.SUBSCRIBED,
+    'unsubscribed': Status.UNSUBSCRIBED,
+    'cleaned': Status.CLEANED,
+}
+
+ENGAGEMENT_TYPES = {
+    'opened': EngagementTypes.CAMPAIGN_OPEN,
+    'clicked': EngagementTypes.CAMPAIGN_CLICK,
+}
+
+OPERATORS = ('AND', 'OR', 'NOT')
+
+# (kind, value) where kind is `(`, `)`, an operator or a condition name
+Token = Tuple[str, str]
+
+
+def tokenize(expression: str) -> List[Token]:
+    tokens: List[Token] = list()
+    position = 0
+    expression = expression.rstrip()
+    while position < len(expression):
+        match = TOKEN_REGEX.match(expression, position)
+        if match is None:
+            raise InvalidSegment(gettext('Invalid segment near "%s".') % expression[position:].strip()[:20])
+        if match.group('paren'):
+            tokens.append((match.group('paren'), ''))
+        elif match.group('name'):
+            value = match.group('value')
+            if value is None:
+                value = ESCAPE_REGEX.sub(r'\1', match.group('quoted'))
+            tokens.append((match.group('name').lower(), value))
+        elif match.group('operator').upper() in OPERATORS:
+            tokens.append((match.group('operator').upper(), ''))
+        else:
+            raise InvalidSegment(gettext('Invalid segment near "%s".') % match.group('operator'))
+        position = match.end()
+    return tokens
+
+
+class Segment:
+    """
+    Parsed segment expression of a mailing list.
+
+    The expression is parsed into a tree of tuples: ('AND', left, right),
+    ('OR', left, right), ('NOT', operand) and (key,) for the bitmaps or
+    ('engagement', type, campaign id) for the campaigns engagements.
+    """
+    def __init__(self, expression: str, mailing_list):
+        self.expression = expression
+        self.mailing_list = mailing_list
+        self.tokens = tokenize(expression)
+        self.position = 0
+        if not self.tokens:
+            raise InvalidSegment(gettext('The segment is empty.'))
+        self.tree = self.parse_or()
+        if self.position < len(self.tokens):
+            name, value = self.tokens[self.position]
+            raise InvalidSegment(gettext('Unexpected "%s" in the segment.') % (
+                '%s:%s' % (name, value) if value else name))
+
+    def peek(self) -> Optional[str]:
+        if self.position < len(self.tokens):
+            return self.tokens[self.position][0]
+        return None
+
+    def parse_or(self) -> tuple:
+        node = self.parse_and()
+        while self.peek() == 'OR':
+            self.position += 1
+            node = ('OR', node, self.parse_and())
+        return node
+
+    def parse_and(self) -> tuple:
+        node = self.parse_not()
+        while self.peek() == 'AND':
+            self.position += 1
+            node = ('AND', node, self.parse_not())
+        return node
+
+    def parse_not(self) -> tuple:
+        if self.peek() == 'NOT':
+            self.position += 1
+            return ('NOT', self.parse_not())
+        if self.peek() == '(':
+            self.position += 1
+            node = self.parse_or()
+            if self.peek() != ')':
+                raise InvalidSegment(gettext('Missing closing parenthesis in the segment.'))
+            self.position += 1
+            return node
+        if self.peek() is None:
+            raise InvalidSegment(gettext('Incomplete segment.'))
+        name, value = self.tokens[self.position]
+        self.position += 1
+        return self.parse_condition(name, value)
+
+    def parse_condition(self, name: str, value: str) -> tuple:
+        Tag = apps.get_model('subscribers', 'Tag')
+        if name == 'tag':
+            tag = Tag.objects.filter(mailing_list=self.mailing_list, name=value).only('pk').first()
+            if tag is None:
+                raise InvalidSegment(gettext('Unknown tag "%s".') % value)
+            return (get_tag_key(tag.pk),)
+        if name == 'status':
+            if value.lower() not in STATUSES:
+                raise InvalidSegment(gettext('Unknown status "%s".') % value)
+            return (get_status_key(STATUSES[value.lower()]),)
+        if name in ENGAGEMENT_TYPES:
+            if not value.isdigit():
+                raise InvalidSegment(gettext('Invalid campaign id "%s".') % value)
+            return ('engagement', ENGAGEMENT_TYPES[name], int(value))
+        raise InvalidSegment(gettext('Unknown condition "%s".') % name)
+
+    def get_keys(self, node: tuple) -> List[str]:
+        if node[0] in OPERATORS:
+            return [key for operand in node[1:] for key in self.get_keys(operand)]
+        if node[0] == 'engagement':
+            return list()
+        return [node[0]]
+
+    def load_engagement(self, engagement_type: int, campaign_id: int) -> Bitmap:
+        Engagement = apps.get_model('subscribers', 'Engagement')
+        subscribers_ids = Engagement.objects \
+            .filter(engagement_type=engagement_type, target_id=campaign_id) \
+            .values_list('subscriber_id', flat=True)
+        return Bitmap.from_ids(subscribers_ids.iterator())
+
+    def evaluate_node(self, node: tuple, bitmaps: Dict[str, Bitmap]) -> Bitmap:
+        if node[0] == 'AND':
+            return self.evaluate_node(node[1], bitmaps) & self.evaluate_node(node[2], bitmaps)
+        if node[0] == 'OR':
+            return self.evaluate_node(node[1], bitmaps) | self.evaluate_node(node[2], bitmaps)
+        if node[0] == 'NOT':
+            return bitmaps[ALL_KEY] - self.evaluate_node(node[1], bitmaps)
+        if node[0] == 'engagement':
+            return self.load_engagement(node[1], node[2]) & bitmaps[ALL_KEY]
+        return bitmaps[node[0]]
+
+    def evaluate(self, *keys: str) -> Bitmap:
+        """
+        :param keys: Keys of other bitmaps of the list intersected with the segment
+        :return: Bitmap of the ids of the subscribers of the segment
+        """
+        bitmaps = load_bitmaps(self.mailing_list.pk, [ALL_KEY, *keys, *self.get_keys(self.tree)])
+        bitmap = self.evaluate_node(self.tree, bitmaps)
+        for key in keys:
+            bitmap &= bitmaps[key]
+        return bitmap
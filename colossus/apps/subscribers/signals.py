@@ -0,0 +1,70 @@
+import logging
+
+from django.db import DatabaseError
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from celery.signals import worker_process_init
+
+from colossus.apps.subscribers.bitmaps import add_ids, get_tag_key, remove_ids
+from colossus.apps.subscribers.domains import domain_cache
+from colossus.apps.subscribers.models import (
+    Domain, Subscriber, SubscriberBitmap, Tag,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@worker_process_init.connect
+def warm_domain_cache(**kwargs):
+    """
+    Warm the domains cache of each worker process, which runs the bulk
+    imports, instead of within the first request resolving a domain.
+    """
+    try:
+        domain_cache.warm()
+    except DatabaseError:
+        logger.exception('Could not warm the domains cache.')
+
+
+@receiver(post_delete, sender=Domain)
+def discard_deleted_domain(sender, instance, **kwargs):
+    domain_cache.discard(instance.name)
+
+
+@receiver(post_delete, sender=Tag)
+def delete_tag_bitmap(sender, instance, **kwargs):
+    SubscriberBitmap.objects.filter(mailing_list_id=instance.mailing_list_id, key=get_tag_key(instance.pk)).delete()
+
+
+@receiver(m2m_changed, sender=Subscriber.tags.through)
+def update_tags_bitmaps(sender, instance, action, reverse, model, pk_set, **kwargs):
+    """
+    Keep the tags bitmaps in sync with the changes made through the related
+    managers, e.g. `subscriber.tags.add(tag)` or `tag.subscribers.remove(subscriber)`.
+    """
+    if action == 'pre_clear':
+        # The removed relations are unknown after the clear
+        SubscriberTag = Subscriber.tags.through
+        if reverse:
+            instance._cleared_ids = set(SubscriberTag.objects.filter(tag_id=instance.pk)
+                                        .values_list('subscriber_id', flat=True))
+        else:
+            instance._cleared_ids = set(instance.tags.values_list('pk', flat=True))
+        return
+    if action == 'post_clear':
+        pk_set = getattr(instance, '_cleared_ids', set())
+        update = remove_ids
+    elif action == 'post_add':
+        update = add_ids
+    elif action == 'post_remove':
+        update = remove_ids
+    else:
+        return
+    if not pk_set:
+        return
+    if reverse:
+        update(instance.mailing_list_id, get_tag_key(instance.pk), pk_set)
+    else:
+        for tag_id in pk_set:
+            update(instance.mailing_list_id, get_tag_key(tag_id), [instance.pk])
@@ -1,14 +1,23 @@
 import logging
+from datetime import timedelta
 
 from django.apps import apps
+from django.conf import settings
 from django.db import transaction
 from django.db.models import Q
+from django.utils import timezone
 
 from celery import shared_task
 
 from colossus.apps.lists.models import MailingList
+from colossus.apps.subscribers.archive import archive_activities
 from colossus.apps.subscribers.constants import ActivityTypes
-from colossus.utils import get_location
+from colossus.apps.subscribers.counters import (
+    delete_orphan_engagements, reconcile_campaign_counters, subtract_counts,
+)
+from colossus.apps.subscribers.rollups import move_activities
+from colossus.apps.subscribers.tracking import process_tracking_buffer
+from colossus.utils import debounce_task, get_location
 
 logger = logging.getLogger(__name__)
 
@@ -16,16 +25,11 @@ logger = logging.getLogger(__name__)
 @shared_task
 def update_open_rate(subscriber_id, email_id):
     Subscriber = apps.get_model('subscribers', 'Subscriber')
-    Email = apps.get_model('campaigns', 'Email')
     try:
-        subscriber = Subscriber.objects.filter(pk=subscriber_id).select_related('mailing_list').get()
-        email = Email.objects.filter(pk=email_id).select_related('campaign').get()
-        with transaction.atomic():
-            subscriber.update_open_rate()
-            subscriber.mailing_list.update_open_rate()
-            email.update_opens_count()
-            email.campaign.update_opens_count_and_rate()
-    except (Subscriber.DoesNotExist, Email.DoesNotExist):
+        subscriber = Subscriber.objects.get(pk=subscriber_id)
+        subscriber.update_open_rate()
+        debounce_task(update_mailing_list_rates, subscriber.mailing_list_id)
+    except Subscriber.DoesNotExist:
         logger.exception('An error occurred while trying to update open rates with '
                          'subscriber_id = "%s" and email_id = "%s"' % (subscriber_id, email_id))
 
@@ -35,8 +39,8 @@ def update_click_rate(subscriber_id, link_id):
     Subscriber = apps.get_model('subscribers', 'Subscriber')
     Link = apps.get_model('campaigns', 'Link')
     try:
-        subscriber = Subscriber.objects.filter(pk=subscriber_id).select_related('mailing_list').get()
-        link = Link.objects.filter(pk=link_id).select_related('email__campaign').get()
+        subscriber = Subscriber.objects.get(pk=subscriber_id)
+        link = Link.objects.filter(pk=link_id).select_related('email').get()
         with transaction.atomic():
             if not subscriber.activities.filter(activity_type=ActivityTypes.OPENED, email=link.email).exists():
                 # For the user to click on the email, he/she must have opened it. In some cases the open pixel won't
@@ -45,31 +49,60 @@ def update_click_rate(subscriber_id, link_id):
                 ip_address = activity.ip_address if activity is not None else None
                 subscriber.open(link.email, ip_address)
             subscriber.update_click_rate()
-            subscriber.mailing_list.update_click_rate()
-            link.update_clicks_count()
-            link.email.update_clicks_count()
-            link.email.campaign.update_clicks_count_and_rate()
+        debounce_task(update_mailing_list_rates, subscriber.mailing_list_id)
     except (Subscriber.DoesNotExist, Link.DoesNotExist):
         logger.exception('An error occurred while trying to update open rates with '
                          'subscriber_id = "%s" and link_id = "%s"' % (subscriber_id, link_id))
 
 
 @shared_task
-def update_rates_after_subscriber_deletion(mailing_list_id, email_ids, link_ids):
-    mailing_list = MailingList.objects.only('pk').get(pk=mailing_list_id)
+def update_mailing_list_rates(mailing_list_id):
+    """
+    Recompute the open and click rates of a mailing list, averaging the rates
+    of all its active subscribers. Scheduled with `debounce_task`.
+    """
+    try:
+        mailing_list = MailingList.objects.only('pk').get(pk=mailing_list_id)
+    except MailingList.DoesNotExist:
+        return
     mailing_list.update_open_and_click_rate()
 
-    Email = apps.get_model('campaigns', 'Email')
-    emails = Email.objects.filter(pk__in=email_ids).select_related('campaign').only('pk', 'campaign__id')
-    for email in emails:
-        email.update_clicks_count()
-        email.update_opens_count()
-        email.campaign.update_opens_count_and_rate()
 
-    Link = apps.get_model('campaigns', 'Link')
-    links = Link.objects.filter(pk__in=link_ids).only('pk')
-    for link in links:
-        link.update_clicks_count()
+@shared_task
+def reconcile_campaign_counters_task(campaign_id):
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    try:
+        campaign = Campaign.objects.get(pk=campaign_id)
+    except Campaign.DoesNotExist:
+        return
+    reconcile_campaign_counters(campaign)
+
+
+@shared_task
+def reconcile_engagement_counters_task():
+    """
+    Repair the drift of the incremental opens and clicks counters of the
+    campaigns sent within the last COLOSSUS_COUNTERS_RECONCILIATION_DAYS days.
+    """
+    Campaign = apps.get_model('campaigns', 'Campaign')
+    delete_orphan_engagements()
+    send_date = timezone.now() - timedelta(days=settings.COLOSSUS_COUNTERS_RECONCILIATION_DAYS)
+    campaigns_ids = Campaign.objects.filter(send_date__gte=send_date).values_list('pk', flat=True)
+    for campaign_id in campaigns_ids:
+        reconcile_campaign_counters_task.delay(campaign_id)
+
+
+@shared_task
+def update_rates_after_subscriber_deletion(mailing_list_id, counts):
+    """
+    Subtract the opens and clicks of a deleted subscriber from the counters,
+    instead of aggregating the activities again, which would drop the
+    archived ones. See `get_subscriber_counts`.
+    """
+    # The rates of the remaining subscribers do not depend on the deleted one
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    Subscriber.objects.update_mailing_list_rates(mailing_list_id, subscribers_ids=[])
+    subtract_counts(counts)
 
 
 @shared_task
@@ -84,7 +117,21 @@ def update_subscriber_location(ip_address, subscriber_id):
             subscriber.location = location
             subscriber.save(update_fields=['location'])
 
-        subscriber.activities \
+        activities = subscriber.activities \
             .filter(ip_address=ip_address) \
-            .filter(Q(location=None) | Q(activity_type=ActivityTypes.OPENED)) \
-            .update(location=location)
+            .filter(Q(location=None) | Q(activity_type=ActivityTypes.OPENED))
+        move_activities(activities, {'location': location})
+
+
+@shared_task
+def process_tracking_events_task():
+    process_tracking_buffer()
+
+
+@shared_task
+def archive_activities_task():
+    """
+    Archive the activities older than COLOSSUS_ACTIVITY_ARCHIVE_MONTHS.
+    """
+    archived = archive_activities()
+    logger.info('Archived %s activities.', archived)
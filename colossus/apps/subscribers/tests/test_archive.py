@@ -0,0 +1,181 @@
+import datetime
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory, LinkFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.archive import (
+    ARCHIVED_FIELDS, archive_activities, decode_activities, encode_activities,
+    get_archive_horizon,
+)
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.counters import reconcile_campaign_counters
+from colossus.apps.subscribers.models import (
+    Activity, ActivityArchive, ActivityRollup, Subscriber,
+)
+from colossus.apps.subscribers.rollups import (
+    get_activity_counts, rebuild_rollups,
+)
+from colossus.test.testcases import AuthenticatedTestCase, TestCase
+
+from .factories import SubscriberFactory
+
+FEBRUARY = timezone.make_aware(datetime.datetime(2020, 2, 10, 12))
+MARCH = timezone.make_aware(datetime.datetime(2020, 3, 15, 12))
+HORIZON = datetime.date(2020, 4, 1)
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign)
+        self.link = LinkFactory(email=self.email)
+        self.other_email = EmailFactory(campaign=self.campaign)
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+        self.subscriber.create_activity(ActivityTypes.SUBSCRIBED, date=FEBRUARY)
+        self.subscriber.create_activity(ActivityTypes.SENT, email=self.email, date=FEBRUARY)
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, date=FEBRUARY, ip_address='127.0.0.1')
+        self.subscriber.create_activity(ActivityTypes.SENT, email=self.other_email, date=MARCH)
+        self.subscriber.create_activity(ActivityTypes.CLICKED, email=self.email, link=self.link, date=MARCH)
+        # Opened again after the horizon
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email)
+
+
+class ActivityArchiveTests(ArchiveTestCase):
+    def test_activities_archived(self):
+        self.assertEqual(5, archive_activities(HORIZON))
+        self.assertEqual(1, self.subscriber.activities.count())
+        archives = self.subscriber.activity_archives.order_by('month')
+        self.assertEqual([(datetime.date(2020, 2, 1), 3), (datetime.date(2020, 3, 1), 2)],
+                         [(archive.month, archive.activities_count) for archive in archives])
+        activities = archives[0].get_activities()
+        self.assertEqual([ActivityTypes.OPENED, ActivityTypes.SENT, ActivityTypes.SUBSCRIBED],
+                         [activity.activity_type for activity in activities])
+        self.assertEqual(FEBRUARY, activities[0].date)
+        self.assertEqual('127.0.0.1', activities[0].ip_address)
+        self.assertEqual(self.email, activities[0].email)
+        self.assertIn(self.email.campaign.name, activities[0].as_html)
+
+    def test_archive_again(self):
+        archive_activities(HORIZON)
+        self.assertEqual(0, archive_activities(HORIZON))
+        # Activity created in an archived month
+        self.subscriber.create_activity(ActivityTypes.SENT, email=self.email, date=MARCH)
+        self.assertEqual(1, archive_activities(HORIZON))
+        self.assertEqual(3, self.subscriber.activity_archives.get(month=datetime.date(2020, 3, 1)).activities_count)
+
+    def test_rollups_kept(self):
+        activity_types = [ActivityTypes.SUBSCRIBED, ActivityTypes.SENT, ActivityTypes.OPENED, ActivityTypes.CLICKED]
+        counts = get_activity_counts(activity_types, mailing_list_id=self.mailing_list.pk)
+        ActivityRollup.objects.filter(date__lt=HORIZON).update(count=10)
+        archive_activities(HORIZON)
+        # The rollups of the archived months were recomputed before the activities were moved
+        self.assertEqual(counts, get_activity_counts(activity_types, mailing_list_id=self.mailing_list.pk))
+        rebuild_rollups()
+        self.assertEqual(counts, get_activity_counts(activity_types, mailing_list_id=self.mailing_list.pk))
+
+    def test_rates_kept(self):
+        self.subscriber.update_open_and_click_rate()
+        self.assertEqual((0.5, 0.5), (self.subscriber.open_rate, self.subscriber.click_rate))
+        archive_activities(HORIZON)
+        subscriber = Subscriber.objects.get(pk=self.subscriber.pk)
+        # The email opened before and after the horizon is counted once
+        self.assertEqual((2, 0, 1), (subscriber.archived_sent_count, subscriber.archived_opened_count,
+                                     subscriber.archived_clicked_count))
+        subscriber.update_open_and_click_rate()
+        self.assertEqual((0.5, 0.5), (subscriber.open_rate, subscriber.click_rate))
+        self.assertEqual(0.5, subscriber.update_open_rate())
+        self.assertEqual(0.5, subscriber.update_click_rate())
+        Subscriber.objects.filter(pk=subscriber.pk).update(open_rate=0, click_rate=0)
+        Subscriber.objects.update_open_and_click_rate([subscriber.pk])
+        self.assertEqual((0.5, 0.5), tuple(Subscriber.objects.values_list('open_rate', 'click_rate').get()))
+
+    def test_rollups_after_subscriber_deletion(self):
+        """
+        Deleting a subscriber must subtract its activities, archived or not,
+        from the rollups
+        """
+        activity_types = [ActivityTypes.SUBSCRIBED, ActivityTypes.SENT, ActivityTypes.OPENED, ActivityTypes.CLICKED]
+        other = SubscriberFactory(mailing_list=self.mailing_list)
+        other.create_activity(ActivityTypes.SUBSCRIBED, date=FEBRUARY)
+        other.open(self.email)
+        archive_activities(HORIZON)
+        self.subscriber.delete()
+        expected = {ActivityTypes.SUBSCRIBED: 1, ActivityTypes.SENT: 0, ActivityTypes.OPENED: 1,
+                    ActivityTypes.CLICKED: 0}
+        self.assertEqual(expected, get_activity_counts(activity_types, mailing_list_id=self.mailing_list.pk))
+        rebuild_rollups()
+        self.assertEqual(expected, get_activity_counts(activity_types, mailing_list_id=self.mailing_list.pk))
+
+    def test_counters_kept_after_subscriber_deletion(self):
+        """
+        Deleting a subscriber must only subtract its own opens and clicks,
+        archived or not, from the counters
+        """
+        def get_counters():
+            self.email.refresh_from_db()
+            self.campaign.refresh_from_db()
+            self.link.refresh_from_db()
+            return (self.email.total_opens_count, self.email.unique_opens_count, self.email.total_clicks_count,
+                    self.campaign.total_opens_count, self.campaign.unique_opens_count,
+                    self.link.total_clicks_count, self.link.unique_clicks_count)
+
+        reconcile_campaign_counters(self.campaign)
+        other = SubscriberFactory(mailing_list=self.mailing_list)
+        other.open(self.email)
+        other.click(self.link)
+        self.assertEqual((3, 2, 2, 3, 2, 2, 2), get_counters())
+        archive_activities(HORIZON)
+        other.delete()
+        self.assertEqual((2, 1, 1, 2, 1, 1, 1), get_counters())
+        self.subscriber.delete()
+        self.assertEqual((0, 0, 0, 0, 0, 0, 0), get_counters())
+
+    @override_settings(COLOSSUS_ACTIVITY_ARCHIVE_MONTHS=0, COLOSSUS_COUNTERS_RECONCILIATION_DAYS=40)
+    def test_horizon_before_reconciled_campaigns(self):
+        reconciled = timezone.localdate() - datetime.timedelta(days=40)
+        self.assertEqual(reconciled.replace(day=1), get_archive_horizon())
+
+    def test_encode_activities(self):
+        activities = list(Activity.objects.order_by('pk').values(*ARCHIVED_FIELDS))
+        self.assertEqual(activities, decode_activities(encode_activities(activities)))
+
+    def test_archive_activities_command(self):
+        out = StringIO()
+        call_command('archiveactivities', '--months', '12', stdout=out)
+        self.assertIn('Successfully archived 5 activities', out.getvalue())
+        self.assertEqual(2, ActivityArchive.objects.count())
+
+
+class SubscriberArchivedActivitiesViewTests(AuthenticatedTestCase, ArchiveTestCase):
+    def setUp(self):
+        super().setUp()
+        archive_activities(HORIZON)
+
+    def test_load_button(self):
+        response = self.client.get(reverse('lists:subscriber', kwargs={'pk': self.mailing_list.pk,
+                                                                       'subscriber_pk': self.subscriber.pk}))
+        self.assertContains(response, '?month=2020-03')
+
+    def test_archived_month(self):
+        url = reverse('lists:subscriber_archive', kwargs={'pk': self.mailing_list.pk,
+                                                          'subscriber_pk': self.subscriber.pk})
+        response = self.client.get(url, {'month': '2020-03'})
+        self.assertEqual(2, len(response.context['activities']))
+        self.assertEqual(datetime.date(2020, 2, 1), response.context['older_month'])
+        self.assertContains(response, '?month=2020-02')
+        response = self.client.get(url, {'month': '2020-02'})
+        self.assertIsNone(response.context['older_month'])
+
+    def test_month_not_archived(self):
+        url = reverse('lists:subscriber_archive', kwargs={'pk': self.mailing_list.pk,
+                                                          'subscriber_pk': self.subscriber.pk})
+        self.assertEqual(404, self.client.get(url, {'month': '2020-01'}).status_code)
+        self.assertEqual(404, self.client.get(url, {'month': 'invalid'}).status_code)
@@ -0,0 +1,187 @@
+from importlib import import_module
+from io import StringIO
+
+from django.core.management import call_command
+
+from colossus.apps.campaigns.tests.factories import CampaignFactory
+from colossus.apps.lists.bulk import import_emails, tag_emails
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.bitmaps import (
+    ALL_KEY, CHUNK_SIZE, Bitmap, add_ids, encode_chunks, get_status_key,
+    get_tag_key, load_bitmap, load_bitmaps, rebuild_bitmaps,
+)
+from colossus.apps.subscribers.constants import EngagementTypes, Status
+from colossus.apps.subscribers.exceptions import InvalidSegment
+from colossus.apps.subscribers.models import Engagement, SubscriberBitmap
+from colossus.apps.subscribers.segments import Segment
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory, TagFactory
+
+
+class BitmapTests(TestCase):
+    def test_operations(self):
+        first = Bitmap.from_ids([1, 5, 70000])
+        second = Bitmap.from_ids([5, 9])
+        self.assertEqual([5], list(first & second))
+        self.assertEqual([1, 5, 9, 70000], list(first | second))
+        self.assertEqual([1, 70000], list(first - second))
+        self.assertEqual(3, len(first))
+        self.assertEqual([5], list(first.range(2, 69999)))
+        self.assertFalse(Bitmap())
+
+    def test_chunks(self):
+        mailing_list = MailingListFactory()
+        ids = [3, CHUNK_SIZE - 1, CHUNK_SIZE * 2 + 10]
+        add_ids(mailing_list.pk, 'test', ids)
+        self.assertEqual(2, SubscriberBitmap.objects.filter(key='test').count())
+        self.assertEqual(ids, list(load_bitmap(mailing_list.pk, 'test')))
+        self.assertEqual([], list(load_bitmap(mailing_list.pk, 'missing')))
+
+    def test_migration_chunks(self):
+        """
+        The chunks backfilled by the migration are readable by the current
+        bitmaps code
+        """
+        migration = import_module('colossus.apps.subscribers.migrations.0016_subscriberbitmap')
+        ids = [0, 3, CHUNK_SIZE - 1, CHUNK_SIZE * 2 + 10]
+        self.assertEqual(encode_chunks(ids), migration.encode_chunks(ids))
+
+
+class BitmapsMaintenanceTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.tag = TagFactory(mailing_list=self.mailing_list)
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+
+    def assertBitmaps(self, expected):
+        bitmaps = load_bitmaps(self.mailing_list.pk, expected.keys())
+        self.assertEqual(expected, {key: list(bitmap) for key, bitmap in bitmaps.items()})
+
+    def test_subscriber_created(self):
+        self.assertBitmaps({
+            ALL_KEY: [self.subscriber.pk],
+            get_status_key(Status.SUBSCRIBED): [self.subscriber.pk],
+            get_status_key(Status.PENDING): [],
+        })
+
+    def test_status_changed(self):
+        self.subscriber.status = Status.UNSUBSCRIBED
+        self.subscriber.save()
+        self.assertBitmaps({
+            ALL_KEY: [self.subscriber.pk],
+            get_status_key(Status.SUBSCRIBED): [],
+            get_status_key(Status.UNSUBSCRIBED): [self.subscriber.pk],
+        })
+        # The empty chunks are deleted
+        self.assertFalse(SubscriberBitmap.objects.filter(key=get_status_key(Status.SUBSCRIBED)).exists())
+
+    def test_tags_changed(self):
+        tag_key = get_tag_key(self.tag.pk)
+        self.subscriber.tags.add(self.tag)
+        self.assertBitmaps({tag_key: [self.subscriber.pk]})
+        self.subscriber.tags.remove(self.tag)
+        self.assertBitmaps({tag_key: []})
+        self.tag.subscribers.add(self.subscriber)
+        self.assertBitmaps({tag_key: [self.subscriber.pk]})
+        self.tag.subscribers.clear()
+        self.assertBitmaps({tag_key: []})
+
+    def test_subscriber_deleted(self):
+        self.subscriber.tags.add(self.tag)
+        self.subscriber.delete()
+        self.assertFalse(SubscriberBitmap.objects.exists())
+
+    def test_bulk_operations(self):
+        import_emails(self.mailing_list, [self.subscriber.email, 'new@example.com'], Status.PENDING)
+        new_subscriber = self.mailing_list.subscribers.get(email='new@example.com')
+        tag_emails(self.mailing_list, self.tag, ['new@example.com'])
+        self.assertBitmaps({
+            ALL_KEY: [self.subscriber.pk, new_subscriber.pk],
+            get_status_key(Status.SUBSCRIBED): [],
+            get_status_key(Status.PENDING): [self.subscriber.pk, new_subscriber.pk],
+            get_tag_key(self.tag.pk): [new_subscriber.pk],
+        })
+
+    def test_rebuild_bitmaps(self):
+        self.subscriber.tags.add(self.tag)
+        bitmaps = list(SubscriberBitmap.objects.order_by('key').values_list('key', 'chunk', 'data'))
+        SubscriberBitmap.objects.all().delete()
+        self.assertEqual(3, rebuild_bitmaps(self.mailing_list.pk))
+        self.assertEqual(bitmaps, list(SubscriberBitmap.objects.order_by('key').values_list('key', 'chunk', 'data')))
+
+    def test_rebuild_bitmaps_command(self):
+        SubscriberBitmap.objects.all().delete()
+        out = StringIO()
+        call_command('rebuildbitmaps', stdout=out)
+        self.assertIn('Successfully rebuilt 2 bitmap chunks', out.getvalue())
+
+
+class SegmentTests(TestCase):
+    def setUp(self):
+        super().setUp()
+        self.mailing_list = MailingListFactory()
+        self.customers = TagFactory(name='customers', mailing_list=self.mailing_list)
+        self.partners = TagFactory(name='partners', mailing_list=self.mailing_list)
+        self.customer = SubscriberFactory(mailing_list=self.mailing_list)
+        self.customer.tags.add(self.customers)
+        self.partner = SubscriberFactory(mailing_list=self.mailing_list)
+        self.partner.tags.add(self.partners)
+        self.unsubscribed = SubscriberFactory(mailing_list=self.mailing_list, status=Status.UNSUBSCRIBED)
+        self.unsubscribed.tags.add(self.customers, self.partners)
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        Engagement.objects.create(engagement_type=EngagementTypes.CAMPAIGN_OPEN, target_id=self.campaign.pk,
+                                  subscriber=self.customer)
+        # Engagement of another list, ignored by the segment
+        Engagement.objects.create(engagement_type=EngagementTypes.CAMPAIGN_OPEN, target_id=self.campaign.pk,
+                                  subscriber=SubscriberFactory())
+
+    def evaluate(self, expression, *keys):
+        return list(Segment(expression, self.mailing_list).evaluate(*keys))
+
+    def test_conditions(self):
+        self.assertEqual([self.customer.pk, self.unsubscribed.pk], self.evaluate('tag:customers'))
+        self.assertEqual([self.unsubscribed.pk], self.evaluate('status:unsubscribed'))
+        self.assertEqual([self.customer.pk], self.evaluate('opened:%s' % self.campaign.pk))
+        self.assertEqual([], self.evaluate('clicked:%s' % self.campaign.pk))
+
+    def test_quoted_tag_names(self):
+        vip = TagFactory(name='VIP customers (2019)', mailing_list=self.mailing_list)
+        self.partner.tags.add(vip)
+        quoted = TagFactory(name='say "hi" \\o/', mailing_list=self.mailing_list)
+        self.customer.tags.add(quoted)
+        self.assertEqual([self.partner.pk], self.evaluate('tag:"VIP customers (2019)"'))
+        self.assertEqual([self.customer.pk, self.partner.pk],
+                         self.evaluate('tag:"VIP customers (2019)" OR (tag:"say \\"hi\\" \\\\o/")'))
+        self.assertEqual([self.customer.pk, self.unsubscribed.pk], self.evaluate('tag:"customers"'))
+
+    def test_operators(self):
+        self.assertEqual([self.customer.pk, self.partner.pk, self.unsubscribed.pk],
+                         self.evaluate('tag:customers OR tag:partners'))
+        self.assertEqual([self.unsubscribed.pk], self.evaluate('tag:customers and tag:partners'))
+        self.assertEqual([self.partner.pk], self.evaluate('NOT tag:customers'))
+        self.assertEqual([self.customer.pk, self.partner.pk],
+                         self.evaluate('(tag:customers OR tag:partners) AND NOT status:unsubscribed'))
+        # AND binds tighter than OR
+        self.assertEqual([self.customer.pk, self.unsubscribed.pk],
+                         self.evaluate('tag:customers OR tag:partners AND status:unsubscribed'))
+
+    def test_intersected_keys(self):
+        self.assertEqual([self.customer.pk], self.evaluate('tag:customers', get_status_key(Status.SUBSCRIBED)))
+
+    def test_invalid_segments(self):
+        for expression in ('', 'tag:unknown', 'status:unknown', 'opened:abc', 'foo:bar', 'tag:customers AND',
+                           '(tag:customers', 'tag:customers tag:partners', 'tag:customers XOR tag:partners', '"',
+                           'tag:"customers', 'tag:"VIP customers"'):
+            with self.subTest(expression=expression), self.assertRaises(InvalidSegment):
+                Segment(expression, self.mailing_list)
+
+    def test_campaign_recipients(self):
+        self.campaign.tag = self.partners
+        self.campaign.segment = 'tag:customers OR tag:partners'
+        self.assertEqual([self.partner.pk], list(self.campaign.get_recipients_bitmap()))
+        self.assertEqual(1, self.campaign.get_recipients_count())
+        self.campaign.segment = ''
+        self.assertIsNone(self.campaign.get_recipients_bitmap())
+        self.assertEqual(1, self.campaign.get_recipients_count())
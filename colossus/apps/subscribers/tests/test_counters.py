@@ -0,0 +1,114 @@
+from django.test import override_settings
+from django.utils import timezone
+
+from colossus.apps.campaigns.models import Campaign, Email, Link
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory, LinkFactory,
+)
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import EngagementTypes
+from colossus.apps.subscribers.counters import (
+    count_clicks, count_opens, delete_orphan_engagements,
+    reconcile_campaign_counters, record_first_engagements,
+)
+from colossus.apps.subscribers.models import Engagement
+from colossus.apps.subscribers.tasks import reconcile_engagement_counters_task
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory
+
+
+class RecordFirstEngagementsTests(TestCase):
+    def test_only_new_keys_returned(self):
+        subscriber = SubscriberFactory()
+        key_1 = (EngagementTypes.EMAIL_OPEN, 1, subscriber.pk)
+        key_2 = (EngagementTypes.EMAIL_OPEN, 2, subscriber.pk)
+        self.assertEqual({key_1}, record_first_engagements({key_1}))
+        self.assertEqual({key_2}, record_first_engagements({key_1, key_2}))
+        self.assertEqual(set(), record_first_engagements({key_1, key_2}))
+        self.assertEqual(2, Engagement.objects.count())
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class CountersTests(TestCase):
+    def setUp(self):
+        mailing_list = MailingListFactory()
+        self.campaign = CampaignFactory(mailing_list=mailing_list, recipients_count=4)
+        self.email_1 = EmailFactory(campaign=self.campaign)
+        self.email_2 = EmailFactory(campaign=self.campaign)
+        self.link = LinkFactory(email=self.email_1)
+        self.subscriber_1 = SubscriberFactory(mailing_list=mailing_list)
+        self.subscriber_2 = SubscriberFactory(mailing_list=mailing_list)
+
+    def test_count_opens(self):
+        count_opens([
+            (self.subscriber_1.pk, self.email_1.pk, self.campaign.pk),
+            (self.subscriber_1.pk, self.email_1.pk, self.campaign.pk),
+            (self.subscriber_1.pk, self.email_2.pk, self.campaign.pk),
+        ])
+        count_opens([(self.subscriber_2.pk, self.email_1.pk, self.campaign.pk)])
+        self.email_1.refresh_from_db()
+        self.assertEqual((2, 3), (self.email_1.unique_opens_count, self.email_1.total_opens_count))
+        self.email_2.refresh_from_db()
+        self.assertEqual((1, 1), (self.email_2.unique_opens_count, self.email_2.total_opens_count))
+        self.campaign.refresh_from_db()
+        self.assertEqual((2, 4), (self.campaign.unique_opens_count, self.campaign.total_opens_count))
+        self.assertEqual(0.5, self.campaign.open_rate)
+
+    def test_count_clicks(self):
+        click = (self.subscriber_1.pk, self.link.pk, self.email_1.pk, self.campaign.pk)
+        count_clicks([click, click])
+        count_clicks([click])
+        self.link.refresh_from_db()
+        self.assertEqual((1, 3), (self.link.unique_clicks_count, self.link.total_clicks_count))
+        self.email_1.refresh_from_db()
+        self.assertEqual((1, 3), (self.email_1.unique_clicks_count, self.email_1.total_clicks_count))
+        self.campaign.refresh_from_db()
+        self.assertEqual((1, 3), (self.campaign.unique_clicks_count, self.campaign.total_clicks_count))
+        self.assertEqual(0.25, self.campaign.click_rate)
+
+    def test_subscriber_open_and_click(self):
+        self.subscriber_1.open(self.email_1)
+        self.subscriber_1.click(self.link)
+        self.campaign.refresh_from_db()
+        self.assertEqual((1, 1), (self.campaign.unique_opens_count, self.campaign.total_opens_count))
+        self.assertEqual((1, 1), (self.campaign.unique_clicks_count, self.campaign.total_clicks_count))
+
+    def test_reconcile_campaign_counters(self):
+        self.subscriber_1.open(self.email_1)
+        self.subscriber_1.click(self.link)
+        self.subscriber_2.click(self.link)  # forces an open
+        Engagement.objects.all().delete()
+        Campaign.objects.update(unique_opens_count=10, total_opens_count=10, unique_clicks_count=10)
+        Email.objects.update(unique_opens_count=10, unique_clicks_count=10)
+        Link.objects.update(unique_clicks_count=10, total_clicks_count=10)
+
+        reconcile_campaign_counters(self.campaign)
+
+        self.campaign.refresh_from_db()
+        self.assertEqual((2, 2), (self.campaign.unique_opens_count, self.campaign.total_opens_count))
+        self.assertEqual((2, 2), (self.campaign.unique_clicks_count, self.campaign.total_clicks_count))
+        self.link.refresh_from_db()
+        self.assertEqual((2, 2), (self.link.unique_clicks_count, self.link.total_clicks_count))
+        self.assertEqual(10, Engagement.objects.count())
+
+        # The counters keep counting from the rebuilt engagements
+        self.subscriber_1.open(self.email_1)
+        self.campaign.refresh_from_db()
+        self.assertEqual((2, 3), (self.campaign.unique_opens_count, self.campaign.total_opens_count))
+
+    def test_delete_orphan_engagements(self):
+        self.subscriber_1.click(self.link)
+        self.assertEqual(5, Engagement.objects.count())
+        self.link.delete()
+        self.assertEqual(1, delete_orphan_engagements())
+        self.campaign.delete()
+        self.assertEqual(4, delete_orphan_engagements())
+        self.assertFalse(Engagement.objects.exists())
+
+    def test_reconcile_engagement_counters_task(self):
+        self.subscriber_1.open(self.email_1)
+        Campaign.objects.filter(pk=self.campaign.pk).update(send_date=timezone.now(), unique_opens_count=10)
+        reconcile_engagement_counters_task.delay()
+        self.campaign.refresh_from_db()
+        self.assertEqual(1, self.campaign.unique_opens_count)
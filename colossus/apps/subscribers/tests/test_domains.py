@@ -0,0 +1,112 @@
+from unittest import mock
+
+from celery.signals import worker_process_init
+
+from colossus.apps.subscribers.domains import (
+    DomainCache, domain_cache, get_domain_name, resolve_domain,
+    resolve_domains,
+)
+from colossus.apps.subscribers.models import Domain
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory
+
+
+def run_on_commit(func):
+    func()
+
+
+class DomainCacheTests(TestCase):
+    def test_least_recently_used_evicted(self):
+        cache = DomainCache(max_size=2)
+        cache.update({'@a.com': 1, '@b.com': 2})
+        self.assertEqual(1, cache.get('@a.com'))
+        cache.update({'@c.com': 3})
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get('@b.com'))
+        self.assertEqual(1, cache.get('@a.com'))
+
+    def test_discard(self):
+        cache = DomainCache(max_size=2)
+        cache.update({'@a.com': 1})
+        cache.discard('@a.com')
+        cache.discard('@b.com')
+        self.assertIsNone(cache.get('@a.com'))
+
+    @mock.patch('colossus.apps.subscribers.domains.transaction.on_commit', run_on_commit)
+    def test_warm_loads_most_frequent_domains(self):
+        popular = Domain.objects.create(name='@popular.com')
+        unpopular = Domain.objects.create(name='@unpopular.com')
+        SubscriberFactory(email='john@unpopular.com', domain=unpopular)
+        SubscriberFactory.create_batch(2, domain=popular)
+        cache = DomainCache(max_size=10)
+        with self.assertNumQueries(1):
+            cache.warm(size=1)
+        self.assertTrue(cache.warmed)
+        self.assertEqual({'@popular.com': popular.pk}, dict(cache.ids))
+
+    @mock.patch('colossus.apps.subscribers.domains.transaction.on_commit', run_on_commit)
+    def test_warm_reads_latest_subscribers_only(self):
+        popular = Domain.objects.create(name='@popular.com')
+        SubscriberFactory.create_batch(2, domain=popular)
+        latest = Domain.objects.create(name='@latest.com')
+        SubscriberFactory(email='john@latest.com', domain=latest)
+        cache = DomainCache(max_size=10)
+        cache.warm(size=1, sample_size=1)
+        self.assertEqual({'@latest.com': latest.pk}, dict(cache.ids))
+
+    def test_rolled_back_warm_not_warmed(self):
+        cache = DomainCache(max_size=10)
+        with mock.patch('colossus.apps.subscribers.domains.transaction.on_commit'):
+            cache.warm()
+        self.assertFalse(cache.warmed)
+
+    @mock.patch('colossus.apps.subscribers.domains.transaction.on_commit', run_on_commit)
+    def test_warmed_when_worker_process_starts(self):
+        subscriber = SubscriberFactory()
+        domain_cache.clear()
+        self.addCleanup(domain_cache.clear)
+        worker_process_init.send(sender=None)
+        self.assertTrue(domain_cache.warmed)
+        self.assertEqual(subscriber.domain_id, domain_cache.get('@colossusmail.com'))
+
+
+@mock.patch('colossus.apps.subscribers.domains.transaction.on_commit', run_on_commit)
+class ResolveDomainsTests(TestCase):
+    def setUp(self):
+        domain_cache.clear()
+
+    def tearDown(self):
+        domain_cache.clear()
+
+    def test_get_domain_name(self):
+        self.assertEqual('@example.com', get_domain_name('john.doe@example.com'))
+
+    def test_missing_domains_created(self):
+        existing = Domain.objects.create(name='@example.com')
+        ids = resolve_domains(['@example.com', '@example.org', '@example.net', '@example.org'])
+        self.assertEqual(3, len(ids))
+        self.assertEqual(existing.pk, ids['@example.com'])
+        self.assertEqual(ids['@example.org'], Domain.objects.get(name='@example.org').pk)
+
+    def test_cached_domains_resolved_without_queries(self):
+        domain_id = resolve_domain('@example.com')
+        with self.assertNumQueries(0):
+            self.assertEqual(domain_id, resolve_domain('@example.com'))
+
+    def test_rolled_back_domains_not_cached(self):
+        with mock.patch('colossus.apps.subscribers.domains.transaction.on_commit'):
+            resolve_domain('@example.com')
+        self.assertIsNone(domain_cache.get('@example.com'))
+
+    def test_deleted_domain_discarded(self):
+        domain_id = resolve_domain('@example.com')
+        Domain.objects.get(pk=domain_id).delete()
+        self.assertIsNone(domain_cache.get('@example.com'))
+
+    def test_subscriber_save(self):
+        subscriber = SubscriberFactory(email='john@example.com')
+        subscriber.email = 'john@example.org'
+        subscriber.save()
+        self.assertEqual(domain_cache.get('@example.org'), subscriber.domain_id)
+        self.assertEqual('@example.org', Domain.objects.get(pk=subscriber.domain_id).name)
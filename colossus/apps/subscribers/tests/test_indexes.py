@@ -0,0 +1,161 @@
+import re
+from typing import List
+from unittest import mock, skipUnless
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from colossus.apps.campaigns.api import get_sent_subscribers_ids
+from colossus.apps.campaigns.constants import DeliveryStatus
+from colossus.apps.campaigns.ledger import (
+    get_sent_emails_ids,
+    get_sent_subscribers_ids as get_ledger_sent_subscribers_ids,
+    record_deliveries,
+)
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory, LinkFactory,
+)
+from colossus.apps.core.models import City, Country
+from colossus.apps.lists.charts import SubscriptionsSummaryChart
+from colossus.apps.lists.importer import get_existing_subscribers
+from colossus.apps.lists.pagination import NEXT, KeysetPaginator, encode_cursor
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity, Subscriber
+from colossus.apps.subscribers.tasks import update_subscriber_location
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory
+
+FULL_SCAN_PATTERNS = {
+    'sqlite': r'^SCAN (TABLE )?%s\b',
+    'postgresql': r'Seq Scan on %s\b',
+}
+
+
+def explain(sql: str) -> List[str]:
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN %s' % sql)
+        else:
+            # The tables are tiny, so only the usable indexes are compared
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute('EXPLAIN %s' % sql)
+        return [str(row[-1]).strip() for row in cursor.fetchall()]
+
+
+@skipUnless(connection.vendor in FULL_SCAN_PATTERNS, 'Query plans are only checked on SQLite and PostgreSQL')
+class ActivityIndexesTests(TestCase):
+    """
+    The hot queries over the activities must search an index instead of
+    scanning the whole table.
+    """
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign)
+        self.link = LinkFactory(email=self.email)
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list, last_seen_ip_address='127.0.0.1')
+        self.subscriber.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, ip_address='127.0.0.1')
+        self.subscriber.create_activity(ActivityTypes.CLICKED, email=self.email, link=self.link)
+
+    def assertNoFullScan(self, func, *tables):
+        with CaptureQueriesContext(connection) as context:
+            func()
+        checked = 0
+        for query in context.captured_queries:
+            sql = query['sql']
+            if not sql.startswith('SELECT'):
+                continue
+            plan = explain(sql)
+            for table in tables:
+                if table not in sql:
+                    continue
+                checked += 1
+                pattern = re.compile(FULL_SCAN_PATTERNS[connection.vendor] % table)
+                full_scans = [line for line in plan if pattern.search(line)]
+                self.assertFalse(full_scans, 'Full scan of %s in:\n%s\n%s' % (table, sql, '\n'.join(plan)))
+        self.assertTrue(checked, 'No query over %s' % ', '.join(tables))
+
+    # campaigns/models.py
+
+    def test_campaign_counters(self):
+        self.assertNoFullScan(self.campaign.update_opens_count_and_rate, 'colossus_activities')
+        self.assertNoFullScan(self.campaign.update_clicks_count_and_rate, 'colossus_activities')
+
+    def test_email_counters(self):
+        self.assertNoFullScan(self.email.update_opens_count, 'colossus_activities')
+        self.assertNoFullScan(self.email.update_clicks_count, 'colossus_activities')
+
+    def test_link_counters(self):
+        self.assertNoFullScan(self.link.update_clicks_count, 'colossus_activities')
+
+    def test_campaign_unsubscriptions(self):
+        self.assertNoFullScan(lambda: list(self.campaign.activities.filter(activity_type=ActivityTypes.UNSUBSCRIBED)),
+                              'colossus_activities')
+
+    # subscribers/models.py
+
+    def test_subscriber_rates(self):
+        self.assertNoFullScan(self.subscriber.update_open_and_click_rate, 'colossus_activities')
+        self.assertNoFullScan(lambda: Subscriber.objects.update_open_and_click_rate([self.subscriber.pk]),
+                              'colossus_activities')
+
+    def test_subscriber_forced_open(self):
+        self.assertNoFullScan(
+            lambda: self.subscriber.activities.filter(activity_type=ActivityTypes.OPENED, email=self.email).exists(),
+            'colossus_activities'
+        )
+
+    def test_subscriber_activities(self):
+        self.assertNoFullScan(lambda: list(self.subscriber.get_activities()), 'colossus_activities')
+
+    # lists/charts.py
+
+    def test_subscriptions_summary_chart(self):
+        chart = SubscriptionsSummaryChart(self.mailing_list)
+        self.assertNoFullScan(chart.get_data, 'colossus_activity_rollups')
+
+    # subscribers/tasks.py
+
+    def test_update_subscriber_location(self):
+        city = City.objects.create(name='Porto Alegre', country=Country.objects.create(code='BR', name='Brazil'))
+        with mock.patch('colossus.apps.subscribers.tasks.get_location', return_value=city):
+            self.assertNoFullScan(lambda: update_subscriber_location('127.0.0.1', self.subscriber.pk),
+                                  'colossus_activities')
+
+    def test_full_scan_detected(self):
+        with self.assertRaises(AssertionError):
+            self.assertNoFullScan(lambda: list(Activity.objects.filter(ip_address='127.0.0.1')),
+                                  'colossus_activities')
+
+    def test_subscribers_search(self):
+        search = Subscriber.objects.filter(mailing_list=self.mailing_list) & Subscriber.objects.search('sub')
+        self.assertNoFullScan(lambda: list(search), 'colossus_subscribers')
+
+    # lists/importer.py
+
+    def test_existing_subscribers(self):
+        self.assertNoFullScan(lambda: get_existing_subscribers(self.mailing_list.pk, ['Subscriber@example.com']),
+                              'colossus_subscribers')
+
+    # lists/pagination.py
+
+    def test_subscribers_keyset_page(self):
+        paginator = KeysetPaginator(Subscriber.objects.filter(mailing_list=self.mailing_list), 10, 'optin_date')
+        cursor = encode_cursor(NEXT, self.subscriber.optin_date, self.subscriber.pk)
+        self.assertNoFullScan(lambda: paginator.get_page(cursor), 'colossus_subscribers')
+
+    # campaigns/api.py
+
+    def test_sent_subscribers_ids(self):
+        self.assertNoFullScan(lambda: get_sent_subscribers_ids(self.email, 1, 100), 'colossus_activities')
+
+    # campaigns/ledger.py
+
+    def test_delivery_ledger(self):
+        record_deliveries(self.email.pk, {self.subscriber.pk: DeliveryStatus.SENT})
+        self.assertNoFullScan(lambda: get_sent_emails_ids([self.subscriber.pk]), 'colossus_delivery_ledgers')
+        self.assertNoFullScan(lambda: get_ledger_sent_subscribers_ids(self.email.pk, 1, 100),
+                              'colossus_delivery_ledgers')
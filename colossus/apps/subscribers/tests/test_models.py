@@ -1,4 +1,7 @@
+from io import StringIO
+
 from django.core import mail
+from django.core.management import call_command
 from django.test import override_settings
 
 from colossus.apps.campaigns.tests.factories import EmailFactory, LinkFactory
@@ -368,6 +371,88 @@ class SubscriberUpdateClickRateTests(TestCase):
         self.assertEqual(0.3333, self.subscriber.update_click_rate())
 
 
+class SubscriberManagerUpdateOpenAndClickRateTests(TestCase):
+    def setUp(self):
+        self.email = EmailFactory()
+        self.link = LinkFactory(email=self.email)
+        self.subscriber_1 = SubscriberFactory()
+        self.subscriber_2 = SubscriberFactory()
+        self.subscriber_3 = SubscriberFactory()
+
+    def test_rates(self):
+        other_email = EmailFactory()
+        self.subscriber_1.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscriber_1.create_activity(ActivityTypes.OPENED, email=self.email)
+        self.subscriber_1.create_activity(ActivityTypes.CLICKED, email=self.email, link=self.link)
+        self.subscriber_2.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscriber_2.create_activity(ActivityTypes.SENT, email=other_email)
+        self.subscriber_2.create_activity(ActivityTypes.OPENED, email=self.email)
+        self.subscriber_2.create_activity(ActivityTypes.OPENED, email=self.email)
+        ids = [self.subscriber_1.pk, self.subscriber_2.pk, self.subscriber_3.pk]
+        self.assertEqual(3, Subscriber.objects.update_open_and_click_rate(ids, batch_size=2))
+        for subscriber, open_rate, click_rate in ((self.subscriber_1, 1.0, 1.0),
+                                                  (self.subscriber_2, 0.5, 0.0),
+                                                  (self.subscriber_3, 0.0, 0.0)):
+            subscriber.refresh_from_db()
+            with self.subTest(subscriber=subscriber):
+                self.assertEqual(open_rate, subscriber.open_rate)
+                self.assertEqual(click_rate, subscriber.click_rate)
+
+    def test_same_result_as_instance_method(self):
+        for _ in range(3):
+            self.subscriber_1.create_activity(ActivityTypes.SENT, email=EmailFactory())
+        self.subscriber_1.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscriber_1.create_activity(ActivityTypes.OPENED, email=self.email)
+        Subscriber.objects.update_open_and_click_rate([self.subscriber_1.pk])
+        self.subscriber_1.refresh_from_db()
+        self.assertEqual(self.subscriber_1.update_open_rate(), self.subscriber_1.open_rate)
+
+    def test_queries_per_batch(self):
+        ids = [self.subscriber_1.pk, self.subscriber_2.pk, self.subscriber_3.pk]
+        # delivery ledger, aggregate and update per batch
+        with self.assertNumQueries(6):
+            Subscriber.objects.update_open_and_click_rate(iter(ids), batch_size=2)
+
+
+class SubscriberManagerUpdateMailingListRatesTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.email = EmailFactory()
+        self.subscribers = SubscriberFactory.create_batch(5, mailing_list=self.mailing_list)
+        for subscriber in self.subscribers:
+            subscriber.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscribers[0].create_activity(ActivityTypes.OPENED, email=self.email)
+        self.other_subscriber = SubscriberFactory()
+        self.other_subscriber.create_activity(ActivityTypes.SENT, email=self.email)
+        self.other_subscriber.create_activity(ActivityTypes.OPENED, email=self.email)
+
+    def test_iter_mailing_list_ids(self):
+        ids = list(Subscriber.objects.iter_mailing_list_ids(self.mailing_list.pk, batch_size=2))
+        self.assertEqual(sorted(subscriber.pk for subscriber in self.subscribers), ids)
+
+    def test_rates(self):
+        self.assertEqual(5, Subscriber.objects.update_mailing_list_rates(self.mailing_list.pk, batch_size=2))
+        self.assertEqual(1.0, Subscriber.objects.get(pk=self.subscribers[0].pk).open_rate)
+        self.assertEqual(0.0, Subscriber.objects.get(pk=self.other_subscriber.pk).open_rate)
+        self.mailing_list.refresh_from_db()
+        self.assertEqual(0.2, self.mailing_list.open_rate)
+
+    def test_queries_do_not_depend_on_subscribers_count(self):
+        # 2 batches of ids, 2 batches of delivery ledger + aggregate + update, and 3 for the list
+        with self.assertNumQueries(11):
+            Subscriber.objects.update_mailing_list_rates(self.mailing_list.pk, batch_size=3)
+
+    def test_only_mailing_list_rates(self):
+        with self.assertNumQueries(3):
+            Subscriber.objects.update_mailing_list_rates(self.mailing_list.pk, subscribers_ids=[])
+
+    def test_update_rates_command(self):
+        out = StringIO()
+        call_command('updaterates', '--list', str(self.mailing_list.pk), stdout=out)
+        self.assertIn('Successfully updated rates for 5 subscribers.', out.getvalue())
+        self.assertEqual(1.0, Subscriber.objects.get(pk=self.subscribers[0].pk).open_rate)
+
+
 class SubscriptionFormTemplateTests(TestCase):
     def setUp(self):
         super().setUp()
@@ -0,0 +1,145 @@
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from colossus.apps.campaigns.api import SentActivitiesBuffer
+from colossus.apps.campaigns.tests.factories import (
+    CampaignFactory, EmailFactory,
+)
+from colossus.apps.core.models import City, Country
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity, ActivityRollup
+from colossus.apps.subscribers.rollups import (
+    count_activities_queryset, get_activity_counts, get_countries_counts,
+    get_daily_counts, rebuild_rollups, record_activities,
+)
+from colossus.apps.subscribers.tasks import update_subscriber_location
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory
+
+
+class ActivityRollupTests(TestCase):
+    def setUp(self):
+        self.mailing_list = MailingListFactory()
+        self.campaign = CampaignFactory(mailing_list=self.mailing_list)
+        self.email = EmailFactory(campaign=self.campaign)
+        self.subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+        self.country = Country.objects.create(code='BR', name='Brazil')
+        self.city = City.objects.create(name='Porto Alegre', country=self.country)
+
+    def get_rollups(self):
+        return set(ActivityRollup.objects.values_list(
+            'mailing_list_id', 'campaign_id', 'date', 'activity_type', 'country_id', 'count'
+        ))
+
+    def test_create_activity(self):
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, location=self.city)
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, location=self.city)
+        self.subscriber.create_activity(ActivityTypes.UNSUBSCRIBED, campaign=self.campaign)
+        today = timezone.localdate()
+        self.assertEqual({
+            (self.mailing_list.pk, self.campaign.pk, today, ActivityTypes.OPENED, self.country.pk, 2),
+            (self.mailing_list.pk, self.campaign.pk, today, ActivityTypes.UNSUBSCRIBED, None, 1),
+        }, self.get_rollups())
+
+    def test_bulk_created_activities(self):
+        yesterday = timezone.now() - timedelta(days=1)
+        other_subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+        activities = [
+            Activity(activity_type=ActivityTypes.SENT, subscriber_id=self.subscriber.pk, email_id=self.email.pk),
+            Activity(activity_type=ActivityTypes.SENT, subscriber_id=other_subscriber.pk, email_id=self.email.pk),
+            Activity(activity_type=ActivityTypes.SUBSCRIBED, subscriber_id=self.subscriber.pk, date=yesterday),
+        ]
+        Activity.objects.bulk_create(activities)
+        # mailing lists, campaigns, and a select and an insert per rollup key within a savepoint
+        with self.assertNumQueries(8):
+            record_activities(activities)
+        self.assertEqual(count_activities_queryset(Activity.objects.all()),
+                         {key[:5]: key[5] for key in self.get_rollups()})
+
+    def test_location_resolved(self):
+        self.subscriber.last_seen_ip_address = '127.0.0.1'
+        self.subscriber.save()
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, ip_address='127.0.0.1')
+        with mock.patch('colossus.apps.subscribers.tasks.get_location', return_value=self.city):
+            update_subscriber_location('127.0.0.1', self.subscriber.pk)
+        self.assertEqual({
+            (self.mailing_list.pk, self.campaign.pk, timezone.localdate(), ActivityTypes.OPENED, None, 0),
+            (self.mailing_list.pk, self.campaign.pk, timezone.localdate(), ActivityTypes.OPENED, self.country.pk, 1),
+        }, self.get_rollups())
+        self.assertEqual([{'country__code': 'BR', 'country__name': 'Brazil', 'total': 1}],
+                         list(get_countries_counts(ActivityTypes.OPENED, campaign_id=self.campaign.pk)))
+
+    def test_duplicated_rows_summed(self):
+        for _ in range(2):
+            ActivityRollup.objects.create(mailing_list=self.mailing_list, date=timezone.localdate(),
+                                          activity_type=ActivityTypes.SUBSCRIBED, count=2)
+        counts = get_activity_counts([ActivityTypes.SUBSCRIBED, ActivityTypes.CLEANED],
+                                     mailing_list_id=self.mailing_list.pk)
+        self.assertEqual({ActivityTypes.SUBSCRIBED: 4, ActivityTypes.CLEANED: 0}, counts)
+        daily_counts = get_daily_counts(self.mailing_list.pk, [ActivityTypes.SUBSCRIBED],
+                                        since=timezone.localdate())
+        self.assertEqual({timezone.localdate(): {ActivityTypes.SUBSCRIBED: 4}}, daily_counts)
+
+    def test_rebuild_rollups(self):
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, location=self.city)
+        self.subscriber.create_activity(ActivityTypes.SUBSCRIBED)
+        expected = self.get_rollups()
+        ActivityRollup.objects.update(count=10)
+        ActivityRollup.objects.create(mailing_list=self.mailing_list, date=timezone.localdate(),
+                                      activity_type=ActivityTypes.CLEANED, count=1)
+        self.assertEqual(2, rebuild_rollups(self.mailing_list.pk))
+        self.assertEqual(expected, self.get_rollups())
+
+    @override_settings(COLOSSUS_DELIVERY_LEDGER=True)
+    def test_rebuild_rollups_delivery_ledger(self):
+        """
+        Test the emails sent recorded in the delivery ledger are kept in the
+        rebuilt rollups, and the failed deliveries are not counted
+        """
+        subscribers = SubscriberFactory.create_batch(3, mailing_list=self.mailing_list)
+        with SentActivitiesBuffer(self.email) as progress:
+            progress.add(self.subscriber.pk)
+            progress.add(subscribers[0].pk)
+            progress.add_failed(subscribers[1].pk)
+        expected = {(self.mailing_list.pk, self.campaign.pk, timezone.localdate(), ActivityTypes.SENT, None, 2)}
+        self.assertEqual(expected, self.get_rollups())
+        ActivityRollup.objects.all().delete()
+        self.assertEqual(1, rebuild_rollups())
+        self.assertEqual(expected, self.get_rollups())
+        self.assertEqual(0, rebuild_rollups(MailingListFactory().pk))
+        self.assertEqual(expected, self.get_rollups())
+
+    @override_settings(COLOSSUS_DELIVERY_LEDGER=True)
+    def test_subscriber_deleted(self):
+        """
+        Test the activities and the emails sent recorded in the delivery
+        ledger of a deleted subscriber are subtracted from the rollups
+        """
+        other_subscriber = SubscriberFactory(mailing_list=self.mailing_list)
+        with SentActivitiesBuffer(self.email) as progress:
+            progress.add(self.subscriber.pk)
+            progress.add(other_subscriber.pk)
+        self.subscriber.create_activity(ActivityTypes.OPENED, email=self.email, location=self.city)
+        self.subscriber.create_activity(ActivityTypes.SUBSCRIBED)
+        self.subscriber.delete()
+        today = timezone.localdate()
+        self.assertEqual({
+            (self.mailing_list.pk, self.campaign.pk, today, ActivityTypes.SENT, None, 1),
+            (self.mailing_list.pk, self.campaign.pk, today, ActivityTypes.OPENED, self.country.pk, 0),
+            (self.mailing_list.pk, None, today, ActivityTypes.SUBSCRIBED, None, 0),
+        }, self.get_rollups())
+
+    def test_rollup_activities_command(self):
+        self.subscriber.create_activity(ActivityTypes.SUBSCRIBED)
+        ActivityRollup.objects.all().delete()
+        out = StringIO()
+        call_command('rollupactivities', '--list', str(self.mailing_list.pk), stdout=out)
+        self.assertIn('Successfully rebuilt 1 rollup rows.', out.getvalue())
+        self.assertEqual(1, ActivityRollup.objects.get().count)
@@ -0,0 +1,209 @@
+import shutil
+import tempfile
+import uuid
+from io import StringIO
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import override_settings
+from django.utils import timezone
+
+from colossus.apps.campaigns.tests.factories import LinkFactory
+from colossus.apps.lists.tests.factories import MailingListFactory
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.models import Activity, TrackingEvent
+from colossus.apps.subscribers.tracking import (
+    CLICK, OPEN, DatabaseTrackingBuffer, FileTrackingBuffer,
+    LocalMemoryTrackingBuffer, make_event, process_tracking_buffer,
+    process_tracking_events,
+)
+from colossus.test.testcases import TestCase
+
+from .factories import SubscriberFactory
+
+
+class DatabaseTrackingBufferTests(TestCase):
+    def setUp(self):
+        self.buffer = DatabaseTrackingBuffer()
+
+    def test_drain_events(self):
+        self.buffer.append({'n': 1})
+        self.buffer.append({'n': 2})
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 1}, {'n': 2}], events)
+        self.assertFalse(TrackingEvent.objects.exists())
+        with self.buffer.drain() as events:
+            self.assertEqual([], events)
+
+    def test_failed_drain_keeps_events(self):
+        self.buffer.append({'n': 1})
+        with self.assertRaises(RuntimeError):
+            with self.buffer.drain():
+                raise RuntimeError
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 1}], events)
+
+    def test_drain_limit(self):
+        for n in range(3):
+            self.buffer.append({'n': n})
+        with self.buffer.drain(2) as events:
+            self.assertEqual([{'n': 0}, {'n': 1}], events)
+        with self.buffer.drain(2) as events:
+            self.assertEqual([{'n': 2}], events)
+        self.assertFalse(TrackingEvent.objects.exists())
+
+
+@override_settings(COLOSSUS_TRACKING_BUFFER_SHARED_HOST=True)
+class FileTrackingBufferTests(TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.buffer = FileTrackingBuffer(path=self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def test_drain_events(self):
+        self.buffer.append({'n': 1})
+        self.buffer.append({'n': 2})
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 1}, {'n': 2}], events)
+        with self.buffer.drain() as events:
+            self.assertEqual([], events)
+
+    def test_drain_empty_buffer(self):
+        with self.buffer.drain() as events:
+            self.assertEqual([], events)
+
+    def test_events_appended_while_draining(self):
+        self.buffer.append({'n': 1})
+        with self.buffer.drain() as events:
+            self.buffer.append({'n': 2})
+            self.assertEqual([{'n': 1}], events)
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 2}], events)
+
+    def test_failed_drain_keeps_events(self):
+        self.buffer.append({'n': 1})
+        with self.assertRaises(RuntimeError):
+            with self.buffer.drain():
+                raise RuntimeError
+        self.buffer.append({'n': 2})
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 1}], events)
+        with self.buffer.drain() as events:
+            self.assertEqual([{'n': 2}], events)
+
+    @override_settings(COLOSSUS_TRACKING_BUFFER_SHARED_HOST=False)
+    def test_refused_without_shared_host(self):
+        with self.assertRaises(ImproperlyConfigured):
+            FileTrackingBuffer(path=self.path)
+
+
+class LocalMemoryTrackingBufferTests(TestCase):
+    def test_failed_drain_keeps_events(self):
+        buffer = LocalMemoryTrackingBuffer()
+        buffer.append({'n': 1})
+        with self.assertRaises(RuntimeError):
+            with buffer.drain():
+                raise RuntimeError
+        with buffer.drain() as events:
+            self.assertEqual([{'n': 1}], events)
+        with buffer.drain() as events:
+            self.assertEqual([], events)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class ProcessTrackingEventsTests(TestCase):
+    def setUp(self):
+        mailing_list = MailingListFactory()
+        self.link = LinkFactory()
+        self.email = self.link.email
+        self.subscriber_1 = SubscriberFactory(mailing_list=mailing_list)
+        self.subscriber_1.create_activity(ActivityTypes.SENT, email=self.email)
+        self.subscriber_2 = SubscriberFactory(mailing_list=mailing_list)
+        self.subscriber_2.create_activity(ActivityTypes.SENT, email=self.email)
+
+    def test_opens(self):
+        events = [
+            make_event(OPEN, self.email.uuid, self.subscriber_1.uuid),
+            make_event(OPEN, self.email.uuid, self.subscriber_1.uuid),
+            make_event(OPEN, self.email.uuid, self.subscriber_2.uuid),
+        ]
+        self.assertEqual(3, process_tracking_events(events))
+        self.email.refresh_from_db()
+        self.assertEqual(2, self.email.unique_opens_count)
+        self.assertEqual(3, self.email.total_opens_count)
+        self.subscriber_1.refresh_from_db()
+        self.assertEqual(1.0, self.subscriber_1.open_rate)
+        self.subscriber_1.mailing_list.refresh_from_db()
+        self.assertEqual(1.0, self.subscriber_1.mailing_list.open_rate)
+
+    def test_event_date(self):
+        event = make_event(OPEN, self.email.uuid, self.subscriber_1.uuid)
+        event['timestamp'] -= 3600
+        process_tracking_events([event])
+        activity = Activity.objects.get(activity_type=ActivityTypes.OPENED)
+        self.assertLess(activity.date, timezone.now() - timezone.timedelta(minutes=59))
+
+    def test_unknown_objects_discarded(self):
+        events = [
+            make_event(OPEN, uuid.uuid4(), self.subscriber_1.uuid),
+            make_event(OPEN, self.email.uuid, uuid.uuid4()),
+            make_event(CLICK, uuid.uuid4(), self.subscriber_1.uuid, '127.0.0.1'),
+        ]
+        self.assertEqual(0, process_tracking_events(events))
+        self.assertFalse(Activity.objects.exclude(activity_type=ActivityTypes.SENT).exists())
+
+    def test_click_forces_open_once(self):
+        events = [
+            make_event(CLICK, self.link.uuid, self.subscriber_1.uuid, '127.0.0.1'),
+            make_event(CLICK, self.link.uuid, self.subscriber_1.uuid, '127.0.0.1'),
+        ]
+        self.assertEqual(3, process_tracking_events(events))
+        opens = Activity.objects.filter(activity_type=ActivityTypes.OPENED, subscriber=self.subscriber_1)
+        self.assertEqual(['127.0.0.1'], [activity.ip_address for activity in opens])
+        process_tracking_events([make_event(CLICK, self.link.uuid, self.subscriber_1.uuid)])
+        self.assertEqual(1, opens.count())
+        self.link.refresh_from_db()
+        self.assertEqual(1, self.link.unique_clicks_count)
+        self.assertEqual(3, self.link.total_clicks_count)
+
+    def test_click_updates_last_seen_and_opens_ip_address(self):
+        process_tracking_events([make_event(OPEN, self.email.uuid, self.subscriber_1.uuid)])
+        process_tracking_events([make_event(CLICK, self.link.uuid, self.subscriber_1.uuid, '127.0.0.1')])
+        self.subscriber_1.refresh_from_db()
+        self.assertEqual('127.0.0.1', self.subscriber_1.last_seen_ip_address)
+        self.assertIsNotNone(self.subscriber_1.last_seen_date)
+        activity = Activity.objects.get(activity_type=ActivityTypes.OPENED, subscriber=self.subscriber_1)
+        self.assertEqual('127.0.0.1', activity.ip_address)
+
+    @override_settings(COLOSSUS_TRACKING_BATCH_SIZE=2)
+    def test_process_buffer_in_batches(self):
+        buffer = LocalMemoryTrackingBuffer()
+        for _ in range(5):
+            buffer.append(make_event(OPEN, self.email.uuid, self.subscriber_1.uuid))
+        self.assertEqual(5, process_tracking_buffer(buffer))
+        self.assertEqual(0, len(buffer.events))
+        self.email.refresh_from_db()
+        self.assertEqual(5, self.email.total_opens_count)
+
+    @override_settings(COLOSSUS_TRACKING_BATCH_SIZE=2)
+    def test_failed_batch_keeps_processed_batches(self):
+        buffer = DatabaseTrackingBuffer()
+        for _ in range(5):
+            buffer.append(make_event(OPEN, self.email.uuid, self.subscriber_1.uuid))
+        with mock.patch('colossus.apps.subscribers.tracking.process_tracking_events',
+                        side_effect=[2, RuntimeError]) as mock_process:
+            with self.assertRaises(RuntimeError):
+                process_tracking_buffer(buffer)
+        self.assertEqual([2, 2], [len(call[0][0]) for call in mock_process.call_args_list])
+        self.assertEqual(3, TrackingEvent.objects.count())
+        self.assertEqual(3, process_tracking_buffer(buffer))
+        self.assertFalse(TrackingEvent.objects.exists())
+
+    def test_process_tracking_events_command(self):
+        DatabaseTrackingBuffer().append(make_event(OPEN, self.email.uuid, self.subscriber_1.uuid))
+        out = StringIO()
+        call_command('processtrackingevents', stdout=out)
+        self.assertIn('Successfully created 1 activities', out.getvalue())
@@ -7,6 +7,8 @@ from colossus.apps.lists.tests.factories import MailingListFactory
 from colossus.apps.subscribers.constants import ActivityTypes, Status
 from colossus.apps.subscribers.forms import UnsubscribeForm
 from colossus.apps.subscribers.models import Activity
+from colossus.apps.subscribers.tasks import process_tracking_events_task
+from colossus.apps.subscribers.tracking import process_tracking_buffer
 from colossus.test.testcases import TestCase
 
 from .factories import SubscriberFactory
@@ -22,6 +24,7 @@ class TrackOpenTests(TestCase):
             'subscriber_uuid': self.subscriber.uuid
         })
         self.response = self.client.get(self.url)
+        process_tracking_buffer()
 
     def test_status_code_200(self):
         self.assertEqual(self.response.status_code, 200)
@@ -43,6 +46,7 @@ class TrackClickTests(TestCase):
             'subscriber_uuid': self.subscriber.uuid
         })
         self.response = self.client.get(self.url)
+        process_tracking_buffer()
 
     def test_redirection(self):
         self.assertRedirects(self.response, self.link.url, fetch_redirect_response=False)
@@ -50,6 +54,35 @@ class TrackClickTests(TestCase):
     def test_subscriber_clicked_link(self):
         self.assertTrue(Activity.objects.filter(activity_type=ActivityTypes.CLICKED).exists())
 
+    def test_unknown_link_not_found(self):
+        url = reverse('subscribers:click', kwargs={
+            'link_uuid': self.subscriber.uuid,
+            'subscriber_uuid': self.subscriber.uuid
+        })
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class TrackOpenWriteBehindTests(TestCase):
+    def setUp(self):
+        self.subscriber = SubscriberFactory()
+        self.email = EmailFactory()
+        self.url = reverse('subscribers:open', kwargs={
+            'email_uuid': self.email.uuid,
+            'subscriber_uuid': self.subscriber.uuid
+        })
+        self.response = self.client.get(self.url)
+
+    def test_open_recorded_by_consumer(self):
+        """
+        The events are never processed within the request, even in eager mode
+        """
+        self.assertEqual(self.response.status_code, 200)
+        self.assertFalse(Activity.objects.filter(activity_type=ActivityTypes.OPENED).exists())
+        process_tracking_events_task()
+        self.assertTrue(Activity.objects.filter(activity_type=ActivityTypes.OPENED).exists())
+
 
 @override_settings(RATELIMIT_ENABLE=False)
 class TestPostUnsubscribeManualSuccessful(TestCase):
@@ -0,0 +1,403 @@
+"""
+Write-behind buffer of the open and click tracking events.
+
+Recording an open or a click used to insert the activity and recompute the
+statistics of the subscriber, the mailing list, the email and the campaign
+within the request. During a campaign the tracking endpoints are hit by
+thousands of recipients at the same time, so the views now only validate the
+request, append the event to a buffer and respond immediately.
+
+The events are consumed in batches by `process_tracking_events_task`: the
+activities are bulk inserted, the counters of the campaigns, emails and links
+are incremented, the rates of the subscribers are recomputed once per batch
+and the rates of the lists are recomputed at most once per
+`COLOSSUS_RATES_UPDATE_WINDOW`, no matter how many events touched them.
+
+The events are only consumed by the task, never within the request, even
+when the Celery tasks run eagerly. Without a Celery beat scheduler, the events
+can be processed with the `processtrackingevents` command.
+
+The buffer is pluggable, defined by the `COLOSSUS_TRACKING_BUFFER` setting. The
+default `DatabaseTrackingBuffer` stores the events in a table, shared by the
+web and worker processes wherever they run, and drains them in batches of
+`COLOSSUS_TRACKING_BATCH_SIZE` events, each one processed and deleted in its
+own transaction. The `FileTrackingBuffer` appends the events to a spool file,
+so it can only be used when the web processes and the Celery worker share the
+same host. The events are delivered at least once: if the consumer crashes in
+the middle of a batch, the events drained with it are processed again.
+"""
+import fcntl
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from colossus.apps.subscribers.constants import ActivityTypes
+from colossus.apps.subscribers.counters import count_clicks, count_opens
+from colossus.apps.subscribers.rollups import record_activities
+from colossus.utils import debounce_task
+
+logger = logging.getLogger(__name__)
+
+OPEN = 'open'
+
+CLICK = 'click'
+
+
+def make_event(event_type: str, target_uuid, subscriber_uuid, ip_address: str = None) -> dict:
+    """
+    :param event_type: Either `OPEN` or `CLICK`
+    :param target_uuid: Email uuid for the opens, Link uuid for the clicks
+    :param subscriber_uuid: Subscriber uuid
+    :param ip_address: Optional client IP address
+    :return: A JSON serializable event
+    """
+    return {
+        'type': event_type,
+        'target': str(target_uuid),
+        'subscriber': str(subscriber_uuid),
+        'ip_address': ip_address,
+        'timestamp': time.time(),
+    }
+
+
+class BaseTrackingBuffer:
+    """
+    Base class of the tracking events buffers. Subclasses must implement the
+    `append` and `drain` methods.
+    """
+    def append(self, event: dict):
+        raise NotImplementedError
+
+    @contextmanager
+    def drain(self, limit: Optional[int] = None) -> Iterator[List[dict]]:
+        """
+        Context manager providing the buffered events. The events are removed
+        from the buffer only if the block exits without errors.
+
+        :param limit: Maximum number of events drained, if the buffer supports
+                      draining a part of the events
+        """
+        raise NotImplementedError
+        yield
+
+
+class DatabaseTrackingBuffer(BaseTrackingBuffer):
+    """
+    Buffer stored in the `TrackingEvent` table. The consumer locks the oldest
+    events it drains, skipping the events locked by a concurrent consumer when
+    the database supports it, and deletes them in the same transaction.
+    """
+    delete_batch_size = 500
+
+    def append(self, event: dict):
+        TrackingEvent = apps.get_model('subscribers', 'TrackingEvent')
+        TrackingEvent.objects.create(data=json.dumps(event))
+
+    @contextmanager
+    def drain(self, limit: Optional[int] = None) -> Iterator[List[dict]]:
+        TrackingEvent = apps.get_model('subscribers', 'TrackingEvent')
+        with transaction.atomic():
+            rows = TrackingEvent.objects \
+                .select_for_update(skip_locked=connection.features.has_select_for_update_skip_locked) \
+                .order_by('pk') \
+                .values_list('pk', 'data')
+            if limit is not None:
+                rows = rows[:limit]
+            pks = list()
+            events = list()
+            for pk, data in rows:
+                pks.append(pk)
+                try:
+                    events.append(json.loads(data))
+                except ValueError:
+                    logger.warning('Discarding malformed tracking event %r', data)
+            yield events
+            for index in range(0, len(pks), self.delete_batch_size):
+                TrackingEvent.objects.filter(pk__in=pks[index:index + self.delete_batch_size]).delete()
+
+
+class LocalMemoryTrackingBuffer(BaseTrackingBuffer):
+    """
+    In-process buffer. The events are lost when the process exits, and they
+    can only be consumed by the process that recorded them. Meant for tests.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.events: Deque[dict] = deque()
+
+    def append(self, event: dict):
+        self.events.append(event)
+
+    @contextmanager
+    def drain(self, limit: Optional[int] = None) -> Iterator[List[dict]]:
+        with self.lock:
+            events = list(itertools.islice(self.events, limit))
+            yield events
+            for _ in range(len(events)):
+                self.events.popleft()
+
+
+class FileTrackingBuffer(BaseTrackingBuffer):
+    """
+    Append-only spool file, one JSON event per line, shared by all the
+    processes of the host. Refused unless the COLOSSUS_TRACKING_BUFFER_SHARED_HOST
+    setting states that the web processes and the Celery worker run on the
+    same host, otherwise the events would never reach the consumer.
+
+    The writers append under a shared lock. The consumer renames the spool
+    file and takes an exclusive lock on it, waiting for the writers still
+    holding the old file, so the new events go to a new spool file while the
+    renamed one is processed. The whole file is drained at once.
+    """
+    def __init__(self, path: str = None):
+        if not settings.COLOSSUS_TRACKING_BUFFER_SHARED_HOST:
+            raise ImproperlyConfigured('FileTrackingBuffer requires the web processes and the Celery worker to '
+                                       'share the same host. Set COLOSSUS_TRACKING_BUFFER_SHARED_HOST to confirm.')
+        self.path = settings.COLOSSUS_TRACKING_BUFFER_PATH if path is None else path
+        self.spool_path = os.path.join(self.path, 'events.jsonl')
+        self.processing_path = os.path.join(self.path, 'events.processing.jsonl')
+
+    def append(self, event: dict):
+        line = (json.dumps(event) + '\n').encode('utf-8')
+        os.makedirs(self.path, exist_ok=True)
+        while True:
+            fd = os.open(self.spool_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_SH)
+                try:
+                    is_current = os.fstat(fd).st_ino == os.stat(self.spool_path).st_ino
+                except FileNotFoundError:
+                    is_current = False
+                if is_current:
+                    os.write(fd, line)
+                    return
+                # The consumer renamed the file in the meantime, try again with a new one
+            finally:
+                os.close(fd)
+
+    @contextmanager
+    def drain(self, limit: Optional[int] = None) -> Iterator[List[dict]]:
+        if not os.path.exists(self.processing_path):
+            # Otherwise, a previous consumer failed, process its file first
+            try:
+                os.rename(self.spool_path, self.processing_path)
+            except FileNotFoundError:
+                yield list()
+                return
+        try:
+            spool_file = open(self.processing_path, 'rb')
+        except FileNotFoundError:
+            yield list()
+            return
+        with spool_file:
+            fcntl.flock(spool_file.fileno(), fcntl.LOCK_EX)
+            if os.fstat(spool_file.fileno()).st_nlink == 0:
+                # Already processed by a concurrent consumer
+                yield list()
+                return
+            events = list()
+            for line in spool_file:
+                try:
+                    events.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    logger.warning('Discarding malformed tracking event %r', line)
+            yield events
+            os.remove(self.processing_path)
+
+
+_buffers: Dict[str, BaseTrackingBuffer] = dict()
+
+
+def get_tracking_buffer() -> BaseTrackingBuffer:
+    buffer_class = settings.COLOSSUS_TRACKING_BUFFER
+    if buffer_class not in _buffers:
+        _buffers[buffer_class] = import_string(buffer_class)()
+    return _buffers[buffer_class]
+
+
+def record_tracking_event(event: dict):
+    """
+    Append an event to the tracking buffer, processed later by
+    `process_tracking_events_task`.
+    """
+    get_tracking_buffer().append(event)
+
+
+def process_tracking_buffer(buffer: Optional[BaseTrackingBuffer] = None) -> int:
+    """
+    Consume the events of a tracking buffer, one batch at a time, until the
+    buffer is empty. The batches already processed are kept if a batch fails.
+
+    :return: Number of activities created
+    """
+    if buffer is None:
+        buffer = get_tracking_buffer()
+    batch_size = settings.COLOSSUS_TRACKING_BATCH_SIZE
+    created = 0
+    while True:
+        with buffer.drain(batch_size) as events:
+            if not events:
+                break
+            for index in range(0, len(events), batch_size):
+                created += process_tracking_events(events[index:index + batch_size])
+    return created
+
+
+def _get_date(event: dict) -> datetime:
+    return datetime.fromtimestamp(event['timestamp'], tz=timezone.utc)
+
+
+def process_tracking_events(events: List[dict]) -> int:
+    """
+    Bulk insert the activities of a batch of tracking events and update the
+    statistics once per affected object. Events referencing objects that no
+    longer exist are discarded.
+
+    As in `Subscriber.click`, a click forces an open record when the
+    subscriber has not opened the email yet, the clicks update the last seen
+    date and IP address of the subscriber, and set the IP address of the
+    previous opens of the email without one.
+
+    :param events: Events built with `make_event`
+    :return: Number of activities created
+    """
+    from colossus.apps.subscribers.tasks import update_subscriber_location
+
+    Activity = apps.get_model('subscribers', 'Activity')
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+    Email = apps.get_model('campaigns', 'Email')
+    Link = apps.get_model('campaigns', 'Link')
+
+    emails_uuids = {event['target'] for event in events if event['type'] == OPEN}
+    links_uuids = {event['target'] for event in events if event['type'] == CLICK}
+    subscribers_uuids = {event['subscriber'] for event in events}
+    emails = {str(email.uuid): email for email in Email.objects.filter(uuid__in=emails_uuids)}
+    links = {str(link.uuid): link for link in Link.objects.filter(uuid__in=links_uuids).select_related('email')}
+    subscribers = {
+        str(subscriber.uuid): subscriber for subscriber in Subscriber.objects.filter(uuid__in=subscribers_uuids)
+    }
+
+    activities = list()
+    opened = set()
+    clicks: Dict[tuple, dict] = dict()  # First click per (subscriber_id, email_id), to force the missing opens
+    last_seen: Dict[int, dict] = dict()  # Last click with an IP address per subscriber_id
+    for event in sorted(events, key=lambda e: e['timestamp']):
+        subscriber = subscribers.get(event['subscriber'])
+        if event['type'] == OPEN:
+            email = emails.get(event['target'])
+            if subscriber is None or email is None:
+                continue
+            activities.append(Activity(
+                activity_type=ActivityTypes.OPENED,
+                date=_get_date(event),
+                subscriber_id=subscriber.pk,
+                email_id=email.pk,
+                location_id=subscriber.location_id
+            ))
+            opened.add((subscriber.pk, email.pk))
+        elif event['type'] == CLICK:
+            link = links.get(event['target'])
+            if subscriber is None or link is None:
+                continue
+            activities.append(Activity(
+                activity_type=ActivityTypes.CLICKED,
+                date=_get_date(event),
+                subscriber_id=subscriber.pk,
+                email_id=link.email_id,
+                link_id=link.pk,
+                ip_address=event['ip_address']
+            ))
+            clicks.setdefault((subscriber.pk, link.email_id), event)
+            if event['ip_address']:
+                last_seen[subscriber.pk] = event
+
+    if not activities:
+        return 0
+
+    subscribers_ids = {activity.subscriber_id for activity in activities}
+    campaigns_ids = {email.pk: email.campaign_id for email in emails.values()}
+    campaigns_ids.update({link.email_id: link.email.campaign_id for link in links.values()})
+    missing_opens = set(clicks.keys()) - opened
+    if missing_opens:
+        already_opened = Activity.objects.filter(
+            activity_type=ActivityTypes.OPENED,
+            subscriber_id__in={subscriber_id for subscriber_id, email_id in missing_opens},
+            email_id__in={email_id for subscriber_id, email_id in missing_opens}
+        ).values_list('subscriber_id', 'email_id')
+        missing_opens -= set(already_opened)
+    for subscriber_id, email_id in missing_opens:
+        # For the user to click on the email, he/she must have opened it. In some cases the open pixel won't
+        # be triggered. So in those cases, force an open record
+        event = clicks[(subscriber_id, email_id)]
+        activities.append(Activity(
+            activity_type=ActivityTypes.OPENED,
+            date=_get_date(event),
+            subscriber_id=subscriber_id,
+            email_id=email_id,
+            ip_address=event['ip_address']
+        ))
+
+    with transaction.atomic():
+        Activity.objects.bulk_create(activities)
+        record_activities(activities)
+        count_opens(
+            (activity.subscriber_id, activity.email_id, campaigns_ids[activity.email_id])
+            for activity in activities if activity.activity_type == ActivityTypes.OPENED
+        )
+        count_clicks(
+            (activity.subscriber_id, activity.link_id, activity.email_id, campaigns_ids[activity.email_id])
+            for activity in activities if activity.activity_type == ActivityTypes.CLICKED
+        )
+        for subscriber_id, event in last_seen.items():
+            Subscriber.objects.filter(pk=subscriber_id).update(
+                last_seen_date=_get_date(event),
+                last_seen_ip_address=event['ip_address']
+            )
+        for (subscriber_id, email_id), event in clicks.items():
+            if event['ip_address']:
+                Activity.objects.filter(
+                    activity_type=ActivityTypes.OPENED,
+                    subscriber_id=subscriber_id,
+                    email_id=email_id,
+                    ip_address=None
+                ).update(ip_address=event['ip_address'])
+
+    update_tracking_statistics(subscribers_ids)
+
+    locations = {(event['ip_address'], subscriber_id) for subscriber_id, event in last_seen.items()}
+    for ip_address, subscriber_id in locations:
+        update_subscriber_location.delay(ip_address, subscriber_id)
+
+    return len(activities)
+
+
+def update_tracking_statistics(subscribers_ids):
+    """
+    Recompute the open and click rates of the subscribers, and schedule the
+    (debounced) update of the rates of their mailing lists.
+    """
+    from colossus.apps.subscribers.tasks import update_mailing_list_rates
+
+    Subscriber = apps.get_model('subscribers', 'Subscriber')
+
+    Subscriber.objects.update_open_and_click_rate(subscribers_ids)
+    mailing_lists_ids = Subscriber.objects.filter(pk__in=subscribers_ids) \
+        .values_list('mailing_list_id', flat=True) \
+        .order_by() \
+        .distinct()
+    for mailing_list_id in mailing_lists_ids:
+        debounce_task(update_mailing_list_rates, mailing_list_id)
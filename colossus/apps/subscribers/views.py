@@ -4,8 +4,7 @@ from uuid import UUID
 
 from django.contrib import messages
 from django.http import (
-    Http404, HttpRequest, HttpResponse, HttpResponseBadRequest,
-    HttpResponseRedirect,
+    HttpRequest, HttpResponse, HttpResponseBadRequest, HttpResponseRedirect,
 )
 from django.shortcuts import get_object_or_404, redirect, render
 from django.utils.translation import gettext as _
@@ -17,7 +16,7 @@ from django.views.decorators.http import (
 import requests
 from ratelimit.decorators import ratelimit
 
-from colossus.apps.campaigns.models import Campaign, Email, Link
+from colossus.apps.campaigns.models import Campaign, Link
 from colossus.apps.core.models import Token
 from colossus.apps.lists.models import MailingList
 from colossus.utils import get_client_ip, ip_address_key
@@ -25,6 +24,7 @@ from colossus.utils import get_client_ip, ip_address_key
 from .constants import Status
 from .forms import SubscribeForm, UnsubscribeForm
 from .models import Subscriber
+from .tracking import CLICK, OPEN, make_event, record_tracking_event
 
 logger = logging.getLogger(__name__)
 
@@ -197,10 +197,13 @@ def goodbye(request, mailing_list_uuid):
 @require_GET
 @ratelimit(key=ip_address_key, rate='100/h', method='GET', block=True)
 def track_open(request, email_uuid, subscriber_uuid):
+    """
+    Track subscriber's open of emails from campaigns. The event is appended to
+    the tracking buffer and recorded later, in batches, so the pixel is
+    returned right away.
+    """
     try:
-        email = Email.objects.get(uuid=email_uuid)
-        subscriber = Subscriber.objects.get(uuid=subscriber_uuid)
-        subscriber.open(email)
+        record_tracking_event(make_event(OPEN, email_uuid, subscriber_uuid))
     except Exception:
         logger.exception('An error occurred while subscriber "%s" was trying to '
                          'open the email "%s".' % (subscriber_uuid, email_uuid))
@@ -216,9 +219,9 @@ def track_click(request: HttpRequest,
                 subscriber_uuid: UUID) -> HttpResponseRedirect:
     """
     Track subscriber's click on links on email from campaigns.
-    Triggers celery tasks to update total and unique click count.
-    Affects subscriber click rate, mailing list click rate and campaign click
-    rate.
+    The event is appended to the tracking buffer and recorded later, in
+    batches, where the total and unique click counts are updated. Affects
+    subscriber click rate, mailing list click rate and campaign click rate.
 
     This view can only be accessed via GET request and has a limit of 100
     requests per hour per IP address.
@@ -228,18 +231,10 @@ def track_click(request: HttpRequest,
     :param subscriber_uuid: A Subscriber instance uuid field
     :return: Redirection to the link's target URL
     """
-    link: Link
+    link = get_object_or_404(Link.objects.only('url'), uuid=link_uuid)
     try:
-        link = Link.objects.filter(uuid=link_uuid).select_related('email').get()
-        subscriber = Subscriber.objects.get(uuid=subscriber_uuid)
         ip_address = get_client_ip(request)
-        subscriber.click(link, ip_address)
-    except Link.DoesNotExist:
-        raise Http404
-    except Subscriber.DoesNotExist:
-        # fail silently
-        logger.info('track_click call to non-existing Subscriber instance'
-                    'uuid = "%s"' % str(subscriber_uuid))
+        record_tracking_event(make_event(CLICK, link_uuid, subscriber_uuid, ip_address))
     except Exception:
         logger.exception('Failed to track click on link "%s" from subscriber '
                          '"%s"' % (str(link_uuid), str(subscriber_uuid)))
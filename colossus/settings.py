@@ -226,6 +226,18 @@ CELERY_BEAT_SCHEDULE = {
         'task': 'colossus.apps.campaigns.tasks.send_scheduled_campaigns_task',
         'schedule': 60.0
     },
+    'process-tracking-events': {
+        'task': 'colossus.apps.subscribers.tasks.process_tracking_events_task',
+        'schedule': 10.0
+    },
+    'reconcile-engagement-counters': {
+        'task': 'colossus.apps.subscribers.tasks.reconcile_engagement_counters_task',
+        'schedule': crontab(hour=4, minute=0)
+    },
+    'archive-activities': {
+        'task': 'colossus.apps.subscribers.tasks.archive_activities_task',
+        'schedule': crontab(day_of_month=1, hour=5, minute=0)
+    },
     'clean-lists-hard-bounces': {
         'task': 'colossus.apps.lists.tasks.clean_lists_hard_bounces_task',
         'schedule': crontab(hour=12, minute=0)
@@ -234,6 +246,9 @@ CELERY_BEAT_SCHEDULE = {
 
 CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=True, cast=bool)
 
+# Required by the sharded campaign delivery (Celery chords), e.g. redis://localhost:6379/0
+CELERY_RESULT_BACKEND = config('CELERY_RESULT_BACKEND', default=None)
+
 
 # ==============================================================================
 # FIRST-PARTY APPS SETTINGS
@@ -241,6 +256,94 @@ CELERY_TASK_ALWAYS_EAGER = config('CELERY_TASK_ALWAYS_EAGER', default=True, cast
 
 COLOSSUS_HTTPS_ONLY = config('COLOSSUS_HTTPS_ONLY', default=False, cast=bool)
 
+COLOSSUS_CAMPAIGN_SHARD_SIZE = config('COLOSSUS_CAMPAIGN_SHARD_SIZE', default=5000, cast=int)
+
+COLOSSUS_DELIVERY_BATCH_SIZE = config('COLOSSUS_DELIVERY_BATCH_SIZE', default=100, cast=int)
+
+# Seconds without news from its task after which a delivery shard is considered interrupted and can be resumed
+COLOSSUS_DELIVERY_SHARD_LEASE = config('COLOSSUS_DELIVERY_SHARD_LEASE', default=600, cast=int)
+
+# Idle SMTP sessions kept alive per mailing list relay, in each worker process
+COLOSSUS_SMTP_POOL_SIZE = config('COLOSSUS_SMTP_POOL_SIZE', default=2, cast=int)
+
+# Renew the SMTP session after this many messages (0 means no limit)
+COLOSSUS_SMTP_MAX_MESSAGES_PER_CONNECTION = config('COLOSSUS_SMTP_MAX_MESSAGES_PER_CONNECTION', default=1000, cast=int)
+
+# Maximum messages per second per SMTP relay and per recipient domain (0 means no limit)
+COLOSSUS_SMTP_RATE_LIMIT = config('COLOSSUS_SMTP_RATE_LIMIT', default=0, cast=float)
+
+COLOSSUS_DOMAIN_RATE_LIMIT = config('COLOSSUS_DOMAIN_RATE_LIMIT', default=0, cast=float)
+
+# Use colossus.apps.campaigns.ratelimit.CacheRateLimitStore to share the limits between the workers
+COLOSSUS_RATE_LIMIT_STORE = config(
+    'COLOSSUS_RATE_LIMIT_STORE',
+    default='colossus.apps.campaigns.ratelimit.LocalMemoryRateLimitStore'
+)
+
+# Recipients refused with a temporary SMTP error are retried after this many seconds, doubled on each attempt
+COLOSSUS_DELIVERY_RETRY_DELAY = config('COLOSSUS_DELIVERY_RETRY_DELAY', default=30, cast=float)
+
+COLOSSUS_DELIVERY_MAX_RETRIES = config('COLOSSUS_DELIVERY_MAX_RETRIES', default=3, cast=int)
+
+# SMTP conversations in flight per delivery task. Greater than 1 enables the asyncio SMTP backend
+COLOSSUS_DELIVERY_CONCURRENCY = config('COLOSSUS_DELIVERY_CONCURRENCY', default=1, cast=int)
+
+# Record the deliveries in the compact delivery ledger instead of a SENT
+# activity per recipient
+COLOSSUS_DELIVERY_LEDGER = config('COLOSSUS_DELIVERY_LEDGER', default=False, cast=bool)
+
+# Write-behind buffer of the open and click tracking events, consumed by a periodic task
+COLOSSUS_TRACKING_BUFFER = config(
+    'COLOSSUS_TRACKING_BUFFER',
+    default='colossus.apps.subscribers.tracking.DatabaseTrackingBuffer'
+)
+
+# The FileTrackingBuffer can only be used when the web processes and the Celery worker share the same host
+COLOSSUS_TRACKING_BUFFER_SHARED_HOST = config('COLOSSUS_TRACKING_BUFFER_SHARED_HOST', default=False, cast=bool)
+
+COLOSSUS_TRACKING_BUFFER_PATH = config(
+    'COLOSSUS_TRACKING_BUFFER_PATH',
+    default=os.path.join(os.path.dirname(BASE_DIR), 'var/tracking')
+)
+
+COLOSSUS_TRACKING_BATCH_SIZE = config('COLOSSUS_TRACKING_BATCH_SIZE', default=1000, cast=int)
+
+# The open and click rates of the lists and campaigns are recomputed at most once per window, in seconds
+COLOSSUS_RATES_UPDATE_WINDOW = config('COLOSSUS_RATES_UPDATE_WINDOW', default=60, cast=float)
+
+# The opens and clicks counters of the campaigns sent within this many days are reconciled daily
+COLOSSUS_COUNTERS_RECONCILIATION_DAYS = config('COLOSSUS_COUNTERS_RECONCILIATION_DAYS', default=30, cast=int)
+
+# Rows of the subscribers CSV imports processed and committed at once
+COLOSSUS_IMPORT_CHUNK_SIZE = config('COLOSSUS_IMPORT_CHUNK_SIZE', default=1000, cast=int)
+
+# Seconds without a committed chunk after which an import is considered interrupted and can be resumed
+COLOSSUS_IMPORT_LEASE = config('COLOSSUS_IMPORT_LEASE', default=600, cast=int)
+
+# Invalid rows of a subscribers CSV import kept in its error log
+COLOSSUS_IMPORT_MAX_ERRORS = config('COLOSSUS_IMPORT_MAX_ERRORS', default=1000, cast=int)
+
+# Size in bytes of the segments of the large subscribers CSV imports, imported
+# in parallel. Requires a Celery result backend. Set to 0 to disable
+COLOSSUS_IMPORT_SEGMENT_SIZE = config('COLOSSUS_IMPORT_SEGMENT_SIZE', default=64 * 1024 * 1024, cast=int)
+
+# Pasted email addresses above which the paste import and the bulk tagging run
+# as background tasks
+COLOSSUS_BULK_TASK_THRESHOLD = config('COLOSSUS_BULK_TASK_THRESHOLD', default=1000, cast=int)
+
+# Domains ids kept in the process-wide LRU cache, and the most frequent domains
+# among the latest subscribers loaded when a Celery worker process starts
+COLOSSUS_DOMAIN_CACHE_SIZE = config('COLOSSUS_DOMAIN_CACHE_SIZE', default=10000, cast=int)
+COLOSSUS_DOMAIN_CACHE_WARM_SIZE = config('COLOSSUS_DOMAIN_CACHE_WARM_SIZE', default=1000, cast=int)
+COLOSSUS_DOMAIN_CACHE_WARM_SAMPLE = config('COLOSSUS_DOMAIN_CACHE_WARM_SAMPLE', default=100000, cast=int)
+
+# Maximum age in seconds of the cached statistics of the mailing lists detail page
+COLOSSUS_LIST_STATS_MAX_AGE = config('COLOSSUS_LIST_STATS_MAX_AGE', default=900, cast=int)
+
+# The activities older than this many months are moved to the compressed monthly
+# archives. The campaigns still reconciled are never archived
+COLOSSUS_ACTIVITY_ARCHIVE_MONTHS = config('COLOSSUS_ACTIVITY_ARCHIVE_MONTHS', default=24, cast=int)
+
 MAILGUN_API_KEY = config('MAILGUN_API_KEY', default='')
 
 MAILGUN_API_BASE_URL = config('MAILGUN_API_BASE_URL', default='')
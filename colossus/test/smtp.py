@@ -0,0 +1,102 @@
+import asyncio
+import threading
+from typing import Dict, List, Tuple
+
+
+class SMTPSink:
+    """
+    In-process SMTP server accepting and storing every message, running an
+    asyncio event loop in a background thread. Used to test and benchmark the
+    SMTP delivery without a real relay.
+
+    :param latency: Seconds to wait before each reply, simulating the round
+                    trip to a remote relay
+    :param recipient_replies: Custom replies to the RCPT command, per
+                              recipient (e.g. '451 Try again later')
+    """
+    def __init__(self, host: str = '127.0.0.1', latency: float = 0, recipient_replies: Dict[str, str] = None):
+        self.host = host
+        self.port = None
+        self.latency = latency
+        self.recipient_replies = recipient_replies or dict()
+        self.messages: List[Tuple[str, List[str], bytes]] = list()
+        self.connections_count = 0
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.server = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        async def start_server():
+            # Called within the sink loop, so the server is bound to it
+            return await asyncio.start_server(self.handle, self.host, 0)
+        self.thread.start()
+        self.server = asyncio.run_coroutine_threadsafe(start_server(), self.loop).result()
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        async def close_server():
+            self.server.close()
+            await self.server.wait_closed()
+        asyncio.run_coroutine_threadsafe(close_server(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+
+    async def reply(self, writer, line: str):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        writer.write(line.encode('ascii') + b'\r\n')
+        await writer.drain()
+
+    async def handle(self, reader, writer):
+        self.connections_count += 1
+        mail_from, recipients = '', list()
+        await self.reply(writer, '220 localhost SMTP sink')
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            command = line.decode('ascii').strip()
+            verb = command[:4].upper()
+            if verb in ('EHLO', 'HELO'):
+                await self.reply(writer, '250-localhost\r\n250 AUTH PLAIN LOGIN')
+            elif verb == 'AUTH':
+                await self.reply(writer, '235 Authentication successful')
+            elif verb == 'MAIL':
+                mail_from, recipients = command[10:].strip('<>'), list()
+                await self.reply(writer, '250 OK')
+            elif verb == 'RCPT':
+                recipient = command[8:].strip('<>')
+                reply = self.recipient_replies.get(recipient, '250 OK')
+                if reply.startswith('250'):
+                    recipients.append(recipient)
+                await self.reply(writer, reply)
+                if reply.startswith('421'):
+                    # The service is closing the transmission channel
+                    break
+            elif verb == 'DATA':
+                await self.reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                data = list()
+                while True:
+                    data_line = await reader.readline()
+                    if data_line in (b'.\r\n', b''):
+                        break
+                    data.append(data_line[1:] if data_line.startswith(b'..') else data_line)
+                self.messages.append((mail_from, recipients, b''.join(data)))
+                await self.reply(writer, '250 OK')
+            elif verb == 'RSET':
+                mail_from, recipients = '', list()
+                await self.reply(writer, '250 OK')
+            elif verb == 'QUIT':
+                await self.reply(writer, '221 Bye')
+                break
+            else:
+                await self.reply(writer, '250 OK')
+        writer.close()
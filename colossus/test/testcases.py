@@ -1,3 +1,4 @@
+from django.core.cache import cache
 from django.test import TestCase as DjangoTestCase
 from django.urls import reverse
 
@@ -5,6 +6,11 @@ from colossus.apps.accounts.tests.factories import UserFactory
 
 
 class TestCase(DjangoTestCase):
+    def _pre_setup(self):
+        super()._pre_setup()
+        # The primary keys are reused between tests, so are the cache keys
+        cache.clear()
+
     def assertRedirectsLoginRequired(self, response, url, status_code=302,
                                      target_status_code=200, msg_prefix='',
                                      fetch_redirect_response=True):
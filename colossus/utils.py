@@ -1,13 +1,17 @@
 import logging
+import time
 import uuid
 from typing import Optional
 
 from django.conf import settings
 from django.contrib.gis.geoip2 import GeoIP2
 from django.contrib.sites.shortcuts import get_current_site
+from django.core.cache import cache
 from django.http import HttpRequest
 from django.urls import reverse
 
+from celery import chord
+from celery.result import allow_join_result
 from geoip2.errors import AddressNotFoundError
 
 from colossus.apps.core.models import City, Country
@@ -102,3 +106,49 @@ def get_absolute_url(urlname: str, kwargs: dict = None) -> str:
     path = reverse(urlname, kwargs=kwargs)
     absolute_url = '%s://%s%s' % (protocol, site.domain, path)
     return absolute_url
+
+
+def debounce_task(task, *args, window: float = None) -> bool:
+    """
+    Schedule a Celery task to run only once per time window for a given set of
+    arguments, at the end of the window, no matter how many times it is
+    requested within the window. Meant for the tasks recomputing aggregated
+    statistics, which only need to see the latest state.
+
+    The windows are tracked in the default cache, which must be shared by all
+    the processes (e.g. Redis or Memcached) for the tasks to be coalesced
+    across processes. When the tasks run eagerly the task runs right away.
+
+    :param task: Celery task
+    :param args: Positional arguments of the task
+    :param window: Window length in seconds. Defaults to the
+                   COLOSSUS_RATES_UPDATE_WINDOW setting
+    :return: True if the task was scheduled, False if it was already scheduled
+             for the current window
+    """
+    if window is None:
+        window = settings.COLOSSUS_RATES_UPDATE_WINDOW
+    if settings.CELERY_TASK_ALWAYS_EAGER or not window:
+        task.delay(*args)
+        return True
+    now = time.time()
+    window_index = int(now // window)
+    key = 'colossus:debounce:%s:%s:%s' % (task.name, ':'.join(map(str, args)), window_index)
+    if not cache.add(key, True, timeout=int(window * 2) + 1):
+        return False
+    task.apply_async(args=args, countdown=(window_index + 1) * window - now)
+    return True
+
+
+def run_chord(header: list, callback):
+    """
+    Run a group of Celery tasks, and then the callback with the list of their
+    results. When the tasks run eagerly the chord joins the results of the
+    group synchronously, which Celery only allows within a task under
+    `allow_join_result`.
+
+    :param header: Signatures of the tasks of the group
+    :param callback: Signature of the task called with the results
+    """
+    with allow_join_result():
+        return chord(header)(callback)